@@ -1,15 +1,24 @@
 import os
 import sys
+import time
 import pathlib
-import coalpy.gpu
+import importlib
+
+g_import_begin = time.perf_counter()
 from . import native
-from . import debug_font
-from . import overlay
-from . import utilities
-from . import radix_sort
 
 g_wave_size = 0
 g_module_path = os.path.dirname(pathlib.Path(sys.modules[__name__].__file__)) + "\\"
+g_startup_times = { "import_ms" : (time.perf_counter() - g_import_begin) * 1000.0 }
+
+# coalpy.gpu is only imported by init_module and the gpu modules (imported on first use), so cpu only tools
+# (converters, benchmarks, scene_loader with upload = False) never import it or compile shaders.
+g_lazy_exports = { "AsyncLoad" : "scene_loader", "load_scene" : "scene_loader", "load_scene_blocking" : "scene_loader" }
+
+def __getattr__(name):
+    if name in g_lazy_exports:
+        return getattr(importlib.import_module("." + g_lazy_exports[name], __name__), name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 def _checkGpu(gpuInfo, substring):
     (idx, nm) = gpuInfo
@@ -29,10 +38,26 @@ def get_module_path():
 def get_selected_gpu_wave_size():
     return g_wave_size
 
-def init_module():
+def get_startup_times():
+    # ms spent importing the package and in each init_module step, plus the lazy shader counters.
+    times = dict(g_startup_times)
+    if "splatastic.lazy_shader" in sys.modules:
+        times["shaders"] = sys.modules["splatastic.lazy_shader"].stats()
+    return times
+
+# warm_up_shaders creates every rendering shader right away so coalpy compiles them in the background
+# (while the window opens), otherwise each one is compiled on its first dispatch.
+def init_module(thread_count = 0, io_thread_count = 2, pin_threads = False, warm_up_shaders = False):
     print("Initializing native module.")
-    native.init()
+    begin = time.perf_counter()
+    native.init(thread_count = thread_count, io_thread_count = io_thread_count, pin_threads = pin_threads)
+    g_startup_times["native_init_ms"] = (time.perf_counter() - begin) * 1000.0
     print("Initialization success.")
+
+    begin = time.perf_counter()
+    import coalpy.gpu
+    stats = native.task_system_stats()
+    print("Task system: {} workers, {} io threads, {} cpus available.".format(stats["workers"], stats["io_threads"], stats["available_cpus"]))
     print ("Graphics devices:")
     [print("{}: {}".format(idx, nm)) for (idx, nm) in coalpy.gpu.get_adapters()]
     
@@ -53,11 +78,15 @@ def init_module():
     g_wave_size = _queryWaveSize(selected_gpu)
     info = coalpy.gpu.get_current_adapter_info()
     print("device: {}".format(info[1]))
+    g_startup_times["gpu_init_ms"] = (time.perf_counter() - begin) * 1000.0
+
+    if warm_up_shaders:
+        from . import lazy_shader
+        from . import overlay
+        from . import splat_rasterizer
+        g_startup_times["shader_warm_up_ms"] = lazy_shader.warm_up()
 
-    debug_font.init()
-    overlay.init()
-    utilities.init()
-    radix_sort.init()
+    print("Startup: " + ", ".join("{} {:.1f} ms".format(k[:-3].replace("_", " "), v) for (k, v) in g_startup_times.items()))
 
 def shutdown_module():
     native.shutdown()
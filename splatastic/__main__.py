@@ -7,6 +7,12 @@ from . import editor
 from . import init_module, shutdown_module
 from . import overlay
 from . import splat_rasterizer
+from . import metrics
+from . import native
+from . import scene_cache
+from . import readback
+from . import paged_scene
+from . import resources
 
 print ("##########################")
 print ("####### splatastic #######")
@@ -16,43 +22,151 @@ parser = argparse.ArgumentParser(
         prog="python -m splatastic",
         description = "::splatastic:: - splat renderer")
 parser.add_argument("-s", "--scene", default=None, required = False, help = "Scene file to load")
+parser.add_argument("-m", "--multi-view", action = "store_true", help = "Render all viewports in a single batched submission")
+parser.add_argument("-t", "--threads", type = int, default = 0, help = "Native task system worker count, 0 uses one per available cpu")
+parser.add_argument("--io-threads", type = int, default = 2, help = "Native threads dedicated to blocking file io")
+parser.add_argument("--pin-threads", action = "store_true", help = "Pin each native worker thread to a cpu")
+parser.add_argument("--cache-dir", default = None, help = "Directory of the persistent parsed scene cache, disabled if not set")
+parser.add_argument("--cache-budget-gb", type = float, default = 32.0, help = "Disk budget of the scene cache, least recently used scenes get evicted")
+parser.add_argument("--playlist", nargs = "+", default = None, help = "Scene files to flip between (scene panel next / previous), the next one is prefetched in the background")
+parser.add_argument("--vram-budget-gb", type = float, default = 4.0, help = "GPU memory budget of resident scenes, least recently viewed ones drop their gpu buffers first")
+parser.add_argument("--host-budget-gb", type = float, default = 16.0, help = "Host memory budget of resident scenes, least recently viewed ones drop their host copies")
+parser.add_argument("--lazy-shaders", action = "store_true", help = "Compile each shader on its first dispatch instead of warming all of them up in the background at startup")
+parser.add_argument("--trace-out", default = None, help = "Record native task / io / scene load events, written on exit as chrome trace json")
+parser.add_argument("--metrics-out", default = None, help = "Record per frame / per viewport stage timings and counters, written to this file (.csv or .json) on exit")
+parser.add_argument("--metrics-capacity", type = int, default = 4096, help = "Number of viewport frame records kept in the metrics ring buffer")
+parser.add_argument("--metrics-dump-interval", type = int, default = 0, help = "Also write the metrics file every N frames, 0 only writes on exit")
+parser.add_argument("--capture-dir", default = None, help = "Read back every rendered viewport frame and write it as <dir>/view<id>_<frame>.png, without stalling the gpu")
+parser.add_argument("--readback-slots", type = int, default = 3, help = "Frames of viewport readbacks in flight before rendering waits on the oldest one")
+parser.add_argument("--capture-writers", type = int, default = 2, help = "Background threads encoding / writing captured frames")
+parser.add_argument("--no-idle-skip", action = "store_true", help = "Render every viewport every frame, even if its camera, size and scene did not change")
+parser.add_argument("--progressive-divider", type = int, default = 1, help = "Render moving viewports at 1/N resolution and refine to full resolution once the camera stops, 1 disables it")
+parser.add_argument("--tile-segment-splats", type = int, default = splat_rasterizer.DefaultTileSegmentSplats, help = "Split coarse tiles holding more splats than this across several thread groups, 0 rasters every tile in one group")
+parser.add_argument("--sort-mode", default = splat_rasterizer.DefaultSortMode, choices = splat_rasterizer.SortModes, help = "Sort the tile records with one global radix sort, or count / scatter them per tile and sort every tile locally by its full float depth")
+parser.add_argument("--occlusion-culling", action = "store_true", help = "Skip the splats hidden behind the tiles a viewport saw opaque in its previous frame (falls back on camera cuts)")
+parser.add_argument("--occlusion-opacity", type = float, default = splat_rasterizer.DefaultOcclusionOpacity, help = "Opacity at which a tile counts as opaque for --occlusion-culling")
+parser.add_argument("--paged-scene", default = None, help = "Stream a paged scene (.spgs, see python -m splatastic.paged_scene build) instead of loading a whole scene")
+parser.add_argument("--page-pool-gb", type = float, default = 2.0, help = "GPU memory of the paged scene's page pool")
+parser.add_argument("--gpu-memory-budget-gb", type = float, default = None, help = "Fail gpu allocations that would take all the tracked gpu memory over this budget, with the largest owners in the error")
+parser.add_argument("--host-memory-budget-gb", type = float, default = None, help = "Same as --gpu-memory-budget-gb for the tracked host allocations (resident scene payloads)")
+parser.add_argument("--memory-report", default = None, help = "Write the tracked memory per subsystem and the live resources to this file (.json or .csv) on exit")
 args = parser.parse_args()
 print(args.scene)
+if args.gpu_memory_budget_gb is not None:
+    resources.set_budget(args.gpu_memory_budget_gb * 1024 * 1024 * 1024, resources.Gpu)
+if args.host_memory_budget_gb is not None:
+    resources.set_budget(args.host_memory_budget_gb * 1024 * 1024 * 1024, resources.Host)
 
-init_module()
+init_module(thread_count = args.threads, io_thread_count = args.io_threads, pin_threads = args.pin_threads, warm_up_shaders = not args.lazy_shaders)
+if args.trace_out is not None:
+    native.enable_trace()
 
 initial_w = 1600 
 initial_h = 900
 
 active_editor = editor.Editor()
 active_editor.load_editor_state()
+active_editor.residency.vram_budget_bytes = args.vram_budget_gb * 1024 * 1024 * 1024
+active_editor.residency.host_budget_bytes = args.host_budget_gb * 1024 * 1024 * 1024
+if args.cache_dir is not None:
+    active_editor.scene_cache = scene_cache.SceneCache(args.cache_dir, budget_bytes = args.cache_budget_gb * 1024 * 1024 * 1024)
+if args.playlist is not None:
+    active_editor.set_playlist(args.playlist)
 active_editor.load_scene(args.scene)
 
 rasterizer = splat_rasterizer.SplatRaster()
+rasterizer.tile_segment_splats = args.tile_segment_splats
+rasterizer.sort_mode = args.sort_mode
+rasterizer.occlusion_culling = args.occlusion_culling
+rasterizer.occlusion_opacity = args.occlusion_opacity
+
+streamed_scene = None
+if args.paged_scene is not None:
+    streamed_scene = paged_scene.PagedScene(args.paged_scene, pool_bytes = int(args.page_pool_gb * 1024 * 1024 * 1024))
+    print("Streaming {} ({} pages, {} in the pool)".format(args.paged_scene, streamed_scene.file.page_count, streamed_scene.policy.pool_pages))
+
+frame_metrics = None
+if args.metrics_out is not None:
+    # the metrics collector owns the gpu marker collection, the profiler panel stays empty while recording.
+    frame_metrics = metrics.FrameMetricsCollector(capacity = args.metrics_capacity)
+    rasterizer.metrics = frame_metrics
+    print("Recording frame metrics to " + args.metrics_out)
+
+frame_capture = None
+capture_frame_index = 0
+if args.capture_dir is not None:
+    os.makedirs(args.capture_dir, exist_ok = True)
+    frame_capture = readback.ReadbackRing(slot_count = args.readback_slots * splat_rasterizer.MaxViewsPerBatch, writer_threads = args.capture_writers, name = "FrameCapture")
+    print("Capturing frames to " + args.capture_dir)
+
+def plan_viewports(scene_data, viewports):
+    # returns [(viewport, color divider)] of the viewports that need rendering this frame.
+    settings = (args.multi_view,)
+    planned = [(vp, vp.plan_render(scene_data, settings, idle_skip = not args.no_idle_skip, progressive_divider = args.progressive_divider)) for vp in viewports]
+    return [(vp, divider) for (vp, divider) in planned if divider > 0]
+
+def capture_view(cmd_list, vp):
+    if frame_capture is None:
+        return
+    file_name = os.path.join(args.capture_dir, "view%d_%06d.png" % (vp.id, capture_frame_index))
+    frame_capture.copy_view(cmd_list, rasterizer.get_view(vp.id), tag = vp.id, file_name = file_name)
 
 def on_render(render_args : coalpy.gpu.RenderArgs):
+    global capture_frame_index
 
     if render_args.width == 0 or render_args.height == 0:
         return False
 
     active_editor.build_ui(render_args.imgui, render_args.implot)
     scene_data = active_editor.scene_data
+    if streamed_scene is not None:
+        # pages visible from any viewport get paged in.
+        scene_data = streamed_scene.update([(vp.camera.view_matrix, vp.camera.proj_matrix) for vp in active_editor.viewports if vp.texture is not None])
     if scene_data is None:
         return False
 
-    active_editor.profiler_begin_capture()
-    viewports = active_editor.viewports
+    if frame_metrics is not None:
+        frame_metrics.begin_frame()
+    else:
+        active_editor.profiler_begin_capture()
+    viewports = [vp for vp in active_editor.viewports if vp.texture is not None]
     for vp in viewports:
         vp.update(render_args.delta_time, rasterizer)
-        cmd_list = coalpy.gpu.CommandList()
+    viewports = plan_viewports(scene_data, viewports)
+    if args.multi_view:
+        render_multi_view(render_args, scene_data, viewports)
+    else:
+        for (vp, divider) in viewports:
+            cmd_list = coalpy.gpu.CommandList()
 
-        rasterizer.raster(cmd_list, scene_data, vp.camera.view_matrix, vp.camera.proj_matrix, vp.width, vp.height)
-        overlay.render_overlay(cmd_list, rasterizer, rasterizer.color_buffer, vp.texture, vp)
-        coalpy.gpu.schedule(cmd_list)
+            rasterizer.raster(cmd_list, scene_data, vp.camera.view_matrix, vp.camera.proj_matrix, max(1, vp.width // divider), max(1, vp.height // divider), view_id = vp.id)
+            overlay.render_overlay(cmd_list, rasterizer, rasterizer.get_view(vp.id).color_buffer, vp.texture, vp, color_divider = divider)
+            capture_view(cmd_list, vp)
+            coalpy.gpu.schedule(cmd_list)
+
+    if frame_capture is not None:
+        frame_capture.submit()
+        capture_frame_index += 1
 
-    active_editor.profiler_end_capture()
+    if frame_metrics is not None:
+        frame_metrics.end_frame()
+        if args.metrics_dump_interval > 0 and (frame_metrics.frame_index % args.metrics_dump_interval) == 0:
+            frame_metrics.metrics.save(args.metrics_out)
+    else:
+        active_editor.profiler_end_capture()
     return True
 
+def render_multi_view(render_args, scene_data, viewports):
+    batch_size = splat_rasterizer.MaxViewsPerBatch
+    for batch_begin in range(0, len(viewports), batch_size):
+        batch = viewports[batch_begin:batch_begin + batch_size]
+        cmd_list = coalpy.gpu.CommandList()
+        rasterizer.raster_views(cmd_list, scene_data, [(vp.id, vp.camera.view_matrix, vp.camera.proj_matrix, max(1, vp.width // divider), max(1, vp.height // divider)) for (vp, divider) in batch])
+        for (vp, divider) in batch:
+            overlay.render_overlay(cmd_list, rasterizer, rasterizer.get_view(vp.id).color_buffer, vp.texture, vp, color_divider = divider)
+            capture_view(cmd_list, vp)
+        coalpy.gpu.schedule(cmd_list)
+
 w = coalpy.gpu.Window(
     title="Splatastic - Splatter Renderer",
     on_render = on_render,
@@ -60,5 +174,22 @@ w = coalpy.gpu.Window(
 
 coalpy.gpu.run()
 active_editor.save_editor_state()
+if frame_metrics is not None:
+    frame_metrics.flush()
+    frame_metrics.metrics.save(args.metrics_out)
+    print("Frame metrics written to {} ({} records, {} dropped).".format(args.metrics_out, frame_metrics.metrics.count, frame_metrics.metrics.dropped))
+if streamed_scene is not None:
+    streamed_scene.release()
+    print("Paged scene: " + str(streamed_scene.stats))
+frame_counters = [vp.frame_counters for vp in active_editor.viewports]
+print("Viewport frames rendered: {} (low res {}), skipped: {}".format(*[sum(c[k] for c in frame_counters) for k in ["rendered", "progressive", "skipped"]]))
+if frame_capture is not None:
+    frame_capture.close()
+    print("Frame capture: " + str(frame_capture.stats))
+print(resources.format_report())
+if args.memory_report is not None:
+    resources.save_report(args.memory_report)
 w = None
+if args.trace_out is not None:
+    print("Wrote {} native trace events to {}".format(native.dump_trace(args.trace_out), args.trace_out))
 shutdown_module()
@@ -0,0 +1,143 @@
+import sys
+import argparse
+from .. import native
+from . import suite
+from . import scene_gen
+
+parser = argparse.ArgumentParser(
+        prog="python -m splatastic.benchmarks",
+        description = "::splatastic:: - benchmark suite")
+commands = parser.add_subparsers(dest = "command", required = True)
+
+run_parser = commands.add_parser("run", help = "Runs the benchmarks and writes the results as json")
+run_parser.add_argument("-o", "--output", default = "benchmark_results.json", help = "Results json file")
+run_parser.add_argument("-s", "--sizes", default = "10000,50000,200000", help = "Comma separated splat counts")
+run_parser.add_argument("-w", "--work-dir", default = "benchmark_data", help = "Directory for the generated scenes")
+run_parser.add_argument("-r", "--repeats", type = int, default = 5, help = "Samples per benchmark")
+run_parser.add_argument("--raster-repeats", type = int, default = 1, help = "Samples of the cpu raster benchmark")
+run_parser.add_argument("--width", type = int, default = 256, help = "Render width of the cpu benchmarks")
+run_parser.add_argument("--height", type = int, default = 256, help = "Render height of the cpu benchmarks")
+run_parser.add_argument("--seed", type = int, default = 0, help = "Scene generator seed")
+run_parser.add_argument("--distribution", default = "uniform", choices = scene_gen.Distributions, help = "Spatial distribution of the splats")
+run_parser.add_argument("--scale-spread", type = float, default = 1.0, help = "Spread of the (log) splat scales")
+run_parser.add_argument("-t", "--threads", type = int, default = 0, help = "Native task system worker count, 0 uses one per available cpu")
+run_parser.add_argument("--tile-segment-splats", type = int, default = 2048, help = "Records per segment of the split tile raster benchmark")
+run_parser.add_argument("--container-codecs", default = "zlib,lzma", help = "Comma separated compressed container codecs to benchmark, empty to skip")
+run_parser.add_argument("--startup-gpu", action = "store_true", help = "Also time init_module (gpu device, lazy and warmed up shaders), needs a gpu")
+run_parser.add_argument("--trace-out", default = None, help = "Writes a chrome trace json of the native tasks / io of the whole run")
+
+tile_load_parser = commands.add_parser("tile-load", help = "Prints the tile list lengths of a view of a scene and the expected speed up of splitting heavy tiles")
+tile_load_parser.add_argument("scene", help = "Scene file")
+tile_load_parser.add_argument("--width", type = int, default = 1920, help = "View width")
+tile_load_parser.add_argument("--height", type = int, default = 1080, help = "View height")
+tile_load_parser.add_argument("--camera-distance", type = float, default = 0.75, help = "Camera distance from the scene center, in scene bounds diagonals")
+tile_load_parser.add_argument("--segment-splats", type = int, default = 2048, help = "Records per segment of split tiles")
+tile_load_parser.add_argument("--concurrent-groups", type = int, default = 512, help = "Thread groups the modelled gpu runs at once")
+tile_load_parser.add_argument("-o", "--output", default = None, help = "Also write the report as json")
+
+sort_parser = commands.add_parser("sort-compare", help = "Compares the global radix sort and the per tile local sort of the tile records on a view of a scene")
+sort_parser.add_argument("scene", help = "Scene file")
+sort_parser.add_argument("--width", type = int, default = 1920, help = "View width")
+sort_parser.add_argument("--height", type = int, default = 1080, help = "View height")
+sort_parser.add_argument("--camera-distance", type = float, default = 0.75, help = "Camera distance from the scene center, in scene bounds diagonals")
+sort_parser.add_argument("-r", "--repeats", type = int, default = 5, help = "Samples of the cpu reference sorts")
+sort_parser.add_argument("--gpu-frames", type = int, default = 0, help = "Also render this many frames in each sort mode on the gpu and report the median stage timings, needs a gpu")
+sort_parser.add_argument("-o", "--output", default = None, help = "Also write the report as json")
+
+compare_parser = commands.add_parser("compare", help = "Compares results against a baseline, exits with 1 on regressions")
+compare_parser.add_argument("baseline", help = "Baseline results json file")
+compare_parser.add_argument("current", help = "Current results json file")
+compare_parser.add_argument("--threshold", type = float, default = 0.1, help = "Relative slow down that counts as a regression")
+compare_parser.add_argument("--min-delta-ms", type = float, default = 1.0, help = "Absolute slow down (ms) below which timings are treated as noise")
+compare_parser.add_argument("--metric", default = "median_ms", choices = ["median_ms", "min_ms", "mean_ms"], help = "Timing used for the comparison")
+
+generate_parser = commands.add_parser("generate", help = "Writes a synthetic scene ply file")
+generate_parser.add_argument("output", help = "Ply file to write")
+generate_parser.add_argument("-n", "--vertex-count", type = int, default = 100000, help = "Number of splats")
+generate_parser.add_argument("--seed", type = int, default = 0, help = "Scene generator seed")
+generate_parser.add_argument("--distribution", default = "uniform", choices = scene_gen.Distributions, help = "Spatial distribution of the splats")
+generate_parser.add_argument("--scale-spread", type = float, default = 1.0, help = "Spread of the (log) splat scales")
+
+args = parser.parse_args()
+
+def run_command():
+    native.init(thread_count = args.threads)
+    config = {
+        "repeats" : args.repeats,
+        "raster_repeats" : args.raster_repeats,
+        "width" : args.width,
+        "height" : args.height,
+        "seed" : args.seed,
+        "distribution" : args.distribution,
+        "scale_spread" : args.scale_spread,
+        "startup_gpu" : args.startup_gpu,
+        "tile_segment_splats" : args.tile_segment_splats,
+        "container_codecs" : [c for c in args.container_codecs.split(",") if c != ""] }
+    sizes = [int(s) for s in args.sizes.split(",") if s != ""]
+    if args.trace_out is not None:
+        native.enable_trace()
+    results = suite.run(sizes, config, args.work_dir)
+    suite.save_results(results, args.output)
+    if args.trace_out is not None:
+        print("Wrote {} trace events to {}".format(native.dump_trace(args.trace_out), args.trace_out))
+    native.shutdown()
+    print("Results written to " + args.output)
+    return 0
+
+def compare_command():
+    baseline = suite.load_results(args.baseline)
+    current = suite.load_results(args.current)
+    rows = suite.compare(baseline, current, args.threshold, args.min_delta_ms, args.metric)
+    print("{:<16} {:>10} {:>12} {:>12} {:>8}".format("benchmark", "splats", "baseline ms", "current ms", "ratio"))
+    for (name, vertex_count, base_ms, cur_ms, ratio, regression) in rows:
+        print("{:<16} {:>10} {:>12.3f} {:>12.3f} {:>8.2f}{}".format(name, vertex_count, base_ms, cur_ms, ratio, "  REGRESSION" if regression else ""))
+    regressions = [r for r in rows if r[5]]
+    print("{} regressions out of {} benchmarks (threshold {:.0f}%).".format(len(regressions), len(rows), args.threshold * 100.0))
+    return 1 if len(regressions) > 0 else 0
+
+def tile_load_command():
+    native.init()
+    report = suite.tile_load(args.scene, args.width, args.height, args.camera_distance, segment_splats = args.segment_splats, concurrent_groups = args.concurrent_groups)
+    native.shutdown()
+    print("{:>12} {:>8}".format("records", "tiles"))
+    histogram = report["histogram"]
+    for (edge, count) in zip(histogram["edges"], histogram["counts"]):
+        if count > 0:
+            print("{:>12} {:>8}".format(">= " + str(edge), count))
+    print("{} / {} non empty tiles, {} records, max {} mean {:.1f} p99 {:.1f} per tile".format(report["non_empty_tiles"], report["tiles"], report["records"],
+        report["max_tile_records"], report["mean_tile_records"], report["p99_tile_records"]))
+    print("{} tiles split in {} segments ({} did not fit), expected raster speed up {:.2f}x".format(report["split_tiles"], report["segments"],
+        report["overflow_tiles"], report["speedup"]))
+    if args.output is not None:
+        suite.save_results(report, args.output)
+    return 0
+
+def sort_compare_command():
+    if args.gpu_frames > 0:
+        from .. import init_module
+        init_module()
+    else:
+        native.init()
+    report = suite.sort_compare(args.scene, args.width, args.height, args.camera_distance, args.repeats, args.gpu_frames)
+    native.shutdown()
+    print("{} records in {} tiles, max {} per tile, {} tiles ({} records) over {} take the fallback sort".format(report["records"], report["tiles"],
+        report["max_tile_records"], report["fallback_tiles"], report["fallback_records"], report["local_sort_max_records"]))
+    print("{} records out of full depth order with the global sort keys".format(report["reordered_records"]))
+    print("cpu reference: global {:.3f} ms, local {:.3f} ms (median)".format(report["cpu_global_sort"]["median_ms"], report["cpu_local_sort"]["median_ms"]))
+    for (sort_mode, timings) in report.get("gpu", {}).items():
+        stages = ["radix_sort_ms", "local_sort_ms", "create_tile_list_ranges_ms", "gpu_total_ms"]
+        print("gpu {:<8} ".format(sort_mode) + "  ".join("{} {:.3f}".format(s, timings[s]) for s in stages if s in timings))
+    if args.output is not None:
+        suite.save_results(report, args.output)
+    return 0
+
+def generate_command():
+    native.init()
+    vertices = scene_gen.generate_scene(args.vertex_count, seed = args.seed, distribution = args.distribution, scale_spread = args.scale_spread)
+    scene_gen.write_scene(args.output, vertices)
+    native.shutdown()
+    print("Wrote {} splats to {}".format(args.vertex_count, args.output))
+    return 0
+
+commands_table = { "run" : run_command, "compare" : compare_command, "tile-load" : tile_load_command, "sort-compare" : sort_compare_command, "generate" : generate_command }
+sys.exit(commands_table[args.command]())
@@ -0,0 +1,47 @@
+import numpy as np
+from .. import scene_loader
+
+# Deterministic generator of 3d gaussian splatting scenes (same vertex layout as scene_loader.GaussianSplatProperties).
+
+Distributions = ["uniform", "gaussian", "clusters", "shell"]
+
+def generate_scene(vertex_count, seed = 0, distribution = "uniform", extent = 10.0, base_scale = 0.05, scale_spread = 1.0, cluster_count = 16):
+    # returns a (vertex_count, 62) float32 array. Same arguments always produce the same bytes.
+    rng = np.random.default_rng(seed)
+    stride = len(scene_loader.GaussianSplatProperties)
+    vertices = np.zeros((vertex_count, stride), dtype='f')
+    vertices[:, 0:3] = generate_positions(rng, vertex_count, distribution, extent, cluster_count)
+
+    #normals (3:6) are unused by the renderer and left at 0.
+    vertices[:, 6:9] = rng.uniform(0.0, 1.0, (vertex_count, 3))
+    vertices[:, 9:54] = rng.normal(0.0, 0.05, (vertex_count, 45))
+
+    #opacity and scales are stored pre activation (sigmoid / exp).
+    vertices[:, 54] = rng.normal(1.0, 1.5, vertex_count)
+    vertices[:, 55:58] = np.log(base_scale) + scale_spread * rng.normal(0.0, 0.5, (vertex_count, 3))
+
+    rotations = rng.normal(0.0, 1.0, (vertex_count, 4))
+    vertices[:, 58:62] = rotations / np.linalg.norm(rotations, axis=1, keepdims=True)
+    return vertices
+
+def generate_positions(rng, vertex_count, distribution, extent, cluster_count):
+    if distribution == "uniform":
+        return rng.uniform(-extent, extent, (vertex_count, 3))
+    elif distribution == "gaussian":
+        return rng.normal(0.0, extent * 0.5, (vertex_count, 3))
+    elif distribution == "clusters":
+        centers = rng.uniform(-extent, extent, (cluster_count, 3))
+        assignment = rng.integers(0, cluster_count, vertex_count)
+        return centers[assignment] + rng.normal(0.0, extent * 0.05, (vertex_count, 3))
+    elif distribution == "shell":
+        directions = rng.normal(0.0, 1.0, (vertex_count, 3))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        return directions * extent * rng.uniform(0.95, 1.0, (vertex_count, 1))
+    raise Exception("Unknown distribution \"%s\", must be one of %s" % (distribution, Distributions))
+
+def write_scene(file_name, vertices):
+    export = scene_loader.export_scene(file_name, vertices, vertices.shape[0])
+    export.resolve()
+    (status, msg) = export.status()
+    if status != scene_loader.ExportSuccessFinish:
+        raise Exception("Failed writing scene %s: %s" % (file_name, msg))
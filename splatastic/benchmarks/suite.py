@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import platform
+import datetime
+import numpy as np
+from .. import native
+from .. import scene_loader
+from .. import cpu_rasterizer
+from .. import camera
+from .. import scene_container
+from .. import prune
+from . import scene_gen
+
+# results file layout version, bump when the json format changes.
+ResultsVersion = 1
+
+Benchmarks = ["startup_import", "startup_init", "startup_init_warm_up", "load_resolve", "load_streaming", "payload_copy", "container_load_zlib", "container_load_lzma", "cpu_preprocess", "cpu_bin", "cpu_sort", "cpu_local_sort", "cpu_raster", "cpu_raster_balanced"]
+
+class Timer:
+
+    def __init__(self):
+        self.m_samples = []
+
+    @property
+    def samples(self):
+        return self.m_samples
+
+    def __enter__(self):
+        self.m_begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.m_samples.append((time.perf_counter() - self.m_begin) * 1000.0)
+
+def make_result(name, vertex_count, samples_ms, **extra):
+    samples = np.array(samples_ms)
+    return {
+        "benchmark" : name,
+        "vertex_count" : int(vertex_count),
+        "median_ms" : float(np.median(samples)),
+        "min_ms" : float(samples.min()),
+        "mean_ms" : float(samples.mean()),
+        "samples_ms" : [float(s) for s in samples_ms],
+        "extra" : extra }
+
+def scene_file(work_dir, vertex_count, config):
+    name = "bench_{}_{}_{}_{}.ply".format(vertex_count, config["distribution"], config["scale_spread"], config["seed"])
+    file_name = os.path.join(work_dir, name)
+    if not os.path.exists(file_name):
+        vertices = scene_gen.generate_scene(
+            vertex_count, seed = config["seed"],
+            distribution = config["distribution"], scale_spread = config["scale_spread"])
+        scene_gen.write_scene(file_name, vertices)
+    return file_name
+
+def wait_status(request, busy_status):
+    (status, msg) = request.status()
+    while status == busy_status:
+        (status, msg) = request.status()
+    if status != scene_loader.SuccessFinish:
+        raise Exception("Scene request failed: " + msg)
+
+def bench_load_resolve(file_name, repeats):
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            request = native.SceneAsyncRequest(file = file_name)
+            request.resolve()
+            wait_status(request, scene_loader.Reading)
+        del request
+    return timer.samples
+
+def bench_load_streaming(file_name, repeats):
+    timer = Timer()
+    polls = 0
+    for _ in range(repeats):
+        with timer:
+            request = native.SceneAsyncRequest(file = file_name)
+            (status, _) = request.status()
+            while status == scene_loader.Reading:
+                request.ioProgress()
+                (status, _) = request.status()
+                polls += 1
+            wait_status(request, scene_loader.Reading)
+        del request
+    return (timer.samples, polls // max(repeats, 1))
+
+def bench_payload_copy(file_name, repeats):
+    request = native.SceneAsyncRequest(file = file_name)
+    request.resolve()
+    wait_status(request, scene_loader.Reading)
+    payload = np.zeros(request.payload_size(), dtype=np.uint8)
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            request.request_copy_payload(payload)
+            wait_status(request, scene_loader.CopyingPayload)
+            request.close_copy_payload()
+    return (timer.samples, payload)
+
+def bench_container_load(file_name, repeats):
+    # full native load of a compressed container: read, then chunks decompressed in parallel into the payload.
+    (load_timer, decode_timer) = (Timer(), Timer())
+    for _ in range(repeats):
+        with load_timer:
+            request = native.SceneAsyncRequest(file = file_name)
+            request.resolve()
+            wait_status(request, scene_loader.Reading)
+            payload = np.zeros(request.payload_size(), dtype=np.uint8)
+            with decode_timer:
+                request.request_copy_payload(payload)
+                wait_status(request, scene_loader.CopyingPayload)
+            request.close_copy_payload()
+        del request
+    return (load_timer.samples, decode_timer.samples, payload)
+
+def run_containers(file_name, vertex_count, payload, ply_load_ms, config, work_dir, log = print):
+    # compression ratio and decode / load throughput of each container codec, against the raw ply load.
+    results = []
+    codecs = native.container_codecs()
+    for codec in config.get("container_codecs", ["zlib"]):
+        if not codecs.get(codec, False):
+            log("	skipping container_load_{}: native module built without {}".format(codec, codec))
+            continue
+        container_name = os.path.splitext(file_name)[0] + "_" + codec + scene_container.ContainerFileExtension
+        stats = scene_container.write_container(payload, payload.nbytes // vertex_count, container_name, codec)
+        (samples, decode_samples, loaded) = bench_container_load(container_name, config["repeats"])
+        if not np.array_equal(loaded, payload):
+            raise Exception("Container {} does not round trip the payload.".format(container_name))
+        (decode_ms, megabytes) = (float(np.median(decode_samples)), payload.nbytes / (1024.0 * 1024.0))
+        results.append(make_result("container_load_" + codec, vertex_count, samples,
+            file_bytes = stats["file_bytes"], compression_ratio = stats["ratio"], compress_ms = stats["compress_ms"],
+            decode_ms = decode_ms, decode_mb_s = megabytes / max(decode_ms, 1e-6) * 1000.0,
+            load_mb_s = megabytes / max(float(np.median(samples)), 1e-6) * 1000.0,
+            ply_load_mb_s = megabytes / max(ply_load_ms, 1e-6) * 1000.0))
+        extra = results[-1]["extra"]
+        log("	{:<20} ratio {:>5.2f}  decode {:>8.1f} MB/s  load {:>8.1f} MB/s  (ply load {:>8.1f} MB/s)".format(
+            results[-1]["benchmark"], extra["compression_ratio"], extra["decode_mb_s"], extra["load_mb_s"], extra["ply_load_mb_s"]))
+    return results
+
+# runs in a fresh interpreter per sample, prints its timings as json on the last line.
+StartupScript = """
+import sys, time, json
+begin = time.perf_counter()
+import splatastic
+import_ms = (time.perf_counter() - begin) * 1000.0
+begin = time.perf_counter()
+from splatastic import scene_loader
+scene_loader_import_ms = (time.perf_counter() - begin) * 1000.0
+results = { "import_ms" : import_ms, "scene_loader_import_ms" : scene_loader_import_ms, "coalpy_gpu_imported" : "coalpy.gpu" in sys.modules }
+if len(sys.argv) > 1:
+    begin = time.perf_counter()
+    splatastic.init_module(warm_up_shaders = sys.argv[1] == "warm_up")
+    results["init_ms"] = (time.perf_counter() - begin) * 1000.0
+    results["startup_times"] = splatastic.get_startup_times()
+    splatastic.shutdown_module()
+print(json.dumps(results))
+"""
+
+def run_startup_script(*script_args):
+    package_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([package_parent] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+    begin = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", StartupScript] + list(script_args), env = env, capture_output = True, text = True)
+    process_ms = (time.perf_counter() - begin) * 1000.0
+    if output.returncode != 0:
+        raise Exception("Startup benchmark process failed: " + output.stderr)
+    return (process_ms, json.loads(output.stdout.strip().splitlines()[-1]))
+
+def run_startup(config, log = print):
+    # import time of the package (must not pull coalpy.gpu), and with config["startup_gpu"] the full init_module.
+    results = []
+    runs = [run_startup_script() for _ in range(config["repeats"])]
+    results.append(make_result("startup_import", 0, [r["import_ms"] for (_, r) in runs],
+        scene_loader_import_ms = float(np.median([r["scene_loader_import_ms"] for (_, r) in runs])),
+        process_ms = float(np.median([p for (p, _) in runs])),
+        coalpy_gpu_imported = any(r["coalpy_gpu_imported"] for (_, r) in runs)))
+    if results[-1]["extra"]["coalpy_gpu_imported"]:
+        log("\tWARNING: importing splatastic imported coalpy.gpu")
+
+    if config.get("startup_gpu", False):
+        for mode in ["lazy", "warm_up"]:
+            runs = [run_startup_script(mode) for _ in range(config["repeats"])]
+            results.append(make_result("startup_init" if mode == "lazy" else "startup_init_warm_up", 0, [r["init_ms"] for (_, r) in runs],
+                startup_times = runs[-1][1]["startup_times"]))
+
+    for r in results:
+        log("\t{:<22} median {:>10.3f} ms  min {:>10.3f} ms".format(r["benchmark"], r["median_ms"], r["min_ms"]))
+    return results
+
+def benchmark_camera(width, height):
+    cam = camera.Camera(width, height)
+    cam.pos = [0.0, 0.0, -40.0]
+    return (cam.view_matrix, cam.proj_matrix)
+
+def run_scene(vertex_count, config, work_dir, log = print):
+    (repeats, width, height) = (config["repeats"], config["width"], config["height"])
+    results = []
+    file_name = scene_file(work_dir, vertex_count, config)
+    file_size = os.path.getsize(file_name)
+
+    samples = bench_load_resolve(file_name, repeats)
+    results.append(make_result("load_resolve", vertex_count, samples, file_bytes = file_size))
+
+    (samples, polls) = bench_load_streaming(file_name, repeats)
+    results.append(make_result("load_streaming", vertex_count, samples, file_bytes = file_size, status_polls = polls))
+
+    (samples, payload) = bench_payload_copy(file_name, repeats)
+    results.append(make_result("payload_copy", vertex_count, samples, payload_bytes = int(payload.nbytes)))
+
+    ply_load_ms = results[0]["median_ms"] + results[-1]["median_ms"]
+    results.extend(run_containers(file_name, vertex_count, payload, ply_load_ms, config, work_dir, log))
+
+    (view_matrix, proj_matrix) = benchmark_camera(width, height)
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            cloud = cpu_rasterizer.SplatCloud(payload)
+            screen_data = cpu_rasterizer.preprocess(cloud, view_matrix, proj_matrix, width, height)
+    results.append(make_result("cpu_preprocess", vertex_count, timer.samples))
+
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, width, height)
+    results.append(make_result("cpu_bin", vertex_count, timer.samples, records = int(keys.shape[0])))
+
+    (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(width, height)
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            ordering = cpu_rasterizer.sort_records(keys)
+            ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], tiles_x * tiles_y)
+    results.append(make_result("cpu_sort", vertex_count, timer.samples, records = int(keys.shape[0])))
+
+    timer = Timer()
+    for _ in range(repeats):
+        with timer:
+            (_, _, fallback_tiles) = cpu_rasterizer.local_sort_records(cloud, keys, splat_ids, view_matrix, tiles_x * tiles_y)
+    results.append(make_result("cpu_local_sort", vertex_count, timer.samples, records = int(keys.shape[0]), fallback_tiles = int(fallback_tiles.shape[0])))
+
+    timer = Timer()
+    for _ in range(config["raster_repeats"]):
+        with timer:
+            cpu_rasterizer.raster(screen_data, splat_ids, ordering, ranges, width, height)
+    tile_load = cpu_rasterizer.load_balance_model(ranges, config["tile_segment_splats"])
+    results.append(make_result("cpu_raster", vertex_count, timer.samples, width = width, height = height,
+        max_tile_records = tile_load["max_tile_records"], mean_tile_records = tile_load["mean_tile_records"]))
+
+    timer = Timer()
+    for _ in range(config["raster_repeats"]):
+        with timer:
+            cpu_rasterizer.raster_load_balanced(screen_data, splat_ids, ordering, ranges, width, height, config["tile_segment_splats"])
+    results.append(make_result("cpu_raster_balanced", vertex_count, timer.samples, width = width, height = height,
+        split_tiles = tile_load["split_tiles"], segments = tile_load["segments"], expected_gpu_speedup = tile_load["speedup"]))
+
+    for r in results:
+        log("\t{:<20} {:>10} splats  median {:>10.3f} ms  min {:>10.3f} ms".format(r["benchmark"], vertex_count, r["median_ms"], r["min_ms"]))
+    return results
+
+def tile_load(file_name, width, height, distance = 0.75, **model_args):
+    # tile list length histogram and expected speed up of the split tile raster for one view orbiting the scene.
+    scene = scene_loader.load_scene_blocking(file_name, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(scene.host_payload, scene.stride // 4)
+    bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+    cameras = prune.sample_cameras(bounds, 1, width, height, distance = distance)
+    return cpu_rasterizer.tile_load_report(cloud, cameras.view_matrices()[0], cameras.proj_matrices()[0], width, height, **model_args)
+
+def sort_compare(file_name, width, height, distance = 0.75, repeats = 5, gpu_frames = 0):
+    # global radix sort against the per tile local sort on one view orbiting the scene: cpu reference timings, tiles
+    # taking the fallback and records the quantized depth of the global sort keeps out of depth order. gpu_frames > 0
+    # also renders that many frames in each SplatRaster.sort_mode and reports the median stage timings.
+    scene = scene_loader.load_scene_blocking(file_name, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(scene.host_payload, scene.stride // 4)
+    bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+    cameras = prune.sample_cameras(bounds, 1, width, height, distance = distance)
+    (view_matrix, proj_matrix) = (cameras.view_matrices()[0], cameras.proj_matrices()[0])
+    (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, width, height)
+    (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(width, height)
+
+    (global_timer, local_timer) = (Timer(), Timer())
+    for _ in range(repeats):
+        with global_timer:
+            ordering = cpu_rasterizer.sort_records(keys)
+            ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], tiles_x * tiles_y)
+        with local_timer:
+            (local_ordering, _, fallback_tiles) = cpu_rasterizer.local_sort_records(cloud, keys, splat_ids, view_matrix, tiles_x * tiles_y)
+    counts = (ranges[:, 1].astype(np.int64) - ranges[:, 0])
+    report = {
+        "scene" : file_name,
+        "width" : width,
+        "height" : height,
+        "records" : int(keys.shape[0]),
+        "tiles" : int(tiles_x * tiles_y),
+        "max_tile_records" : int(counts.max(initial = 0)),
+        "local_sort_max_records" : cpu_rasterizer.LocalSortMaxRecords,
+        "fallback_tiles" : int(fallback_tiles.shape[0]),
+        "fallback_records" : int(counts[fallback_tiles].sum()),
+        "reordered_records" : int(np.count_nonzero(ordering != local_ordering)),
+        "cpu_global_sort" : make_result("cpu_sort", cloud.vertex_count, global_timer.samples),
+        "cpu_local_sort" : make_result("cpu_local_sort", cloud.vertex_count, local_timer.samples) }
+    if gpu_frames > 0:
+        report["gpu"] = gpu_sort_timings(file_name, view_matrix, proj_matrix, width, height, gpu_frames)
+    return report
+
+def gpu_sort_timings(file_name, view_matrix, proj_matrix, width, height, frames):
+    # needs init_module. returns {sort mode : {stage / counter column : median}}.
+    import coalpy.gpu
+    from .. import splat_rasterizer
+    from .. import metrics
+    scene = scene_loader.load_scene_blocking(file_name)
+    rasterizer = splat_rasterizer.SplatRaster()
+    timings = {}
+    for sort_mode in splat_rasterizer.SortModes:
+        rasterizer.sort_mode = sort_mode
+        collector = metrics.FrameMetricsCollector(capacity = frames)
+        rasterizer.metrics = collector
+        for _ in range(frames):
+            collector.begin_frame()
+            cmd_list = coalpy.gpu.CommandList()
+            rasterizer.raster(cmd_list, scene, view_matrix, proj_matrix, width, height)
+            coalpy.gpu.schedule(cmd_list)
+            collector.end_frame()
+        collector.flush()
+        summary = collector.metrics.summary().get(0, {})
+        timings[sort_mode] = { name : stats["median"] for (name, stats) in summary.items() if name != "frames" }
+    rasterizer.metrics = None
+    return timings
+
+def machine_info():
+    stats = native.task_system_stats()
+    return {
+        "platform" : platform.platform(),
+        "processor" : platform.processor(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "available_cpus" : stats["available_cpus"],
+        "native_workers" : stats["workers"] }
+
+def run(sizes, config, work_dir, log = print):
+    os.makedirs(work_dir, exist_ok = True)
+    log("[startup]")
+    results = run_startup(config, log)
+    for vertex_count in sizes:
+        log("[scene {} splats]".format(vertex_count))
+        results.extend(run_scene(vertex_count, config, work_dir, log))
+
+    return {
+        "version" : ResultsVersion,
+        "created" : datetime.datetime.now().isoformat(),
+        "machine" : machine_info(),
+        "config" : dict(config, sizes = list(sizes)),
+        "results" : results }
+
+def save_results(results, file_name):
+    with open(file_name, "w") as f:
+        json.dump(results, f, indent = 2)
+
+def load_results(file_name):
+    with open(file_name, "r") as f:
+        results = json.load(f)
+    if results.get("version") != ResultsVersion:
+        raise Exception("Unsupported benchmark results version in %s" % file_name)
+    return results
+
+def compare(baseline, current, threshold = 0.1, min_delta_ms = 1.0, metric = "median_ms"):
+    # returns a list of (benchmark, vertex_count, baseline_ms, current_ms, ratio, is_regression).
+    # A benchmark regresses if it is slower than the baseline by more than threshold (relative)
+    # and min_delta_ms (absolute, to ignore noise on tiny timings).
+    baseline_map = { (r["benchmark"], r["vertex_count"]) : r for r in baseline["results"] }
+    rows = []
+    for r in current["results"]:
+        key = (r["benchmark"], r["vertex_count"])
+        if key not in baseline_map:
+            continue
+        (base_ms, cur_ms) = (baseline_map[key][metric], r[metric])
+        ratio = cur_ms / base_ms if base_ms > 0.0 else float("inf")
+        regression = cur_ms > base_ms * (1.0 + threshold) and (cur_ms - base_ms) > min_delta_ms
+        rows.append((key[0], key[1], base_ms, cur_ms, ratio, regression))
+    return rows
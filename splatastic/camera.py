@@ -1,4 +1,5 @@
 import numpy as np
+import quaternion
 from . import vec
 from . import transform as t
 
@@ -118,3 +119,147 @@ class Camera:
                 (f, n) = (self.m_near, self.m_far)
             self.m_proj_matrix = t.projection_matrix_from_aspect(self.m_fov, self.m_h / self.m_w, n, f)
             self.m_proj_inv_matrix = np.linalg.inv(self.m_proj_matrix)
+
+# Structure of arrays of N cameras with the conventions of Camera (transform scaled by [-1, 1, -1], g_InvertedDepth),
+# all matrices are built in one vectorized call per batch. Rotations are (N, 4) float quaternions (w, x, y, z).
+class CameraBatch:
+
+    s_Scale = np.array([-1.0, 1.0, -1.0])
+
+    def __init__(self, count, w, h, fov = 20 * t.to_radians(), near = 0.1, far = 10000):
+        self.m_positions = np.zeros((count, 3), dtype = np.float64)
+        self.m_rotations = np.zeros((count, 4), dtype = np.float64)
+        self.m_rotations[:, 0] = 1.0
+        self.m_fovs = np.full(count, fov, dtype = np.float64)
+        self.m_ws = np.full(count, w, dtype = np.float64)
+        self.m_hs = np.full(count, h, dtype = np.float64)
+        self.m_nears = np.full(count, near, dtype = np.float64)
+        self.m_fars = np.full(count, far, dtype = np.float64)
+
+    @staticmethod
+    def from_cameras(cameras):
+        batch = CameraBatch(len(cameras), 1, 1)
+        for (i, cam) in enumerate(cameras):
+            batch.m_positions[i] = cam.pos
+            batch.m_rotations[i] = quaternion.as_float_array(cam.transform.rotation)
+            (batch.m_fovs[i], batch.m_ws[i], batch.m_hs[i], batch.m_nears[i], batch.m_fars[i]) = (cam.fov, cam.w, cam.h, cam.near, cam.far)
+        return batch
+
+    def camera(self, index):
+        cam = Camera(int(self.m_ws[index]), int(self.m_hs[index]))
+        (cam.fov, cam.near, cam.far) = (float(self.m_fovs[index]), float(self.m_nears[index]), float(self.m_fars[index]))
+        cam.pos = self.m_positions[index].astype('f')
+        cam.transform.rotation = quaternion.from_float_array(self.m_rotations[index])
+        return cam
+
+    def __len__(self):
+        return self.m_positions.shape[0]
+
+    # per camera arrays, writable in place (batch.positions[10:20] = ...)
+    @property
+    def positions(self):
+        return self.m_positions
+
+    @property
+    def rotations(self):
+        return self.m_rotations
+
+    @property
+    def fovs(self):
+        return self.m_fovs
+
+    @property
+    def ws(self):
+        return self.m_ws
+
+    @property
+    def hs(self):
+        return self.m_hs
+
+    @property
+    def nears(self):
+        return self.m_nears
+
+    @property
+    def fars(self):
+        return self.m_fars
+
+    @positions.setter
+    def positions(self, value):
+        self.m_positions[:] = value
+
+    @rotations.setter
+    def rotations(self, value):
+        self.m_rotations[:] = value
+
+    @fovs.setter
+    def fovs(self, value):
+        self.m_fovs[:] = value
+
+    def rotation_matrices(self):
+        return t.rotation_matrices(self.m_rotations)
+
+    def fronts(self):
+        return self.rotation_matrices()[:, :, 2]
+
+    def transform_matrices(self):
+        # (N, 4, 4) camera to world, translation * rotation * scale like Transform.
+        mats = np.zeros((len(self), 4, 4), dtype = np.float64)
+        mats[:, 0:3, 0:3] = self.rotation_matrices() * CameraBatch.s_Scale[None, None, :]
+        mats[:, 0:3, 3] = self.m_positions
+        mats[:, 3, 3] = 1.0
+        return mats.astype('f')
+
+    def view_matrices(self):
+        return t.rigid_inverse(self.rotation_matrices(), np.broadcast_to(CameraBatch.s_Scale, (len(self), 3)), self.m_positions).astype('f')
+
+    def _proj_terms(self):
+        (n, f) = (self.m_nears, self.m_fars)
+        if g_InvertedDepth:
+            (f, n) = (self.m_nears, self.m_fars)
+        tan_half_fov = np.tan(0.5 * self.m_fovs)
+        return (1.0 / tan_half_fov, 1.0 / ((self.m_hs / self.m_ws) * tan_half_fov), -f / (f - n), -(n * f) / (f - n))
+
+    def proj_matrices(self):
+        # (N, 4, 4), same as t.projection_matrix_from_aspect per camera.
+        (a, b, c, d) = self._proj_terms()
+        mats = np.zeros((len(self), 4, 4), dtype = np.float64)
+        (mats[:, 0, 0], mats[:, 1, 1], mats[:, 2, 2], mats[:, 2, 3], mats[:, 3, 2]) = (a, b, c, d, -1.0)
+        return mats.astype('f')
+
+    def proj_inv_matrices(self):
+        (a, b, c, d) = self._proj_terms()
+        mats = np.zeros((len(self), 4, 4), dtype = np.float64)
+        (mats[:, 0, 0], mats[:, 1, 1], mats[:, 2, 3], mats[:, 3, 2], mats[:, 3, 3]) = (1.0 / a, 1.0 / b, -1.0, 1.0 / d, c / d)
+        return mats.astype('f')
+
+    def view_proj_matrices(self):
+        return np.matmul(self.proj_matrices(), self.view_matrices())
+
+    def interpolate(self, key_times, times, mode = "linear"):
+        # Treats this batch as the keys of a path at key_times (increasing) and returns a CameraBatch sampled at times.
+        # Rotations are slerped, positions are linear or, with mode "spline", a catmull rom spline through the keys.
+        if mode not in ("linear", "spline"):
+            raise Exception("Unknown camera path interpolation mode " + str(mode))
+        key_times = np.asarray(key_times, dtype = np.float64)
+        times = np.clip(np.asarray(times, dtype = np.float64), key_times[0], key_times[-1])
+        if key_times.shape[0] != len(self) or len(self) < 2:
+            raise Exception("Camera path needs one key time per camera and at least 2 keys.")
+
+        seg = np.clip(np.searchsorted(key_times, times, side = "right") - 1, 0, len(self) - 2)
+        u = (times - key_times[seg]) / (key_times[seg + 1] - key_times[seg])
+        out = CameraBatch(times.shape[0], 1, 1)
+        (p1, p2) = (self.m_positions[seg], self.m_positions[seg + 1])
+        if mode == "linear":
+            out.m_positions[:] = p1 + (p2 - p1) * u[:, None]
+        else:
+            # end keys are mirrored to get the outer tangents
+            p0 = np.where((seg == 0)[:, None], 2.0 * p1 - p2, self.m_positions[np.maximum(seg - 1, 0)])
+            p3 = np.where((seg == len(self) - 2)[:, None], 2.0 * p2 - p1, self.m_positions[np.minimum(seg + 2, len(self) - 1)])
+            (u1, u2, u3) = (u[:, None], u[:, None] ** 2, u[:, None] ** 3)
+            out.m_positions[:] = 0.5 * ((2.0 * p1) + (p2 - p0) * u1 + (2.0 * p0 - 5.0 * p1 + 4.0 * p2 - p3) * u2 + (3.0 * p1 - p0 - 3.0 * p2 + p3) * u3)
+
+        out.m_rotations[:] = vec.q_slerp(self.m_rotations[seg], self.m_rotations[seg + 1], u)
+        for (dst, src) in [(out.m_fovs, self.m_fovs), (out.m_ws, self.m_ws), (out.m_hs, self.m_hs), (out.m_nears, self.m_nears), (out.m_fars, self.m_fars)]:
+            dst[:] = src[seg] + (src[seg + 1] - src[seg]) * u
+        return out
@@ -0,0 +1,574 @@
+import numpy as np
+import math
+import heapq
+
+# CPU (numpy) reference of the splat rasterizer pipeline in splat_rasterizer_cs.hlsl.
+# Used for benchmarking and for validating the gpu passes without a gpu device.
+
+#keep in sync with splat_rasterizer_cs.hlsl
+CoarseTileSize = 32
+BitsPerView = 4
+BitsPerTileAddress = 14
+BitsPerClipZ = 32 - BitsPerTileAddress - BitsPerView
+ClipZRange = 600.0
+
+#float offsets of a vertex in a 3d gaussian splatting payload, keep in sync with SPLAT_*_OFFSET
+SplatPosOffset = 0
+SplatShOffset = 6
+SplatAlphaOffset = 54
+SplatScaleOffset = 55
+SplatRotOffset = 58
+
+class SplatCloud:
+
+    def __init__(self, payload, stride_floats = 62):
+        # payload: buffer / array holding vertex_count * stride_floats float32 values.
+        vertices = np.frombuffer(payload, dtype='f').reshape(-1, stride_floats)
+        self.m_positions = np.ascontiguousarray(vertices[:, SplatPosOffset:SplatPosOffset+3])
+        self.m_colors = np.maximum(vertices[:, SplatShOffset:SplatShOffset+3], 0.0)
+        self.m_alphas = 1.0 / (1.0 + np.exp(-vertices[:, SplatAlphaOffset]))
+        self.m_scales = np.exp(vertices[:, SplatScaleOffset:SplatScaleOffset+3])
+        self.m_rotations = np.ascontiguousarray(vertices[:, SplatRotOffset:SplatRotOffset+4])
+
+    @property
+    def vertex_count(self):
+        return self.m_positions.shape[0]
+
+    @property
+    def positions(self):
+        return self.m_positions
+
+    @property
+    def colors(self):
+        return self.m_colors
+
+    @property
+    def alphas(self):
+        return self.m_alphas
+
+    @property
+    def scales(self):
+        return self.m_scales
+
+    @property
+    def rotations(self):
+        return self.m_rotations
+
+    @property
+    def covariances(self):
+        return covariance_3d(self.m_rotations, self.m_scales)
+
+def coarse_tiles_dims(width, height):
+    return (int(math.ceil(width/CoarseTileSize)), int(math.ceil(height/CoarseTileSize)))
+
+def ndc_to_uv(ndc):
+    return ndc * np.array([0.5, -0.5], dtype='f') + 0.5
+
+def transform_points(matrix, points):
+    return points @ matrix[0:3, 0:3].T + matrix[0:3, 3]
+
+def covariance_3d(rotations, scales):
+    # returns (N, 3, 3), matches calcMatrixFromRotationScale / calcCovariance3D
+    q = rotations / np.maximum(np.linalg.norm(rotations, axis=1, keepdims=True), 1e-20)
+    (r, x, y, z) = (q[:, 0], q[:, 1], q[:, 2], q[:, 3])
+    rot = np.empty((q.shape[0], 3, 3), dtype='f')
+    rot[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    rot[:, 0, 1] = 2.0 * (x * y - r * z)
+    rot[:, 0, 2] = 2.0 * (x * z + r * y)
+    rot[:, 1, 0] = 2.0 * (x * y + r * z)
+    rot[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    rot[:, 1, 2] = 2.0 * (y * z - r * x)
+    rot[:, 2, 0] = 2.0 * (x * z - r * y)
+    rot[:, 2, 1] = 2.0 * (y * z + r * x)
+    rot[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    m = rot * scales[:, np.newaxis, :]
+    return m @ m.transpose(0, 2, 1)
+
+def covariance_2d(positions, cov3d, view_matrix, proj_matrix, screen_width):
+    # returns (N, 3) [m00, m01, m11], matches calcCovariance2D
+    view_pos = transform_points(view_matrix, positions)
+    aspect = proj_matrix[0, 0] / proj_matrix[1, 1]
+    (lim_x, lim_y) = (1.3 / proj_matrix[0, 0], 1.3 / (proj_matrix[1, 1] * aspect))
+    z = view_pos[:, 2]
+    x = np.clip(view_pos[:, 0] / z, -lim_x, lim_x) * z
+    y = np.clip(view_pos[:, 1] / z, -lim_y, lim_y) * z
+    focal = screen_width * proj_matrix[0, 0] / 2
+    J = np.zeros((positions.shape[0], 3, 3), dtype='f')
+    J[:, 0, 0] = focal / z
+    J[:, 0, 2] = -(focal * x) / (z * z)
+    J[:, 1, 1] = focal / z
+    J[:, 1, 2] = -(focal * y) / (z * z)
+    T = J @ view_matrix[0:3, 0:3]
+    cov = T @ cov3d @ T.transpose(0, 2, 1)
+    return np.stack([cov[:, 0, 0] + 0.3, cov[:, 0, 1], cov[:, 1, 1] + 0.3], axis=1)
+
+def decompose_covariance(cov2d):
+    # returns the two screen space axis of each splat, matches decomposeCovariance
+    (diag1, off_diag, diag2) = (cov2d[:, 0], cov2d[:, 1], cov2d[:, 2])
+    mid = 0.5 * (diag1 + diag2)
+    radius = np.sqrt(((diag1 - diag2) / 2.0) ** 2 + off_diag ** 2)
+    lambda1 = mid + radius
+    lambda2 = np.maximum(mid - radius, 0.1)
+    diag_vec = np.stack([off_diag, lambda1 - diag1], axis=1)
+    diag_vec = diag_vec / np.maximum(np.linalg.norm(diag_vec, axis=1, keepdims=True), 1e-20)
+    diag_vec[:, 1] = -diag_vec[:, 1]
+    max_size = 4096.0
+    axis0 = np.minimum(np.sqrt(2.0 * lambda1), max_size)[:, np.newaxis] * diag_vec
+    axis1 = np.minimum(np.sqrt(2.0 * lambda2), max_size)[:, np.newaxis] * np.stack([diag_vec[:, 1], -diag_vec[:, 0]], axis=1)
+    return (axis0, axis1)
+
+def quantize_clip_z(clip_z):
+    # depth bits of the coarse tile records, matches quantizeClipZ
+    z_mask = (1 << BitsPerClipZ) - 1
+    return (np.clip(clip_z, 0.0, 1.0) * float(z_mask)).astype(np.uint32) & z_mask
+
+def pack_coarse_tiles(view_index, tile_addresses, clip_z):
+    packed_z = quantize_clip_z(clip_z)
+    packed_tiles = (tile_addresses.astype(np.uint32) & ((1 << BitsPerTileAddress) - 1)) << BitsPerClipZ
+    packed_view = np.uint32((view_index & ((1 << BitsPerView) - 1)) << (BitsPerTileAddress + BitsPerClipZ))
+    return packed_view | packed_tiles | packed_z
+
+def unpack_coarse_tiles(keys):
+    view_indices = keys >> (BitsPerTileAddress + BitsPerClipZ)
+    tile_addresses = (keys >> BitsPerClipZ) & ((1 << BitsPerTileAddress) - 1)
+    clip_z = (keys & ((1 << BitsPerClipZ) - 1)) / float((1 << BitsPerClipZ) - 1)
+    return (view_indices, tile_addresses, clip_z)
+
+def splat_screen_bounds(positions, scales, view_matrix, proj_matrix):
+    # uv bounds of the splat bounding spheres, matches splatScreenBounds.
+    # returns (visible, aabb_begin (N,2), aabb_end (N,2), view_pos (N,3)), bounds are not clamped to the view.
+    view_pos = transform_points(view_matrix, positions)
+    clip_pos = view_pos @ proj_matrix[0:3, 0:3].T + proj_matrix[0:3, 3]
+    clip_w = view_pos @ proj_matrix[3, 0:3] + proj_matrix[3, 3]
+    visible = (np.abs(clip_pos[:, 2]) < clip_w) & np.all(np.abs(clip_pos[:, 0:2]) < (clip_w * 2.0)[:, np.newaxis], axis=1)
+
+    rad = np.linalg.norm(scales, axis=1)
+    end_pos = view_pos + rad[:, np.newaxis]
+    clip_end = end_pos @ proj_matrix[0:3, 0:3].T + proj_matrix[0:3, 3]
+    clip_end_w = end_pos @ proj_matrix[3, 0:3] + proj_matrix[3, 3]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        uv_center = ndc_to_uv(clip_pos[:, 0:2] / clip_w[:, np.newaxis])
+        uv_corner = ndc_to_uv(clip_end[:, 0:2] / clip_end_w[:, np.newaxis])
+    uv_diff = np.abs(uv_corner - uv_center)
+    aabb_begin = uv_center - uv_diff
+    aabb_end = uv_center + uv_diff
+    visible &= ~np.any(aabb_begin >= 1.0, axis=1) & ~np.any(aabb_end <= 0.0, axis=1)
+    return (visible, aabb_begin, aabb_end, view_pos)
+
+def splat_tile_rects(cloud, view_matrix, proj_matrix, width, height):
+    # per splat coarse tile rectangle, matches the culling and bounds of csCoarseTileBin.
+    # returns (splat_ids, tile_begin (N,2), tile_end (N,2), view_z) of the visible splats.
+    (visible, aabb_begin, aabb_end, view_pos) = splat_screen_bounds(cloud.positions, cloud.scales, view_matrix, proj_matrix)
+    splat_ids = np.nonzero(visible)[0].astype(np.uint32)
+    view_size = np.array([width, height], dtype='f')
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    tile_max = np.array([tiles_x - 1, tiles_y - 1])
+    tile_begin = np.floor(np.clip(aabb_begin[splat_ids], 0.0, 1.0) * view_size / CoarseTileSize).astype(np.int64)
+    tile_end = np.floor(np.clip(aabb_end[splat_ids], 0.0, 1.0) * view_size / CoarseTileSize).astype(np.int64)
+    #the gpu writes past the last tile when the view size is a multiple of the tile size, clamp here instead.
+    tile_end = np.minimum(tile_end, tile_max)
+    return (splat_ids, tile_begin, tile_end, view_pos[splat_ids, 2])
+
+def bin_splats(cloud, view_matrix, proj_matrix, width, height, view_index = 0):
+    # returns the coarse tile records (keys, splat_ids) of a view, same as csCoarseTileBin.
+    (splat_ids, tile_begin, tile_end, view_z) = splat_tile_rects(cloud, view_matrix, proj_matrix, width, height)
+    (tiles_x, _) = coarse_tiles_dims(width, height)
+    extents = tile_end - tile_begin + 1
+    counts = extents[:, 0] * extents[:, 1]
+    total = int(counts.sum())
+
+    record_splats = np.repeat(np.arange(splat_ids.shape[0]), counts)
+    local_index = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    # column major within the rect, same loop order as the shader (i outer, j inner)
+    tile_x = tile_begin[record_splats, 0] + local_index // extents[record_splats, 1]
+    tile_y = tile_begin[record_splats, 1] + local_index % extents[record_splats, 1]
+    keys = pack_coarse_tiles(view_index, tile_x + tile_y * tiles_x, np.abs(view_z[record_splats]) / ClipZRange)
+    return (keys, splat_ids[record_splats])
+
+def sort_records(keys):
+    # stable, same ordering as the lsb radix sort in radix_sort.hlsl
+    return np.argsort(keys, kind='stable').astype(np.uint32)
+
+def tile_list_ranges(sorted_keys, tile_count):
+    # returns (tile_count, 2) [begin, end) of each tile in the sorted record list, same as csCreateCoarseTileListRanges
+    (_, tile_addresses, _) = unpack_coarse_tiles(sorted_keys)
+    tiles = np.arange(tile_count)
+    ranges = np.empty((tile_count, 2), dtype=np.uint32)
+    ranges[:, 0] = np.searchsorted(tile_addresses, tiles, side='left')
+    ranges[:, 1] = np.searchsorted(tile_addresses, tiles, side='right')
+    return ranges
+
+# Per tile local sort (SplatRaster.sort_mode "local"): records are counted per tile, the counts prefix summed into the
+# tile list ranges and the records scattered into them, then every tile is sorted by the full float view depth of its
+# splats. Tiles over LocalSortMaxRecords records fall back to a radix sort of (tile, depth) keys.
+# keep in sync with LOCAL_SORT_MAX_RECORDS in splat_rasterizer_cs.hlsl
+LocalSortMaxRecords = 2048
+
+def count_tile_records(keys, tile_count):
+    # records per tile, same as csCountTileRecords
+    (_, tile_addresses, _) = unpack_coarse_tiles(keys)
+    return np.bincount(tile_addresses, minlength=tile_count).astype(np.uint32)
+
+def tile_record_ranges(counts):
+    # (tile_count, 2) [begin, end) of each tile from the inclusive prefix sum of its record counts, same as csCreateLocalSortRanges
+    ends = np.cumsum(counts, dtype=np.int64)
+    return np.stack([ends - counts, ends], axis=1).astype(np.uint32)
+
+def scatter_tile_records(keys):
+    # record indices grouped by tile, in the tile ranges of tile_record_ranges. csScatterTileRecords places the records
+    # of a tile in atomic order, here they keep the record order.
+    (_, tile_addresses, _) = unpack_coarse_tiles(keys)
+    return np.argsort(tile_addresses, kind='stable').astype(np.uint32)
+
+def bitonic_sort(keys, values):
+    # sorts every row of (rows, n) uint32 keys, n a power of 2, with the compare / exchange network of csLocalSortTiles,
+    # equal keys ordered by value. returns the sorted (keys, values).
+    (keys, values) = (np.array(keys, dtype=np.uint32), np.array(values, dtype=np.uint32))
+    index = np.arange(keys.shape[1])
+    k = 2
+    while k <= keys.shape[1]:
+        j = k >> 1
+        while j > 0:
+            partner = index ^ j
+            (lo, hi) = (index[partner > index], partner[partner > index])
+            (key_lo, key_hi, value_lo, value_hi) = (keys[:, lo], keys[:, hi], values[:, lo], values[:, hi])
+            greater = (key_lo > key_hi) | ((key_lo == key_hi) & (value_lo > value_hi))
+            swap = greater == ((lo & k) == 0)
+            (keys[:, lo], keys[:, hi]) = (np.where(swap, key_hi, key_lo), np.where(swap, key_lo, key_hi))
+            (values[:, lo], values[:, hi]) = (np.where(swap, value_hi, value_lo), np.where(swap, value_lo, value_hi))
+            j >>= 1
+        k <<= 1
+    return (keys, values)
+
+def fallback_sort_keys(tiles, depths, tile_count):
+    # (tile, depth) keys of the records of tiles over LocalSortMaxRecords, the depth gets the bits the tile index
+    # leaves. matches localSortFallbackKey
+    depth_bits = 32 - max(1, int(tile_count - 1).bit_length())
+    depth_mask = (1 << depth_bits) - 1
+    quantized = (np.clip(depths / ClipZRange, 0.0, 1.0).astype(np.float32) * np.float32(depth_mask)).astype(np.uint64)
+    return ((tiles.astype(np.uint64) << depth_bits) | np.minimum(quantized, depth_mask)).astype(np.uint32)
+
+def local_sort_tiles(ordering, ranges, depths, max_records = LocalSortMaxRecords):
+    # sorts the records of every tile, ordering: record indices grouped by tile (scatter_tile_records), depths: view
+    # depth per record. Same order as csLocalSortTiles and the fallback radix sort. returns (ordering, fallback tiles).
+    ordering = np.array(ordering, dtype=np.uint32)
+    counts = (ranges[:, 1].astype(np.int64) - ranges[:, 0])
+    # tiles of the same padded (power of 2) size are sorted as the rows of one network
+    local_tiles = np.nonzero((counts > 1) & (counts <= max_records))[0]
+    padded = np.array([1 << int(c - 1).bit_length() for c in counts[local_tiles]], dtype=np.int64)
+    for size in np.unique(padded):
+        tiles = local_tiles[padded == size]
+        positions = ranges[tiles, 0][:, np.newaxis].astype(np.int64) + np.arange(size)[np.newaxis, :]
+        valid = np.arange(size)[np.newaxis, :] < counts[tiles][:, np.newaxis]
+        records = np.where(valid, ordering[np.where(valid, positions, 0)], 0xffffffff).astype(np.uint32)
+        keys = np.where(valid, np.abs(depths[np.where(valid, records, 0)]).astype(np.float32).view(np.uint32), 0xffffffff)
+        (_, records) = bitonic_sort(keys, records)
+        ordering[positions[valid]] = records[valid]
+
+    fallback_tiles = np.nonzero(counts > max_records)[0]
+    if fallback_tiles.shape[0] > 0:
+        positions = np.concatenate([np.arange(ranges[t, 0], ranges[t, 1]) for t in fallback_tiles])
+        records = ordering[positions]
+        keys = fallback_sort_keys(np.repeat(fallback_tiles, counts[fallback_tiles]), np.abs(depths[records]), ranges.shape[0])
+        ordering[positions] = records[np.argsort(keys, kind='stable')]
+    return (ordering, fallback_tiles)
+
+def local_sort_records(cloud, keys, splat_ids, view_matrix, tile_count, max_records = LocalSortMaxRecords):
+    # local sort path of the records of a view (bin_splats), returns (ordering, ranges, fallback tiles) with ordering /
+    # ranges in the layout of sort_records / tile_list_ranges.
+    ranges = tile_record_ranges(count_tile_records(keys, tile_count))
+    depths = transform_points(view_matrix, cloud.positions[splat_ids])[:, 2]
+    (ordering, fallback_tiles) = local_sort_tiles(scatter_tile_records(keys), ranges, depths, max_records)
+    return (ordering, ranges, fallback_tiles)
+
+class SplatScreenData:
+    # per splat values the raster pass needs, computed once per splat instead of per pixel.
+    def __init__(self, cloud, view_matrix, proj_matrix, width, height):
+        clip_pos = cloud.positions @ (proj_matrix @ view_matrix)[0:4, 0:3].T + (proj_matrix @ view_matrix)[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.screen_pos = ndc_to_uv(clip_pos[:, 0:2] / clip_pos[:, 3:4]) * np.array([width, height], dtype='f')
+        cov2d = covariance_2d(cloud.positions, cloud.covariances, view_matrix, proj_matrix, float(width))
+        (axis0, axis1) = decompose_covariance(cov2d)
+        (len0, len1) = (np.sum(axis0 * axis0, axis=1), np.sum(axis1 * axis1, axis=1))
+        self.axis0 = 2.0 * axis0 / len0[:, np.newaxis]
+        self.axis1 = 2.0 * axis1 / len1[:, np.newaxis]
+        self.opacity = np.clip(cloud.alphas, 0.0, 1.0)
+        self.colors = cloud.colors
+
+def preprocess(cloud, view_matrix, proj_matrix, width, height):
+    return SplatScreenData(cloud, view_matrix, proj_matrix, width, height)
+
+def tile_pixels(tile_x, tile_y, width, height):
+    # pixel centers of a coarse tile clipped to the view, (pixels, 2) row major, and the tile bounds (x0, y0, x1, y1).
+    (x0, y0) = (tile_x * CoarseTileSize, tile_y * CoarseTileSize)
+    (x1, y1) = (min(x0 + CoarseTileSize, width), min(y0 + CoarseTileSize, height))
+    (px, py) = np.meshgrid(np.arange(x0, x1, dtype='f') + 0.5, np.arange(y0, y1, dtype='f') + 0.5)
+    return (np.stack([px.ravel(), py.ravel()], axis=1), (x0, y0, x1, y1))
+
+def blend_records(screen_data, splat_ids, ordering, begin, end, pixels, chunk_size = 2048):
+    # blends the sorted records [begin, end) over pixels, returns (color (pixels, 3), transmittance (pixels,)): the color the
+    # records add to black and the product of their (1 - alpha). Any run blended over col gives color + col * transmittance.
+    col = np.zeros((pixels.shape[0], 3), dtype='f')
+    total_transmittance = np.ones(pixels.shape[0], dtype='f')
+    for chunk_begin in range(int(begin), int(end), chunk_size):
+        ids = splat_ids[ordering[chunk_begin:min(chunk_begin + chunk_size, int(end))]]
+        rel = screen_data.screen_pos[ids][:, np.newaxis, :] - pixels[np.newaxis, :, :]
+        u = np.sum(screen_data.axis0[ids][:, np.newaxis, :] * rel, axis=2)
+        v = np.sum(screen_data.axis1[ids][:, np.newaxis, :] * rel, axis=2)
+        alpha = np.exp(-(u * u + v * v)) * screen_data.opacity[ids][:, np.newaxis]
+        # col = rad + col * (1 - a), applied in order == sum(rad_k * prod_{j > k} (1 - a_j))
+        transmittance = np.cumprod((1.0 - alpha)[::-1], axis=0)[::-1]
+        after = np.vstack([transmittance[1:], np.ones((1, pixels.shape[0]), dtype='f')])
+        col = np.einsum('kp,kc->pc', alpha * after, screen_data.colors[ids]) + col * transmittance[0][:, np.newaxis]
+        total_transmittance *= transmittance[0]
+    return (col, total_transmittance)
+
+def raster(screen_data, splat_ids, ordering, ranges, width, height, chunk_size = 2048):
+    # returns an (height, width, 4) float32 image, same blending as csRasterSplats.
+    image = np.zeros((height, width, 4), dtype='f')
+    image[:, :, 3] = 1.0
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    for tile_y in range(tiles_y):
+        for tile_x in range(tiles_x):
+            (begin, end) = ranges[tile_x + tile_y * tiles_x]
+            if end <= begin:
+                continue
+
+            (pixels, (x0, y0, x1, y1)) = tile_pixels(tile_x, tile_y, width, height)
+            (col, _) = blend_records(screen_data, splat_ids, ordering, begin, end, pixels, chunk_size)
+            image[y0:y1, x0:x1, 0:3] = col.reshape(y1 - y0, x1 - x0, 3)
+    return image
+
+#keep in sync with splat_rasterizer.py
+DefaultTileSegmentSplats = 2048
+MaxTileSegments = 2048
+TileSegmentPixels = CoarseTileSize * CoarseTileSize
+TileSegmentGroups = (CoarseTileSize // 8) * (CoarseTileSize // 8)
+
+def tile_segments(ranges, segment_splats = DefaultTileSegmentSplats, max_segments = MaxTileSegments):
+    # splits the tiles holding more than segment_splats records, same as csCreateTileSegments with the segments allocated
+    # in tile order. returns (segments (S, 3) [tile, begin, end], tile_segments (tile_count, 2) [first segment, segment count]),
+    # tiles whose segments do not fit in max_segments keep (0, 0) and are rastered as a whole.
+    lengths = np.maximum(ranges[:, 1].astype(np.int64) - ranges[:, 0].astype(np.int64), 0)
+    split = (lengths > segment_splats) if segment_splats > 0 else np.zeros(lengths.shape[0], dtype=bool)
+    counts = np.where(split, (lengths + max(segment_splats, 1) - 1) // max(segment_splats, 1), 0)
+    first = np.cumsum(counts) - counts
+    # tiles that do not fit still take their slots (empty segments), so the tiles after them do not fit either.
+    tiles = np.nonzero(split & ((first + counts) <= max_segments))[0]
+    result = np.zeros((ranges.shape[0], 2), dtype=np.uint32)
+    result[tiles, 0] = first[tiles]
+    result[tiles, 1] = counts[tiles]
+
+    segment_tiles = np.repeat(tiles, counts[tiles])
+    local_index = np.arange(segment_tiles.shape[0]) - np.repeat(np.cumsum(counts[tiles]) - counts[tiles], counts[tiles])
+    begins = ranges[segment_tiles, 0].astype(np.int64) + local_index * segment_splats
+    segments = np.zeros((min(int(counts.sum()), max_segments), 3), dtype=np.int64)
+    segments[first[segment_tiles] + local_index] = np.stack([segment_tiles, begins, np.minimum(begins + segment_splats, ranges[segment_tiles, 1].astype(np.int64))], axis=1)
+    return (segments, result)
+
+def raster_segments(screen_data, splat_ids, ordering, segments, width, height, chunk_size = 2048):
+    # returns (S, TileSegmentPixels, 4) float32 partials: color and transmittance of every segment over the pixels of its
+    # (unclipped) tile, same as csRasterTileSegments.
+    (tiles_x, _) = coarse_tiles_dims(width, height)
+    partials = np.zeros((segments.shape[0], TileSegmentPixels, 4), dtype='f')
+    partials[:, :, 3] = 1.0
+    (px, py) = np.meshgrid(np.arange(CoarseTileSize, dtype='f') + 0.5, np.arange(CoarseTileSize, dtype='f') + 0.5)
+    local_pixels = np.stack([px.ravel(), py.ravel()], axis=1)
+    for (segment_index, (tile, begin, end)) in enumerate(segments):
+        if end <= begin:
+            continue
+        pixels = local_pixels + np.array([tile % tiles_x, tile // tiles_x], dtype='f') * CoarseTileSize
+        (col, transmittance) = blend_records(screen_data, splat_ids, ordering, begin, end, pixels, chunk_size)
+        partials[segment_index, :, 0:3] = col
+        partials[segment_index, :, 3] = transmittance
+    return partials
+
+def raster_load_balanced(screen_data, splat_ids, ordering, ranges, width, height, segment_splats = DefaultTileSegmentSplats, max_segments = MaxTileSegments, chunk_size = 2048):
+    # same image as raster() through the split tile path: segments of heavy tiles are blended on their own, then merged
+    # in list order (col = color + col * transmittance) like csRasterSplats. The other tiles are blended as a whole.
+    (segments, tile_segment_ranges) = tile_segments(ranges, segment_splats, max_segments)
+    partials = raster_segments(screen_data, splat_ids, ordering, segments, width, height, chunk_size)
+    image = np.zeros((height, width, 4), dtype='f')
+    image[:, :, 3] = 1.0
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    for tile_y in range(tiles_y):
+        for tile_x in range(tiles_x):
+            tile = tile_x + tile_y * tiles_x
+            (begin, end) = ranges[tile]
+            (first_segment, segment_count) = tile_segment_ranges[tile]
+            if end <= begin:
+                continue
+
+            (pixels, (x0, y0, x1, y1)) = tile_pixels(tile_x, tile_y, width, height)
+            if segment_count == 0:
+                (col, _) = blend_records(screen_data, splat_ids, ordering, begin, end, pixels, chunk_size)
+            else:
+                col = np.zeros((pixels.shape[0], 3), dtype='f')
+                pixel_index = (pixels[:, 0].astype(np.int64) - x0) + (pixels[:, 1].astype(np.int64) - y0) * CoarseTileSize
+                for partial in partials[first_segment : first_segment + segment_count]:
+                    col = partial[pixel_index, 0:3] + col * partial[pixel_index, 3:4]
+            image[y0:y1, x0:x1, 0:3] = col.reshape(y1 - y0, x1 - x0, 3)
+    return image
+
+def _dispatch_cost(group_costs, concurrent_groups):
+    # duration of a dispatch whose groups run in order on concurrent_groups slots, each group taking the first free slot.
+    slots = [0.0] * min(concurrent_groups, max(1, len(group_costs)))
+    heapq.heapify(slots)
+    for cost in group_costs:
+        heapq.heappush(slots, heapq.heappop(slots) + cost)
+    return max(slots)
+
+def tile_load_histogram(ranges, bin_count = 16):
+    # records per non empty tile in power of two bins, returns (counts, bin edges): bin i counts tiles with [edges[i], edges[i+1]) records.
+    lengths = np.maximum(ranges[:, 1].astype(np.int64) - ranges[:, 0].astype(np.int64), 0)
+    edges = np.concatenate([[1], 2 ** np.arange(1, bin_count), [np.iinfo(np.int64).max]])
+    (counts, _) = np.histogram(lengths[lengths > 0], bins = edges)
+    return (counts, edges)
+
+def load_balance_model(ranges, segment_splats = DefaultTileSegmentSplats, max_segments = MaxTileSegments, concurrent_groups = 512, group_overhead = 16.0, merge_cost = 0.25):
+    # expected raster time with and without splitting the heavy tiles, in splat evaluations per pixel. Every tile is
+    # TileSegmentGroups groups costing group_overhead plus one unit per record (or merge_cost per merged segment),
+    # scheduled on concurrent_groups slots in dispatch order. The split path adds the segment dispatch before the raster one.
+    lengths = np.maximum(ranges[:, 1].astype(np.int64) - ranges[:, 0].astype(np.int64), 0)
+    (segments, tile_segment_ranges) = tile_segments(ranges, segment_splats, max_segments)
+    split = tile_segment_ranges[:, 1] > 0
+
+    baseline = _dispatch_cost(np.repeat(lengths + group_overhead, TileSegmentGroups).tolist(), concurrent_groups)
+    segment_lengths = np.maximum(segments[:, 2] - segments[:, 1], 0)
+    raster_costs = np.where(split, tile_segment_ranges[:, 1] * merge_cost, lengths) + group_overhead
+    balanced = (_dispatch_cost(np.repeat(segment_lengths + group_overhead, TileSegmentGroups).tolist(), concurrent_groups) if segments.shape[0] > 0 else 0.0) + \
+        _dispatch_cost(np.repeat(raster_costs, TileSegmentGroups).tolist(), concurrent_groups)
+    (counts, edges) = tile_load_histogram(ranges)
+    non_empty = lengths[lengths > 0]
+    return {
+        "tiles" : int(lengths.shape[0]),
+        "non_empty_tiles" : int(non_empty.shape[0]),
+        "records" : int(lengths.sum()),
+        "max_tile_records" : int(lengths.max()) if lengths.shape[0] > 0 else 0,
+        "mean_tile_records" : float(non_empty.mean()) if non_empty.shape[0] > 0 else 0.0,
+        "p99_tile_records" : float(np.percentile(non_empty, 99)) if non_empty.shape[0] > 0 else 0.0,
+        "split_tiles" : int(split.sum()),
+        "segments" : int(segments.shape[0]),
+        "overflow_tiles" : int(np.sum((lengths > segment_splats) & ~split)) if segment_splats > 0 else 0,
+        "histogram" : { "edges" : [int(e) for e in edges[:-1]], "counts" : [int(c) for c in counts] },
+        "baseline_cost" : float(baseline),
+        "balanced_cost" : float(balanced),
+        "speedup" : float(baseline / max(balanced, 1e-9)) }
+
+def tile_load_report(cloud, view_matrix, proj_matrix, width, height, **model_args):
+    # bins / sorts a view like the gpu and runs load_balance_model on its tile lists.
+    (keys, _) = bin_splats(cloud, view_matrix, proj_matrix, width, height)
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    ranges = tile_list_ranges(np.sort(keys), tiles_x * tiles_y)
+    return load_balance_model(ranges, **model_args)
+
+def splat_weights(screen_data, splat_ids, ordering, ranges, width, height, vertex_count, chunk_size = 2048):
+    # returns (vertex_count,) float32, the blend weight of each splat summed over the pixels of the view, i.e. how many
+    # pixels worth of color it adds to the raster image: alpha_k * prod_{j > k} (1 - alpha_j) per pixel.
+    weights = np.zeros(vertex_count, dtype='f')
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    for tile_y in range(tiles_y):
+        for tile_x in range(tiles_x):
+            (begin, end) = ranges[tile_x + tile_y * tiles_x]
+            if end <= begin:
+                continue
+
+            (x0, y0) = (tile_x * CoarseTileSize, tile_y * CoarseTileSize)
+            (x1, y1) = (min(x0 + CoarseTileSize, width), min(y0 + CoarseTileSize, height))
+            (px, py) = np.meshgrid(np.arange(x0, x1, dtype='f') + 0.5, np.arange(y0, y1, dtype='f') + 0.5)
+            pixels = np.stack([px.ravel(), py.ravel()], axis=1)
+            # chunks in reverse blend order, later_transmittance is the product of (1 - alpha) of every splat blended after the chunk.
+            later_transmittance = np.ones(pixels.shape[0], dtype='f')
+            chunk_begins = list(range(int(begin), int(end), chunk_size))
+            for chunk_begin in reversed(chunk_begins):
+                ids = splat_ids[ordering[chunk_begin:min(chunk_begin + chunk_size, int(end))]]
+                rel = screen_data.screen_pos[ids][:, np.newaxis, :] - pixels[np.newaxis, :, :]
+                u = np.sum(screen_data.axis0[ids][:, np.newaxis, :] * rel, axis=2)
+                v = np.sum(screen_data.axis1[ids][:, np.newaxis, :] * rel, axis=2)
+                alpha = np.exp(-(u * u + v * v)) * screen_data.opacity[ids][:, np.newaxis]
+                transmittance = np.cumprod((1.0 - alpha)[::-1], axis=0)[::-1]
+                after = np.vstack([transmittance[1:], np.ones((1, pixels.shape[0]), dtype='f')])
+                np.add.at(weights, ids, np.sum(alpha * after * later_transmittance, axis=1))
+                later_transmittance *= transmittance[0]
+    return weights
+
+#keep in sync with splat_rasterizer.py / OCCLUSION_MAX_TEST_TILES in splat_rasterizer_cs.hlsl
+DefaultOcclusionOpacity = 0.99
+OcclusionMaxTestTiles = 64
+
+def tile_opaque_depths(screen_data, splat_ids, ordering, ranges, view_depths, width, height, opacity = DefaultOcclusionOpacity, chunk_size = 2048):
+    # returns (tile_count,) float32, the opaque depth csRasterSplats records per tile. Records are blended over the ones
+    # before them, walking a pixel's list from the end the transmittance of the records blended over it drops below
+    # 1 - opacity at some record: the records before it add less than 1 - opacity to the pixel. The tile keeps the smallest
+    # view depth of that record over its pixels, 0 when a pixel never gets there.
+    # view_depths: abs view z of every splat. Split tiles record the depth of the first record of the segment on the gpu,
+    # which is the same or smaller.
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    depths = np.zeros(tiles_x * tiles_y, dtype='f')
+    for tile_y in range(tiles_y):
+        for tile_x in range(tiles_x):
+            (begin, end) = ranges[tile_x + tile_y * tiles_x]
+            if end <= begin:
+                continue
+
+            (pixels, _) = tile_pixels(tile_x, tile_y, width, height)
+            pixel_depths = np.zeros(pixels.shape[0], dtype='f')
+            found = np.zeros(pixels.shape[0], dtype=bool)
+            transmittance = np.ones(pixels.shape[0], dtype='f')
+            for chunk_end in range(int(end), int(begin), -chunk_size):
+                # records of the chunk from the last one
+                ids = splat_ids[ordering[max(chunk_end - chunk_size, int(begin)):chunk_end]][::-1]
+                rel = screen_data.screen_pos[ids][:, np.newaxis, :] - pixels[np.newaxis, :, :]
+                u = np.sum(screen_data.axis0[ids][:, np.newaxis, :] * rel, axis=2)
+                v = np.sum(screen_data.axis1[ids][:, np.newaxis, :] * rel, axis=2)
+                alpha = np.exp(-(u * u + v * v)) * screen_data.opacity[ids][:, np.newaxis]
+                after = transmittance * np.cumprod(1.0 - alpha, axis=0)
+                crossed = after < (1.0 - opacity)
+                first = np.argmax(crossed, axis=0)
+                crossing = np.any(crossed, axis=0) & ~found
+                pixel_depths[crossing] = view_depths[ids[first[crossing]]]
+                found |= crossing
+                transmittance = after[-1]
+                if np.all(found):
+                    break
+            depths[tile_x + tile_y * tiles_x] = pixel_depths.min()
+    return depths
+
+def occluded_splats(cloud, splat_ids, prev_view_matrix, prev_proj_matrix, prev_tile_depths, width, height, parallax = 0.0):
+    # returns a bool per splat of splat_ids, True for the ones isSplatOccluded skips: inside the previous frame's view and,
+    # there, sorting before the opaque depth (prev_tile_depths, see tile_opaque_depths) of every tile of their bounds
+    # dilated by a tile.
+    # parallax: camera translation since the previous frame * focal length in pixels, tiles whose opaque surface moved by
+    # more than the dilation (parallax / depth > CoarseTileSize pixels) do not occlude.
+    (visible, aabb_begin, aabb_end, view_pos) = splat_screen_bounds(cloud.positions[splat_ids], cloud.scales[splat_ids], prev_view_matrix, prev_proj_matrix)
+    candidates = np.nonzero(visible & np.all(aabb_begin >= 0.0, axis=1) & np.all(aabb_end <= 1.0, axis=1))[0]
+    view_size = np.array([width, height], dtype='f')
+    (tiles_x, tiles_y) = coarse_tiles_dims(width, height)
+    tile_max = np.array([tiles_x - 1, tiles_y - 1])
+    tile_begin = np.clip(np.floor(aabb_begin[candidates] * view_size / CoarseTileSize).astype(np.int64) - 1, 0, tile_max)
+    tile_end = np.clip(np.floor(aabb_end[candidates] * view_size / CoarseTileSize).astype(np.int64) + 1, 0, tile_max)
+    extents = tile_end - tile_begin + 1
+    counts = extents[:, 0] * extents[:, 1]
+    tested = counts <= OcclusionMaxTestTiles
+    (candidates, tile_begin, extents, counts) = (candidates[tested], tile_begin[tested], extents[tested], counts[tested])
+
+    occluded = np.zeros(len(splat_ids), dtype=bool)
+    if candidates.shape[0] == 0:
+        return occluded
+    record_splats = np.repeat(np.arange(candidates.shape[0]), counts)
+    local_index = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = tile_begin[record_splats, 0] + local_index // extents[record_splats, 1]
+    tile_y = tile_begin[record_splats, 1] + local_index % extents[record_splats, 1]
+    depth_keys = quantize_clip_z(np.abs(view_pos[candidates, 2]) / ClipZRange)
+    tile_depths = prev_tile_depths[tile_x + tile_y * tiles_x]
+    hidden = (depth_keys[record_splats] < quantize_clip_z(tile_depths / ClipZRange)) & (tile_depths * CoarseTileSize >= parallax)
+    occluded[candidates] = np.logical_and.reduceat(hidden, np.cumsum(counts) - counts)
+    return occluded
+
+def render(cloud, view_matrix, proj_matrix, width, height):
+    (keys, splat_ids) = bin_splats(cloud, view_matrix, proj_matrix, width, height)
+    ordering = sort_records(keys)
+    ranges = tile_list_ranges(keys[ordering], coarse_tiles_dims(width, height)[0] * coarse_tiles_dims(width, height)[1])
+    screen_data = preprocess(cloud, view_matrix, proj_matrix, width, height)
+    return raster(screen_data, splat_ids, ordering, ranges, width, height)
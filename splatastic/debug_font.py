@@ -1,9 +1,17 @@
 import coalpy.gpu as g
 
+# created on first use (the font texture is loaded from disk), only the overlay needs them.
 font_sampler = None
 font_texture = None 
 
-def init():
-    global font_sampler, font_texture
-    font_sampler = g.Sampler(filter_type = g.FilterType.Linear)
-    font_texture = g.Texture(file = "data/debug_font.jpg")
+def get_font_sampler():
+    global font_sampler
+    if font_sampler is None:
+        font_sampler = g.Sampler(filter_type = g.FilterType.Linear)
+    return font_sampler
+
+def get_font_texture():
+    global font_texture
+    if font_texture is None:
+        font_texture = g.Texture(file = "data/debug_font.jpg")
+    return font_texture
@@ -7,8 +7,10 @@ import sys
 import pathlib
 import json
 import math
+import hashlib
 from . import native
-from . import scene_loader
+from . import scene_residency
+from . import resources
 from . import get_module_path
 from . import camera as c
 from . import transform as t
@@ -54,6 +56,12 @@ class EditorViewport:
         self.gpu_view_debug_info = None
         self.request_gpu_view_debug_info = False
 
+        #frame skipping state, see plan_render
+        self.m_last_camera_hash = None
+        self.m_last_inputs_hash = None
+        self.m_last_color_divider = 1
+        self.m_frame_counters = { "rendered" : 0, "skipped" : 0, "progressive" : 0 }
+
     def save_editor_state(self):
         return {
             'id' : self.m_id,
@@ -76,8 +84,7 @@ class EditorViewport:
             if (nw > 0 and nh > 0 and (self.m_texture == None or self.m_width != nw or self.m_height != nh)):
                 self.m_width = nw;
                 self.m_height = nh;
-                self.m_texture = g.Texture(
-                    name = self.m_name, width = self.m_width, height = self.m_height,
+                self.m_texture = resources.texture("editor", self.m_name, self, width = self.m_width, height = self.m_height,
                     format = g.Format.RGBA_8_UNORM)
 
             if (self.m_texture != None):
@@ -198,6 +205,37 @@ class EditorViewport:
     def is_focused(self):
         return self.m_is_focused
 
+    @property
+    def frame_counters(self):
+        return self.m_frame_counters
+
+    # The viewport texture keeps the last rendered frame, frames whose render inputs (camera matrices, size,
+    # scene version, settings) hash the same as the last full resolution frame don't need to be rendered again.
+    # With progressive_divider > 1 frames where the camera moves render at 1 / progressive_divider resolution,
+    # the first frame after the camera stops refines to full resolution.
+    # Returns the resolution divider to render at, or 0 to skip rendering this frame.
+    def plan_render(self, scene_data, settings = (), idle_skip = True, progressive_divider = 1):
+        cam = self.m_editor_camera
+        camera_hash = hashlib.blake2b(cam.view_matrix.tobytes() + cam.proj_matrix.tobytes(), digest_size = 16).digest()
+        inputs = (self.m_width, self.m_height, id(self.m_texture), scene_data.version, tuple(settings))
+        inputs_hash = hashlib.blake2b(camera_hash + repr(inputs).encode("utf-8"), digest_size = 16).digest()
+        moving = self.m_last_camera_hash is not None and camera_hash != self.m_last_camera_hash
+        self.m_last_camera_hash = camera_hash
+
+        if idle_skip and inputs_hash == self.m_last_inputs_hash and self.m_last_color_divider == 1:
+            self.m_frame_counters["skipped"] += 1
+            return 0
+
+        color_divider = progressive_divider if moving and progressive_divider > 1 else 1
+        (self.m_last_inputs_hash, self.m_last_color_divider) = (inputs_hash, color_divider)
+        self.m_frame_counters["rendered"] += 1
+        if color_divider > 1:
+            self.m_frame_counters["progressive"] += 1
+        return color_divider
+
+    def invalidate_render(self):
+        self.m_last_inputs_hash = None
+
     @property
     def debug_fine_tiles(self):
         return self.m_debug_fine_tiles
@@ -223,13 +261,27 @@ class Editor:
         self.m_profiler = None
 
         #scene data
-        self.m_scene_loader = None
         self.m_scene_data = None
+        self.m_scene_cache = None
+        self.m_residency = scene_residency.SceneResidencyManager()
 
     @property
     def scene_data(self):
         return self.m_scene_data
 
+    @property
+    def scene_cache(self):
+        return self.m_scene_cache
+
+    @scene_cache.setter
+    def scene_cache(self, value):
+        self.m_scene_cache = value
+        self.m_residency.disk_cache = value
+
+    @property
+    def residency(self):
+        return self.m_residency
+
     def createToolPanels(self):
         return {
             'view_panel' : EditorPanel("View Settings", False),
@@ -275,7 +327,7 @@ class Editor:
         if (imgui.begin_main_menu_bar()):
             if (imgui.begin_menu("File")):
                 if (imgui.menu_item("Open Scene")):
-                    self.m_open_active = self.m_scene_loader is None
+                    self.m_open_active = True
                 imgui.end_menu()
             if (imgui.begin_menu("Tools")):
                 for t in self.m_tools.values():
@@ -315,6 +367,8 @@ class Editor:
                     self.m_selected_viewport.reset_camera()
 
                 self.m_selected_viewport.m_cam_move_speed = imgui.slider_float(label="moving speed", v = self.m_selected_viewport.m_cam_move_speed, v_min = 0.01, v_max = 16.0)
+                frame_counters = self.m_selected_viewport.frame_counters
+                imgui.text("Frames rendered: %d (low res %d) skipped: %d" % (frame_counters["rendered"], frame_counters["progressive"], frame_counters["skipped"]))
 
             self.m_selected_viewport.request_gpu_view_debug_info = imgui.collapsing_header("Raster Debug Info")
             if (self.m_selected_viewport.request_gpu_view_debug_info):
@@ -352,28 +406,41 @@ class Editor:
 
         panel.state = imgui.begin(panel.name, panel.state)
 
-        if self.m_scene_loader is None and imgui.button("Open Scene") and not self.m_open_active:
+        if imgui.button("Open Scene") and not self.m_open_active:
             self.m_open_active = True
-        elif self.m_scene_loader != None:
-            imgui.text("Opening scene...")
-            (status, percentage, msg) = self.m_scene_loader.update_load_status()
-            if status == scene_loader.Reading:
-                imgui.progress_bar(fraction = percentage)
-            elif status == scene_loader.Failed:
-                print("Failed opening scene, reason: "+ msg) 
-                self.m_scene_loader = None
-            elif status == scene_loader.SuccessFinish:
-                print("Success loading scene.") 
-                self.m_scene_data = self.m_scene_loader.scene_data
-                self.m_scene_loader = None
-                if self.m_scene_data.vertex_count == 0:
-                    print ("No vertex count found. Unloading scene.")
-                    self.m_scene_data.vertex_count = None
+
+        residency = self.m_residency
+        (status, percentage, msg) = residency.active_status()
+        if status in (scene_residency.LoadingHost, scene_residency.Uploading):
+            imgui.text("Opening %s..." % residency.active_scene.name)
+            imgui.progress_bar(fraction = percentage)
         
         if self.m_scene_data != None:
             imgui.text("Scene vertices: %d" % self.m_scene_data.vertex_count)
             imgui.text("Vertex stride: %d" % self.m_scene_data.stride)
 
+        stats = residency.stats
+        imgui.text("Resident scenes: %d on gpu, %d in host memory" % (stats["gpu_resident"], stats["host_resident"]))
+        imgui.progress_bar(fraction = min(1.0, stats["vram_bytes"] / max(1, stats["vram_budget_bytes"])),
+            overlay = "VRAM %.2f / %.2f GB" % (stats["vram_bytes"] / (1024 ** 3), stats["vram_budget_bytes"] / (1024 ** 3)))
+        imgui.progress_bar(fraction = min(1.0, stats["host_bytes"] / max(1, stats["host_budget_bytes"])),
+            overlay = "Host %.2f / %.2f GB" % (stats["host_bytes"] / (1024 ** 3), stats["host_budget_bytes"] / (1024 ** 3)))
+        imgui.text("%d gpu hits, %d host hits, %d loads, %d prefetches" % (stats["gpu_hits"], stats["host_hits"], stats["loads"], stats["prefetches"]))
+        if len(residency.playlist) > 1:
+            if imgui.button("Previous Scene"):
+                residency.previous()
+            if imgui.button("Next Scene"):
+                residency.next()
+        for (i, scene) in enumerate(residency.scenes):
+            label = "%s [%s]##resident_scene_%d" % (scene.name, scene_residency.StateNames[scene.state], i)
+            if imgui.button(label) and scene is not residency.active_scene:
+                residency.activate(scene.path)
+
+        if self.m_scene_cache is not None:
+            stats = self.m_scene_cache.stats
+            imgui.text("Scene cache: %d hits, %d misses, %d evictions" % (stats["hits"], stats["misses"], stats["evictions"]))
+            imgui.text("Cache size: %.2f / %.2f GB" % (stats["total_bytes"] / (1024 ** 3), self.m_scene_cache.budget_bytes / (1024 ** 3)))
+
         imgui.end()
 
     @property
@@ -410,7 +477,18 @@ class Editor:
     def load_scene(self, file_path_name):
         if file_path_name is None:
             return
-        self.m_scene_loader = scene_loader.Loader(file_path_name)
+        self.m_residency.add_to_playlist(file_path_name)
+        self.m_residency.activate(file_path_name)
+
+    def set_playlist(self, file_path_names):
+        self.m_residency.set_playlist(file_path_names)
+
+    def update_scenes(self):
+        # keeps rendering the previous scene until the newly activated one is on the gpu.
+        self.m_residency.update()
+        scene_data = self.m_residency.active_scene_data
+        if scene_data is not None:
+            self.m_scene_data = scene_data
 
     def build_open_file(self, imgui):
         if not self.m_open_active:
@@ -432,6 +510,7 @@ class Editor:
         imgui.dockspace(dock_id=root_d_id)
         imgui.end()
 
+        self.update_scenes()
         self.build_menu_bar(imgui)
         self.build_view_settings_panel(imgui)
         self.build_scene_panel(imgui)
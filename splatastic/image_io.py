@@ -0,0 +1,49 @@
+import zlib
+import struct
+import numpy as np
+
+# Image encoding of rendered frames (readback captures, render server responses), numpy and zlib only.
+
+def encode_png(image, compress_level = 1):
+    # image (h, w, 4) or (h, w, 3) uint8, returns the png file bytes. zlib releases the gil, so threads encode in parallel.
+    (height, width, channels) = image.shape
+    rows = np.zeros((height, width * channels + 1), dtype = np.uint8)
+    rows[:, 1:] = image.reshape((height, width * channels))
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    header = struct.pack(">IIBBBBB", width, height, 8, 6 if channels == 4 else 2, 0, 0, 0)
+    return b"".join([b"\x89PNG\r\n\x1a\n", chunk(b"IHDR", header), chunk(b"IDAT", zlib.compress(rows.tobytes(), compress_level)), chunk(b"IEND", b"")])
+
+def decode_png(data):
+    # decodes the pngs encode_png writes (8 bit rgb / rgba, no interlacing, filter type 0 rows) back to (h, w, channels) uint8.
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise Exception("Not a png file.")
+    (offset, idat) = (8, [])
+    while offset < len(data):
+        (length, tag) = struct.unpack(">I4s", data[offset : offset + 8])
+        if tag == b"IHDR":
+            (width, height, depth, color_type) = struct.unpack(">IIBB", data[offset + 8 : offset + 18])
+        elif tag == b"IDAT":
+            idat.append(data[offset + 8 : offset + 8 + length])
+        offset += 12 + length
+    if depth != 8 or color_type not in [2, 6]:
+        raise Exception("Only 8 bit rgb / rgba pngs are supported.")
+    channels = 4 if color_type == 6 else 3
+    rows = np.frombuffer(zlib.decompress(b"".join(idat)), dtype = np.uint8).reshape((height, width * channels + 1))
+    if np.any(rows[:, 0] != 0):
+        raise Exception("Only unfiltered png rows are supported.")
+    return rows[:, 1:].reshape((height, width, channels)).copy()
+
+def write_png(file_name, image, compress_level = 1):
+    with open(file_name, "wb") as f:
+        f.write(encode_png(image, compress_level))
+
+def write_image(file_name, image):
+    # .png, .npy or raw bytes for anything else.
+    lower_name = file_name.lower()
+    if lower_name.endswith(".png"):
+        write_png(file_name, image)
+    elif lower_name.endswith(".npy"):
+        np.save(file_name, image)
+    else:
+        image.tofile(file_name)
@@ -0,0 +1,300 @@
+import numpy as np
+from . import scene_loader
+from . import paged_scene
+from . import cpu_rasterizer
+from . import resources
+
+# Instanced scenes: many placements (instances) of a few splat assets (props, vegetation, building modules), every
+# asset payload stored once on the gpu.
+#
+# InstanceTable is the host side (no gpu): per instance the asset, an affine 4x4 object to world transform and a tint.
+# InstancedScene copies the unique asset payloads into one gpu payload buffer and, once per batch, culls the instances
+# against the views (transformed asset bounds against each frustum) and uploads the table of the visible ones in the
+# scene metadata buffer. SplatRaster.raster_views rasters its scene_data like any scene: the coarse tile bin runs over
+# the splats of every visible instance, so all instances share one sort and one raster pass.
+#
+# Splat ids of instanced scenes are instance splat ids (first splat of the instance in the visible list + splat index in
+# its asset). The shaders find the instance with a binary search over the first splats (loadSplatInstance) and apply its
+# transform: position M * p, covariance A * cov * A^T (A the 3x3 part of M, so non uniform scales and shears work),
+# color * tint, and the instance's view mask skips the views it was culled from.
+# InstancedCloud is the cpu_rasterizer reference of the same transforms.
+
+# keep in sync with INSTANCE_METADATA_OFFSET / INSTANCE_RECORD_DWORDS in splat_rasterizer_cs.hlsl
+InstanceMetadataOffset = 4
+InstanceRecordDwords = 20
+# dword offsets in an instance record
+RecordTransform = 0
+RecordTint = 12
+RecordMaxScale = 15
+RecordFirstSplat = 16
+RecordViewMask = 17
+
+def transform_bounds(bounds, transforms):
+    # world aabbs (N, 6) of local aabbs ((N, 6) or one (6,)) under (N, 4, 4) affine transforms.
+    transforms = np.asarray(transforms, dtype = np.float64).reshape((-1, 4, 4))
+    bounds = np.broadcast_to(np.asarray(bounds, dtype = np.float64).reshape((-1, 6)), (transforms.shape[0], 6))
+    (center, half) = (0.5 * (bounds[:, 0:3] + bounds[:, 3:6]), 0.5 * (bounds[:, 3:6] - bounds[:, 0:3]))
+    linear = transforms[:, 0:3, 0:3]
+    world_center = np.einsum("nij,nj->ni", linear, center) + transforms[:, 0:3, 3]
+    world_half = np.einsum("nij,nj->ni", np.abs(linear), half)
+    return np.concatenate([world_center - world_half, world_center + world_half], axis = 1)
+
+def max_axis_scales(transforms):
+    # largest axis scale of each transform (column norm of its 3x3 part), scales the splat radius in the coarse tile bin.
+    return np.max(np.linalg.norm(np.asarray(transforms, dtype = np.float64)[:, 0:3, 0:3], axis = 1), axis = 1)
+
+def instance_view_masks(world_bounds, view_proj_matrices):
+    # bit v is set for the instances whose world aabb intersects the frustum of view v.
+    masks = np.zeros(world_bounds.shape[0], dtype = np.uint32)
+    for (v, view_proj) in enumerate(view_proj_matrices):
+        masks[paged_scene.visible_pages(world_bounds, view_proj)] |= np.uint32(1 << v)
+    return masks
+
+class InstanceTable:
+
+    def __init__(self):
+        self.m_assets = np.zeros(0, dtype = np.int32)
+        self.m_transforms = np.zeros((0, 4, 4), dtype = np.float64)
+        self.m_tints = np.zeros((0, 3), dtype = np.float32)
+        self.m_version = 0
+
+    @property
+    def count(self):
+        return self.m_assets.shape[0]
+
+    @property
+    def assets(self):
+        return self.m_assets
+
+    @property
+    def transforms(self):
+        return self.m_transforms
+
+    @property
+    def tints(self):
+        return self.m_tints
+
+    # bumped by every change of the table.
+    @property
+    def version(self):
+        return self.m_version
+
+    def add(self, asset, transform = None, tint = None):
+        # returns the index of the new instance.
+        return int(self.add_many([asset], None if transform is None else [transform], None if tint is None else [tint])[0])
+
+    def add_many(self, assets, transforms = None, tints = None):
+        # assets (N,), transforms (N, 4, 4) (identity if None), tints (N, 3) or one rgb (white if None), returns the new indices.
+        assets = np.asarray(assets, dtype = np.int32).reshape(-1)
+        count = assets.shape[0]
+        transforms = np.broadcast_to(np.eye(4), (count, 4, 4)) if transforms is None else np.asarray(transforms, dtype = np.float64).reshape((count, 4, 4))
+        if not np.allclose(transforms[:, 3], [0.0, 0.0, 0.0, 1.0]):
+            raise Exception("Instance transforms must be affine, with a last row of 0, 0, 0, 1.")
+        tints = np.ones((count, 3), dtype = np.float32) if tints is None else np.broadcast_to(np.asarray(tints, dtype = np.float32).reshape((-1, 3)), (count, 3))
+        first = self.count
+        self.m_assets = np.concatenate([self.m_assets, assets])
+        self.m_transforms = np.concatenate([self.m_transforms, transforms])
+        self.m_tints = np.concatenate([self.m_tints, tints])
+        self.m_version += 1
+        return np.arange(first, first + count)
+
+    def set_transforms(self, indices, transforms):
+        self.m_transforms[indices] = transforms
+        self.m_version += 1
+
+    def set_tints(self, indices, tints):
+        self.m_tints[indices] = tints
+        self.m_version += 1
+
+    def remove(self, indices):
+        # removes instances, the ones after them move down.
+        keep = np.ones(self.count, dtype = bool)
+        keep[indices] = False
+        (self.m_assets, self.m_transforms, self.m_tints) = (self.m_assets[keep], self.m_transforms[keep], self.m_tints[keep])
+        self.m_version += 1
+
+    def world_bounds(self, asset_bounds):
+        # (N, 6) world aabb of every instance, asset_bounds (asset count, 6).
+        return transform_bounds(np.asarray(asset_bounds, dtype = np.float64)[self.m_assets], self.m_transforms)
+
+def instance_metadata(table, asset_first_splats, asset_splat_counts, stride, view_masks):
+    # scene metadata buffer contents for the instances with a non zero view mask, in table order.
+    # Returns (uint32 metadata, visible instance indices, instance splat count).
+    visible = np.nonzero(view_masks)[0]
+    assets = table.assets[visible]
+    offsets = np.zeros(visible.shape[0] + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(np.asarray(asset_splat_counts, dtype = np.int64)[assets])
+    total = int(offsets[-1])
+    if total >= (1 << 32):
+        raise Exception("%d instance splats do not fit 32 bit splat ids." % total)
+    records = np.zeros((visible.shape[0], InstanceRecordDwords), dtype = np.uint32)
+    floats = records.view(np.float32)
+    transforms = table.transforms[visible]
+    floats[:, RecordTransform:RecordTransform + 12] = transforms[:, 0:3, :].reshape((-1, 12))
+    floats[:, RecordTint:RecordTint + 3] = table.tints[visible]
+    floats[:, RecordMaxScale] = max_axis_scales(transforms)
+    records[:, RecordFirstSplat] = np.asarray(asset_first_splats, dtype = np.int64)[assets]
+    records[:, RecordViewMask] = view_masks[visible]
+    header = np.array([total, stride, visible.shape[0], 0], dtype = np.uint32)
+    return (np.concatenate([header, offsets.astype(np.uint32), records.ravel()]), visible, total)
+
+def resolve_instance_splats(metadata, splat_ids):
+    # numpy reference of loadSplatInstance: (index in the visible instances, payload splat index) of instance splat ids.
+    count = int(metadata[2])
+    offsets = metadata[InstanceMetadataOffset : InstanceMetadataOffset + count + 1].astype(np.int64)
+    records = metadata[InstanceMetadataOffset + count + 1:].reshape((count, InstanceRecordDwords))
+    instances = np.searchsorted(offsets, splat_ids, side = "right") - 1
+    return (instances, records[instances, RecordFirstSplat].astype(np.int64) + np.asarray(splat_ids, dtype = np.int64) - offsets[instances])
+
+class InstancedCloud:
+
+    # cpu_rasterizer cloud of the splats of instances (all of them or the given indices, in instance splat id order),
+    # transformed the same way as the shaders.
+    def __init__(self, asset_clouds, table, instances = None):
+        instances = np.arange(table.count) if instances is None else np.asarray(instances, dtype = np.int64)
+        (positions, covariances, colors, alphas, scales, rotations) = ([], [], [], [], [], [])
+        max_scales = max_axis_scales(table.transforms[instances]) if instances.shape[0] > 0 else np.zeros(0)
+        for (i, instance) in enumerate(instances):
+            cloud = asset_clouds[table.assets[instance]]
+            transform = table.transforms[instance].astype(np.float32)
+            linear = transform[0:3, 0:3]
+            positions.append(cpu_rasterizer.transform_points(transform, cloud.positions))
+            covariances.append(linear @ cloud.covariances @ linear.T)
+            colors.append(cloud.colors * table.tints[instance])
+            alphas.append(cloud.alphas)
+            scales.append(cloud.scales * np.float32(max_scales[i]))
+            rotations.append(cloud.rotations)
+        concat = lambda parts, shape : np.concatenate(parts).astype(np.float32) if len(parts) > 0 else np.zeros(shape, dtype = np.float32)
+        self.m_positions = concat(positions, (0, 3))
+        self.m_covariances = concat(covariances, (0, 3, 3))
+        self.m_colors = concat(colors, (0, 3))
+        self.m_alphas = concat(alphas, (0,))
+        # only used for the coarse tile bin radius, like the shaders: asset scale * largest instance axis scale
+        self.m_scales = concat(scales, (0, 3))
+        self.m_rotations = concat(rotations, (0, 4))
+
+    @property
+    def vertex_count(self):
+        return self.m_positions.shape[0]
+
+    @property
+    def positions(self):
+        return self.m_positions
+
+    @property
+    def colors(self):
+        return self.m_colors
+
+    @property
+    def alphas(self):
+        return self.m_alphas
+
+    @property
+    def scales(self):
+        return self.m_scales
+
+    @property
+    def rotations(self):
+        return self.m_rotations
+
+    @property
+    def covariances(self):
+        return self.m_covariances
+
+def render(asset_clouds, asset_bounds, table, view_matrix, proj_matrix, width, height):
+    # cpu reference of an instanced scene view: instances culled by their world bounds, then rendered as one cloud.
+    masks = instance_view_masks(table.world_bounds(asset_bounds), [proj_matrix @ view_matrix])
+    return cpu_rasterizer.render(InstancedCloud(asset_clouds, table, np.nonzero(masks)[0]), view_matrix, proj_matrix, width, height)
+
+class InstancedScene:
+
+    # assets: SceneData with gpu payloads and bounds, all of the same stride. Their payloads are copied once into the
+    # instanced scene's payload buffer, the asset SceneData can be dropped afterwards.
+    def __init__(self, assets, table = None):
+        import coalpy.gpu
+        if len(assets) == 0:
+            raise Exception("Instanced scenes need at least one asset.")
+        if len(set(asset.stride for asset in assets)) != 1:
+            raise Exception("Instanced scene assets must share the same stride.")
+        if any(asset.bounds is None for asset in assets):
+            raise Exception("Instanced scene assets need bounds to cull their instances.")
+        self.m_stride = assets[0].stride
+        self.m_asset_splat_counts = np.array([asset.vertex_count for asset in assets], dtype = np.int64)
+        self.m_asset_first_splats = np.cumsum(self.m_asset_splat_counts) - self.m_asset_splat_counts
+        self.m_asset_bounds = np.array([asset.bounds for asset in assets], dtype = np.float64).reshape((-1, 6))
+        self.m_payload = resources.buffer("instancing", "InstancedScenePayload", self,
+            type = coalpy.gpu.BufferType.Raw,
+            stride = 4,
+            element_count = int(np.sum(self.m_asset_splat_counts)) * self.m_stride // 4,
+            mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
+        cmd_list = coalpy.gpu.CommandList()
+        for (asset, first) in zip(assets, self.m_asset_first_splats):
+            if asset.vertex_count > 0:
+                cmd_list.copy_resource(source = asset.payload_buffer, destination = self.m_payload, source_offset = 0,
+                    destination_offset = int(first) * self.m_stride, size = asset.vertex_count * self.m_stride)
+        coalpy.gpu.schedule(cmd_list)
+        self.m_metadata = None
+        self.m_metadata_elements = 0
+        self.m_scene_data = scene_loader.SceneData(payload_buffer = self.m_payload, metadata_buffer = None, vertex_count = 0, stride = self.m_stride)
+        self.m_table = InstanceTable() if table is None else table
+        self.m_world_bounds = None
+        self.m_bounds_version = -1
+        self.m_uploaded = None
+        self.m_stats = { "updates" : 0, "uploads" : 0, "instances" : 0, "visible_instances" : 0, "instance_splats" : 0 }
+
+    @property
+    def table(self):
+        return self.m_table
+
+    @property
+    def scene_data(self):
+        return self.m_scene_data
+
+    @property
+    def asset_bounds(self):
+        return self.m_asset_bounds
+
+    @property
+    def stats(self):
+        # payload bytes of the unique assets against what one payload copy per instance would take.
+        asset_bytes = int(np.sum(self.m_asset_splat_counts)) * self.m_stride
+        instanced_bytes = int(np.sum(self.m_asset_splat_counts[self.m_table.assets])) * self.m_stride
+        return dict(self.m_stats, asset_bytes = asset_bytes, instanced_bytes = instanced_bytes)
+
+    def world_bounds(self):
+        if self.m_bounds_version != self.m_table.version:
+            self.m_world_bounds = self.m_table.world_bounds(self.m_asset_bounds)
+            self.m_bounds_version = self.m_table.version
+        return self.m_world_bounds
+
+    def update(self, views):
+        # views: [(view_matrix, proj_matrix)] of the batch, in the order given to raster_views. Culls the instances
+        # against every view, uploads the table of the visible ones if it changed and returns the SceneData to raster.
+        import coalpy.gpu
+        if len(views) > 32:
+            raise Exception("Instance view masks hold at most 32 views.")
+        self.m_stats["updates"] += 1
+        masks = instance_view_masks(self.world_bounds(), [proj_matrix @ view_matrix for (view_matrix, proj_matrix) in views])
+        version = self.m_table.version
+        if self.m_uploaded is not None and self.m_uploaded[0] == version and np.array_equal(self.m_uploaded[1], masks):
+            return self.m_scene_data
+
+        (metadata, visible, total) = instance_metadata(self.m_table, self.m_asset_first_splats, self.m_asset_splat_counts, self.m_stride, masks)
+        if metadata.shape[0] > self.m_metadata_elements:
+            self.m_metadata_elements = max(metadata.shape[0], 2 * self.m_metadata_elements)
+            self.m_metadata = resources.buffer("instancing", "InstancedSceneMetadata", self,
+                format = coalpy.gpu.Format.R32_UINT,
+                stride = 4,
+                element_count = self.m_metadata_elements)
+        cmd_list = coalpy.gpu.CommandList()
+        cmd_list.upload_resource(source = metadata, destination = self.m_metadata)
+        coalpy.gpu.schedule(cmd_list)
+
+        self.m_scene_data.metadata_buffer = self.m_metadata
+        self.m_scene_data.vertex_count = total
+        if self.m_uploaded is None or self.m_uploaded[0] != version:
+            self.m_scene_data.touch()
+        self.m_uploaded = (version, masks)
+        self.m_stats["uploads"] += 1
+        (self.m_stats["instances"], self.m_stats["visible_instances"], self.m_stats["instance_splats"]) = (self.m_table.count, int(visible.shape[0]), total)
+        return self.m_scene_data
@@ -0,0 +1,59 @@
+import coalpy.gpu as g
+import time
+
+# Shaders are declared at import time but only created (and compiled) on first use, so tools that never
+# render a given pass never compile it. warm_up() creates every declared shader up front instead:
+# coalpy compiles them in the background, the first dispatch of a shader waits for its compile if needed.
+
+g_shaders = []
+
+class LazyShader:
+
+    def __init__(self, **shader_args):
+        self.m_shader_args = shader_args
+        self.m_shader = None
+        self.m_create_ms = 0.0
+        g_shaders.append(self)
+
+    @property
+    def name(self):
+        return self.m_shader_args.get("name", self.m_shader_args.get("main_function", ""))
+
+    @property
+    def is_created(self):
+        return self.m_shader is not None
+
+    @property
+    def create_ms(self):
+        return self.m_create_ms
+
+    def get(self):
+        if self.m_shader is None:
+            begin = time.perf_counter()
+            self.m_shader = g.Shader(**self.m_shader_args)
+            self.m_create_ms = (time.perf_counter() - begin) * 1000.0
+        return self.m_shader
+
+    def release(self):
+        self.m_shader = None
+
+def warm_up(wait = False):
+    # creates every declared shader, wait = True also blocks until all of them are compiled.
+    begin = time.perf_counter()
+    shaders = [s.get() for s in g_shaders]
+    if wait:
+        for shader in shaders:
+            shader.resolve()
+    return (time.perf_counter() - begin) * 1000.0
+
+def release_all():
+    # drops the shader objects (device shutdown / re init), they get created again on next use.
+    for s in g_shaders:
+        s.release()
+
+def stats():
+    created = [s for s in g_shaders if s.is_created]
+    return {
+        "declared" : len(g_shaders),
+        "created" : len(created),
+        "create_ms" : sum(s.create_ms for s in created) }
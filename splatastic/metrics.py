@@ -0,0 +1,319 @@
+import coalpy.gpu as g
+import numpy as np
+import time
+import json
+import csv
+from . import radix_sort
+from . import splat_rasterizer
+from . import resources
+
+# Headless per frame / per viewport render metrics.
+# Records live in a fixed size ring buffer (oldest records are overwritten) that can be queried
+# from python or dumped to csv / json, so long soak runs can be tracked without the profiler panel.
+
+# gpu markers emitted by SplatRaster. The batch stages are shared by all views of a batch,
+# raster_splat is dispatched once per view. A batch sorts its records with either radix_sort or local_sort
+# (SplatRaster.sort_mode), SortModeStages lists the stages each mode runs.
+BatchStages = ["coarse_tile_bin", "radix_sort", "local_sort", "create_tile_args", "create_tile_list_ranges", "tile_segments"]
+ViewStages = ["raster_splat"]
+Stages = BatchStages + ViewStages
+SortModeStages = {
+    "global" : [s for s in Stages if s != "local_sort"],
+    "local" : [s for s in Stages if s != "radix_sort"] }
+
+# json layout version, bump when the format changes.
+MetricsVersion = 5
+
+RecordFields = [
+    ("frame", np.int64),
+    ("time_s", np.float64),
+    ("view_id", np.int32),
+    ("batch_index", np.int32),
+    ("batch_size", np.int32),
+    ("width", np.int32),
+    ("height", np.int32)
+] + [(s + "_ms", np.float32) for s in Stages] + [
+    ("gpu_total_ms", np.float32),
+    ("record_ms", np.float32),
+    ("visible_splats", np.int64),
+    ("tile_records", np.int64),
+    ("batch_tile_records", np.int64),
+    ("tile_record_overflow", np.int64),
+    ("occlusion_culling", np.int32),
+    ("occluded_splats", np.int64),
+    ("occluded_tile_records", np.int64),
+    ("sort_mode", np.int32),
+    ("sort_fallback_records", np.int64),
+    ("sort_passes", np.int32),
+    ("gpu_memory_bytes", np.int64),
+    ("host_memory_bytes", np.int64)
+]
+
+RecordType = np.dtype(RecordFields)
+Columns = [name for (name, _) in RecordFields]
+
+def _empty_record():
+    record = np.zeros(1, dtype = RecordType)[0]
+    for (name, field_type) in RecordFields:
+        if field_type == np.float32:
+            record[name] = np.nan
+    return record
+
+class FrameMetrics:
+
+    def __init__(self, capacity = 4096):
+        if capacity <= 0:
+            raise Exception("Frame metrics capacity must be greater than 0.")
+        self.m_records = np.zeros(capacity, dtype = RecordType)
+        self.m_empty = _empty_record()
+        self.m_head = 0
+        self.m_count = 0
+        self.m_pushed = 0
+
+    @property
+    def capacity(self):
+        return self.m_records.shape[0]
+
+    @property
+    def count(self):
+        return self.m_count
+
+    @property
+    def dropped(self):
+        return self.m_pushed - self.m_count
+
+    def clear(self):
+        (self.m_head, self.m_count, self.m_pushed) = (0, 0, 0)
+
+    def push(self, **values):
+        self.m_records[self.m_head] = self.m_empty
+        row = self.m_records[self.m_head : self.m_head + 1]
+        for (name, value) in values.items():
+            row[name] = value
+        self.m_head = (self.m_head + 1) % self.capacity
+        self.m_count = min(self.m_count + 1, self.capacity)
+        self.m_pushed += 1
+
+    # returns a copy of the records in the order they were pushed (oldest first).
+    def records(self, view_id = None, last = None):
+        begin = (self.m_head - self.m_count) % self.capacity
+        ordered = np.roll(self.m_records, -begin)[:self.m_count]
+        if view_id is not None:
+            ordered = ordered[ordered["view_id"] == view_id]
+        return ordered if last is None else ordered[-last:]
+
+    def column(self, name, view_id = None, last = None):
+        return self.records(view_id, last)[name]
+
+    @property
+    def view_ids(self):
+        return sorted(set(int(v) for v in self.records()["view_id"]))
+
+    # per view statistics of every timing / counter column: {view_id : {column : {mean, median, p95, max}}}
+    def summary(self):
+        stats = {}
+        for view_id in self.view_ids:
+            records = self.records(view_id)
+            view_stats = { "frames" : int(records.shape[0]) }
+            for name in Columns[Columns.index(Stages[0] + "_ms"):]:
+                values = records[name].astype(np.float64)
+                values = values[~np.isnan(values)]
+                if values.shape[0] == 0:
+                    continue
+                view_stats[name] = {
+                    "mean" : float(values.mean()),
+                    "median" : float(np.median(values)),
+                    "p95" : float(np.percentile(values, 95)),
+                    "max" : float(values.max()) }
+            stats[view_id] = view_stats
+        return stats
+
+    def to_dicts(self, view_id = None, last = None):
+        return [{ name : row[name].item() for name in Columns } for row in self.records(view_id, last)]
+
+    def save_csv(self, file_name):
+        with open(file_name, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(Columns)
+            for row in self.records():
+                writer.writerow([row[name].item() for name in Columns])
+
+    def save_json(self, file_name):
+        # nan (stage not captured) is written as null to keep the file valid json.
+        records = [{ k : (None if isinstance(v, float) and np.isnan(v) else v) for (k, v) in r.items() } for r in self.to_dicts()]
+        with open(file_name, "w") as f:
+            json.dump({
+                "version" : MetricsVersion,
+                "capacity" : self.capacity,
+                "dropped" : self.dropped,
+                "columns" : Columns,
+                "summary" : { str(k) : v for (k, v) in self.summary().items() },
+                "memory" : resources.report(),
+                "records" : records }, f, indent = 1)
+
+    def save(self, file_name):
+        if file_name.lower().endswith(".json"):
+            self.save_json(file_name)
+        else:
+            self.save_csv(file_name)
+
+class _BatchCapture:
+
+    def __init__(self, views, readback, record_max, record_ms, sort_mode):
+        self.views = [(view.view_id, view.width, view.height, view.occlusion.culling) for view in views]
+        self.readback = readback
+        self.record_max = record_max
+        self.record_ms = record_ms
+        self.sort_mode = sort_mode
+        self.request = None
+
+class _FrameCapture:
+
+    def __init__(self, frame_index, time_s):
+        self.frame_index = frame_index
+        self.time_s = time_s
+        self.batches = []
+        self.markers = None
+        self.timestamp_request = None
+
+    def is_ready(self):
+        if self.timestamp_request is not None and not self.timestamp_request.is_ready():
+            return False
+        return all(b.request.is_ready() for b in self.batches)
+
+    def resolve(self):
+        if self.timestamp_request is not None:
+            self.timestamp_request.resolve()
+        for b in self.batches:
+            b.request.resolve()
+
+# Collects FrameMetrics from SplatRaster. Usage per frame:
+#   collector.begin_frame(), SplatRaster.raster_views (with rasterizer.metrics = collector), collector.end_frame()
+# gpu results are read back asynchronously, records are pushed to the ring buffer once a frame's downloads are ready.
+class FrameMetricsCollector:
+
+    def __init__(self, capacity = 4096, max_frames_in_flight = 8, collect_gpu_timings = True):
+        self.m_metrics = FrameMetrics(capacity)
+        self.m_max_frames_in_flight = max_frames_in_flight
+        self.m_collect_gpu_timings = collect_gpu_timings
+        self.m_frame_index = 0
+        self.m_begin_time = time.perf_counter()
+        self.m_frame = None
+        self.m_in_flight = []
+        self.m_free_readbacks = []
+        self.m_readback_count = 0
+
+    @property
+    def metrics(self):
+        return self.m_metrics
+
+    @property
+    def frame_index(self):
+        return self.m_frame_index
+
+    def begin_frame(self):
+        if self.m_frame is not None:
+            raise Exception("begin_frame called twice without end_frame.")
+        self.m_frame = _FrameCapture(self.m_frame_index, time.perf_counter() - self.m_begin_time)
+        if self.m_collect_gpu_timings:
+            g.begin_collect_markers()
+
+    def record_batch(self, cmd_list, view_stats_buffer, views, record_max, record_ms, sort_mode = "global"):
+        if self.m_frame is None:
+            return
+        if len(self.m_free_readbacks) == 0:
+            self.m_free_readbacks.append(resources.buffer("metrics", "FrameMetricsViewStatsReadback" + str(self.m_readback_count), self,
+            format = g.Format.R32_UINT,
+            stride = 4,
+            element_count = splat_rasterizer.ViewStatsSize * splat_rasterizer.MaxViewsPerBatch))
+            self.m_readback_count += 1
+        readback = self.m_free_readbacks.pop()
+        cmd_list.copy_resource(source = view_stats_buffer, destination = readback)
+        self.m_frame.batches.append(_BatchCapture(views, readback, record_max, record_ms, sort_mode))
+
+    def end_frame(self):
+        frame = self.m_frame
+        if frame is None:
+            return
+        self.m_frame = None
+        self.m_frame_index += 1
+        if self.m_collect_gpu_timings:
+            marker_results = g.end_collect_markers()
+            frame.markers = marker_results
+            frame.timestamp_request = g.ResourceDownloadRequest(resource = marker_results.timestamp_buffer)
+
+        for b in frame.batches:
+            b.request = g.ResourceDownloadRequest(resource = b.readback)
+        self.m_in_flight.append(frame)
+
+        # bound the number of frames waiting on the gpu, block on the oldest one if needed.
+        while len(self.m_in_flight) > self.m_max_frames_in_flight:
+            self.m_in_flight[0].resolve()
+            self._retire(self.m_in_flight.pop(0))
+        self.poll()
+
+    def poll(self):
+        while len(self.m_in_flight) > 0 and self.m_in_flight[0].is_ready():
+            self._retire(self.m_in_flight.pop(0))
+
+    def flush(self):
+        while len(self.m_in_flight) > 0:
+            self.m_in_flight[0].resolve()
+            self._retire(self.m_in_flight.pop(0))
+
+    def _retire(self, frame):
+        batch_timings = self._parse_markers(frame)
+        for batch_index, b in enumerate(frame.batches):
+            view_stats = np.frombuffer(b.request.data_as_bytearray(), dtype = np.uint32).reshape((-1, splat_rasterizer.ViewStatsSize))
+            batch_tile_records = int(view_stats[:len(b.views), splat_rasterizer.ViewStatsTileRecords].astype(np.int64).sum())
+            (batch_stages, view_stages) = batch_timings[batch_index] if batch_index < len(batch_timings) else ({}, [])
+            for view_index, (view_id, width, height, occlusion_culling) in enumerate(b.views):
+                stages = dict(batch_stages)
+                if view_index < len(view_stages):
+                    stages.update(view_stages[view_index])
+                self.m_metrics.push(
+                    frame = frame.frame_index,
+                    time_s = frame.time_s,
+                    view_id = view_id,
+                    batch_index = batch_index,
+                    batch_size = len(b.views),
+                    width = width,
+                    height = height,
+                    gpu_total_ms = sum(stages.values()) if len(stages) == len(SortModeStages[b.sort_mode]) else np.nan,
+                    record_ms = b.record_ms,
+                    visible_splats = int(view_stats[view_index, splat_rasterizer.ViewStatsVisibleSplats]),
+                    tile_records = int(view_stats[view_index, splat_rasterizer.ViewStatsTileRecords]),
+                    batch_tile_records = batch_tile_records,
+                    tile_record_overflow = max(0, batch_tile_records - b.record_max),
+                    occlusion_culling = int(occlusion_culling),
+                    occluded_splats = int(view_stats[view_index, splat_rasterizer.ViewStatsOccludedSplats]),
+                    occluded_tile_records = int(view_stats[view_index, splat_rasterizer.ViewStatsOccludedTileRecords]),
+                    sort_mode = splat_rasterizer.SortModes.index(b.sort_mode),
+                    sort_fallback_records = int(view_stats[view_index, splat_rasterizer.ViewStatsSortFallbackRecords]),
+                    sort_passes = radix_sort.g_radix_iterations,
+                    gpu_memory_bytes = resources.current_bytes(resources.Gpu),
+                    host_memory_bytes = resources.current_bytes(resources.Host),
+                    **{ s + "_ms" : ms for (s, ms) in stages.items() })
+            self.m_free_readbacks.append(b.readback)
+
+    def _parse_markers(self, frame):
+        # returns a list per batch of ({batch stage : ms}, [{view stage : ms} per view]).
+        # markers come in submission order, every coarse_tile_bin marker opens a new batch.
+        if frame.markers is None:
+            return []
+        timestamps = np.frombuffer(frame.timestamp_request.data_as_bytearray(), dtype = np.uint64)
+        to_ms = 1000.0 / float(frame.markers.timestamp_frequency)
+        batches = []
+        for (name, parent_index, begin_index, end_index) in frame.markers.markers:
+            if name not in Stages:
+                continue
+            ms = float(timestamps[end_index] - timestamps[begin_index]) * to_ms
+            if name == BatchStages[0]:
+                batches.append(({}, []))
+            if len(batches) == 0:
+                continue
+            if name in BatchStages:
+                batches[-1][0][name] = ms
+            else:
+                batches[-1][1].append({ name : ms })
+        return batches
@@ -1,9 +1,16 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <files/IFileSystem.h>
+#include <files/InternalFileSystem.h>
 #include <tasks/ITaskSystem.h>
+#include <tasks/TaskBenchmark.h>
 #include <scene/SceneDb.h>
+#include <scene/SceneContainer.h>
+#include <kernels/BufferKernels.h>
+#include <utils/Trace.h>
 #include <string>
+#include <vector>
+#include <atomic>
 
 #define KW_FN(pyname, fn_name, desc) \
     { #pyname, (PyCFunction)(fn_name), METH_VARARGS | METH_KEYWORDS, desc }
@@ -17,9 +24,16 @@ PyObject* g_exObj = nullptr;
 
 PyObject* initialize(PyObject* self, PyObject* vargs, PyObject* kwds)
 {
+    TaskSystemDesc tsDesc;
+    static const char* keywords[] = { "thread_count", "io_thread_count", "pin_threads", nullptr };
+    int pinThreads = 0;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "|iip", const_cast<char**>(keywords),
+        &tsDesc.threadPoolSize, &tsDesc.ioThreadCount, &pinThreads))
+        return nullptr;
+
+    tsDesc.pinThreads = pinThreads != 0;
     if (g_ts == nullptr)
     {
-        TaskSystemDesc tsDesc;
         g_ts = ITaskSystem::create(tsDesc);
         g_ts->start();
     }
@@ -61,6 +75,63 @@ PyObject* shutdown(PyObject* self, PyObject* vargs, PyObject* kwds)
     Py_RETURN_NONE;
 }
 
+PyObject* taskSystemStats(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    if (g_ts == nullptr)
+    {
+        PyErr_SetString(g_exObj, "Native module not initialized, call init() first.");
+        return nullptr;
+    }
+
+    ITaskSystem::Stats stats = {};
+    g_ts->getStats(stats);
+    return Py_BuildValue("{s:i,s:i,s:i,s:i,s:O,s:i,s:i,s:K,s:K,s:K}",
+        "live_tasks", stats.numElements,
+        "workers", stats.numWorkers,
+        "io_threads", stats.numIoThreads,
+        "available_cpus", stats.availableCpus,
+        "pinned_threads", stats.pinnedThreads ? Py_True : Py_False,
+        "queued_tasks", stats.queuedTasks,
+        "pending_io_jobs", stats.pendingIoJobs,
+        "tasks_executed", stats.tasksExecuted,
+        "tasks_stolen", stats.tasksStolen,
+        "io_jobs_executed", stats.ioJobsExecuted);
+}
+
+PyObject* benchmarkTaskSystem(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    if (g_ts == nullptr)
+    {
+        PyErr_SetString(g_exObj, "Native module not initialized, call init() first.");
+        return nullptr;
+    }
+
+    TaskBenchmarkDesc desc;
+    static const char* keywords[] = { "task_count", "chain_length", "parallel_for_elements", "parallel_for_grain", nullptr };
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "|iiii", const_cast<char**>(keywords),
+        &desc.taskCount, &desc.chainLength, &desc.parallelForElements, &desc.parallelForGrain))
+        return nullptr;
+
+    if (desc.taskCount < 0 || desc.chainLength < 0 || desc.parallelForElements < 0)
+    {
+        PyErr_SetString(g_exObj, "Benchmark counts must be positive.");
+        return nullptr;
+    }
+
+    TaskBenchmarkResults results;
+    Py_BEGIN_ALLOW_THREADS
+    runTaskBenchmark(*g_ts, desc, results);
+    Py_END_ALLOW_THREADS
+
+    return Py_BuildValue("{s:i,s:d,s:d,s:d,s:d,s:d}",
+        "workers", results.workerCount,
+        "tasks_per_sec", results.tasksPerSecond,
+        "task_batch_ms", results.taskBatchMs,
+        "chain_latency_us", results.chainLatencyUs,
+        "chain_ms", results.chainMs,
+        "parallel_for_ms", results.parallelForMs);
+}
+
 // python wrapper objects
 
 struct SceneAsyncRequest
@@ -69,6 +140,7 @@ struct SceneAsyncRequest
     SceneLoadHandle loadHandle;
     Py_buffer destCopyPayloadView = {};
     std::string fileName;
+    PyObject* statusCallback = nullptr;
 };
 
 int SceneAsyncRequest_init(PyObject* self, PyObject * vargs, PyObject* kwds)
@@ -102,7 +174,10 @@ PyObject* SceneAsyncRequest_resolve(PyObject* self, PyObject* vargs, PyObject* k
         return nullptr;
     }
 
-    g_sdb->resolve(sceneRequest.loadHandle); 
+    SceneLoadHandle loadHandle = sceneRequest.loadHandle;
+    Py_BEGIN_ALLOW_THREADS
+    g_sdb->resolve(loadHandle); 
+    Py_END_ALLOW_THREADS
 
     Py_RETURN_NONE;
 }
@@ -169,7 +244,15 @@ PyObject* SceneAsyncRequest_requestCopyPayload(PyObject* self, PyObject* vargs,
     if (PyObject_GetBuffer(destinationObj, &sceneRequest.destCopyPayloadView, 0) < 0)
         return nullptr;
 
-    if (!g_sdb->copyPayload(sceneRequest.loadHandle, (char*)sceneRequest.destCopyPayloadView.buf, sceneRequest.destCopyPayloadView.len))
+    // the GIL is released around every SceneDb call that can run a status callback.
+    bool copyStarted = false;
+    SceneLoadHandle loadHandle = sceneRequest.loadHandle;
+    char* dest = (char*)sceneRequest.destCopyPayloadView.buf;
+    size_t destSize = (size_t)sceneRequest.destCopyPayloadView.len;
+    Py_BEGIN_ALLOW_THREADS
+    copyStarted = g_sdb->copyPayload(loadHandle, dest, destSize);
+    Py_END_ALLOW_THREADS
+    if (!copyStarted)
     {
         PyBuffer_Release(&sceneRequest.destCopyPayloadView);
         PyErr_SetString(g_exObj, "Error trying to copy to payload, closing request.");
@@ -243,17 +326,655 @@ PyObject* SceneAsyncRequest_metadata(PyObject* self, PyObject* vargs, PyObject*
     return Py_BuildValue("(ii)", metadata.vertexCount, metadata.stride);
 }
 
+PyObject* SceneAsyncRequest_setStatusCallback(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& sceneRequest = *(SceneAsyncRequest*)self;
+    if (!sceneRequest.loadHandle.valid())
+    {
+        PyErr_SetString(g_exObj, "Invalid scene request.");
+        return nullptr;
+    }
+
+    const char* arguments[] = { "callback", nullptr };
+    PyObject* callbackObj = nullptr;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "O", const_cast<char**>(arguments), &callbackObj))
+        return nullptr;
+
+    if (callbackObj == Py_None)
+        callbackObj = nullptr;
+    else if (!PyCallable_Check(callbackObj))
+    {
+        PyErr_SetString(g_exObj, "Status callback must be callable or None.");
+        return nullptr;
+    }
+
+    SceneStatusCallback callback;
+    if (callbackObj != nullptr)
+    {
+        callback = [callbackObj](SceneLoadHandle, SceneLoadStatus status)
+        {
+            PyGILState_STATE gilState = PyGILState_Ensure();
+            PyObject* result = PyObject_CallFunction(callbackObj, "i", (int)status);
+            if (result == nullptr)
+                PyErr_WriteUnraisable(callbackObj);
+            Py_XDECREF(result);
+            PyGILState_Release(gilState);
+        };
+    }
+
+    // setStatusCallback waits for a running callback (which needs the GIL) before replacing it.
+    Py_XINCREF(callbackObj);
+    SceneLoadHandle loadHandle = sceneRequest.loadHandle;
+    Py_BEGIN_ALLOW_THREADS
+    g_sdb->setStatusCallback(loadHandle, std::move(callback));
+    Py_END_ALLOW_THREADS
+    Py_XDECREF(sceneRequest.statusCallback);
+    sceneRequest.statusCallback = callbackObj;
+    Py_RETURN_NONE;
+}
+
 void SceneAsyncRequest_dealloc(PyObject* self)
 {
     auto& sceneRequest = *(SceneAsyncRequest*)self;
     if (g_sdb != nullptr && sceneRequest.loadHandle.valid())
-        g_sdb->closeScene(sceneRequest.loadHandle);
+    {
+        SceneLoadHandle loadHandle = sceneRequest.loadHandle;
+        Py_BEGIN_ALLOW_THREADS
+        g_sdb->closeScene(loadHandle);
+        Py_END_ALLOW_THREADS
+    }
+    Py_XDECREF(sceneRequest.statusCallback);
     if (sceneRequest.destCopyPayloadView.obj != nullptr)
         PyBuffer_Release(&sceneRequest.destCopyPayloadView);
     sceneRequest.~SceneAsyncRequest();
     Py_TYPE(self)->tp_free(self);
 }
 
+struct SceneAsyncExport
+{
+    PyObject_HEAD;
+    SceneExportHandle exportHandle;
+    Py_buffer payloadView = {};
+    std::string fileName;
+};
+
+int SceneAsyncExport_init(PyObject* self, PyObject * vargs, PyObject* kwds)
+{
+    auto& sceneExport = *(SceneAsyncExport*)self;
+    new (&sceneExport) SceneAsyncExport;
+
+    if (g_sdb == nullptr)
+    {
+        PyErr_SetString(g_exObj, "Native module not initialized, call init() first.");
+        return -1;
+    }
+
+    static const char* keywords[] = { "file", "payload", "vertex_count", "properties", nullptr };
+    char* fileName = nullptr;
+    PyObject* payloadObj = nullptr;
+    int vertexCount = 0;
+    PyObject* propertiesObj = nullptr;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "sOiO", const_cast<char**>(keywords), &fileName, &payloadObj, &vertexCount, &propertiesObj))
+        return -1;
+
+    SceneExportDesc desc;
+    PyObject* seq = PySequence_Fast(propertiesObj, "properties must be a list of property names.");
+    if (seq == nullptr)
+        return -1;
+
+    for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); ++i)
+    {
+        const char* propertyName = PyUnicode_AsUTF8(PySequence_Fast_GET_ITEM(seq, i));
+        if (propertyName == nullptr)
+        {
+            Py_DECREF(seq);
+            return -1;
+        }
+        desc.propertyNames.push_back(propertyName);
+    }
+    Py_DECREF(seq);
+
+    if (!PyObject_CheckBuffer(payloadObj))
+    {
+        PyErr_SetString(g_exObj, "Payload must be a buffer protocol object.");
+        return -1;
+    }
+
+    if (PyObject_GetBuffer(payloadObj, &sceneExport.payloadView, PyBUF_SIMPLE) < 0)
+        return -1;
+
+    desc.payload = (const char*)sceneExport.payloadView.buf;
+    desc.payloadSize = (size_t)sceneExport.payloadView.len;
+    desc.vertexCount = vertexCount;
+
+    std::string error;
+    sceneExport.fileName = fileName;
+    sceneExport.exportHandle = g_sdb->exportScene(fileName, desc, error);
+    if (!sceneExport.exportHandle.valid())
+    {
+        PyBuffer_Release(&sceneExport.payloadView);
+        sceneExport.payloadView = {};
+        PyErr_SetString(g_exObj, error.c_str());
+        return -1;
+    }
+
+    return 0;
+}
+
+PyObject* SceneAsyncExport_resolve(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& sceneExport = *(SceneAsyncExport*)self;
+    if (!sceneExport.exportHandle.valid())
+    {
+        PyErr_SetString(g_exObj, "Invalid scene export.");
+        return nullptr;
+    }
+
+    SceneExportHandle exportHandle = sceneExport.exportHandle;
+    Py_BEGIN_ALLOW_THREADS
+    g_sdb->resolveExport(exportHandle);
+    Py_END_ALLOW_THREADS
+
+    Py_RETURN_NONE;
+}
+
+PyObject* SceneAsyncExport_status(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& sceneExport = *(SceneAsyncExport*)self;
+    if (!sceneExport.exportHandle.valid())
+    {
+        PyErr_SetString(g_exObj, "Invalid scene export.");
+        return nullptr;
+    }
+
+    SceneExportStatus exportStatus = g_sdb->checkExportStatus(sceneExport.exportHandle);
+    return Py_BuildValue("(is)", exportStatus, exportStatus == SceneExportStatus::Failed ? g_sdb->exportErrorStr(sceneExport.exportHandle) : "");
+}
+
+PyObject* SceneAsyncExport_ioProgress(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& sceneExport = *(SceneAsyncExport*)self;
+    if (!sceneExport.exportHandle.valid())
+    {
+        PyErr_SetString(g_exObj, "Invalid scene export.");
+        return nullptr;
+    }
+
+    unsigned long long b = {}, sz = {};
+    g_sdb->exportProgress(sceneExport.exportHandle, b, sz);
+    return Py_BuildValue("(KK)", b, sz);
+}
+
+void SceneAsyncExport_dealloc(PyObject* self)
+{
+    auto& sceneExport = *(SceneAsyncExport*)self;
+    if (g_sdb != nullptr && sceneExport.exportHandle.valid())
+    {
+        SceneExportHandle exportHandle = sceneExport.exportHandle;
+        Py_BEGIN_ALLOW_THREADS
+        g_sdb->closeExport(exportHandle);
+        Py_END_ALLOW_THREADS
+    }
+    if (sceneExport.payloadView.obj != nullptr)
+        PyBuffer_Release(&sceneExport.payloadView);
+    sceneExport.~SceneAsyncExport();
+    Py_TYPE(self)->tp_free(self);
+}
+
+// buffer kernels
+
+struct BufferJob
+{
+    const BufferKernel* kernel = nullptr;
+    BufferKernelArgs args;
+    std::vector<float> partials;
+    Py_buffer views[2 * MaxKernelBuffers] = {};
+    int viewCount = 0;
+
+    //read_file_ranges jobs, one destination buffer per file range.
+    InternalFileSystem::OpaqueFileHandle file = {};
+    std::vector<Py_buffer> rangeViews;
+    std::vector<unsigned long long> rangeOffsets;
+    std::atomic<int> failedRanges = { 0 };
+
+    Task rootTask;
+};
+
+void releaseBufferJob(BufferJob* job)
+{
+    if (job->rootTask.valid() && g_ts != nullptr)
+        g_ts->cleanTaskTree(job->rootTask);
+
+    for (int i = 0; i < job->viewCount; ++i)
+        PyBuffer_Release(&job->views[i]);
+
+    for (auto& view : job->rangeViews)
+        PyBuffer_Release(&view);
+
+    if (InternalFileSystem::valid(job->file))
+        InternalFileSystem::close(job->file);
+
+    delete job;
+}
+
+bool acquireKernelBuffers(PyObject* list, bool writable, BufferJob& job, const char** outPtrs, char** outMutablePtrs, size_t* outSizes, int& outCount)
+{
+    outCount = 0;
+    if (list == nullptr || list == Py_None)
+        return true;
+
+    PyObject* seq = PySequence_Fast(list, "Kernel buffers must be a list of buffer protocol objects.");
+    if (seq == nullptr)
+        return false;
+
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(seq);
+    if (count > (Py_ssize_t)MaxKernelBuffers)
+    {
+        Py_DECREF(seq);
+        PyErr_SetString(g_exObj, "Too many buffers passed to kernel.");
+        return false;
+    }
+
+    for (Py_ssize_t i = 0; i < count; ++i)
+    {
+        PyObject* obj = PySequence_Fast_GET_ITEM(seq, i);
+        Py_buffer& view = job.views[job.viewCount];
+        if (!PyObject_CheckBuffer(obj) || PyObject_GetBuffer(obj, &view, writable ? PyBUF_WRITABLE : PyBUF_SIMPLE) < 0)
+        {
+            Py_DECREF(seq);
+            if (!PyErr_Occurred())
+                PyErr_SetString(g_exObj, "Kernel buffers must be contiguous buffer protocol objects.");
+            return false;
+        }
+
+        ++job.viewCount;
+        if (writable)
+            outMutablePtrs[i] = (char*)view.buf;
+        else
+            outPtrs[i] = (const char*)view.buf;
+        outSizes[i] = (size_t)view.len;
+        ++outCount;
+    }
+
+    Py_DECREF(seq);
+    return true;
+}
+
+BufferJob* launchBufferJob(PyObject* vargs, PyObject* kwds)
+{
+    if (g_ts == nullptr)
+    {
+        PyErr_SetString(g_exObj, "Native module not initialized, call init() first.");
+        return nullptr;
+    }
+
+    static const char* keywords[] = { "kernel", "inputs", "outputs", "grain_size", "stride", nullptr };
+    const char* kernelName = nullptr;
+    PyObject* inputs = nullptr;
+    PyObject* outputs = nullptr;
+    int grainSize = 4096;
+    int stride = 0;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "s|OOii", const_cast<char**>(keywords), &kernelName, &inputs, &outputs, &grainSize, &stride))
+        return nullptr;
+
+    const BufferKernel* kernel = findBufferKernel(kernelName);
+    if (kernel == nullptr)
+    {
+        PyErr_Format(g_exObj, "Unknown kernel \"%s\". See buffer_kernels() for the list of kernels.", kernelName);
+        return nullptr;
+    }
+
+    BufferJob* job = new BufferJob;
+    job->kernel = kernel;
+    job->args.stride = stride;
+    if (!acquireKernelBuffers(inputs, false, *job, job->args.inputs, nullptr, job->args.inputSizes, job->args.inputCount)
+     || !acquireKernelBuffers(outputs, true, *job, nullptr, job->args.outputs, job->args.outputSizes, job->args.outputCount))
+    {
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    if (const char* err = prepareBufferKernelArgs(*kernel, job->args))
+    {
+        PyErr_SetString(g_exObj, err);
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    grainSize = grainSize < 1 ? 1 : grainSize;
+    int rangeCount = (job->args.elementCount + grainSize - 1) / grainSize;
+    job->partials.resize((size_t)rangeCount * kernel->partialsPerRange);
+    job->args.partials = job->partials.data();
+
+    Task parallelTask = g_ts->createParallelFor(kernel->name, job->args.elementCount, grainSize, [job, grainSize](int begin, int end)
+    {
+        job->kernel->rangeFn(job->args, begin / grainSize, begin, end);
+    });
+
+    job->rootTask = g_ts->createTask(TaskDesc(kernel->name, [job, rangeCount](TaskContext& ctx)
+    {
+        if (job->kernel->reduceFn)
+            job->kernel->reduceFn(job->args, rangeCount);
+    }));
+
+    if (!parallelTask.valid() || !job->rootTask.valid())
+    {
+        if (parallelTask.valid())
+            g_ts->cleanTaskTree(parallelTask);
+        PyErr_SetString(g_exObj, "Could not create kernel tasks.");
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    g_ts->depends(job->rootTask, parallelTask);
+    g_ts->execute(job->rootTask);
+    return job;
+}
+
+struct TaskFuture
+{
+    PyObject_HEAD;
+    BufferJob* job;
+};
+
+PyTypeObject g_TaskFutureType =
+{
+    PyVarObject_HEAD_INIT(NULL, 0)
+};
+
+//returns the number of file ranges that failed to read.
+int TaskFuture_finish(TaskFuture& future)
+{
+    if (future.job == nullptr)
+        return 0;
+
+    //always wait on the root task, not on state set in its body: the worker still touches the
+    //task record after the body returns, the task tree can only be freed once it is Finished.
+    Task rootTask = future.job->rootTask;
+    Py_BEGIN_ALLOW_THREADS
+    g_ts->wait(rootTask);
+    Py_END_ALLOW_THREADS
+
+    int failedRanges = future.job->failedRanges;
+    releaseBufferJob(future.job);
+    future.job = nullptr;
+    return failedRanges;
+}
+
+PyObject* TaskFuture_isReady(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& future = *(TaskFuture*)self;
+    if (future.job != nullptr && g_ts->isFinished(future.job->rootTask))
+    {
+        if (int failedRanges = TaskFuture_finish(future))
+        {
+            PyErr_Format(g_exObj, "Failed reading %d file ranges.", failedRanges);
+            return nullptr;
+        }
+    }
+
+    if (future.job == nullptr)
+        Py_RETURN_TRUE;
+
+    Py_RETURN_FALSE;
+}
+
+PyObject* TaskFuture_wait(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    auto& future = *(TaskFuture*)self;
+    if (int failedRanges = TaskFuture_finish(future))
+    {
+        PyErr_Format(g_exObj, "Failed reading %d file ranges.", failedRanges);
+        return nullptr;
+    }
+    Py_RETURN_NONE;
+}
+
+void TaskFuture_dealloc(PyObject* self)
+{
+    auto& future = *(TaskFuture*)self;
+    if (g_ts != nullptr)
+        TaskFuture_finish(future);
+    Py_TYPE(self)->tp_free(self);
+}
+
+bool registerTaskFutureType(PyObject* moduleObj)
+{
+    static PyMethodDef s_methods[] = {
+        KW_FN(is_ready, TaskFuture_isReady, "Returns True when the work is finished. Buffers are released once this returns True."),
+        KW_FN(wait, TaskFuture_wait, "Blocks (with the GIL released) until the work is finished."),
+        { nullptr }
+    };
+
+    PyTypeObject& o = g_TaskFutureType;
+    o.tp_name = "native.TaskFuture";
+    o.tp_basicsize = sizeof(TaskFuture);
+    o.tp_dealloc = TaskFuture_dealloc;
+    o.tp_flags = Py_TPFLAGS_DEFAULT;
+    o.tp_methods = s_methods;
+    o.tp_doc = R"(
+    Handle to work running in the native task system. Returned by map_buffers and read_file_ranges.
+    Keeps the buffers passed to the kernel alive until the work is finished.
+    For read_file_ranges, is_ready / wait raise if any range failed to read.
+    )";
+
+    if (PyType_Ready(&o) < 0)
+        return false;
+
+    if (PyModule_AddObject(moduleObj, "TaskFuture", (PyObject*)&o) < 0)
+        return false;
+
+    return true;
+}
+
+PyObject* mapBuffers(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    BufferJob* job = launchBufferJob(vargs, kwds);
+    if (job == nullptr)
+        return nullptr;
+
+    auto* future = (TaskFuture*)g_TaskFutureType.tp_alloc(&g_TaskFutureType, 0);
+    if (future == nullptr)
+    {
+        Py_BEGIN_ALLOW_THREADS
+        g_ts->wait(job->rootTask);
+        Py_END_ALLOW_THREADS
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    future->job = job;
+    return (PyObject*)future;
+}
+
+PyObject* readFileRanges(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    if (g_ts == nullptr)
+    {
+        PyErr_SetString(g_exObj, "Native module not initialized, call init() first.");
+        return nullptr;
+    }
+
+    static const char* keywords[] = { "file", "offsets", "outputs", nullptr };
+    const char* fileName = nullptr;
+    PyObject* offsets = nullptr;
+    PyObject* outputs = nullptr;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "sOO", const_cast<char**>(keywords), &fileName, &offsets, &outputs))
+        return nullptr;
+
+    PyObject* offsetSeq = PySequence_Fast(offsets, "offsets must be a list of ints.");
+    if (offsetSeq == nullptr)
+        return nullptr;
+    PyObject* outputSeq = PySequence_Fast(outputs, "outputs must be a list of writable buffer protocol objects.");
+    if (outputSeq == nullptr)
+    {
+        Py_DECREF(offsetSeq);
+        return nullptr;
+    }
+
+    BufferJob* job = new BufferJob;
+    Py_ssize_t rangeCount = PySequence_Fast_GET_SIZE(offsetSeq);
+    bool valid = rangeCount == PySequence_Fast_GET_SIZE(outputSeq);
+    if (!valid)
+        PyErr_SetString(g_exObj, "read_file_ranges needs one output per offset.");
+
+    job->rangeViews.reserve(rangeCount);
+    for (Py_ssize_t i = 0; valid && i < rangeCount; ++i)
+    {
+        unsigned long long offset = PyLong_AsUnsignedLongLong(PySequence_Fast_GET_ITEM(offsetSeq, i));
+        Py_buffer view = {};
+        if (PyErr_Occurred() || PyObject_GetBuffer(PySequence_Fast_GET_ITEM(outputSeq, i), &view, PyBUF_WRITABLE) < 0)
+        {
+            valid = false;
+            break;
+        }
+        job->rangeOffsets.push_back(offset);
+        job->rangeViews.push_back(view);
+    }
+    Py_DECREF(offsetSeq);
+    Py_DECREF(outputSeq);
+
+    if (valid)
+    {
+        job->file = InternalFileSystem::openFile(fileName, InternalFileSystem::RequestType::Read);
+        if (!InternalFileSystem::valid(job->file))
+        {
+            PyErr_Format(g_exObj, "Could not open file \"%s\".", fileName);
+            valid = false;
+        }
+    }
+
+    if (!valid)
+    {
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    //one task per range, the blocking read itself is handed to the io threads.
+    Task readTask = g_ts->createParallelFor("readFileRanges", (int)rangeCount, 1, [job](int begin, int end)
+    {
+        for (int i = begin; i < end; ++i)
+        {
+            bool success = false;
+            TaskUtil::yieldUntil([job, i, &success]()
+            {
+                SPT_TRACE_SCOPE_VALUE("io", "read_range", job->rangeViews[i].len);
+                success = InternalFileSystem::readRange(job->file, (size_t)job->rangeOffsets[i], (char*)job->rangeViews[i].buf, (size_t)job->rangeViews[i].len);
+            });
+            if (!success)
+                ++job->failedRanges;
+        }
+    });
+
+    //empty join task, TaskFuture waits on it (never on state set by a task body) before releasing the job.
+    job->rootTask = g_ts->createTask(TaskDesc("readFileRanges", nullptr));
+
+    if (!readTask.valid() || !job->rootTask.valid())
+    {
+        if (readTask.valid())
+            g_ts->cleanTaskTree(readTask);
+        PyErr_SetString(g_exObj, "Could not create file read tasks.");
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    g_ts->depends(job->rootTask, readTask);
+    g_ts->execute(job->rootTask);
+
+    auto* future = (TaskFuture*)g_TaskFutureType.tp_alloc(&g_TaskFutureType, 0);
+    if (future == nullptr)
+    {
+        Py_BEGIN_ALLOW_THREADS
+        g_ts->wait(job->rootTask);
+        Py_END_ALLOW_THREADS
+        releaseBufferJob(job);
+        return nullptr;
+    }
+
+    future->job = job;
+    return (PyObject*)future;
+}
+
+PyObject* parallelFor(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    BufferJob* job = launchBufferJob(vargs, kwds);
+    if (job == nullptr)
+        return nullptr;
+
+    Py_BEGIN_ALLOW_THREADS
+    g_ts->wait(job->rootTask);
+    Py_END_ALLOW_THREADS
+    releaseBufferJob(job);
+    Py_RETURN_NONE;
+}
+
+PyObject* listBufferKernels(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    int kernelCount = 0;
+    const BufferKernel* kernels = bufferKernels(kernelCount);
+    PyObject* result = PyDict_New();
+    for (int i = 0; i < kernelCount; ++i)
+    {
+        PyObject* desc = PyUnicode_FromString(kernels[i].description);
+        PyDict_SetItemString(result, kernels[i].name, desc);
+        Py_DECREF(desc);
+    }
+    return result;
+}
+
+PyObject* enableTrace(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    static const char* keywords[] = { "enabled", "max_events_per_thread", nullptr };
+    int enabled = 1;
+    unsigned long long maxEvents = 0ull;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "|pK", const_cast<char**>(keywords), &enabled, &maxEvents))
+        return nullptr;
+
+#if SPT_TRACING
+    if (maxEvents > 0ull)
+        Trace::setMaxEventsPerThread((size_t)maxEvents);
+    SPT_TRACE_THREAD_NAME("python");
+    Trace::setEnabled(enabled != 0);
+    Py_RETURN_TRUE;
+#else
+    Py_RETURN_FALSE;
+#endif
+}
+
+PyObject* dumpTrace(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    static const char* keywords[] = { "path", nullptr };
+    const char* path = nullptr;
+    if (!PyArg_ParseTupleAndKeywords(vargs, kwds, "s", const_cast<char**>(keywords), &path))
+        return nullptr;
+
+    size_t eventCount = 0;
+    std::string error;
+    bool success = false;
+    Py_BEGIN_ALLOW_THREADS
+    success = Trace::dump(path, eventCount, error);
+    Py_END_ALLOW_THREADS
+    if (!success)
+    {
+        PyErr_SetString(g_exObj, error.c_str());
+        return nullptr;
+    }
+
+    return PyLong_FromUnsignedLongLong((unsigned long long)eventCount);
+}
+
+PyObject* traceStats(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    Trace::Stats stats = {};
+    Trace::getStats(stats);
+    return Py_BuildValue("{s:O,s:O,s:K,s:K,s:i}",
+        "compiled", SPT_TRACING ? Py_True : Py_False,
+        "enabled", Trace::enabled() ? Py_True : Py_False,
+        "events", (unsigned long long)stats.events,
+        "dropped_events", (unsigned long long)stats.droppedEvents,
+        "threads", stats.threads);
+}
+
 //module types
 PyTypeObject g_SceneAsyncRequestType =
 {
@@ -265,11 +986,12 @@ bool registerSceneAsyncRequestType(PyObject* moduleObj)
     static PyMethodDef s_methods[] = {
         KW_FN(ioProgress, SceneAsyncRequest_ioProgress, "Returns: tuple (bytesRead, totalBytes)"),
         KW_FN(status, SceneAsyncRequest_status, "Gets the status [None, Reading, Invalidhandle, SuccessFinish, Failed] and a string message if an error exists"),
-        KW_FN(resolve, SceneAsyncRequest_resolve, "Halts and blocks for io to finish."),
+        KW_FN(resolve, SceneAsyncRequest_resolve, "Blocks (with the GIL released) until io is finished."),
         KW_FN(request_copy_payload, SceneAsyncRequest_requestCopyPayload, "Copies a payload to a destination memory view."),
         KW_FN(payload_size, SceneAsyncRequest_payloadSize, "Gets payload size."),
         KW_FN(metadata, SceneAsyncRequest_metadata, "Gets metadata as a tuple."),
         KW_FN(close_copy_payload, SceneAsyncRequest_closeCopyPayload, "Closes an in flight copy payload."),
+        KW_FN(set_status_callback, SceneAsyncRequest_setStatusCallback, "Calls callback(status) from a native thread (with the GIL held) every time the load changes status, None removes it."),
         { nullptr }
     };
 
@@ -296,9 +1018,83 @@ bool registerSceneAsyncRequestType(PyObject* moduleObj)
     return true;
 }
 
+PyTypeObject g_SceneAsyncExportType =
+{
+    PyVarObject_HEAD_INIT(NULL, 0)
+};
+
+bool registerSceneAsyncExportType(PyObject* moduleObj)
+{
+    static PyMethodDef s_methods[] = {
+        KW_FN(ioProgress, SceneAsyncExport_ioProgress, "Returns: tuple (bytesWritten, totalBytes)"),
+        KW_FN(status, SceneAsyncExport_status, "Gets the status [Writing, InvalidHandle, SuccessFinish, Failed] and a string message if an error exists"),
+        KW_FN(resolve, SceneAsyncExport_resolve, "Blocks (with the GIL released) until the file is written."),
+        { nullptr }
+    };
+
+    PyTypeObject& o = g_SceneAsyncExportType;
+    o.tp_name = "native.SceneAsyncExport";
+    o.tp_basicsize = sizeof(SceneAsyncExport);
+    o.tp_init = SceneAsyncExport_init;
+    o.tp_dealloc = SceneAsyncExport_dealloc;
+    o.tp_flags = Py_TPFLAGS_DEFAULT;
+    o.tp_new = PyType_GenericNew;
+    o.tp_methods = s_methods;
+    o.tp_doc = R"(
+    Scene Async Export Object. Writes a binary little endian ply file in the background.
+    Constructor:
+        file (str): destination file.
+        payload (buffer): vertex_count * len(properties) float32 values. Not copied, kept alive by this object.
+        vertex_count (int): number of vertices.
+        properties (list of str): name of each float property of a vertex.
+    )";
+
+    if (PyType_Ready(&o) < 0)
+        return false;
+
+    if (PyModule_AddObject(moduleObj, "SceneAsyncExport", (PyObject*)&o) < 0)
+        return false;
+
+    return true;
+}
+
+PyObject* containerCodecs(PyObject* self, PyObject* vargs, PyObject* kwds)
+{
+    return Py_BuildValue("{s:O,s:O,s:O}",
+        "none", Py_True,
+        "zlib", SPT_ZLIB ? Py_True : Py_False,
+        "lzma", SPT_LZMA ? Py_True : Py_False);
+}
+
 static PyMethodDef g_methods[] = {
-    {"init", (PyCFunction)initialize, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"init", (PyCFunction)initialize, METH_VARARGS | METH_KEYWORDS,
+        "Initializes the native module. Arguments: thread_count (compute workers, 0 = one per available CPU), "
+        "io_thread_count (threads for blocking file io), pin_threads (pin each worker to a CPU). "
+        "Arguments are ignored if the module is already initialized."},
+    {"task_system_stats", (PyCFunction)taskSystemStats, METH_VARARGS | METH_KEYWORDS,
+        "Returns a dict with the task system thread counts, queue depths and executed / stolen task counters."},
     {"shutdown", (PyCFunction)shutdown, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"benchmark_task_system", (PyCFunction)benchmarkTaskSystem, METH_VARARGS | METH_KEYWORDS,
+        "Runs the task system microbenchmark. Returns a dict with tasks/sec, dependency chain latency and parallel for timings."},
+    {"map_buffers", (PyCFunction)mapBuffers, METH_VARARGS | METH_KEYWORDS,
+        "Runs a built-in kernel over buffer protocol objects across the task system workers. "
+        "Arguments: kernel (str), inputs (list), outputs (list), grain_size (int), stride (int). Returns a TaskFuture."},
+    {"read_file_ranges", (PyCFunction)readFileRanges, METH_VARARGS | METH_KEYWORDS,
+        "Reads byte ranges of a file on the native task system (blocking reads run on the io threads).\n"
+        "Arguments: file (str), offsets (list of int), outputs (list of writable buffers, each filled with len(output) bytes from its offset). Returns a TaskFuture."},
+    {"parallel_for", (PyCFunction)parallelFor, METH_VARARGS | METH_KEYWORDS,
+        "Same as map_buffers, but blocks with the GIL released until the kernel is finished."},
+    {"buffer_kernels", (PyCFunction)listBufferKernels, METH_VARARGS | METH_KEYWORDS,
+        "Returns a dict of the built-in kernel names and the buffers each one expects."},
+    {"enable_trace", (PyCFunction)enableTrace, METH_VARARGS | METH_KEYWORDS,
+        "Starts (or stops with enabled=False) recording native trace events: tasks, file chunks and scene state transitions. "
+        "max_events_per_thread bounds the memory used until the next dump. Returns False if tracing was compiled out (SPT_TRACING=0)."},
+    {"dump_trace", (PyCFunction)dumpTrace, METH_VARARGS | METH_KEYWORDS,
+        "Writes the recorded events to path as chrome trace json (chrome://tracing, ui.perfetto.dev) and clears them. Returns the event count."},
+    {"trace_stats", (PyCFunction)traceStats, METH_VARARGS | METH_KEYWORDS,
+        "Returns a dict with the trace state and the number of recorded / dropped events."},
+    {"container_codecs", (PyCFunction)containerCodecs, METH_VARARGS | METH_KEYWORDS,
+        "Returns a dict of the compressed scene container codecs and whether this build can decompress them."},
     {NULL, NULL, 0, NULL},
 };
 
@@ -314,6 +1110,12 @@ bool initializeTypes(PyObject* moduleObj)
 {
     if (!registerSceneAsyncRequestType(moduleObj))
         return false;
+
+    if (!registerSceneAsyncExportType(moduleObj))
+        return false;
+
+    if (!registerTaskFutureType(moduleObj))
+        return false;
     
     return true;
 }
@@ -69,6 +69,8 @@ struct FileWriteResponse
 {
     IoError error = IoError::None;
     FileStatus status = FileStatus::Idle;
+    size_t bytesWritten = 0;
+    size_t totalBytes = 0;
 };
 
 using AsyncFileHandle = GenericHandle<unsigned int>;
@@ -77,7 +79,10 @@ using FileWriteDoneCallback = std::function<void(FileWriteResponse& response)>;
 
 enum class FileRequestFlags : int
 {
-    AutoStart = 1 << 0
+    AutoStart = 1 << 0,
+
+    // write requests only: segment buffers are not copied, the caller keeps them alive until the request is closed.
+    NoCopy = 1 << 1
 };
 
 struct FileReadRequest
@@ -96,21 +101,30 @@ struct FileReadRequest
     : flags(flags), path(path), doneCallback(doneCallback) {}
 };
 
+struct FileWriteSegment
+{
+    const char* buffer;
+    size_t size;
+};
+
+// Segments are written back to back into the file.
 struct FileWriteRequest
 {
     std::string path;
     FileWriteDoneCallback doneCallback;
-    const char* buffer;
-    int size;
+    std::vector<FileWriteSegment> segments;
     int flags;
     
     FileWriteRequest() {}
 
-    FileWriteRequest(std::string path, FileWriteDoneCallback doneCallback, const char* buffer, int size)
-    : flags(0), path(path), doneCallback(doneCallback), buffer(buffer), size(size) {}
+    FileWriteRequest(std::string path, FileWriteDoneCallback doneCallback, const char* buffer, size_t size)
+    : flags(0), path(path), doneCallback(doneCallback), segments({ { buffer, size } }) {}
+
+    FileWriteRequest(std::string path, FileWriteDoneCallback doneCallback, const char* buffer, size_t size, int flags)
+    : flags(flags), path(path), doneCallback(doneCallback), segments({ { buffer, size } }) {}
 
-    FileWriteRequest(std::string path, FileWriteDoneCallback doneCallback, const char* buffer, int size, int flags)
-    : flags(flags), path(path), doneCallback(doneCallback), buffer(buffer), size(size) {}
+    FileWriteRequest(std::string path, FileWriteDoneCallback doneCallback, const std::vector<FileWriteSegment>& segments, int flags)
+    : flags(flags), path(path), doneCallback(doneCallback), segments(segments) {}
 };
 
 struct FileAttributes
@@ -1,6 +1,7 @@
 #include "FileSystem.h"
 #include <tasks/ITaskSystem.h>
 #include <utils/Assert.h>
+#include <utils/Trace.h>
 #include "Utils.h"
 #include <sstream>
 
@@ -100,11 +101,13 @@ AsyncFileHandle FileSystem::read(const FileReadRequest& request)
             while (!readState.isEof)
             {
                 TaskUtil::yieldUntil([&readState, requestData]() {
+                    SPT_TRACE_SCOPE("io", "read_chunk");
                     readState.successRead = InternalFileSystem::readBytes(
                         requestData->opaqueHandle, readState.output, readState.bytesRead, readState.isEof);
                 });
 
                 {
+                    SPT_TRACE_SCOPE_VALUE("io", "read_callback", readState.bytesRead);
                     FileReadResponse response;
                     response.status = FileStatus::Reading;
                     response.buffer = readState.output;
@@ -188,9 +191,22 @@ AsyncFileHandle FileSystem::write(const FileWriteRequest& request)
         requestData->opaqueHandle = {};
         requestData->error = IoError::None;
         requestData->fileStatus = FileStatus::Idle;
-        requestData->writeBuffer.append((const u8*)request.buffer, (size_t)request.size);
-        requestData->writeSize = request.size;
-        requestData->task = m_ts.createTask(TaskDesc([this](TaskContext& ctx)
+        requestData->writeSize = 0;
+        for (const auto& segment : request.segments)
+            requestData->writeSize += segment.size;
+
+        if ((request.flags & (int)FileRequestFlags::NoCopy) != 0)
+        {
+            requestData->writeSegments = request.segments;
+        }
+        else
+        {
+            for (const auto& segment : request.segments)
+                requestData->writeBuffer.append((const u8*)segment.buffer, segment.size);
+            requestData->writeSegments.push_back({ (const char*)requestData->writeBuffer.data(), requestData->writeSize });
+        }
+
+        requestData->task = m_ts.createTask(TaskDesc("FileSystem::write", [this](TaskContext& ctx)
         {
             auto* requestData = (Request*)ctx.data;
             {
@@ -236,12 +252,34 @@ AsyncFileHandle FileSystem::write(const FileWriteRequest& request)
                 const char* buffer;
                 int bufferSize;
                 bool successWrite;
-            } writeState = { (const char*)requestData->writeBuffer.data(), requestData->writeSize, false };
+            } writeState = { nullptr, 0, true };
 
-            TaskUtil::yieldUntil([&writeState, requestData]() {
-                writeState.successWrite = InternalFileSystem::writeBytes(
-                    requestData->opaqueHandle, writeState.buffer, writeState.bufferSize);
-            });
+            size_t bytesWritten = 0;
+            for (const auto& segment : requestData->writeSegments)
+            {
+                for (size_t offset = 0; offset < segment.size && writeState.successWrite; offset += (size_t)writeState.bufferSize)
+                {
+                    size_t chunkSize = segment.size - offset;
+                    writeState.buffer = segment.buffer + offset;
+                    writeState.bufferSize = (int)(chunkSize < (size_t)InternalFileSystem::writeChunkSize ? chunkSize : (size_t)InternalFileSystem::writeChunkSize);
+                    TaskUtil::yieldUntil([&writeState, requestData]() {
+                        SPT_TRACE_SCOPE_VALUE("io", "write_chunk", writeState.bufferSize);
+                        writeState.successWrite = InternalFileSystem::writeBytes(
+                            requestData->opaqueHandle, writeState.buffer, writeState.bufferSize);
+                    });
+
+                    if (writeState.successWrite)
+                    {
+                        bytesWritten += (size_t)writeState.bufferSize;
+                        SPT_TRACE_SCOPE_VALUE("io", "write_callback", writeState.bufferSize);
+                        FileWriteResponse response;
+                        response.status = FileStatus::Writing;
+                        response.bytesWritten = bytesWritten;
+                        response.totalBytes = requestData->writeSize;
+                        requestData->writeCallback(response);
+                    }
+                }
+            }
 
             if (!writeState.successWrite)
             {
@@ -266,6 +304,8 @@ AsyncFileHandle FileSystem::write(const FileWriteRequest& request)
                 requestData->fileStatus = FileStatus::Success;
                 FileWriteResponse response;
                 response.status = FileStatus::Success;
+                response.bytesWritten = bytesWritten;
+                response.totalBytes = requestData->writeSize;
                 requestData->writeCallback(response);
             }
 
@@ -51,7 +51,8 @@ private:
         InternalFileSystem::OpaqueFileHandle opaqueHandle = {};
 
         ByteBuffer writeBuffer;
-        int writeSize = 0;
+        std::vector<FileWriteSegment> writeSegments;
+        size_t writeSize = 0;
 
         Task task;
         std::atomic<IoError> error;
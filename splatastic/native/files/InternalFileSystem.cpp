@@ -2,6 +2,7 @@
 #include <utils/Assert.h>
 #include <sstream>
 #include <cstring>
+#include <algorithm>
 #include <utils/ClTokenizer.h>
 
 #ifdef _WIN32 
@@ -164,6 +165,36 @@ namespace InternalFileSystem
         return result;
     }
 
+    bool readRange(OpaqueFileHandle h, size_t offset, char* destination, size_t size)
+    {
+        auto* wf = (WindowsFile*)h;
+        if (wf == nullptr || wf->h == INVALID_HANDLE_VALUE)
+            return false;
+
+        //own overlapped struct, so concurrent range reads on the same handle don't share offsets / events
+        OVERLAPPED overlapped = {};
+        overlapped.hEvent = CreateEvent(NULL, TRUE, FALSE, NULL);
+        bool result = true;
+        size_t done = 0;
+        while (result && done < size)
+        {
+            ULARGE_INTEGER position;
+            position.QuadPart = offset + done;
+            overlapped.Offset = position.LowPart;
+            overlapped.OffsetHigh = position.HighPart;
+            DWORD chunkSize = (DWORD)(std::min)(size - done, (size_t)writeChunkSize);
+            DWORD dwordBytesRead = 0;
+            if (!ReadFile(wf->h, destination + done, chunkSize, &dwordBytesRead, &overlapped))
+                result = GetLastError() == ERROR_IO_PENDING && GetOverlappedResult(wf->h, &overlapped, &dwordBytesRead, TRUE);
+            ResetEvent(overlapped.hEvent);
+            if (dwordBytesRead == 0)
+                result = false;
+            done += dwordBytesRead;
+        }
+        CloseHandle(overlapped.hEvent);
+        return result;
+    }
+
     bool writeBytes(OpaqueFileHandle h, const char* buffer, int bufferSize)
     {
         SPT_ASSERT(h != nullptr);
@@ -213,6 +244,16 @@ namespace InternalFileSystem
         if (bufferSize != dwordBytesWritten)
             return false;
 
+        if (result)
+        {
+            ULARGE_INTEGER offset;
+            offset.LowPart = wf->overlapped.Offset;
+            offset.HighPart = wf->overlapped.OffsetHigh;
+            offset.QuadPart += dwordBytesWritten;
+            wf->overlapped.Offset = offset.LowPart;
+            wf->overlapped.OffsetHigh = offset.HighPart;
+        }
+
         return result;
     }
 
@@ -418,7 +459,7 @@ namespace InternalFileSystem
             return {};
 
         SPT_ASSERT(pf->h != 01);
-        return (size_t)wf->fileSize;
+        return (size_t)pf->fileSize;
     }
 
     bool readBytes(OpaqueFileHandle h, char*& outputBuffer, int& bytesRead, bool& isEof)
@@ -438,14 +479,54 @@ namespace InternalFileSystem
         return true;
     }
 
+    bool readRange(OpaqueFileHandle h, size_t offset, char* destination, size_t size)
+    {
+        auto* pf = (PosixFile*)h;
+        if (pf == nullptr || pf->h == -1)
+            return false;
+
+        size_t done = 0;
+        while (done < size)
+        {
+            ssize_t preadBytes = pread(pf->h, destination + done, size - done, (off_t)(offset + done));
+            if (preadBytes == -1)
+            {
+                if (errno == EINTR)
+                    continue;
+                return false;
+            }
+
+            if (preadBytes == 0)
+                return false;
+
+            done += (size_t)preadBytes;
+        }
+
+        return true;
+    }
+
     bool writeBytes(OpaqueFileHandle h, const char* buffer, int bufferSize)
     {
         auto* pf = (PosixFile*)h;
         if (pf == nullptr || pf->h == -1)
             return false;
         
-        ssize_t pwriteBytes = pwrite(pf->h, buffer, (size_t)bufferSize, 0u);
-        return pwriteBytes != -1;
+        size_t written = 0;
+        while (written < (size_t)bufferSize)
+        {
+            ssize_t pwriteBytes = pwrite(pf->h, buffer + written, (size_t)bufferSize - written, pf->offset);
+            if (pwriteBytes == -1)
+            {
+                if (errno == EINTR)
+                    continue;
+                return false;
+            }
+
+            written += (size_t)pwriteBytes;
+            pf->offset += pwriteBytes;
+        }
+
+        return true;
     }
 
     void close(OpaqueFileHandle& h)
@@ -553,6 +634,9 @@ namespace InternalFileSystem
             pathInfo.directoryList.push_back(pathInfo.filename);
 
         std::stringstream ss;
+        if (!path.empty() && path[0] == '/')
+            ss << "/";
+
         for (auto& d : pathInfo.directoryList)
         {
             ss << d << "/";
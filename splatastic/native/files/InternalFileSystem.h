@@ -11,7 +11,8 @@ namespace InternalFileSystem
 {
     enum
     {
-        bufferSize = 32 * 1024 //32kb buffer size
+        bufferSize = 32 * 1024, //32kb buffer size
+        writeChunkSize = 4 * 1024 * 1024 //4mb per write call
     };
 
     enum RequestType
@@ -37,6 +38,11 @@ namespace InternalFileSystem
 
     bool readBytes(OpaqueFileHandle h, char*& outputBuffer, int& bytesRead, bool& isEof);
 
+    // reads size bytes at offset into destination, independent of the sequential read offset.
+    // Safe to call concurrently on the same handle. Fails if the range goes past the end of the file.
+    bool readRange(OpaqueFileHandle h, size_t offset, char* destination, size_t size);
+
+    // appends the buffer at the current write offset of the file.
     bool writeBytes(OpaqueFileHandle h, const char* buffer, int bufferSize);
 
     void close(OpaqueFileHandle& h);
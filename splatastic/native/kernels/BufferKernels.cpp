@@ -0,0 +1,192 @@
+#include "BufferKernels.h"
+#include <string.h>
+#include <math.h>
+#include <float.h>
+
+namespace splatastic
+{
+
+namespace
+{
+
+void normalizeQuaternions(const BufferKernelArgs& args, int rangeIndex, int begin, int end)
+{
+    float* q = (float*)args.outputs[0];
+    for (int i = begin; i < end; ++i)
+    {
+        float* qi = q + 4 * i;
+        float len = sqrtf(qi[0] * qi[0] + qi[1] * qi[1] + qi[2] * qi[2] + qi[3] * qi[3]);
+        float invLen = len > 0.0f ? 1.0f / len : 0.0f;
+        for (int c = 0; c < 4; ++c)
+            qi[c] *= invLen;
+    }
+}
+
+// must match calcMatrixFromRotationScale / calcCovariance3D in splat_rasterizer_cs.hlsl
+void buildCovariance(const BufferKernelArgs& args, int rangeIndex, int begin, int end)
+{
+    const float* scales = (const float*)args.inputs[0];
+    const float* rotations = (const float*)args.inputs[1];
+    float* cov = (float*)args.outputs[0];
+    for (int i = begin; i < end; ++i)
+    {
+        const float* s = scales + 3 * i;
+        const float* q = rotations + 4 * i;
+        float len = sqrtf(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3]);
+        float invLen = len > 0.0f ? 1.0f / len : 0.0f;
+        float r = q[0] * invLen, x = q[1] * invLen, y = q[2] * invLen, z = q[3] * invLen;
+
+        float rot[3][3] = {
+            { 1.f - 2.f * (y * y + z * z), 2.f * (x * y - r * z), 2.f * (x * z + r * y) },
+            { 2.f * (x * y + r * z), 1.f - 2.f * (x * x + z * z), 2.f * (y * z - r * x) },
+            { 2.f * (x * z - r * y), 2.f * (y * z + r * x), 1.f - 2.f * (x * x + y * y) }
+        };
+
+        float m[3][3];
+        for (int row = 0; row < 3; ++row)
+            for (int col = 0; col < 3; ++col)
+                m[row][col] = rot[row][col] * s[col];
+
+        auto dot = [&m](int a, int b) { return m[a][0] * m[b][0] + m[a][1] * m[b][1] + m[a][2] * m[b][2]; };
+        float* c = cov + 6 * i;
+        c[0] = dot(0, 0);
+        c[1] = dot(0, 1);
+        c[2] = dot(0, 2);
+        c[3] = dot(1, 1);
+        c[4] = dot(1, 2);
+        c[5] = dot(2, 2);
+    }
+}
+
+void computeAabb(const BufferKernelArgs& args, int rangeIndex, int begin, int end)
+{
+    float bmin[3] = { FLT_MAX, FLT_MAX, FLT_MAX };
+    float bmax[3] = { -FLT_MAX, -FLT_MAX, -FLT_MAX };
+    for (int i = begin; i < end; ++i)
+    {
+        const float* p = (const float*)(args.inputs[0] + (size_t)i * args.stride);
+        for (int c = 0; c < 3; ++c)
+        {
+            bmin[c] = p[c] < bmin[c] ? p[c] : bmin[c];
+            bmax[c] = p[c] > bmax[c] ? p[c] : bmax[c];
+        }
+    }
+
+    float* partial = args.partials + 6 * rangeIndex;
+    memcpy(partial, bmin, sizeof(bmin));
+    memcpy(partial + 3, bmax, sizeof(bmax));
+}
+
+void reduceAabb(const BufferKernelArgs& args, int rangeCount)
+{
+    float bounds[6] = { FLT_MAX, FLT_MAX, FLT_MAX, -FLT_MAX, -FLT_MAX, -FLT_MAX };
+    for (int r = 0; r < rangeCount; ++r)
+    {
+        const float* partial = args.partials + 6 * r;
+        for (int c = 0; c < 3; ++c)
+        {
+            bounds[c] = partial[c] < bounds[c] ? partial[c] : bounds[c];
+            bounds[c + 3] = partial[c + 3] > bounds[c + 3] ? partial[c + 3] : bounds[c + 3];
+        }
+    }
+    memcpy(args.outputs[0], bounds, sizeof(bounds));
+}
+
+void gatherRows(const BufferKernelArgs& args, int rangeIndex, int begin, int end)
+{
+    const unsigned* indices = (const unsigned*)args.inputs[1];
+    size_t rowCount = args.inputSizes[0] / (size_t)args.stride;
+    for (int i = begin; i < end; ++i)
+    {
+        char* dst = args.outputs[0] + (size_t)i * args.stride;
+        if (indices[i] < rowCount)
+            memcpy(dst, args.inputs[0] + (size_t)indices[i] * args.stride, args.stride);
+        else
+            memset(dst, 0, args.stride);
+    }
+}
+
+// bytes per element of the copy kernel.
+enum : int { CopyBlockSize = 64 * 1024 };
+
+void copyBlocks(const BufferKernelArgs& args, int rangeIndex, int begin, int end)
+{
+    size_t byteBegin = (size_t)begin * CopyBlockSize;
+    size_t byteEnd = (size_t)end * CopyBlockSize;
+    byteEnd = byteEnd < args.inputSizes[0] ? byteEnd : args.inputSizes[0];
+    memcpy(args.outputs[0] + byteBegin, args.inputs[0] + byteBegin, byteEnd - byteBegin);
+}
+
+const BufferKernel g_kernels[] = {
+    { "normalize_quaternions", "outputs: [quaternions (N x 4 float32)], normalized in place.", 0, 1, false, 0, normalizeQuaternions, nullptr },
+    { "build_covariance", "inputs: [scales (N x 3 float32), rotations (N x 4 float32)], outputs: [covariance (N x 6 float32)].", 2, 1, false, 0, buildCovariance, nullptr },
+    { "compute_aabb", "inputs: [positions (N x stride bytes, xyz float32 first)], outputs: [bounds (6 float32, min then max)]. stride defaults to 12.", 1, 1, false, 6, computeAabb, reduceAabb },
+    { "gather", "inputs: [source (rows of stride bytes), indices (M uint32)], outputs: [destination (M rows of stride bytes)].", 2, 1, true, 0, gatherRows, nullptr },
+    { "copy", "inputs: [source (bytes)], outputs: [destination (at least as many bytes)]. Elements are 64KB blocks.", 1, 1, false, 0, copyBlocks, nullptr },
+};
+
+}
+
+const BufferKernel* findBufferKernel(const char* name)
+{
+    for (const BufferKernel& k : g_kernels)
+    {
+        if (!strcmp(k.name, name))
+            return &k;
+    }
+
+    return nullptr;
+}
+
+const BufferKernel* bufferKernels(int& count)
+{
+    count = (int)(sizeof(g_kernels) / sizeof(g_kernels[0]));
+    return g_kernels;
+}
+
+const char* prepareBufferKernelArgs(const BufferKernel& kernel, BufferKernelArgs& args)
+{
+    if (args.inputCount != kernel.inputCount || args.outputCount != kernel.outputCount)
+        return "Wrong number of input / output buffers for kernel.";
+
+    if (kernel.needsStride && args.stride <= 0)
+        return "Kernel requires a stride (in bytes) greater than 0.";
+
+    if (kernel.rangeFn == normalizeQuaternions)
+    {
+        args.elementCount = (int)(args.outputSizes[0] / (4 * sizeof(float)));
+    }
+    else if (kernel.rangeFn == buildCovariance)
+    {
+        args.elementCount = (int)(args.inputSizes[0] / (3 * sizeof(float)));
+        if (args.inputSizes[1] < (size_t)args.elementCount * 4 * sizeof(float))
+            return "Rotation buffer is smaller than the scale buffer.";
+        if (args.outputSizes[0] < (size_t)args.elementCount * 6 * sizeof(float))
+            return "Covariance output buffer must hold 6 floats per element.";
+    }
+    else if (kernel.rangeFn == computeAabb)
+    {
+        args.stride = args.stride <= 0 ? (int)(3 * sizeof(float)) : args.stride;
+        if (args.stride < (int)(3 * sizeof(float)))
+            return "Stride must be at least 12 bytes to hold a position.";
+        args.elementCount = (int)(args.inputSizes[0] / (size_t)args.stride);
+        if (args.outputSizes[0] < 6 * sizeof(float))
+            return "Bounds output buffer must hold 6 floats.";
+    }
+    else if (kernel.rangeFn == gatherRows)
+    {
+        args.elementCount = (int)(args.inputSizes[1] / sizeof(unsigned));
+        if (args.outputSizes[0] < (size_t)args.elementCount * (size_t)args.stride)
+            return "Gather output buffer must hold stride bytes per index.";
+    }
+    else if (kernel.rangeFn == copyBlocks)
+    {
+        args.elementCount = (int)((args.inputSizes[0] + CopyBlockSize - 1) / CopyBlockSize);
+        if (args.outputSizes[0] < args.inputSizes[0])
+            return "Copy destination is smaller than the source.";
+    }
+
+    return nullptr;
+}
+
+}
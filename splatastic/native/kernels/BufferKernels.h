@@ -0,0 +1,50 @@
+#pragma once
+
+#include <stddef.h>
+
+namespace splatastic
+{
+
+enum : int { MaxKernelBuffers = 4 };
+
+// Arguments of a buffer kernel. Buffers are raw memory owned by the caller,
+// elementCount is the number of elements the kernel iterates over.
+struct BufferKernelArgs
+{
+    const char* inputs[MaxKernelBuffers] = {};
+    size_t inputSizes[MaxKernelBuffers] = {};
+    char* outputs[MaxKernelBuffers] = {};
+    size_t outputSizes[MaxKernelBuffers] = {};
+    int inputCount = 0;
+    int outputCount = 0;
+    int elementCount = 0;
+    int stride = 0;
+    float* partials = nullptr;
+};
+
+using BufferKernelRangeFn = void(*)(const BufferKernelArgs& args, int rangeIndex, int begin, int end);
+using BufferKernelReduceFn = void(*)(const BufferKernelArgs& args, int rangeCount);
+
+struct BufferKernel
+{
+    const char* name;
+    const char* description;
+    int inputCount;
+    int outputCount;
+    bool needsStride;
+
+    // number of floats each range writes into BufferKernelArgs::partials, 0 if the kernel does not reduce.
+    int partialsPerRange;
+
+    BufferKernelRangeFn rangeFn;
+    BufferKernelReduceFn reduceFn;
+};
+
+const BufferKernel* findBufferKernel(const char* name);
+const BufferKernel* bufferKernels(int& count);
+
+// Validates the buffer sizes against the kernel and resolves elementCount.
+// Returns an error string, or nullptr if the arguments are valid.
+const char* prepareBufferKernelArgs(const BufferKernel& kernel, BufferKernelArgs& args);
+
+}
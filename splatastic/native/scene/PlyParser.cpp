@@ -2,6 +2,7 @@
 #include <utils/ClTokenizer.h>
 #include <stdio.h>
 #include <string.h>
+#include <sstream>
 
 namespace splatastic
 {
@@ -195,4 +196,16 @@ size_t parsePlyChunk(PlyFileData& fileData, const char* buffer, size_t bufferSiz
     return readOffset;
 }
 
+void writePlyHeader(int vertexCount, const std::vector<std::string>& propertyNames, std::string& outHeader)
+{
+    std::stringstream ss;
+    ss << "ply\n";
+    ss << "format binary_little_endian 1.0\n";
+    ss << "element vertex " << vertexCount << "\n";
+    for (const auto& name : propertyNames)
+        ss << "property float " << name << "\n";
+    ss << "end_header\n";
+    outHeader = ss.str();
+}
+
 }
@@ -1,5 +1,9 @@
 #pragma once
 
+#include <stddef.h>
+#include <string>
+#include <vector>
+
 namespace splatastic
 {
 
@@ -16,4 +20,7 @@ struct PlyFileData
 
 size_t parsePlyChunk(PlyFileData& fileData, const char* buffer, size_t bufferSize);
 
+// Header for a binary little endian ply file with one float property per name. Readable by parsePlyChunk.
+void writePlyHeader(int vertexCount, const std::vector<std::string>& propertyNames, std::string& outHeader);
+
 }
@@ -0,0 +1,197 @@
+#include "SceneContainer.h"
+#include <algorithm>
+#include <string.h>
+
+#if SPT_ZLIB
+#include <zlib.h>
+#endif
+
+#if SPT_LZMA
+#include <lzma.h>
+#endif
+
+namespace splatastic
+{
+
+namespace
+{
+
+// must match scene_container.py
+const char ContainerMagic[8] = { 'S', 'P', 'L', 'T', 'C', 'Z', '0', '1' };
+const uint32_t ContainerVersion = 1;
+const size_t ContainerHeaderSize = 64;
+
+struct ContainerHeader
+{
+    char magic[8];
+    uint32_t version;
+    uint32_t codec;
+    uint32_t flags;
+    uint32_t stride;
+    uint64_t vertexCount;
+    uint32_t chunkSplats;
+    uint32_t chunkCount;
+    uint64_t indexOffset;
+    uint64_t payloadSize;
+};
+
+static_assert(sizeof(ContainerHeader) == 56, "Container header must match scene_container.HeaderFormat");
+static_assert(sizeof(ContainerChunk) == 24, "Container chunk must match scene_container.ChunkRecordType");
+
+// chunks are stored as (stride, splats) byte planes, turn them back into (splats, stride) rows.
+void unshuffle(const char* src, char* dst, size_t splatCount, size_t stride)
+{
+    const size_t blockSplats = 64;
+    for (size_t blockBegin = 0; blockBegin < splatCount; blockBegin += blockSplats)
+    {
+        size_t blockEnd = std::min(blockBegin + blockSplats, splatCount);
+        for (size_t b = 0; b < stride; ++b)
+        {
+            const char* plane = src + b * splatCount;
+            for (size_t i = blockBegin; i < blockEnd; ++i)
+                dst[i * stride + b] = plane[i];
+        }
+    }
+}
+
+const char* decompress(ContainerCodec codec, const char* src, size_t srcSize, char* dst, size_t dstSize)
+{
+    switch (codec)
+    {
+    case ContainerCodec::None:
+        if (srcSize != dstSize)
+            return "Stored container chunk has the wrong size.";
+        memcpy(dst, src, dstSize);
+        return nullptr;
+    case ContainerCodec::Zlib:
+#if SPT_ZLIB
+    {
+        uLongf outSize = (uLongf)dstSize;
+        if (uncompress((Bytef*)dst, &outSize, (const Bytef*)src, (uLong)srcSize) != Z_OK || outSize != dstSize)
+            return "Corrupted zlib container chunk.";
+        return nullptr;
+    }
+#else
+        return "Zlib container chunks are not supported by this build (built without zlib).";
+#endif
+    case ContainerCodec::Lzma:
+#if SPT_LZMA
+    {
+        uint64_t memLimit = UINT64_MAX;
+        size_t inPos = 0;
+        size_t outPos = 0;
+        if (lzma_stream_buffer_decode(&memLimit, 0, nullptr, (const uint8_t*)src, &inPos, srcSize, (uint8_t*)dst, &outPos, dstSize) != LZMA_OK || outPos != dstSize)
+            return "Corrupted lzma container chunk.";
+        return nullptr;
+    }
+#else
+        return "Lzma container chunks are not supported by this build (built without liblzma).";
+#endif
+    default:
+        return "Unknown container chunk codec.";
+    }
+}
+
+}
+
+bool isContainerFile(const char* buffer, size_t bufferSize)
+{
+    return bufferSize >= sizeof(ContainerMagic) && memcmp(buffer, ContainerMagic, sizeof(ContainerMagic)) == 0;
+}
+
+void readContainerChunk(ContainerFileData& fileData, const char* buffer, size_t bufferSize, size_t fileSize)
+{
+    if (fileData.fileBuffer == nullptr)
+    {
+        fileData.fileSize = fileSize;
+        fileData.fileBuffer = new char[fileSize];
+    }
+
+    if (fileData.fileReadSize + bufferSize > fileData.fileSize)
+    {
+        fileData.errorStr = "Container file is larger than reported.";
+        return;
+    }
+
+    memcpy(fileData.fileBuffer + fileData.fileReadSize, buffer, bufferSize);
+    fileData.fileReadSize += bufferSize;
+}
+
+bool finishContainerRead(ContainerFileData& fileData)
+{
+    if (fileData.errorStr != nullptr)
+        return false;
+
+    ContainerHeader header;
+    if (fileData.fileReadSize != fileData.fileSize || fileData.fileSize < ContainerHeaderSize)
+    {
+        fileData.errorStr = "Container file is incomplete.";
+        return false;
+    }
+
+    memcpy(&header, fileData.fileBuffer, sizeof(header));
+    if (header.version != ContainerVersion)
+    {
+        fileData.errorStr = "Unsupported container version.";
+        return false;
+    }
+
+    size_t indexSize = (size_t)header.chunkCount * sizeof(ContainerChunk);
+    if (header.stride == 0 || header.chunkSplats == 0 || header.payloadSize != header.vertexCount * header.stride
+        || header.indexOffset > fileData.fileSize || indexSize > fileData.fileSize - header.indexOffset)
+    {
+        fileData.errorStr = "Invalid container header.";
+        return false;
+    }
+
+    fileData.chunks.resize(header.chunkCount);
+    memcpy(fileData.chunks.data(), fileData.fileBuffer + header.indexOffset, indexSize);
+
+    // every chunk holds chunkSplats splats except the last one, they must cover the payload exactly.
+    uint64_t splatCount = 0;
+    for (const ContainerChunk& chunk : fileData.chunks)
+    {
+        if (chunk.offset > fileData.fileSize || chunk.compressedSize > fileData.fileSize - chunk.offset
+            || chunk.splatCount > header.chunkSplats || (chunk.splatCount != header.chunkSplats && &chunk != &fileData.chunks.back()))
+        {
+            fileData.errorStr = "Invalid container chunk index.";
+            return false;
+        }
+        splatCount += chunk.splatCount;
+    }
+
+    if (splatCount != header.vertexCount)
+    {
+        fileData.errorStr = "Container chunks do not cover every splat.";
+        return false;
+    }
+
+    fileData.vertexCount = (int)header.vertexCount;
+    fileData.strideSize = (int)header.stride;
+    fileData.flags = header.flags;
+    fileData.chunkSplats = header.chunkSplats;
+    fileData.payloadSize = (size_t)header.payloadSize;
+    fileData.hasHeader = true;
+    return true;
+}
+
+const char* decompressContainerChunk(const ContainerFileData& fileData, int chunkIndex, char* payload, std::vector<char>& scratch)
+{
+    const ContainerChunk& chunk = fileData.chunks[chunkIndex];
+    size_t stride = (size_t)fileData.strideSize;
+    size_t rawSize = (size_t)chunk.splatCount * stride;
+    char* dst = payload + (size_t)chunkIndex * fileData.chunkSplats * stride;
+    const char* src = fileData.fileBuffer + chunk.offset;
+    if ((fileData.flags & ContainerFlagShuffle) == 0)
+        return decompress((ContainerCodec)chunk.codec, src, (size_t)chunk.compressedSize, dst, rawSize);
+
+    if (scratch.size() < rawSize)
+        scratch.resize(rawSize);
+
+    const char* error = decompress((ContainerCodec)chunk.codec, src, (size_t)chunk.compressedSize, scratch.data(), rawSize);
+    if (error == nullptr)
+        unshuffle(scratch.data(), dst, chunk.splatCount, stride);
+    return error;
+}
+
+}
@@ -0,0 +1,70 @@
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+#include <vector>
+
+// codecs compiled in, set by meson when zlib / liblzma are found.
+#ifndef SPT_ZLIB
+#define SPT_ZLIB 0
+#endif
+
+#ifndef SPT_LZMA
+#define SPT_LZMA 0
+#endif
+
+namespace splatastic
+{
+
+// must match scene_container.py
+enum class ContainerCodec : uint32_t
+{
+    None,
+    Zlib,
+    Lzma
+};
+
+// must match scene_container.py
+enum ContainerFlags : uint32_t
+{
+    ContainerFlagShuffle = 1 << 0
+};
+
+struct ContainerChunk
+{
+    uint64_t offset;
+    uint64_t compressedSize;
+    uint32_t splatCount;
+    uint32_t codec;
+};
+
+// Compressed scene container (.splz): header, independently compressed chunks, chunk index.
+// The whole file is read into fileBuffer, chunks are decompressed later straight into the payload destination.
+struct ContainerFileData
+{
+    const char* errorStr = nullptr;
+    bool hasHeader = false;
+    int vertexCount = 0;
+    int strideSize = 0;
+    uint32_t flags = 0;
+    uint32_t chunkSplats = 0;
+    size_t payloadSize = 0;
+    size_t fileSize = 0;
+    size_t fileReadSize = 0;
+    char* fileBuffer = nullptr;
+    std::vector<ContainerChunk> chunks;
+};
+
+bool isContainerFile(const char* buffer, size_t bufferSize);
+
+// Appends a streamed chunk of the file, call finishContainerRead once the whole file is read.
+void readContainerChunk(ContainerFileData& fileData, const char* buffer, size_t bufferSize, size_t fileSize);
+
+// Parses the header and chunk index, returns false and sets errorStr if the file is invalid.
+bool finishContainerRead(ContainerFileData& fileData);
+
+// Decompresses chunk chunkIndex into its place in payload (fileData.payloadSize bytes).
+// scratch is reused between calls of the same thread. Returns an error string, or nullptr on success.
+const char* decompressContainerChunk(const ContainerFileData& fileData, int chunkIndex, char* payload, std::vector<char>& scratch);
+
+}
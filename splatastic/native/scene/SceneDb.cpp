@@ -1,8 +1,11 @@
 #include "SceneDb.h"
 #include "PlyParser.h"
+#include "SceneContainer.h"
 #include <files/IFileSystem.h>
 #include <tasks/ITaskSystem.h>
+#include <utils/Trace.h>
 #include <sstream>
+#include <string.h>
 
 namespace splatastic
 {
@@ -12,6 +15,9 @@ SceneDb::SceneDb(IFileSystem& fs, ITaskSystem& ts)
 {
     for (int i = 0; i < (int)MaxScenes; ++i)
         m_loadStatuses[i] = SceneLoadStatus::Opening;
+
+    for (int i = 0; i < (int)MaxSceneExports; ++i)
+        m_exportStatuses[i] = SceneExportStatus::InvalidHandle;
 }
 
 SceneDb::~SceneDb()
@@ -27,42 +33,70 @@ SceneLoadHandle SceneDb::openScene(const char* path)
 
     std::atomic<SceneLoadStatus>& loadStatus = m_loadStatuses[loadHandle];
     loadStatus = SceneLoadStatus::Reading;
+    SPT_TRACE_INSTANT("scene", "load:Reading", loadHandle.handleId);
     state.plyFileData = new PlyFileData;
-    FileReadRequest readRequest(path, [&state, &loadStatus](FileReadResponse& response)
+    FileReadRequest readRequest(path, [this, &state, &loadStatus, loadHandle](FileReadResponse& response)
     {
         if (response.status == FileStatus::Fail)
         {
             std::stringstream ss; 
             ss << "Failed reading file: " << IoError2String(response.error) << std::endl;
             state.errorStr = ss.str();
-            loadStatus = SceneLoadStatus::Failed;
+            setLoadStatus(loadHandle, SceneLoadStatus::Failed);
+            SPT_TRACE_INSTANT("scene", "load:Failed", loadHandle.handleId);
         }
         else if (response.status == FileStatus::Reading)
         {
             if (state.plyFileData->errorStr != nullptr)
                 return;
 
+            // compressed containers are read whole, their chunks get decompressed by copyPayload.
+            if (state.bytesRead == 0 && isContainerFile(response.buffer, (size_t)response.size))
+                state.containerData = new ContainerFileData;
+
             state.bytesRead += response.size;
             state.totalBytes =  response.fileSize;
-            parsePlyChunk(*state.plyFileData, response.buffer, response.size);
+            if (state.containerData != nullptr)
+            {
+                SPT_TRACE_SCOPE_VALUE("scene", "readContainerChunk", response.size);
+                readContainerChunk(*state.containerData, response.buffer, (size_t)response.size, response.fileSize);
+            }
+            else
+            {
+                SPT_TRACE_SCOPE_VALUE("scene", "parsePlyChunk", response.size);
+                parsePlyChunk(*state.plyFileData, response.buffer, response.size);
+            }
             loadStatus = SceneLoadStatus::Reading;
         }
         else if (response.status == FileStatus::Success)
         {
-            if (state.plyFileData->errorStr != nullptr)
+            if (state.containerData != nullptr)
+            {
+                bool valid = finishContainerRead(*state.containerData);
+                if (!valid)
+                    state.errorStr = state.containerData->errorStr;
+                setLoadStatus(loadHandle, valid ? SceneLoadStatus::SuccessFinish : SceneLoadStatus::Failed);
+                SPT_TRACE_INSTANT("scene", valid ? "load:SuccessFinish" : "load:Failed", loadHandle.handleId);
+            }
+            else if (state.plyFileData->errorStr != nullptr)
             {
                 state.errorStr = state.plyFileData->errorStr;
-                loadStatus = SceneLoadStatus::Failed;
+                setLoadStatus(loadHandle, SceneLoadStatus::Failed);
+                SPT_TRACE_INSTANT("scene", "load:Failed", loadHandle.handleId);
             }
             else if (state.plyFileData->payloadSize != state.plyFileData->payloadReadSize)
             {
                 std::stringstream ss;
                 ss << "Payload of ply file is incomplete: " << state.plyFileData->payloadReadSize << " / " << state.plyFileData->payloadSize;
                 state.errorStr = ss.str();
-                loadStatus = SceneLoadStatus::Failed;
+                setLoadStatus(loadHandle, SceneLoadStatus::Failed);
+                SPT_TRACE_INSTANT("scene", "load:Failed", loadHandle.handleId);
             }
             else
-                loadStatus = SceneLoadStatus::SuccessFinish;
+            {
+                setLoadStatus(loadHandle, SceneLoadStatus::SuccessFinish);
+                SPT_TRACE_INSTANT("scene", "load:SuccessFinish", loadHandle.handleId);
+            }
         }
     });
 
@@ -78,6 +112,23 @@ SceneLoadHandle SceneDb::openScene(const char* path)
     return loadHandle;
 }
 
+void SceneDb::setLoadStatus(SceneLoadHandle handle, SceneLoadStatus status)
+{
+    m_loadStatuses[handle] = status;
+    std::unique_lock<std::mutex> lock(m_statusCallbackMutexes[handle]);
+    if (m_statusCallbacks[handle])
+        m_statusCallbacks[handle](handle, status);
+}
+
+void SceneDb::setStatusCallback(SceneLoadHandle handle, SceneStatusCallback callback)
+{
+    if (!handle.valid() || !m_loads.contains(handle))
+        return;
+
+    std::unique_lock<std::mutex> lock(m_statusCallbackMutexes[handle]);
+    m_statusCallbacks[handle] = std::move(callback);
+}
+
 SceneLoadStatus SceneDb::checkStatus(SceneLoadHandle handle)
 {
     if (!handle.valid() || !m_loads.contains(handle))
@@ -126,30 +177,97 @@ bool SceneDb::copyPayload(SceneLoadHandle handle, char* dest, size_t destSize)
     if (m_loadStatuses[handle] != SceneLoadStatus::SuccessFinish)
         return false;
 
-    if (state.plyFileData == nullptr || state.plyFileData->payload == nullptr)
-        return false;
-
-    if (destSize < state.plyFileData->payloadSize)
-        return false;
-
     if (state.copyPayloadTask.valid())
     {
+        m_ts.wait(state.copyPayloadTask);
         m_ts.cleanTaskTree(state.copyPayloadTask);
         state.copyPayloadTask = Task();
     }
 
+    if (state.containerData != nullptr)
+        return decompressPayload(handle, dest, destSize);
+
+    if (state.plyFileData == nullptr || state.plyFileData->payload == nullptr)
+        return false;
+
+    if (destSize < state.plyFileData->payloadSize)
+        return false;
+
     PlyFileData* plyData = state.plyFileData;
-    TaskDesc td([dest, destSize, plyData, handle, this](TaskContext& ctx)
+    TaskDesc td("SceneDb::copyPayload", [dest, destSize, plyData, handle, this](TaskContext& ctx)
     {
-        memcpy(dest, plyData->payload, plyData->payloadSize);
-        m_loadStatuses[handle] = SceneLoadStatus::SuccessFinish;
+        {
+            SPT_TRACE_SCOPE_VALUE("scene", "payload_memcpy", plyData->payloadSize);
+            memcpy(dest, plyData->payload, plyData->payloadSize);
+        }
+        setLoadStatus(handle, SceneLoadStatus::SuccessFinish);
+        SPT_TRACE_INSTANT("scene", "load:SuccessFinish", handle.handleId);
     });
 
     state.copyPayloadTask = m_ts.createTask(td);
     if (!state.copyPayloadTask.valid())
         return false;
     
-    m_loadStatuses[handle] = SceneLoadStatus::CopyingPayload;
+    setLoadStatus(handle, SceneLoadStatus::CopyingPayload);
+    SPT_TRACE_INSTANT("scene", "load:CopyingPayload", handle.handleId);
+    m_ts.execute(state.copyPayloadTask);
+    return true;
+}
+
+bool SceneDb::decompressPayload(SceneLoadHandle handle, char* dest, size_t destSize)
+{
+    SceneReadState& state = m_loads[handle];
+    ContainerFileData* containerData = state.containerData;
+    if (destSize < containerData->payloadSize)
+        return false;
+
+    // one task per chunk, each one decompresses straight into its part of dest.
+    int chunkCount = (int)containerData->chunks.size();
+    std::vector<const char*>* chunkErrors = new std::vector<const char*>(chunkCount, nullptr);
+    Task decompressTask = m_ts.createParallelFor("SceneDb::decompressChunks", chunkCount, 1, [containerData, chunkErrors, dest](int begin, int end)
+    {
+        std::vector<char> scratch;
+        for (int i = begin; i < end; ++i)
+        {
+            SPT_TRACE_SCOPE_VALUE("scene", "decompress_chunk", containerData->chunks[i].compressedSize);
+            (*chunkErrors)[i] = decompressContainerChunk(*containerData, i, dest, scratch);
+        }
+    });
+
+    TaskDesc td("SceneDb::copyPayload", [chunkErrors, handle, &state, this](TaskContext& ctx)
+    {
+        const char* error = nullptr;
+        for (const char* chunkError : *chunkErrors)
+            error = error != nullptr ? error : chunkError;
+        delete chunkErrors;
+
+        if (error != nullptr)
+        {
+            state.errorStr = error;
+            setLoadStatus(handle, SceneLoadStatus::Failed);
+            SPT_TRACE_INSTANT("scene", "load:Failed", handle.handleId);
+            return;
+        }
+
+        setLoadStatus(handle, SceneLoadStatus::SuccessFinish);
+        SPT_TRACE_INSTANT("scene", "load:SuccessFinish", handle.handleId);
+    });
+
+    state.copyPayloadTask = m_ts.createTask(td);
+    if (!decompressTask.valid() || !state.copyPayloadTask.valid())
+    {
+        if (decompressTask.valid())
+            m_ts.cleanTaskTree(decompressTask);
+        if (state.copyPayloadTask.valid())
+            m_ts.cleanTaskTree(state.copyPayloadTask);
+        state.copyPayloadTask = Task();
+        delete chunkErrors;
+        return false;
+    }
+
+    m_ts.depends(state.copyPayloadTask, decompressTask);
+    setLoadStatus(handle, SceneLoadStatus::CopyingPayload);
+    SPT_TRACE_INSTANT("scene", "load:CopyingPayload", handle.handleId);
     m_ts.execute(state.copyPayloadTask);
     return true;
 }
@@ -163,6 +281,13 @@ bool SceneDb::sceneMetadata(SceneLoadHandle handle, SplatSceneMetadata& metadata
         return false;
 
     SceneReadState& state = m_loads[handle];
+    if (state.containerData != nullptr)
+    {
+        metadata.vertexCount = state.containerData->vertexCount;
+        metadata.stride = state.containerData->strideSize;
+        return true;
+    }
+
     metadata.vertexCount = state.plyFileData->vertexCount;
     metadata.stride = state.plyFileData->strideSize;
     return true;
@@ -177,6 +302,9 @@ size_t SceneDb::payloadSize(SceneLoadHandle handle)
     if (!state.asyncHandle.valid() || state.plyFileData == nullptr)
         return 0ll;
 
+    if (state.containerData != nullptr)
+        return state.containerData->payloadSize;
+
     return state.plyFileData->payloadSize;
 }
 
@@ -187,12 +315,17 @@ bool SceneDb::closeScene(SceneLoadHandle handle)
 
     SceneReadState& state = m_loads[handle];
     SceneLoadStatus loadStatus = m_loadStatuses[handle];
+    setStatusCallback(handle, SceneStatusCallback());
 
     if (state.asyncHandle.valid())
         m_fs.closeHandle(state.asyncHandle);
 
+    // the copy task can still be running past setting the final status (status callback, trace), finish it before cleaning it.
     if (state.copyPayloadTask.valid())
+    {
+        m_ts.wait(state.copyPayloadTask);
         m_ts.cleanTaskTree(state.copyPayloadTask);
+    }
 
     if (state.plyFileData != nullptr)
     {
@@ -202,9 +335,135 @@ bool SceneDb::closeScene(SceneLoadHandle handle)
         state.plyFileData = nullptr;
     }
 
+    if (state.containerData != nullptr)
+    {
+        delete [] state.containerData->fileBuffer;
+        delete state.containerData;
+        state.containerData = nullptr;
+    }
+
     m_loadStatuses[handle] = SceneLoadStatus::Opening;
     m_loads.free(handle);
     return true;
 }
 
+SceneExportHandle SceneDb::exportScene(const char* path, const SceneExportDesc& desc, std::string& outError)
+{
+    size_t expectedSize = (size_t)desc.vertexCount * desc.propertyNames.size() * sizeof(float);
+    if (desc.propertyNames.empty() || desc.vertexCount <= 0 || desc.payload == nullptr || desc.payloadSize < expectedSize)
+    {
+        std::stringstream ss;
+        ss << "Payload must hold " << desc.vertexCount << " vertices of " << desc.propertyNames.size() << " float properties ("
+           << expectedSize << " bytes), got " << desc.payloadSize << " bytes.";
+        outError = ss.str();
+        return SceneExportHandle();
+    }
+
+    SceneExportHandle exportHandle;
+    SceneWriteState& state = m_exports.allocate(exportHandle);
+    if (!exportHandle.valid())
+    {
+        outError = "Too many scene exports in flight.";
+        return SceneExportHandle();
+    }
+
+    std::atomic<SceneExportStatus>& exportStatus = m_exportStatuses[exportHandle];
+    exportStatus = SceneExportStatus::Writing;
+    SPT_TRACE_INSTANT("scene", "export:Writing", exportHandle.handleId);
+    writePlyHeader(desc.vertexCount, desc.propertyNames, state.header);
+    state.errorStr = {};
+    state.bytesWritten = 0;
+    state.totalBytes = state.header.size() + expectedSize;
+
+    std::vector<FileWriteSegment> segments = {
+        { state.header.c_str(), state.header.size() },
+        { desc.payload, expectedSize }
+    };
+
+    FileWriteRequest writeRequest(path, [&state, &exportStatus, exportHandle](FileWriteResponse& response)
+    {
+        if (response.status == FileStatus::Fail)
+        {
+            std::stringstream ss; 
+            ss << "Failed writing file: " << IoError2String(response.error) << std::endl;
+            state.errorStr = ss.str();
+            exportStatus = SceneExportStatus::Failed;
+            SPT_TRACE_INSTANT("scene", "export:Failed", exportHandle.handleId);
+        }
+        else if (response.status == FileStatus::Writing)
+        {
+            state.bytesWritten = response.bytesWritten;
+        }
+        else if (response.status == FileStatus::Success)
+        {
+            state.bytesWritten = response.bytesWritten;
+            exportStatus = SceneExportStatus::SuccessFinish;
+            SPT_TRACE_INSTANT("scene", "export:SuccessFinish", exportHandle.handleId);
+        }
+    }, segments, (int)FileRequestFlags::NoCopy);
+
+    AsyncFileHandle asyncHandle = m_fs.write(writeRequest);
+    if (!asyncHandle.valid())
+    {
+        outError = "Could not create file write request.";
+        m_exportStatuses[exportHandle] = SceneExportStatus::InvalidHandle;
+        m_exports.free(exportHandle);
+        return SceneExportHandle();
+    }
+
+    state.asyncHandle = asyncHandle;
+    m_fs.execute(asyncHandle);
+    return exportHandle;
+}
+
+SceneExportStatus SceneDb::checkExportStatus(SceneExportHandle handle)
+{
+    if (!handle.valid() || !m_exports.contains(handle))
+        return SceneExportStatus::InvalidHandle;
+
+    return m_exportStatuses[handle];
+}
+
+void SceneDb::exportProgress(SceneExportHandle handle, unsigned long long& bytesWritten, unsigned long long& totalBytes)
+{
+    if (!handle.valid() || !m_exports.contains(handle))
+        return;
+
+    SceneWriteState& state = m_exports[handle];
+    bytesWritten = (unsigned long long)state.bytesWritten;
+    totalBytes = (unsigned long long)state.totalBytes;
+}
+
+const char* SceneDb::exportErrorStr(SceneExportHandle handle)
+{
+    if (!handle.valid() || !m_exports.contains(handle))
+        return "";
+
+    return m_exports[handle].errorStr.c_str();
+}
+
+void SceneDb::resolveExport(SceneExportHandle handle)
+{
+    if (!handle.valid() || !m_exports.contains(handle))
+        return;
+
+    SceneWriteState& state = m_exports[handle];
+    if (state.asyncHandle.valid())
+        m_fs.wait(state.asyncHandle);
+}
+
+bool SceneDb::closeExport(SceneExportHandle handle)
+{
+    if (!handle.valid() || !m_exports.contains(handle))
+        return false;
+
+    SceneWriteState& state = m_exports[handle];
+    if (state.asyncHandle.valid())
+        m_fs.closeHandle(state.asyncHandle);
+
+    m_exportStatuses[handle] = SceneExportStatus::InvalidHandle;
+    m_exports.free(handle);
+    return true;
+}
+
 }
@@ -5,7 +5,10 @@
 #include <tasks/TaskDefs.h>
 #include <files/FileDefs.h>
 #include <atomic>
+#include <functional>
+#include <mutex>
 #include <string>
+#include <vector>
 
 namespace splatastic
 {
@@ -13,8 +16,9 @@ namespace splatastic
 class IFileSystem;
 
 struct SceneLoadHandle : public GenericHandle<int> {};
+struct SceneExportHandle : public GenericHandle<int> {};
 
-enum : int { MaxScenes = 8 };
+enum : int { MaxScenes = 8, MaxSceneExports = 8 };
 
 // must match scene_loader.py
 enum class SceneLoadStatus
@@ -27,7 +31,30 @@ enum class SceneLoadStatus
     Failed
 };
 
+// must match scene_loader.py
+enum class SceneExportStatus
+{
+    Writing,
+    InvalidHandle,
+    SuccessFinish,
+    Failed
+};
+
 struct PlyFileData;
+struct ContainerFileData;
+
+struct SceneExportDesc
+{
+    // vertexCount * propertyNames.size() floats. Not copied, must stay alive until closeExport.
+    const char* payload = nullptr;
+    size_t payloadSize = 0;
+    int vertexCount = 0;
+    std::vector<std::string> propertyNames;
+};
+
+// Called every time a load changes status (not on every chunk read), from io / worker threads or the thread
+// calling into SceneDb. Calls for a handle are serialized, setStatusCallback / closeScene wait for a running one.
+using SceneStatusCallback = std::function<void(SceneLoadHandle, SceneLoadStatus)>;
 
 struct SplatSceneMetadata
 {
@@ -57,10 +84,25 @@ public:
 
     const char* errorStr(SceneLoadHandle handle);
     void resolve(SceneLoadHandle handle);
+    void setStatusCallback(SceneLoadHandle handle, SceneStatusCallback callback);
 
     bool closeScene(SceneLoadHandle handle);
 
+    // Writes the payload as a binary little endian ply file, streaming straight from desc.payload.
+    SceneExportHandle exportScene(const char* path, const SceneExportDesc& desc, std::string& outError);
+    SceneExportStatus checkExportStatus(SceneExportHandle handle);
+    void exportProgress(
+        SceneExportHandle handle,
+        unsigned long long& bytesWritten,
+        unsigned long long& totalBytes);
+    const char* exportErrorStr(SceneExportHandle handle);
+    void resolveExport(SceneExportHandle handle);
+    bool closeExport(SceneExportHandle handle);
+
 private:
+    void setLoadStatus(SceneLoadHandle handle, SceneLoadStatus status);
+    bool decompressPayload(SceneLoadHandle handle, char* dest, size_t destSize);
+
     struct SceneReadState
     {
         AsyncFileHandle asyncHandle = {};
@@ -69,10 +111,24 @@ private:
         size_t bytesRead = 0;
         size_t totalBytes = 0;
         PlyFileData* plyFileData = {};
+        ContainerFileData* containerData = {};
+    };
+
+    struct SceneWriteState
+    {
+        AsyncFileHandle asyncHandle = {};
+        std::string header = {};
+        std::string errorStr = {};
+        size_t bytesWritten = 0;
+        size_t totalBytes = 0;
     };
 
     HandleContainer<SceneLoadHandle, SceneReadState, MaxScenes> m_loads;
     std::atomic<SceneLoadStatus> m_loadStatuses[MaxScenes];
+    std::mutex m_statusCallbackMutexes[MaxScenes];
+    SceneStatusCallback m_statusCallbacks[MaxScenes];
+    HandleContainer<SceneExportHandle, SceneWriteState, MaxSceneExports> m_exports;
+    std::atomic<SceneExportStatus> m_exportStatuses[MaxSceneExports];
     IFileSystem& m_fs;
     ITaskSystem& m_ts;
 };
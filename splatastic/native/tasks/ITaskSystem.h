@@ -16,12 +16,17 @@ public:
     virtual void depends(Task src, Task dst) = 0;
     virtual void depends(Task src, Task* dsts, int counts) = 0;
     virtual void wait(Task other) = 0;
+    virtual bool isFinished(Task task) = 0;
     virtual void execute(Task task) = 0;
     virtual void execute(Task* tasks, int counts) = 0;
     virtual void cleanFinishedTasks() = 0;
     virtual void cleanTaskTree(Task src) = 0;
     virtual void yield() = 0;
 
+    // Creates a task that, once executed, splits [0, elementCount) in ranges of grainSize elements and
+    // runs fn on each range in parallel. The returned task finishes when all the ranges are done.
+    virtual Task createParallelFor(const char* name, int elementCount, int grainSize, ParallelForFn fn) = 0;
+
     //convenience functions
     inline Task createTask()
     {
@@ -29,9 +34,26 @@ public:
         return createTask(emptyDesc);
     } 
 
+    inline void parallelFor(const char* name, int elementCount, int grainSize, ParallelForFn fn)
+    {
+        Task t = createParallelFor(name, elementCount, grainSize, fn);
+        execute(t);
+        wait(t);
+        cleanTaskTree(t);
+    }
+
     struct Stats
     {
         int numElements;
+        int numWorkers;
+        int numIoThreads;
+        int availableCpus;
+        bool pinnedThreads;
+        int queuedTasks;
+        int pendingIoJobs;
+        unsigned long long tasksExecuted;
+        unsigned long long tasksStolen;
+        unsigned long long ioJobsExecuted;
     };
 
     virtual void getStats(Stats& outStats) = 0;
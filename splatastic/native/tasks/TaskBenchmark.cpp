@@ -0,0 +1,78 @@
+#include "TaskBenchmark.h"
+#include "ITaskSystem.h"
+#include <atomic>
+#include <chrono>
+#include <vector>
+
+namespace splatastic
+{
+
+namespace
+{
+
+using Clock = std::chrono::high_resolution_clock;
+
+double elapsedMs(Clock::time_point begin)
+{
+    return std::chrono::duration<double, std::milli>(Clock::now() - begin).count();
+}
+
+}
+
+void runTaskBenchmark(ITaskSystem& ts, const TaskBenchmarkDesc& desc, TaskBenchmarkResults& results)
+{
+    ITaskSystem::Stats stats = {};
+    ts.getStats(stats);
+    results.workerCount = stats.numWorkers;
+
+    //throughput: many independent tiny tasks, joined by a root task.
+    {
+        std::atomic<int> counter(0);
+        auto begin = Clock::now();
+        Task root = ts.createTask();
+        std::vector<Task> tasks(desc.taskCount);
+        for (auto& t : tasks)
+            t = ts.createTask(TaskDesc("benchmark_task", [&counter](TaskContext& ctx) { ++counter; }));
+        ts.depends(root, tasks.data(), (int)tasks.size());
+        ts.execute(root);
+        ts.wait(root);
+        results.taskBatchMs = elapsedMs(begin);
+        results.tasksPerSecond = results.taskBatchMs <= 0.0 ? 0.0 : (double)desc.taskCount / (results.taskBatchMs / 1000.0);
+        ts.cleanTaskTree(root);
+    }
+
+    //latency: each task in the chain depends on the previous one.
+    {
+        std::atomic<int> counter(0);
+        std::vector<Task> chain(desc.chainLength);
+        for (auto& t : chain)
+            t = ts.createTask(TaskDesc("benchmark_chain", [&counter](TaskContext& ctx) { ++counter; }));
+        for (int i = 1; i < (int)chain.size(); ++i)
+            ts.depends(chain[i], chain[i - 1]);
+
+        auto begin = Clock::now();
+        if (!chain.empty())
+        {
+            ts.execute(chain.back());
+            ts.wait(chain.back());
+        }
+        results.chainMs = elapsedMs(begin);
+        results.chainLatencyUs = chain.empty() ? 0.0 : (results.chainMs * 1000.0) / (double)chain.size();
+        if (!chain.empty())
+            ts.cleanTaskTree(chain.back());
+    }
+
+    //parallel for over a buffer
+    {
+        std::vector<float> values(desc.parallelForElements, 1.0f);
+        auto begin = Clock::now();
+        ts.parallelFor("benchmark_parallel_for", (int)values.size(), desc.parallelForGrain, [&values](int b, int e)
+        {
+            for (int i = b; i < e; ++i)
+                values[i] = values[i] * 0.5f + 1.0f;
+        });
+        results.parallelForMs = elapsedMs(begin);
+    }
+}
+
+}
@@ -0,0 +1,30 @@
+#pragma once
+
+namespace splatastic
+{
+
+class ITaskSystem;
+
+struct TaskBenchmarkDesc
+{
+    int taskCount = 100000;
+    int chainLength = 10000;
+    int parallelForElements = 1 << 20;
+    int parallelForGrain = 4096;
+};
+
+struct TaskBenchmarkResults
+{
+    double tasksPerSecond = 0.0;
+    double taskBatchMs = 0.0;
+    double chainLatencyUs = 0.0;
+    double chainMs = 0.0;
+    double parallelForMs = 0.0;
+    int workerCount = 0;
+};
+
+// Microbenchmark of the task system: throughput of independent tasks,
+// latency of a dependency chain and a parallel for over a dummy workload.
+void runTaskBenchmark(ITaskSystem& ts, const TaskBenchmarkDesc& desc, TaskBenchmarkResults& results);
+
+}
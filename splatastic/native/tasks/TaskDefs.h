@@ -14,7 +14,14 @@ class ITaskSystem;
 
 struct TaskSystemDesc
 {
-    int threadPoolSize = 8u;
+    // compute workers, 0 uses one per CPU available to the process.
+    int threadPoolSize = 0;
+
+    // threads running blocking io (TaskUtil::yieldUntil), shared by all the workers.
+    int ioThreadCount = 2;
+
+    // pins each compute worker to a CPU of the process affinity mask.
+    bool pinThreads = false;
 };
 
 enum class TaskFlags : int
@@ -24,6 +31,7 @@ enum class TaskFlags : int
 
 using TaskBlockFn = std::function<void()>;
 using TaskFn = std::function<void(TaskContext& ctx)>;
+using ParallelForFn = std::function<void(int begin, int end)>;
 using Task = GenericHandle<unsigned int>;
 
 struct TaskDesc
@@ -1,350 +1,414 @@
 #include "TaskSystem.h"
-#include "ThreadQueue.h"
+#include "ThreadUtils.h"
 #include <utils/Assert.h>
+#include <utils/Trace.h>
 #include <chrono>
 #include <thread>
+#include <set>
 
 namespace splatastic
 {
 
-enum class TaskScheduleMessageType
+TaskSystem::TaskSystem(const TaskSystemDesc& desc)
+: m_desc(desc)
+, m_active(false)
+, m_chunkCount(0)
+, m_liveTasks(0)
+, m_queuedJobs(0)
+, m_sleepers(0)
+, m_externalWaiters(0)
+, m_nextWorker(0u)
+, m_tasksExecuted(0ull)
+, m_tasksStolen(0ull)
+, m_ioJobsExecuted(0ull)
 {
-    Exit,
-    RunJob,
-    RunJobs
-};
+}
 
-struct TaskScheduleMessage
+TaskSystem::~TaskSystem()
 {
-    TaskScheduleMessageType type;
-    Task task;
-    std::vector<Task> tasks;
-};
+    signalStop();
+    join();
 
-class TaskSchedulerQueue : public ThreadQueue<TaskScheduleMessage> {};
+    int aliveTasks = m_liveTasks;
+    SPT_ASSERT_FMT(aliveTasks == 0, "%d still alive tasks detected. This will cause memory leaks.", aliveTasks);
+}
 
-Task TaskSystem::createTask(const TaskDesc& taskDesc, void* taskData)
+bool TaskSystem::contains(Task t) const
 {
+    if (!t.valid() || (int)(t.handleId >> TaskChunkSizeLog2) >= m_chunkCount)
+        return false;
 
-    Task outHandle;
+    return m_chunks[t.handleId >> TaskChunkSizeLog2][t.handleId & (TaskChunkSize - 1)].state != TaskState::Free;
+}
+
+Task TaskSystem::allocateTask()
+{
+    std::unique_lock<std::mutex> lock(m_poolMutex);
+    if (m_freeTasks.empty())
     {
-        std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-        TaskData& data = m_taskTable.allocate(outHandle);
-        data.desc = taskDesc;
-        data.data = taskData;
-        data.syncData = new SyncData;
+        int chunkIndex = m_chunkCount;
+        SPT_ASSERT_MSG(chunkIndex < (int)MaxTaskChunks, "Exceeded the maximum number of tasks alive.");
+        if (chunkIndex >= (int)MaxTaskChunks)
+            return Task();
+
+        m_chunks[chunkIndex] = std::make_unique<TaskRecord[]>(TaskChunkSize);
+        for (int i = TaskChunkSize - 1; i >= 0; --i)
+            m_freeTasks.push_back((unsigned)((chunkIndex << TaskChunkSizeLog2) + i));
+        m_chunkCount = chunkIndex + 1;
     }
 
-    if ((taskDesc.flags & (int)TaskFlags::AutoStart) != 0)
-        execute(outHandle);
-    return outHandle;
+    Task t(m_freeTasks.back());
+    m_freeTasks.pop_back();
+    ++m_liveTasks;
+    return t;
 }
 
-TaskSystem::TaskSystem(const TaskSystemDesc& desc)
-: m_schedulerQueue(std::make_unique<TaskSchedulerQueue>())
-, m_nextWorker(0u)
+void TaskSystem::freeTask(Task t)
 {
+    TaskRecord& r = record(t);
+    r.desc = TaskDesc();
+    r.data = nullptr;
+    r.state = TaskState::Free;
+    m_freeTasks.push_back(t.handleId);
+    --m_liveTasks;
 }
 
-TaskSystem::~TaskSystem()
+Task TaskSystem::createTask(const TaskDesc& taskDesc, void* taskData)
 {
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-
-    signalStop();
-    join();
+    Task outHandle = allocateTask();
+    if (!outHandle.valid())
+        return outHandle;
+
+    TaskRecord& r = record(outHandle);
+    r.desc = taskDesc;
+    r.data = taskData;
+    r.launched = false;
+    r.pendingCount = 1;
+    r.dependencies.clear();
+    r.parents.clear();
+    r.state = TaskState::Unscheduled;
 
-    int aliveTasks = 0;
-    m_taskTable.forEach([&aliveTasks](Task task, TaskData& data){
-        aliveTasks += data.syncData == nullptr ? 0 : 1;
-    });
-
-    SPT_ASSERT_FMT(aliveTasks == 0, "%d still alive tasks detected. This will cause memory leaks.", aliveTasks);
+    if ((taskDesc.flags & (int)TaskFlags::AutoStart) != 0)
+        execute(outHandle);
+    return outHandle;
 }
 
 void TaskSystem::start()
 {
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-
-    SPT_ASSERT_MSG(m_schedulerThread == nullptr, "Task system cannot start, must call signalStop followed by join().");
-    if (m_schedulerThread)
+    SPT_ASSERT_MSG(m_workers.empty(), "Task system cannot start, must call signalStop followed by join().");
+    if (!m_workers.empty())
         return;
 
-    m_workers.resize(m_desc.threadPoolSize);
-    int nextId = 0;
-    for (auto& w : m_workers)
+    m_active = true;
+    int workerCount = m_desc.threadPoolSize < 1 ? ThreadUtils::availableCpuCount() : m_desc.threadPoolSize;
+    for (int i = 0; i < workerCount; ++i)
     {
-        w.setId(nextId++);
-        w.start([this](Task t) { this->onTaskComplete(t); });
+        m_workers.push_back(std::make_unique<ThreadWorker>());
+        m_workers.back()->setId(i);
     }
 
-    m_schedulerThread = std::make_unique<std::thread>([this]() { onMessageLoop(); });
+    for (auto& w : m_workers)
+        w->start(*this, m_desc.pinThreads ? w->id() : -1);
+
+    int ioThreadCount = m_desc.ioThreadCount < 1 ? 1 : m_desc.ioThreadCount;
+    for (int i = 0; i < ioThreadCount; ++i)
+        m_ioThreads.push_back(std::make_unique<std::thread>([this]() { ioLoop(); }));
 }
 
 void TaskSystem::signalStop()
 {
-    TaskScheduleMessage msg;
-    msg.type = TaskScheduleMessageType::Exit;
-    m_schedulerQueue->push(msg);
+    m_active = false;
+    wakeWorkers();
+    for (auto& w : m_workers)
+        w->signalStop();
+
+    for (int i = 0; i < (int)m_ioThreads.size(); ++i)
+        m_ioQueue.push(IoJob());
 }
 
 void TaskSystem::join()
 {
-    if (!m_schedulerThread)
-        return;
-
-    m_schedulerThread->join();
     for (auto& w : m_workers)
-        w.join();
+        w->join();
+
+    m_workers.clear();
 
-    m_schedulerThread.release();
+    for (auto& t : m_ioThreads)
+        t->join();
+
+    m_ioThreads.clear();
 }
 
-void TaskSystem::execute(Task task)
+void TaskSystem::wakeWorkers()
 {
-    TaskScheduleMessage msg = {};
-    msg.type = TaskScheduleMessageType::RunJob;
-    msg.task = task;
-    m_schedulerQueue->push(msg);
+    std::unique_lock<std::mutex> lock(m_wakeMutex);
+    m_wakeCv.notify_all();
 }
 
-void TaskSystem::execute(Task* tasks, int counts)
+void TaskSystem::idleWait(ThreadWorker& worker, const std::atomic<bool>* wakeFlag)
 {
-    TaskScheduleMessage msg = {};
-    msg.type = TaskScheduleMessageType::RunJobs;
-    msg.tasks.assign(tasks, tasks + counts);
-    m_schedulerQueue->push(msg);
+    SPT_TRACE_SCOPE("task", "idle");
+    std::unique_lock<std::mutex> lock(m_wakeMutex);
+    ++m_sleepers;
+    m_wakeCv.wait(lock, [this, wakeFlag]() {
+        return m_queuedJobs > 0 || !m_active || (wakeFlag != nullptr && *wakeFlag);
+    });
+    --m_sleepers;
 }
 
-void TaskSystem::depends(Task src, Task dst)
+void TaskSystem::runBlocking(const TaskBlockFn& fn, std::atomic<bool>* doneFlag)
 {
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
+    IoJob job;
+    job.fn = fn;
+    job.doneFlag = doneFlag;
+    m_ioQueue.push(job);
+}
 
-    bool hasSrcTask = m_taskTable.contains(src);
-    bool hasDstTask = m_taskTable.contains(dst);
-    SPT_ASSERT_MSG(hasSrcTask, "Src task must exist");
-    SPT_ASSERT_MSG(hasDstTask, "Dst task must exist");
-    if (!hasSrcTask || !hasDstTask)
-        return;
+void TaskSystem::ioLoop()
+{
+    SPT_TRACE_THREAD_NAME("io");
+    while (true)
+    {
+        IoJob job;
+        m_ioQueue.waitPop(job);
+        if (job.doneFlag == nullptr)
+            break;
+
+        {
+            SPT_TRACE_SCOPE("io", "io_job");
+            job.fn();
+        }
+        ++m_ioJobsExecuted;
 
-    TaskData& srcTaskData = m_taskTable[src];
-    TaskData& dstTaskData = m_taskTable[dst];
-    srcTaskData.initialDependencies.insert(dst);
-    srcTaskData.dependencies.insert(dst);
-    dstTaskData.parents.insert(src);
+        //wake up the waiting worker, which keeps running jobs until this flag is set.
+        *job.doneFlag = true;
+        wakeWorkers();
+    }
 }
 
-void TaskSystem::depends(Task src, Task* dsts, int counts)
+void TaskSystem::enqueue(Task t)
 {
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-
-    bool hasSrcTask = m_taskTable.contains(src);
-    SPT_ASSERT_MSG(hasSrcTask, "Src task must exist");
-    if (!hasSrcTask)
+    if (m_workers.empty())
         return;
 
-    TaskData& srcTaskData = m_taskTable[src];
-    for (int i = 0; i < counts; ++i)
-    {
-        Task dstTask = dsts[i];
-        bool hasDstTask = m_taskTable.contains(dstTask);
-        SPT_ASSERT_MSG(hasDstTask, "Dst task must exist");
-        if (!hasDstTask)
-            continue;
-        
-        TaskData& dstTaskData = m_taskTable[dstTask];
+    ThreadWorker* worker = ThreadWorker::getLocalThreadWorker();
+    if (worker == nullptr)
+        worker = m_workers[m_nextWorker++ % (unsigned)m_workers.size()].get();
 
-        srcTaskData.initialDependencies.insert(dstTask);
-        srcTaskData.dependencies.insert(dstTask);
-        dstTaskData.parents.insert(src);
+    record(t).state = TaskState::Scheduled;
+    worker->push(t);
+    ++m_queuedJobs;
+    if (m_sleepers > 0)
+    {
+        std::unique_lock<std::mutex> lock(m_wakeMutex);
+        m_wakeCv.notify_one();
     }
 }
 
-void TaskSystem::onScheduleTask(Task* tasks, int counts)
+void TaskSystem::execute(Task task)
 {
-    struct RunCommand
-    {
-        TaskContext context;
-        TaskFn fn;
-    };
+    execute(&task, 1);
+}
 
-    for (int i = 0; i < counts; ++i)
+void TaskSystem::execute(Task* tasks, int counts)
+{
+    // launches the tasks and all of their unlaunched dependencies.
+    std::vector<Task> launchStack(tasks, tasks + counts);
+    while (!launchStack.empty())
     {
-        Task t = tasks[i];
+        Task t = launchStack.back();
+        launchStack.pop_back();
+        if (!contains(t))
         {
-            std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-            std::vector<Task> childTasks;
-            if (!m_taskTable.contains(t))
-            {
-                SPT_ERROR_MSG(false, "Missing task while scheduling it?");
-                continue;
-            }
-        
-            auto& taskData = m_taskTable[t];
-            if (taskData.syncData->state != TaskState::Unscheduled)
-                continue;
-
-            if (!taskData.dependencies.empty())
-            {
-                taskData.syncData->state = TaskState::Unscheduled;
-                for (auto dep : taskData.dependencies)
-                {
-                    if (m_taskTable[dep].syncData->state == TaskState::Unscheduled)
-                        childTasks.push_back(dep);
-                }
-            }
-            else
-            {
-                taskData.syncData->state = TaskState::InWorker;
-                taskData.syncData->workerId = m_nextWorker;
-                TaskContext context = { t, taskData.data, this };
-                m_workers[m_nextWorker].schedule(taskData.desc.fn, context);
-                m_nextWorker = (m_nextWorker + 1) % (int)m_workers.size();
-            }
-            execute(childTasks.data(), (int)childTasks.size());
+            SPT_ERROR_MSG(false, "Missing task while scheduling it?");
+            continue;
         }
-    }
-}
 
-void TaskSystem::onMessageLoop()
-{
-    bool active = true;
-    while (active)
-    {
-        TaskScheduleMessage msg;
-        m_schedulerQueue->waitPop(msg);
-        switch (msg.type)
+        TaskRecord& r = record(t);
+        if (r.launched.exchange(true))
+            continue;
+
+        r.acquire();
+        for (Task dep : r.dependencies)
         {
-        case TaskScheduleMessageType::RunJob:
-            onScheduleTask(&msg.task, 1);
-            break;
-        case TaskScheduleMessageType::RunJobs:
-            onScheduleTask(msg.tasks.data(), msg.tasks.size());
-            break;
-        case TaskScheduleMessageType::Exit:
-        default:
-            for (auto& w : m_workers)
-                w.signalStop();
-            active = false;
-            break;
+            if (record(dep).state == TaskState::Unscheduled)
+                launchStack.push_back(dep);
         }
+        r.release();
+
+        //consume the launch token
+        if (r.pendingCount.fetch_sub(1) == 1)
+            enqueue(t);
     }
 }
 
-void TaskSystem::runSingleJob(ThreadWorker& worker)
+void TaskSystem::depends(Task src, Task dst)
 {
-    TaskFn fn;
-    TaskContext ctx;
-    for (ThreadWorker& otherWorker : m_workers)
+    bool hasSrcTask = contains(src);
+    bool hasDstTask = contains(dst);
+    SPT_ASSERT_MSG(hasSrcTask, "Src task must exist");
+    SPT_ASSERT_MSG(hasDstTask, "Dst task must exist");
+    if (!hasSrcTask || !hasDstTask)
+        return;
+
+    TaskRecord& srcRecord = record(src);
+    TaskRecord& dstRecord = record(dst);
+
+    dstRecord.acquire();
+    if (dstRecord.state != TaskState::Finished)
     {
-        if (otherWorker.stealJob(fn, ctx))
-        {
-            worker.runInThread(fn, ctx);
-            return;
-        }
+        dstRecord.parents.push_back(src);
+        ++srcRecord.pendingCount;
     }
+    dstRecord.release();
+
+    srcRecord.acquire();
+    srcRecord.dependencies.push_back(dst);
+    srcRecord.release();
 }
 
-void TaskSystem::onTaskComplete(Task t)
+void TaskSystem::depends(Task src, Task* dsts, int counts)
 {
-    std::vector<Task> nextTasks;
-    SyncData* syncData = nullptr;
+    for (int i = 0; i < counts; ++i)
+        depends(src, dsts[i]);
+}
+
+bool TaskSystem::runSingleJob(ThreadWorker& worker)
+{
+    Task t;
+    if (worker.pop(t))
     {
-        std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-        TaskData& taskData = m_taskTable[t];
-        syncData = taskData.syncData;
-        SPT_ERROR_MSG(syncData != nullptr, "Sync data not found when task has been completed.");
-        syncData->state = TaskState::Finished;
+        --m_queuedJobs;
+        runTask(worker, t);
+        return true;
+    }
 
-        for (auto p : taskData.parents)
+    int workerCount = (int)m_workers.size();
+    for (int i = 1; i < workerCount; ++i)
+    {
+        ThreadWorker& victim = *m_workers[(worker.id() + i) % workerCount];
+        if (victim.steal(t))
         {
-            auto& parentTask = m_taskTable[p];
-            parentTask.dependencies.erase(t);
-            if (parentTask.dependencies.empty() && parentTask.syncData->state == TaskState::Unscheduled)
-                nextTasks.push_back(p);
+            --m_queuedJobs;
+            ++m_tasksStolen;
+            SPT_TRACE_INSTANT("task", "steal", victim.id());
+            runTask(worker, t);
+            return true;
         }
+    }
 
-        {
-            std::unique_lock<std::shared_mutex> lock(m_finishedTasksMutex);
-            m_finishedTasksList.insert(t);
-        }
+    return false;
+}
 
-        syncData->cv.notify_all();
+void TaskSystem::runTask(ThreadWorker& worker, Task t)
+{
+    TaskRecord& r = record(t);
+    r.state = TaskState::InWorker;
+    TaskContext context = { t, r.data, this };
+    if (r.desc.fn)
+    {
+        SPT_TRACE_SCOPE_VALUE("task", r.desc.name.empty() ? "task" : r.desc.name.c_str(), worker.id());
+        r.desc.fn(context);
     }
-    execute(nextTasks.data(), (int)nextTasks.size());
+
+    ++m_tasksExecuted;
+    onTaskComplete(t);
 }
 
-void TaskSystem::removeTask(Task t)
+void TaskSystem::onTaskComplete(Task t)
 {
-    auto& taskData = m_taskTable[t];
-    for (auto p : taskData.parents)
+    //take the parents before publishing Finished: once a waiter sees it, the record can be freed and reused.
+    std::vector<Task> parents;
+    TaskRecord& r = record(t);
+    r.acquire();
+    parents.swap(r.parents);
+    r.state = TaskState::Finished;
+    r.release();
+
+    for (Task p : parents)
     {
-        if (!m_taskTable.contains(p))
-            continue;
-        auto& pdata = m_taskTable[p];
-        pdata.initialDependencies.erase(t);
-        pdata.dependencies.erase(t);
+        if (record(p).pendingCount.fetch_sub(1) == 1)
+            enqueue(p);
+    }
+
+    if (m_externalWaiters > 0)
+    {
+        std::unique_lock<std::mutex> lock(m_finishedMutex);
+        m_finishedCv.notify_all();
     }
-    delete taskData.syncData;
-    m_taskTable.free(t);
 }
 
 void TaskSystem::cleanFinishedTasks()
 {
     SPT_ASSERT_MSG(ThreadWorker::getLocalThreadWorker() == nullptr, "cleanFinishedTasks cannot be called from a worker thread.");
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-    std::unique_lock<std::shared_mutex> lock2(m_finishedTasksMutex);
-
-    for (auto t : m_finishedTasksList)
-        removeTask(t);
-
-    m_finishedTasksList.clear();
+    std::unique_lock<std::mutex> lock(m_poolMutex);
+    int taskCount = m_chunkCount * TaskChunkSize;
+    for (int i = 0; i < taskCount; ++i)
+    {
+        Task t((unsigned)i);
+        if (record(t).state == TaskState::Finished)
+            freeTask(t);
+    }
 }
 
 void TaskSystem::cleanTaskTree(Task src)
 {
-    std::unique_lock<std::shared_mutex> lock(m_stateMutex);
-    std::unique_lock<std::shared_mutex> lock2(m_finishedTasksMutex);
     std::vector<Task> tasksToClean;
     std::set<Task> erasedTasks;
     tasksToClean.push_back(src);
 
+    std::unique_lock<std::mutex> lock(m_poolMutex);
     while (!tasksToClean.empty())
     {
         auto t = tasksToClean.back();
         tasksToClean.pop_back();
-        if (erasedTasks.insert(t).second == false)
+        if (!contains(t) || erasedTasks.insert(t).second == false)
             continue;
 
-        auto& tableData = m_taskTable[t];
-        for (auto d : tableData.initialDependencies)
+        for (auto d : record(t).dependencies)
             tasksToClean.push_back(d);
 
-        removeTask(t);
-        m_finishedTasksList.erase(t);
+        freeTask(t);
     }
 }
 
-bool TaskSystem::isTaskFinished(Task t)
+Task TaskSystem::createParallelFor(const char* name, int elementCount, int grainSize, ParallelForFn fn)
 {
-    std::shared_lock<std::shared_mutex> lock(m_stateMutex);
-    SyncData* syncData = nullptr;
-    if (!m_taskTable.contains(t))
+    grainSize = grainSize < 1 ? 1 : grainSize;
+    Task root = createTask(TaskDesc(name, nullptr), nullptr);
+    if (!root.valid())
+        return root;
+
+    int rangeCount = (elementCount + grainSize - 1) / grainSize;
+    std::vector<Task> ranges;
+    ranges.reserve(rangeCount);
+    for (int i = 0; i < rangeCount; ++i)
     {
-        SPT_ASSERT_MSG(false, "Task does not exist");
-        return true;
+        int begin = i * grainSize;
+        int end = (begin + grainSize) < elementCount ? (begin + grainSize) : elementCount;
+        Task rangeTask = createTask(TaskDesc(name, [fn, begin, end](TaskContext& ctx) { fn(begin, end); }), nullptr);
+        if (rangeTask.valid())
+            ranges.push_back(rangeTask);
     }
-    
-    syncData = m_taskTable[t].syncData;
-    if (syncData == nullptr)
+
+    depends(root, ranges.data(), (int)ranges.size());
+    return root;
+}
+
+bool TaskSystem::isFinished(Task task)
+{
+    return isTaskFinished(task);
+}
+
+bool TaskSystem::isTaskFinished(Task t)
+{
+    if (!contains(t))
     {
         SPT_ASSERT_MSG(false, "Task does not exist");
         return true;
     }
-    
-    if (syncData->state == TaskState::Finished)
-        return true;
 
-    return false;
+    return record(t).state == TaskState::Finished;
 }
 
 void TaskSystem::wait(Task other)
@@ -352,9 +416,11 @@ void TaskSystem::wait(Task other)
     ThreadWorker* worker = ThreadWorker::getLocalThreadWorker();
     if (worker != nullptr)
     {
-        bool finished = false;
         while (!isTaskFinished(other))
-            runSingleJob(*worker);
+        {
+            if (!runSingleJob(*worker))
+                std::this_thread::yield();
+        }
     }
     else
     {
@@ -364,29 +430,32 @@ void TaskSystem::wait(Task other)
 
 void TaskSystem::internalWait(Task other)
 {
-    SyncData* syncData = nullptr;
+    if (!contains(other))
     {
-        std::shared_lock<std::shared_mutex> lock(m_stateMutex);
-        if (!m_taskTable.contains(other))
-        {
-            SPT_ASSERT_MSG(false, "Cannot wait for task that does not exist");
-            return;
-        }
-
-        syncData = m_taskTable[other].syncData;
-        SPT_ERROR_MSG(syncData != nullptr, "Error, no sync data found during wait.");
+        SPT_ASSERT_MSG(false, "Cannot wait for task that does not exist");
+        return;
     }
 
+    ++m_externalWaiters;
     {
-        std::unique_lock<std::mutex> lock(syncData->m);
-        syncData->cv.wait(lock, [syncData]() { return syncData->state == TaskState::Finished; });
+        std::unique_lock<std::mutex> lock(m_finishedMutex);
+        m_finishedCv.wait(lock, [this, other]() { return isTaskFinished(other); });
     }
+    --m_externalWaiters;
 }
 
 void TaskSystem::getStats(ITaskSystem::Stats& outStats)
 {
-    std::shared_lock<std::shared_mutex> lock(m_stateMutex);
-    outStats.numElements = m_taskTable.elementsCount();
+    outStats.numElements = m_liveTasks;
+    outStats.numWorkers = (int)m_workers.size();
+    outStats.numIoThreads = (int)m_ioThreads.size();
+    outStats.availableCpus = ThreadUtils::availableCpuCount();
+    outStats.pinnedThreads = m_desc.pinThreads;
+    outStats.queuedTasks = m_queuedJobs;
+    outStats.pendingIoJobs = m_ioQueue.size();
+    outStats.tasksExecuted = m_tasksExecuted;
+    outStats.tasksStolen = m_tasksStolen;
+    outStats.ioJobsExecuted = m_ioJobsExecuted;
 }
 
 void TaskSystem::yield()
@@ -394,7 +463,7 @@ void TaskSystem::yield()
     ThreadWorker* localWorker = ThreadWorker::getLocalThreadWorker();
     if (!localWorker)
         return;
-    
+
     runSingleJob(*localWorker);
 }
 
@@ -1,25 +1,19 @@
 #pragma once
 
 #include "ITaskSystem.h"
-#include <utils/HandleContainer.h>
 #include "ThreadWorker.h"
+#include "ThreadQueue.h"
 #include <memory>
-#include <set>
+#include <vector>
 #include <mutex>
-#include <shared_mutex>
+#include <atomic>
 #include <condition_variable>
-
-namespace std
-{
-class thread;
-}
+#include <thread>
 
 namespace splatastic
 {
 
-class TaskSchedulerQueue;
-
-class TaskSystem : public ITaskSystem
+class TaskSystem : public ITaskSystem, public ThreadWorkerHost
 {
 public:
     TaskSystem(const TaskSystemDesc& desc);
@@ -33,63 +27,106 @@ public:
     virtual void depends(Task src, Task dst) override;
     virtual void depends(Task src, Task* dsts, int counts) override;
     virtual void wait(Task other) override;
+    virtual bool isFinished(Task task) override;
     virtual void execute(Task task) override;
     virtual void execute(Task* tasks, int counts) override;
     virtual void cleanFinishedTasks() override;
     virtual void cleanTaskTree(Task src) override;
     virtual void yield() override;
+    virtual Task createParallelFor(const char* name, int elementCount, int grainSize, ParallelForFn fn) override;
 
     void getStats(Stats& outStats) override;
 
-protected:
-    void onMessageLoop();
-    void runSingleJob(ThreadWorker& worker);
-    void onScheduleTask(Task* t, int counts);
-    void internalWait(Task other);
-    void removeTask(Task t);
-    bool isTaskFinished(Task t);
+    //ThreadWorkerHost
+    virtual bool runSingleJob(ThreadWorker& worker) override;
+    virtual void idleWait(ThreadWorker& worker, const std::atomic<bool>* wakeFlag) override;
+    virtual void wakeWorkers() override;
+    virtual bool active() const override { return m_active; }
+    virtual void runBlocking(const TaskBlockFn& fn, std::atomic<bool>* doneFlag) override;
 
-    enum class TaskState
+protected:
+    enum class TaskState : int
     {
+        Free,
         Unscheduled,
+        Scheduled,
         InWorker,
         Finished
     };
 
-    struct SyncData
-    {
-        TaskState state = TaskState::Unscheduled;
-        int workerId = -1;
-        std::mutex m;
-        std::condition_variable cv;
-    };
-
-    struct TaskData
+    struct TaskRecord
     {
         TaskDesc desc;
         void* data = nullptr;
-        std::set<Task> initialDependencies;
-        std::set<Task> dependencies;
-        std::set<Task> parents;
-        SyncData* syncData = nullptr;
+        std::atomic<TaskState> state { TaskState::Free };
+        std::atomic<bool> launched { false };
 
-        TaskState state() { return syncData->state; }
+        // 1 launch token (consumed by execute) + 1 per unfinished dependency.
+        // The task gets pushed to a worker when this reaches 0.
+        std::atomic<int> pendingCount { 0 };
+
+        // protects the lists below
+        std::atomic_flag lock = ATOMIC_FLAG_INIT;
+        std::vector<Task> dependencies;
+        std::vector<Task> parents;
+
+        void acquire() { while (lock.test_and_set(std::memory_order_acquire)); }
+        void release() { lock.clear(std::memory_order_release); }
     };
 
-    void onTaskComplete(Task task);
+    // Task records are pooled in fixed size chunks so a record never moves once allocated,
+    // and workers can access it without holding any lock.
+    enum : int
+    {
+        TaskChunkSizeLog2 = 10,
+        TaskChunkSize = 1 << TaskChunkSizeLog2,
+        MaxTaskChunks = 1024
+    };
 
-    TaskSystemDesc m_desc;
-    std::unique_ptr<TaskSchedulerQueue> m_schedulerQueue;
-    std::unique_ptr<std::thread> m_schedulerThread;
-    std::vector<ThreadWorker> m_workers;
+    TaskRecord& record(Task t) { return m_chunks[t.handleId >> TaskChunkSizeLog2][t.handleId & (TaskChunkSize - 1)]; }
+    bool contains(Task t) const;
+    Task allocateTask();
+    void freeTask(Task t);
 
-    mutable std::shared_mutex m_stateMutex;
-    HandleContainer<Task, TaskData> m_taskTable;
+    void enqueue(Task t);
+    void runTask(ThreadWorker& worker, Task t);
+    void onTaskComplete(Task t);
+    void internalWait(Task other);
+    bool isTaskFinished(Task t);
+    void ioLoop();
 
-    mutable std::shared_mutex m_finishedTasksMutex;
-    std::set<Task> m_finishedTasksList;
+    struct IoJob
+    {
+        TaskBlockFn fn;
+        std::atomic<bool>* doneFlag = nullptr; //null signals the io thread to exit.
+    };
 
-    int m_nextWorker;
+    TaskSystemDesc m_desc;
+    std::vector<std::unique_ptr<ThreadWorker>> m_workers;
+    std::vector<std::unique_ptr<std::thread>> m_ioThreads;
+    ThreadQueue<IoJob> m_ioQueue;
+    std::atomic<bool> m_active;
+
+    std::mutex m_poolMutex;
+    std::unique_ptr<TaskRecord[]> m_chunks[MaxTaskChunks];
+    std::atomic<int> m_chunkCount;
+    std::vector<unsigned> m_freeTasks;
+    std::atomic<int> m_liveTasks;
+
+    // sleeping workers and external waiters.
+    std::mutex m_wakeMutex;
+    std::condition_variable m_wakeCv;
+    std::atomic<int> m_queuedJobs;
+    std::atomic<int> m_sleepers;
+
+    std::mutex m_finishedMutex;
+    std::condition_variable m_finishedCv;
+    std::atomic<int> m_externalWaiters;
+
+    std::atomic<unsigned> m_nextWorker;
+    std::atomic<unsigned long long> m_tasksExecuted;
+    std::atomic<unsigned long long> m_tasksStolen;
+    std::atomic<unsigned long long> m_ioJobsExecuted;
 };
 
 }
@@ -0,0 +1,137 @@
+#include "ThreadUtils.h"
+#include <thread>
+
+#ifdef _WIN32
+#define WIN32_LEAN_AND_MEAN
+#include <windows.h>
+#else
+#include <sched.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <string.h>
+#endif
+
+namespace splatastic
+{
+
+namespace ThreadUtils
+{
+
+#ifdef _WIN32
+
+int availableCpuCount()
+{
+    DWORD_PTR processMask = 0, systemMask = 0;
+    if (!GetProcessAffinityMask(GetCurrentProcess(), &processMask, &systemMask) || processMask == 0)
+    {
+        int hwCount = (int)std::thread::hardware_concurrency();
+        return hwCount < 1 ? 1 : hwCount;
+    }
+
+    int count = 0;
+    for (; processMask != 0; processMask &= processMask - 1)
+        ++count;
+    return count;
+}
+
+bool pinCurrentThread(int cpuSlot)
+{
+    DWORD_PTR processMask = 0, systemMask = 0;
+    if (!GetProcessAffinityMask(GetCurrentProcess(), &processMask, &systemMask) || processMask == 0)
+        return false;
+
+    cpuSlot %= availableCpuCount();
+    for (int bit = 0; bit < (int)(sizeof(DWORD_PTR) * 8); ++bit)
+    {
+        DWORD_PTR cpuMask = (DWORD_PTR)1 << bit;
+        if ((processMask & cpuMask) != 0 && cpuSlot-- == 0)
+            return SetThreadAffinityMask(GetCurrentThread(), cpuMask) != 0;
+    }
+
+    return false;
+}
+
+#else
+
+static bool readCgroupValue(const char* path, long long& outValue)
+{
+    FILE* f = fopen(path, "r");
+    if (f == nullptr)
+        return false;
+    bool success = fscanf(f, "%lld", &outValue) == 1;
+    fclose(f);
+    return success;
+}
+
+// CPUs worth of CFS quota (ceil(quota / period)) of the process cgroup, 0 when unlimited or unknown.
+static int cgroupCpuQuota()
+{
+    long long quota = 0, period = 0;
+
+    // cgroup v2: "<quota> <period>", quota is "max" when unlimited.
+    if (FILE* f = fopen("/sys/fs/cgroup/cpu.max", "r"))
+    {
+        char quotaStr[32] = {};
+        bool success = fscanf(f, "%31s %lld", quotaStr, &period) == 2;
+        fclose(f);
+        if (!success || strcmp(quotaStr, "max") == 0 || sscanf(quotaStr, "%lld", &quota) != 1)
+            return 0;
+    }
+    // cgroup v1: quota is -1 when unlimited.
+    else if (!(readCgroupValue("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", quota) && readCgroupValue("/sys/fs/cgroup/cpu/cpu.cfs_period_us", period))
+          && !(readCgroupValue("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us", quota) && readCgroupValue("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us", period)))
+    {
+        return 0;
+    }
+
+    if (quota <= 0 || period <= 0)
+        return 0;
+    return (int)((quota + period - 1) / period);
+}
+
+int availableCpuCount()
+{
+    int count = 0;
+    cpu_set_t set;
+    CPU_ZERO(&set);
+    if (sched_getaffinity(0, sizeof(set), &set) != 0 || CPU_COUNT(&set) == 0)
+    {
+        int hwCount = (int)std::thread::hardware_concurrency();
+        count = hwCount < 1 ? 1 : hwCount;
+    }
+    else
+    {
+        count = CPU_COUNT(&set);
+    }
+
+    int quotaCount = cgroupCpuQuota();
+    return quotaCount > 0 && quotaCount < count ? quotaCount : count;
+}
+
+bool pinCurrentThread(int cpuSlot)
+{
+    cpu_set_t processSet;
+    CPU_ZERO(&processSet);
+    if (sched_getaffinity(0, sizeof(processSet), &processSet) != 0 || CPU_COUNT(&processSet) == 0)
+        return false;
+
+    cpuSlot %= CPU_COUNT(&processSet);
+    for (int cpu = 0; cpu < CPU_SETSIZE; ++cpu)
+    {
+        if (CPU_ISSET(cpu, &processSet) && cpuSlot-- == 0)
+        {
+            cpu_set_t threadSet;
+            CPU_ZERO(&threadSet);
+            CPU_SET(cpu, &threadSet);
+            return pthread_setaffinity_np(pthread_self(), sizeof(threadSet), &threadSet) == 0;
+        }
+    }
+
+    return false;
+}
+
+#endif
+
+}
+
+}
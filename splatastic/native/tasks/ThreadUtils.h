@@ -0,0 +1,15 @@
+#pragma once
+
+namespace splatastic
+{
+
+namespace ThreadUtils
+{
+    // Number of CPUs this process is allowed to run on (affinity mask, capped by the cgroup CPU quota on linux).
+    int availableCpuCount();
+
+    // Pins the calling thread to the n-th CPU of the process affinity mask (wrapping around).
+    bool pinCurrentThread(int cpuSlot);
+}
+
+}
@@ -3,6 +3,9 @@
 #include "TaskDefs.h"
 #include <memory>
 #include <functional>
+#include <deque>
+#include <mutex>
+#include <atomic>
 
 namespace std
 {
@@ -12,21 +15,38 @@ namespace std
 namespace splatastic
 {
 
-class ThreadWorkerQueue;
+class ThreadWorker;
 
-using OnTaskCompleteFn = std::function<void(Task)>;
+// Implemented by the owner of the workers (the task system).
+// Workers call back into it to find work and to sleep when there is none.
+class ThreadWorkerHost
+{
+public:
+    virtual ~ThreadWorkerHost() {}
+    virtual bool runSingleJob(ThreadWorker& worker) = 0;
+    virtual void idleWait(ThreadWorker& worker, const std::atomic<bool>* wakeFlag) = 0;
+    virtual void wakeWorkers() = 0;
+    virtual bool active() const = 0;
+
+    // Runs a blocking function outside of the compute workers, sets doneFlag when it returns.
+    virtual void runBlocking(const TaskBlockFn& fn, std::atomic<bool>* doneFlag) = 0;
+};
 
 class ThreadWorker
 {
 public:
     ThreadWorker();
     ~ThreadWorker();
-    
+
     void setId(int workerId) { m_workerId = workerId; }
-    void start(OnTaskCompleteFn onTaskCompleteFn = nullptr);
-    void schedule(TaskFn fn, TaskContext& payload);
-    bool stealJob(TaskFn& fn, TaskContext& payload);
-    void runInThread(TaskFn fn, TaskContext& payload);
+    int id() const { return m_workerId; }
+    void start(ThreadWorkerHost& host, int pinnedCpuSlot = -1);
+
+    // local deque. The owner pushes / pops from the back, other workers steal from the front.
+    void push(Task task);
+    bool pop(Task& task);
+    bool steal(Task& task);
+
     void signalStop();
     void join();
     int queueSize() const;
@@ -34,12 +54,12 @@ public:
     static ThreadWorker* getLocalThreadWorker();
 private:
     void run();
-    void auxLoop();
     std::thread* m_thread = nullptr;
-    ThreadWorkerQueue* m_queue = nullptr;
-    std::thread* m_auxThread = nullptr;
-    ThreadWorkerQueue* m_auxQueue = nullptr;
-    OnTaskCompleteFn m_onTaskCompleteFn = nullptr;
+    ThreadWorkerHost* m_host = nullptr;
+
+    mutable std::mutex m_dequeMutex;
+    std::deque<Task> m_deque;
+
     int m_activeDepth = 0;
     int m_workerId = -1;
 };
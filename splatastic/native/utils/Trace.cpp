@@ -0,0 +1,228 @@
+#include "Trace.h"
+#include <chrono>
+#include <mutex>
+#include <vector>
+#include <memory>
+#include <sstream>
+#include <stdio.h>
+#include <string.h>
+
+namespace splatastic
+{
+
+namespace Trace
+{
+
+std::atomic<bool> g_enabled(false);
+
+namespace
+{
+
+struct Event
+{
+    const char* category;
+    char label[MaxLabelLength];
+    unsigned long long beginNs;
+    unsigned long long endNs;
+    long long value;
+    bool instant;
+};
+
+// Each thread only appends to its own buffer, the mutex is only contended while dumping.
+struct ThreadBuffer
+{
+    std::mutex mutex;
+    std::vector<Event> events;
+    std::string name;
+    size_t droppedEvents = 0;
+    int tid = 0;
+};
+
+std::mutex g_buffersMutex;
+std::vector<std::unique_ptr<ThreadBuffer>> g_buffers;
+std::atomic<size_t> g_maxEventsPerThread(1 << 18);
+const auto g_epoch = std::chrono::steady_clock::now();
+
+thread_local ThreadBuffer* t_buffer = nullptr;
+
+ThreadBuffer& localBuffer()
+{
+    if (t_buffer == nullptr)
+    {
+        std::unique_lock<std::mutex> lock(g_buffersMutex);
+        g_buffers.push_back(std::make_unique<ThreadBuffer>());
+        t_buffer = g_buffers.back().get();
+        t_buffer->tid = (int)g_buffers.size();
+        t_buffer->name = "thread " + std::to_string(t_buffer->tid);
+    }
+    return *t_buffer;
+}
+
+void push(const char* category, const char* label, unsigned long long beginNs, unsigned long long endNs, long long value, bool instant)
+{
+    ThreadBuffer& buffer = localBuffer();
+    std::unique_lock<std::mutex> lock(buffer.mutex);
+    if (buffer.events.size() >= g_maxEventsPerThread)
+    {
+        ++buffer.droppedEvents;
+        return;
+    }
+
+    buffer.events.emplace_back();
+    Event& e = buffer.events.back();
+    e.category = category;
+    strncpy(e.label, label ? label : "", MaxLabelLength - 1);
+    e.label[MaxLabelLength - 1] = '\0';
+    e.beginNs = beginNs;
+    e.endNs = endNs;
+    e.value = value;
+    e.instant = instant;
+}
+
+void writeJsonString(std::ostream& out, const char* str)
+{
+    out << '"';
+    for (const char* c = str; *c; ++c)
+    {
+        if (*c == '"' || *c == '\\')
+            out << '\\' << *c;
+        else if ((unsigned char)*c < 0x20)
+            out << ' ';
+        else
+            out << *c;
+    }
+    out << '"';
+}
+
+}
+
+void setEnabled(bool enabled)
+{
+    g_enabled = enabled;
+}
+
+void setMaxEventsPerThread(size_t maxEvents)
+{
+    g_maxEventsPerThread = maxEvents;
+}
+
+void setThreadName(const std::string& name)
+{
+    ThreadBuffer& buffer = localBuffer();
+    std::unique_lock<std::mutex> lock(buffer.mutex);
+    buffer.name = name;
+}
+
+unsigned long long nowNs()
+{
+    // +1 so a valid timestamp is never 0 (Scope uses 0 as "disabled").
+    return (unsigned long long)std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - g_epoch).count() + 1ull;
+}
+
+void recordScope(const char* category, const char* label, unsigned long long beginNs, unsigned long long endNs, long long value)
+{
+    push(category, label, beginNs, endNs, value, false);
+}
+
+void recordInstant(const char* category, const char* label, long long value)
+{
+    unsigned long long ts = nowNs();
+    push(category, label, ts, ts, value, true);
+}
+
+bool dump(const char* path, size_t& outEventCount, std::string& outError)
+{
+    struct ThreadEvents
+    {
+        int tid;
+        std::string name;
+        std::vector<Event> events;
+    };
+
+    std::vector<ThreadEvents> threads;
+    {
+        std::unique_lock<std::mutex> lock(g_buffersMutex);
+        for (auto& buffer : g_buffers)
+        {
+            std::unique_lock<std::mutex> bufferLock(buffer->mutex);
+            threads.push_back({ buffer->tid, buffer->name, {} });
+            threads.back().events.swap(buffer->events);
+            buffer->droppedEvents = 0;
+        }
+    }
+
+    std::stringstream ss;
+    ss << "{\"displayTimeUnit\":\"ms\",\"traceEvents\":[\n";
+    ss << "{\"name\":\"process_name\",\"ph\":\"M\",\"pid\":1,\"tid\":0,\"args\":{\"name\":\"splatastic.native\"}}";
+    outEventCount = 0;
+    char timeStr[64];
+    for (const auto& t : threads)
+    {
+        ss << ",\n{\"name\":\"thread_name\",\"ph\":\"M\",\"pid\":1,\"tid\":" << t.tid << ",\"args\":{\"name\":";
+        writeJsonString(ss, t.name.c_str());
+        ss << "}}";
+        for (const Event& e : t.events)
+        {
+            ss << ",\n{\"name\":";
+            writeJsonString(ss, e.label);
+            ss << ",\"cat\":";
+            writeJsonString(ss, e.category);
+            snprintf(timeStr, sizeof(timeStr), "%.3f", (double)e.beginNs / 1000.0);
+            ss << ",\"pid\":1,\"tid\":" << t.tid << ",\"ts\":" << timeStr;
+            if (e.instant)
+            {
+                ss << ",\"ph\":\"i\",\"s\":\"t\"";
+            }
+            else
+            {
+                snprintf(timeStr, sizeof(timeStr), "%.3f", (double)(e.endNs - e.beginNs) / 1000.0);
+                ss << ",\"ph\":\"X\",\"dur\":" << timeStr;
+            }
+            ss << ",\"args\":{\"value\":" << e.value << "}}";
+        }
+        outEventCount += t.events.size();
+    }
+    ss << "\n]}\n";
+
+    FILE* f = fopen(path, "wb");
+    if (f == nullptr)
+    {
+        outError = std::string("Could not open trace file for writing: ") + path;
+        return false;
+    }
+
+    std::string json = ss.str();
+    bool success = fwrite(json.data(), 1, json.size(), f) == json.size();
+    fclose(f);
+    if (!success)
+        outError = std::string("Failed writing trace file: ") + path;
+    return success;
+}
+
+void clear()
+{
+    std::unique_lock<std::mutex> lock(g_buffersMutex);
+    for (auto& buffer : g_buffers)
+    {
+        std::unique_lock<std::mutex> bufferLock(buffer->mutex);
+        buffer->events.clear();
+        buffer->droppedEvents = 0;
+    }
+}
+
+void getStats(Stats& outStats)
+{
+    outStats = {};
+    std::unique_lock<std::mutex> lock(g_buffersMutex);
+    for (auto& buffer : g_buffers)
+    {
+        std::unique_lock<std::mutex> bufferLock(buffer->mutex);
+        outStats.events += buffer->events.size();
+        outStats.droppedEvents += buffer->droppedEvents;
+    }
+    outStats.threads = (int)g_buffers.size();
+}
+
+}
+
+}
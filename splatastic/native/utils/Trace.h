@@ -0,0 +1,86 @@
+#pragma once
+
+#include <atomic>
+#include <string>
+#include <stddef.h>
+
+// Chrome trace (chrome://tracing, perfetto) instrumentation of the native module.
+// Events are recorded into per thread buffers only while tracing is enabled at runtime,
+// building with SPT_TRACING=0 compiles every trace point out.
+#ifndef SPT_TRACING
+#define SPT_TRACING 1
+#endif
+
+namespace splatastic
+{
+
+namespace Trace
+{
+    enum : int { MaxLabelLength = 64 };
+
+    struct Stats
+    {
+        size_t events;
+        size_t droppedEvents;
+        int threads;
+    };
+
+    extern std::atomic<bool> g_enabled;
+    inline bool enabled() { return g_enabled.load(std::memory_order_relaxed); }
+    void setEnabled(bool enabled);
+
+    // events recorded per thread before new ones get dropped, until the next dump / clear.
+    void setMaxEventsPerThread(size_t maxEvents);
+
+    // names the calling thread in the trace (worker id, io thread...).
+    void setThreadName(const std::string& name);
+
+    unsigned long long nowNs();
+    void recordScope(const char* category, const char* label, unsigned long long beginNs, unsigned long long endNs, long long value);
+    void recordInstant(const char* category, const char* label, long long value);
+
+    // Writes all the recorded events as chrome trace json and clears them.
+    bool dump(const char* path, size_t& outEventCount, std::string& outError);
+    void clear();
+    void getStats(Stats& outStats);
+
+    class Scope
+    {
+    public:
+        Scope(const char* category, const char* label, long long value = 0)
+        : m_category(category), m_label(label), m_value(value), m_beginNs(enabled() ? nowNs() : 0ull)
+        {
+        }
+
+        ~Scope()
+        {
+            if (m_beginNs != 0ull)
+                recordScope(m_category, m_label, m_beginNs, nowNs(), m_value);
+        }
+
+        void setValue(long long value) { m_value = value; }
+
+    private:
+        const char* m_category;
+        const char* m_label;
+        long long m_value;
+        unsigned long long m_beginNs;
+    };
+}
+
+}
+
+#if SPT_TRACING
+#define SPT_TRACE_CONCAT_INNER(a, b) a##b
+#define SPT_TRACE_CONCAT(a, b) SPT_TRACE_CONCAT_INNER(a, b)
+#define SPT_TRACE_SCOPE(category, label) splatastic::Trace::Scope SPT_TRACE_CONCAT(sptTraceScope, __LINE__)(category, label)
+#define SPT_TRACE_SCOPE_VALUE(category, label, value) splatastic::Trace::Scope SPT_TRACE_CONCAT(sptTraceScope, __LINE__)(category, label, (long long)(value))
+#define SPT_TRACE_INSTANT(category, label, value) \
+    do { if (splatastic::Trace::enabled()) splatastic::Trace::recordInstant(category, label, (long long)(value)); } while (0)
+#define SPT_TRACE_THREAD_NAME(name) splatastic::Trace::setThreadName(name)
+#else
+#define SPT_TRACE_SCOPE(category, label)
+#define SPT_TRACE_SCOPE_VALUE(category, label, value)
+#define SPT_TRACE_INSTANT(category, label, value) do {} while (0)
+#define SPT_TRACE_THREAD_NAME(name)
+#endif
@@ -0,0 +1,194 @@
+import json
+import time
+import argparse
+import numpy as np
+from . import cpu_rasterizer
+
+# Tile occlusion culling with the previous frame's opaque depths.
+# While rastering a view, csRasterSplats records per coarse tile the depth at which every pixel of the tile is opaque
+# (transmittance below 1 - opacity). Next frame, csCoarseTileBin moves every splat back into the previous frame of
+# the view (previous view / projection matrices) and skips it, before it emits any tile record, when it sorted before the
+# opaque depth of every tile its bounds covered there, dilated by one tile. Each record of a tile list is blended over
+# the ones sorted before it, so a skipped splat would add less than 1 - opacity to any pixel of the previous frame.
+#
+# The camera moved since that frame, which is only safe while the motion is small:
+#  - the camera translation (parallax) is checked per tile: tiles whose opaque surface moved by more than the one tile
+#    dilation on screen (translation * focal length / depth > CoarseTileSize pixels) do not occlude.
+#  - rotations keep the occlusion of splats that stay in the view, rotating by more than max_rotation radians (camera
+#    cuts) falls back to no culling for the frame, as does a new view size or scene version.
+# Skipped splats behind a thin opaque layer can show up late by a frame when it opens, the opacity threshold bounds the
+# error of everything else.
+#
+# OcclusionHistory holds the previous frame of a view and applies these rules, for SplatRaster and for the cpu model
+# (simulate_occlusion) that runs the same culling on camera paths with the cpu_rasterizer reference.
+
+DefaultMaxRotation = 0.1
+
+def camera_motion(prev_view_matrix, view_matrix):
+    # (translation, rotation in radians) of the camera between two view matrices.
+    (prev_inv, inv) = (np.linalg.inv(prev_view_matrix), np.linalg.inv(view_matrix))
+    translation = float(np.linalg.norm(inv[0:3, 3] - prev_inv[0:3, 3]))
+    relative = np.asarray(view_matrix)[0:3, 0:3] @ prev_inv[0:3, 0:3]
+    rotation = float(np.arccos(np.clip((np.trace(relative) - 1.0) * 0.5, -1.0, 1.0)))
+    return (translation, rotation)
+
+def focal_pixels(proj_matrix, width, height):
+    return 0.5 * max(abs(float(proj_matrix[0, 0])) * width, abs(float(proj_matrix[1, 1])) * height)
+
+class OcclusionHistory:
+
+    def __init__(self):
+        self.m_prev = None
+        self.m_culling = False
+        self.m_parallax = 0.0
+        self.m_prev_matrices = (np.eye(4), np.eye(4))
+        self.m_stats = { "frames" : 0, "culling_frames" : 0, "fallbacks" : 0 }
+
+    # True when this frame culls with the previous opaque depths.
+    @property
+    def culling(self):
+        return self.m_culling
+
+    # camera translation since the previous frame * focal length in pixels.
+    @property
+    def parallax(self):
+        return self.m_parallax
+
+    # (view_matrix, proj_matrix) of the previous frame, the current ones when there is none.
+    @property
+    def prev_matrices(self):
+        return self.m_prev_matrices
+
+    @property
+    def stats(self):
+        return dict(self.m_stats)
+
+    def reset(self):
+        self.m_prev = None
+        self.m_culling = False
+
+    def advance(self, view_matrix, proj_matrix, width, height, scene_version = None, max_rotation = DefaultMaxRotation):
+        # once per frame of the view, before rastering it. Returns culling.
+        (view_matrix, proj_matrix) = (np.array(view_matrix, dtype = np.float64), np.array(proj_matrix, dtype = np.float64))
+        (self.m_culling, self.m_parallax, self.m_prev_matrices) = (False, 0.0, (view_matrix, proj_matrix))
+        if self.m_prev is not None:
+            (prev_view, prev_proj, prev_size, prev_version) = self.m_prev
+            (translation, rotation) = camera_motion(prev_view, view_matrix)
+            self.m_culling = prev_size == (width, height) and prev_version == scene_version and rotation <= max_rotation
+            self.m_parallax = translation * focal_pixels(prev_proj, width, height)
+            self.m_prev_matrices = (prev_view, prev_proj)
+            self.m_stats["fallbacks"] += 0 if self.m_culling else 1
+        self.m_prev = (view_matrix, proj_matrix, (width, height), scene_version)
+        self.m_stats["frames"] += 1
+        self.m_stats["culling_frames"] += 1 if self.m_culling else 0
+        return self.m_culling
+
+def simulate_occlusion(cloud, view_matrices, proj_matrices, width, height, opacity = cpu_rasterizer.DefaultOcclusionOpacity,
+    max_rotation = DefaultMaxRotation, reference = False, log = None):
+    # Runs the occlusion culling over a camera sequence with the cpu rasterizer: bins every frame, culls with the opaque
+    # depths of the previous one and records the new ones. With reference, also renders every frame without culling and
+    # reports the largest pixel difference. Returns (totals, per frame list of {culling, splats, records, culled_splats,
+    # culled_records[, max_error]}), splats / records are the ones emitted after culling.
+    history = OcclusionHistory()
+    tile_depths = None
+    frames = []
+    (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(width, height)
+    for (frame, (view_matrix, proj_matrix)) in enumerate(zip(view_matrices, proj_matrices)):
+        (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, width, height)
+        (unique_ids, record_splats) = np.unique(splat_ids, return_inverse = True)
+        occluded = np.zeros(unique_ids.shape[0], dtype = bool)
+        if history.advance(view_matrix, proj_matrix, width, height, max_rotation = max_rotation):
+            (prev_view, prev_proj) = history.prev_matrices
+            occluded = cpu_rasterizer.occluded_splats(cloud, unique_ids, prev_view, prev_proj, tile_depths, width, height, history.parallax)
+        keep = ~occluded[record_splats]
+
+        ordering = cpu_rasterizer.sort_records(keys[keep])
+        ranges = cpu_rasterizer.tile_list_ranges(keys[keep][ordering], tiles_x * tiles_y)
+        screen_data = cpu_rasterizer.preprocess(cloud, view_matrix, proj_matrix, width, height)
+        view_depths = np.abs(cpu_rasterizer.transform_points(view_matrix, cloud.positions)[:, 2])
+        tile_depths = cpu_rasterizer.tile_opaque_depths(screen_data, splat_ids[keep], ordering, ranges, view_depths, width, height, opacity)
+        result = {
+            "culling" : history.culling,
+            "splats" : int(unique_ids.shape[0] - occluded.sum()),
+            "records" : int(keep.sum()),
+            "culled_splats" : int(occluded.sum()),
+            "culled_records" : int((~keep).sum()) }
+        if reference:
+            image = cpu_rasterizer.raster(screen_data, splat_ids[keep], ordering, ranges, width, height)
+            full_ordering = cpu_rasterizer.sort_records(keys)
+            full_ranges = cpu_rasterizer.tile_list_ranges(keys[full_ordering], tiles_x * tiles_y)
+            full_image = cpu_rasterizer.raster(screen_data, splat_ids, full_ordering, full_ranges, width, height)
+            result["max_error"] = float(np.max(np.abs(image[:, :, 0:3] - full_image[:, :, 0:3])))
+        frames.append(result)
+        if log is not None:
+            log("frame %d: %d / %d records culled%s" % (frame, result["culled_records"], result["records"] + result["culled_records"],
+                "" if history.culling else " (no culling)"))
+
+    records = sum(f["records"] + f["culled_records"] for f in frames)
+    totals = dict(history.stats,
+        records = records,
+        culled_records = sum(f["culled_records"] for f in frames),
+        culled_splats = sum(f["culled_splats"] for f in frames),
+        culled_fraction = sum(f["culled_records"] for f in frames) / max(1, records))
+    if reference:
+        totals["max_error"] = max([f["max_error"] for f in frames], default = 0.0)
+    return (totals, frames)
+
+def load_camera_path(file_name, width, height):
+    # camera path json: {"positions" : [[x, y, z], ...], "rotations" : [[w, x, y, z], ...], "fovs" : [...] (optional)}
+    from . import camera
+    with open(file_name, "r") as f:
+        path = json.load(f)
+    positions = np.asarray(path["positions"], dtype = np.float64).reshape((-1, 3))
+    cameras = camera.CameraBatch(positions.shape[0], width, height)
+    cameras.positions[:] = positions
+    cameras.rotations[:] = np.asarray(path["rotations"], dtype = np.float64).reshape((-1, 4))
+    if "fovs" in path:
+        cameras.fovs[:] = path["fovs"]
+    return cameras
+
+def main(argv = None):
+    from . import native
+    from . import camera
+    from . import scene_loader
+    parser = argparse.ArgumentParser(prog = "python -m splatastic.occlusion", description = "Runs the tile occlusion culling on a camera path with the cpu rasterizer")
+    parser.add_argument("scene", help = "Scene file")
+    parser.add_argument("--path", default = None, help = "Camera path json (positions, rotations, optional fovs), an orbit around the scene if omitted")
+    parser.add_argument("--frames", type = int, default = 60, help = "Frames sampled along the path (spline through its cameras)")
+    parser.add_argument("--width", type = int, default = 256, help = "View width")
+    parser.add_argument("--height", type = int, default = 256, help = "View height")
+    parser.add_argument("--fov", type = float, default = 1.0, help = "Vertical fov (radians) of the orbit cameras")
+    parser.add_argument("--orbit-degrees", type = float, default = 30.0, help = "Arc of the orbit path")
+    parser.add_argument("--camera-distance", type = float, default = 0.75, help = "Orbit radius, relative to the scene bounds diagonal")
+    parser.add_argument("--opacity", type = float, default = cpu_rasterizer.DefaultOcclusionOpacity, help = "Opacity at which tiles record their opaque depth")
+    parser.add_argument("--max-rotation", type = float, default = DefaultMaxRotation, help = "Camera rotation (radians) per frame above which a frame does not cull")
+    parser.add_argument("--reference", action = "store_true", help = "Also renders every frame without culling and reports the largest pixel difference (slow)")
+    parser.add_argument("-o", "--output", default = None, help = "Writes the totals and per frame counters as json")
+    args = parser.parse_args(argv)
+
+    native.init()
+    scene = scene_loader.load_scene_blocking(args.scene, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(scene.host_payload, scene.stride // 4)
+    if args.path is not None:
+        keys = load_camera_path(args.path, args.width, args.height)
+    else:
+        bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+        (center, extent) = (0.5 * (bounds[0:3] + bounds[3:6]), float(np.linalg.norm(bounds[3:6] - bounds[0:3])))
+        angles = np.linspace(0.0, np.radians(args.orbit_degrees), 2)
+        keys = camera.CameraBatch(2, args.width, args.height, fov = args.fov)
+        keys.positions[:] = center + args.camera_distance * extent * np.stack([np.sin(angles), np.zeros(2), -np.cos(angles)], axis = 1)
+        keys.rotations[:] = np.stack([np.cos(-0.5 * angles), np.zeros(2), np.sin(-0.5 * angles), np.zeros(2)], axis = 1)
+    path = keys.interpolate(np.arange(len(keys)), np.linspace(0, len(keys) - 1, args.frames), mode = "spline") if len(keys) > 1 else keys
+
+    begin = time.perf_counter()
+    (totals, frames) = simulate_occlusion(cloud, path.view_matrices(), path.proj_matrices(), args.width, args.height, args.opacity,
+        args.max_rotation, args.reference, log = print)
+    totals["simulate_s"] = time.perf_counter() - begin
+    print(json.dumps(totals, indent = 1))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({ "totals" : totals, "frames" : frames }, f, indent = 1)
+    native.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import coalpy.gpu as g
 import math
 from . import debug_font
+from . import lazy_shader
 
 #enums, must match those in debug_cs.hlsl
 class OverlayFlags:
@@ -9,34 +10,33 @@ class OverlayFlags:
     SHOW_FINE_TILES = 1 << 1
 
 #font stuff
-g_overlay_shader = None
+g_overlay_shader = lazy_shader.LazyShader(file = "shaders/overlay_cs.hlsl", name = "main_overlay", main_function = "csMainOverlay")
 
-def init():
-    global g_overlay_shader
-    g_overlay_shader = g.Shader(file = "shaders/overlay_cs.hlsl", name = "main_overlay", main_function = "csMainOverlay")
-
-def render_overlay(cmd_list, rasterizer, color_buffer, output_texture, view_settings):
+# color_divider > 1: color_buffer was rendered at 1 / color_divider of the view size (progressive frames), it gets upscaled.
+def render_overlay(cmd_list, rasterizer, color_buffer, output_texture, view_settings, color_divider = 1):
 
     w = view_settings.width
     h = view_settings.height
-    (ct_x, ct_y) = rasterizer.get_coarse_tiles_dims(w, h)
+    (ct_x, ct_y) = rasterizer.get_coarse_tiles_dims(w // color_divider, h // color_divider)
+    tile_range_offset = rasterizer.get_view(view_settings.id).tile_range_offset
 
     cmd_list.begin_marker("overlay")
     overlay_flags = OverlayFlags.NONE
 
     cmd_list.dispatch(
-        shader = g_overlay_shader,
+        shader = g_overlay_shader.get(),
         constants = [
             int(w), int(h), ct_x, ct_y,
+            int(tile_range_offset), int(color_divider), 0, 0
         ],
 
         inputs = [
-            debug_font.font_texture,
-            rasterizer.m_coarse_tile_list_ranges,
+            debug_font.get_font_texture(),
+            rasterizer.coarse_tile_list_ranges,
             color_buffer
         ],
 
-        samplers = debug_font.font_sampler,
+        samplers = debug_font.get_font_sampler(),
 
         outputs = output_texture,
         x = math.ceil(w / 32),
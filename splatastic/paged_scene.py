@@ -0,0 +1,445 @@
+import sys
+import json
+import time
+import struct
+import argparse
+import numpy as np
+from . import native
+from . import scene_loader
+from . import resources
+
+# Out of core scenes: the payload is split into pages of PageSplats spatially close splats (morton order) stored in a
+# .spgs file, only the pages visible from the cameras are kept in a fixed size gpu pool.
+#
+# Paged scene file layout (little endian):
+#   header (HeaderSize bytes): magic, version, stride, page splats, page count, vertex count, page table offset, bounds (6 floats)
+#   page table: page count PageRecordType records (file offset, splat count, aabb)
+#   pages: page splats * stride bytes each, aligned to PageAlignment. The last page is padded with transparent splats.
+#
+# Pool slots hold one page each and are only rewritten when a new page is paged in, so a slot always holds a valid
+# page: the rasterizer draws the pool as a regular scene (vertex count = written slots * page splats) and evicted pages
+# keep rendering until their slot is overwritten.
+
+PagedMagic = b"SPLTPGS1"
+PagedVersion = 1
+HeaderFormat = "<8sIIIIQQ6f"
+HeaderSize = 128
+PageAlignment = 4096
+PagedFileExtension = ".spgs"
+PageSplats = 64 * 1024
+PageRecordType = np.dtype([("offset", np.uint64), ("splat_count", np.uint32), ("pad", np.uint32), ("aabb", np.float32, (6,))])
+
+# float offsets in a 3d gaussian splatting vertex, used for the conservative page bounds and padding splats.
+SplatOpacityOffset = scene_loader.GaussianSplatProperties.index("opacity")
+SplatScaleOffset = scene_loader.GaussianSplatProperties.index("scale_0")
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def _spread_bits(v):
+    # spreads the low 21 bits of v so there are 2 zero bits between each of them.
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    for (shift, mask) in [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f), (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)]:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def morton_codes(positions, bounds):
+    # 63 bit morton codes of (N, 3) positions quantized in bounds (min xyz, max xyz).
+    lo = np.asarray(bounds[0:3], dtype = np.float64)
+    extent = np.maximum(np.asarray(bounds[3:6], dtype = np.float64) - lo, 1e-20)
+    q = np.clip((positions - lo) / extent * float(0x1fffff), 0, 0x1fffff).astype(np.uint64)
+    return _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1)) | (_spread_bits(q[:, 2]) << np.uint64(2))
+
+def build_paged_scene(payload, stride, file_name, page_splats = PageSplats):
+    # writes a host payload (vertex count * stride bytes) as a paged scene file, returns the page count.
+    vertices = np.frombuffer(payload, dtype = np.uint8).reshape((-1, stride))
+    vertex_count = vertices.shape[0]
+    floats = vertices.view(np.float32)
+    positions = floats[:, 0:3].astype(np.float64)
+    bounds = np.concatenate([positions.min(axis = 0), positions.max(axis = 0)]) if vertex_count > 0 else np.zeros(6)
+    order = np.argsort(morton_codes(positions, bounds), kind = "stable")
+    is_splat_layout = stride == 4 * len(scene_loader.GaussianSplatProperties)
+
+    page_count = (vertex_count + page_splats - 1) // page_splats
+    page_bytes = page_splats * stride
+    table_offset = HeaderSize
+    first_page_offset = _align(table_offset + page_count * PageRecordType.itemsize, PageAlignment)
+    page_stride = _align(page_bytes, PageAlignment)
+    table = np.zeros(page_count, dtype = PageRecordType)
+    with open(file_name, "wb") as f:
+        f.truncate(first_page_offset + page_count * page_stride)
+        for page in range(page_count):
+            ids = order[page * page_splats : (page + 1) * page_splats]
+            page_vertices = vertices[ids]
+            page_positions = positions[ids]
+            # conservative bounds: 3 sigma of the largest splat axis around every position.
+            radius = 3.0 * np.exp(floats[ids, SplatScaleOffset:SplatScaleOffset + 3].max(axis = 1).astype(np.float64)) if is_splat_layout else np.zeros(ids.shape[0])
+            table[page] = (first_page_offset + page * page_stride, ids.shape[0], 0,
+                np.concatenate([(page_positions - radius[:, None]).min(axis = 0), (page_positions + radius[:, None]).max(axis = 0)]))
+            if ids.shape[0] < page_splats:
+                # pad with copies of the last splat made fully transparent, every page has page_splats splats.
+                padding = np.repeat(page_vertices[-1:], page_splats - ids.shape[0], axis = 0)
+                if is_splat_layout:
+                    padding.view(np.float32)[:, SplatOpacityOffset] = -1e4
+                page_vertices = np.concatenate([page_vertices, padding])
+            f.seek(table[page]["offset"])
+            f.write(page_vertices.tobytes())
+        f.seek(0)
+        f.write(struct.pack(HeaderFormat, PagedMagic, PagedVersion, stride, page_splats, page_count, vertex_count, table_offset, *[float(b) for b in bounds]).ljust(HeaderSize, b"\0"))
+        f.seek(table_offset)
+        f.write(table.tobytes())
+    return page_count
+
+class PagedSceneFile:
+
+    def __init__(self, file_name):
+        self.m_file_name = file_name
+        with open(file_name, "rb") as f:
+            (magic, version, self.m_stride, self.m_page_splats, page_count, self.m_vertex_count, table_offset, *bounds) = struct.unpack_from(HeaderFormat, f.read(HeaderSize))
+            if magic != PagedMagic or version != PagedVersion:
+                raise Exception("%s is not a paged scene file (version %d)." % (file_name, PagedVersion))
+            f.seek(table_offset)
+            self.m_table = np.frombuffer(f.read(page_count * PageRecordType.itemsize), dtype = PageRecordType)
+        self.m_bounds = tuple(bounds)
+
+    @property
+    def file_name(self):
+        return self.m_file_name
+
+    @property
+    def stride(self):
+        return self.m_stride
+
+    @property
+    def page_splats(self):
+        return self.m_page_splats
+
+    @property
+    def page_bytes(self):
+        return self.m_page_splats * self.m_stride
+
+    @property
+    def page_count(self):
+        return self.m_table.shape[0]
+
+    @property
+    def vertex_count(self):
+        return self.m_vertex_count
+
+    @property
+    def bounds(self):
+        return self.m_bounds
+
+    @property
+    def page_bounds(self):
+        return self.m_table["aabb"]
+
+    def read_pages(self, pages, outputs):
+        # reads pages into outputs (page_bytes writable buffers each) on the native io threads, returns a native.TaskFuture.
+        return native.read_file_ranges(file = self.m_file_name, offsets = [int(self.m_table[p]["offset"]) for p in pages], outputs = outputs)
+
+def visible_pages(page_bounds, view_proj):
+    # indices of the pages whose aabb intersects the frustum side planes and is in front of the camera.
+    # Depth range planes are skipped, so this works for both depth conventions.
+    m = np.asarray(view_proj, dtype = np.float64)
+    planes = np.stack([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3]])
+    lo = page_bounds[:, 0:3].astype(np.float64)
+    hi = page_bounds[:, 3:6].astype(np.float64)
+    # corner of each aabb furthest along every plane normal
+    corners = np.where(planes[None, :, 0:3] >= 0.0, hi[:, None, :], lo[:, None, :])
+    distances = np.einsum("npk,pk->np", corners, planes[:, 0:3]) + planes[None, :, 3]
+    return np.nonzero(np.all(distances >= 0.0, axis = 1))[0]
+
+# Which page lives in which pool slot, independent of the gpu so it can be simulated (see simulate_paging).
+# Every frame request() gets the visible pages, resident ones are hits and refresh their slot's last use, missing ones
+# are page faults: up to max_loads_per_frame of them (closest first if priorities are given) get a slot, first never
+# used slots then the least recently used slot whose page is not visible this frame. complete() marks a load as resident.
+class PagingPolicy:
+
+    def __init__(self, page_count, pool_pages, max_loads_per_frame = 8):
+        if pool_pages <= 0:
+            raise Exception("Page pool needs at least 1 page.")
+        self.m_page_slots = np.full(page_count, -1, dtype = np.int64)
+        self.m_slot_pages = np.full(pool_pages, -1, dtype = np.int64)
+        self.m_slot_last_use = np.full(pool_pages, -1, dtype = np.int64)
+        self.m_loading = {}
+        self.m_used_slots = 0
+        self.m_written_slots = 0
+        self.m_max_loads_per_frame = max_loads_per_frame
+        self.m_frame = 0
+        self.m_stats = { "frames" : 0, "visible" : 0, "hits" : 0, "faults" : 0, "loads_issued" : 0, "loads_completed" : 0,
+            "evictions" : 0, "deferred" : 0 }
+
+    @property
+    def pool_pages(self):
+        return self.m_slot_pages.shape[0]
+
+    @property
+    def used_slots(self):
+        # slots ever given to a page (loaded or loading).
+        return self.m_used_slots
+
+    @property
+    def written_slots(self):
+        # slots below this hold a complete page, the pool is drawn up to here.
+        return self.m_written_slots
+
+    @property
+    def page_slots(self):
+        # page -> slot, -1 for pages not resident (or still loading).
+        return self.m_page_slots
+
+    @property
+    def slot_pages(self):
+        return self.m_slot_pages
+
+    @property
+    def loading(self):
+        return len(self.m_loading)
+
+    @property
+    def resident_pages(self):
+        return int(np.count_nonzero(self.m_page_slots >= 0))
+
+    @property
+    def stats(self):
+        return dict(self.m_stats, resident_pages = self.resident_pages, loading = self.loading, used_slots = self.m_used_slots,
+            written_slots = self.m_written_slots, pool_pages = self.pool_pages)
+
+    def request(self, visible, priorities = None, max_loads = None):
+        # returns the new loads [(page, slot)] for this frame, max_loads further limits max_loads_per_frame.
+        visible = np.asarray(visible, dtype = np.int64)
+        if priorities is not None:
+            visible = visible[np.argsort(priorities, kind = "stable")]
+        self.m_frame += 1
+        self.m_stats["frames"] += 1
+        self.m_stats["visible"] += visible.shape[0]
+
+        slots = self.m_page_slots[visible]
+        self.m_slot_last_use[slots[slots >= 0]] = self.m_frame
+        self.m_stats["hits"] += int(np.count_nonzero(slots >= 0))
+        missing = [int(p) for p in visible[slots < 0] if int(p) not in self.m_loading]
+        self.m_stats["faults"] += len(missing)
+
+        loads = []
+        load_limit = self.m_max_loads_per_frame if max_loads is None else min(max_loads, self.m_max_loads_per_frame)
+        for page in missing[:load_limit]:
+            slot = self._acquire_slot()
+            if slot < 0:
+                break
+            loads.append((page, slot))
+        self.m_stats["deferred"] += len(missing) - len(loads)
+        self.m_stats["loads_issued"] += len(loads)
+        return loads
+
+    def _acquire_slot(self):
+        if self.m_used_slots < self.pool_pages:
+            self.m_used_slots += 1
+            slot = self.m_used_slots - 1
+        else:
+            # slots used this frame or already being loaded are not candidates.
+            candidates = np.nonzero(self.m_slot_last_use < self.m_frame)[0]
+            if candidates.shape[0] == 0:
+                return -1
+            slot = int(candidates[np.argmin(self.m_slot_last_use[candidates])])
+            evicted = self.m_slot_pages[slot]
+            if evicted >= 0:
+                self.m_page_slots[evicted] = -1
+                self.m_stats["evictions"] += 1
+        # evicted as soon as the load starts, the slot is written with the new page once the read finishes.
+        self.m_slot_pages[slot] = -1
+        self.m_slot_last_use[slot] = sys.maxsize
+        return slot
+
+    def begin_load(self, page, slot):
+        self.m_loading[page] = slot
+
+    def complete(self, page, slot):
+        self.m_loading.pop(page, None)
+        self.m_page_slots[page] = slot
+        self.m_slot_pages[slot] = page
+        self.m_slot_last_use[slot] = self.m_frame
+        self.m_written_slots = max(self.m_written_slots, slot + 1)
+        self.m_stats["loads_completed"] += 1
+
+def page_priorities(page_bounds, view_matrix):
+    # view space distance of each page center, closer pages get paged in first.
+    centers = 0.5 * (page_bounds[:, 0:3] + page_bounds[:, 3:6]).astype(np.float64)
+    view_pos = centers @ np.asarray(view_matrix, dtype = np.float64)[0:3, 0:3].T + np.asarray(view_matrix, dtype = np.float64)[0:3, 3]
+    return np.linalg.norm(view_pos, axis = 1)
+
+def simulate_paging(page_bounds, view_matrices, proj_matrices, pool_pages, max_loads_per_frame = 8, load_latency_frames = 2):
+    # Runs the paging policy over a camera sequence without gpu or file io, loads finish load_latency_frames later.
+    # Returns (totals, per frame list of {visible, resident_visible, faults, loads, evictions}).
+    policy = PagingPolicy(page_bounds.shape[0], pool_pages, max_loads_per_frame)
+    in_flight = []
+    frames = []
+    for (view_matrix, proj_matrix) in zip(view_matrices, proj_matrices):
+        finished = [l for l in in_flight if l[0] <= policy.m_frame]
+        in_flight = [l for l in in_flight if l[0] > policy.m_frame]
+        for (_, page, slot) in finished:
+            policy.complete(page, slot)
+        before = dict(policy.stats)
+        visible = visible_pages(page_bounds, proj_matrix @ view_matrix)
+        loads = policy.request(visible, page_priorities(page_bounds[visible], view_matrix))
+        for (page, slot) in loads:
+            policy.begin_load(page, slot)
+            in_flight.append((policy.m_frame + load_latency_frames, page, slot))
+        stats = policy.stats
+        frames.append({
+            "visible" : int(visible.shape[0]),
+            "resident_visible" : stats["hits"] - before["hits"],
+            "faults" : stats["faults"] - before["faults"],
+            "loads" : len(loads),
+            "evictions" : stats["evictions"] - before["evictions"] })
+    return (policy.stats, frames)
+
+# Gpu side of a paged scene: a pool buffer of pool_pages slots drawn as a regular scene and upload staging buffers
+# the native io threads read pages straight into. Page residency (page -> slot) is only tracked on the host, by the
+# PagingPolicy: the rasterizer draws every written slot and needs no page lookup.
+# Call update(views) once per frame with the (view_matrix, proj_matrix) of every camera, then render scene_data.
+class PagedScene:
+
+    def __init__(self, file_name, pool_bytes = 2 * 1024 * 1024 * 1024, max_loads_per_frame = 8):
+        import coalpy.gpu
+        self.m_file = PagedSceneFile(file_name)
+        page_bytes = self.m_file.page_bytes
+        pool_pages = max(1, min(int(pool_bytes // page_bytes), self.m_file.page_count))
+        self.m_policy = PagingPolicy(self.m_file.page_count, pool_pages, max_loads_per_frame)
+        self.m_pool = resources.buffer("paged_scene", "PagedScenePool", self,
+            type = coalpy.gpu.BufferType.Raw,
+            stride = 4,
+            element_count = pool_pages * page_bytes // 4,
+            mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
+        self.m_metadata = resources.buffer("paged_scene", "SceneMetadataBuffer", self,
+            type = coalpy.gpu.BufferType.Standard,
+            format = coalpy.gpu.Format.R32_UINT,
+            stride = 4,
+            element_count = 4,
+            mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
+        self.m_staging = resources.StagingRing("paged_scene", "PagedSceneStaging", self,
+            (resources.StagingReuseFrames + 1) * max_loads_per_frame, page_bytes)
+        # [(future, [(page, slot, staging)])]
+        self.m_reads = []
+        self.m_scene_data = scene_loader.SceneData(payload_buffer = self.m_pool, metadata_buffer = self.m_metadata,
+            vertex_count = 0, stride = self.m_file.stride, bounds = self.m_file.bounds)
+        self.m_bytes_paged_in = 0
+        self.m_drawn_slots = -1
+
+    @property
+    def file(self):
+        return self.m_file
+
+    @property
+    def policy(self):
+        return self.m_policy
+
+    @property
+    def scene_data(self):
+        return self.m_scene_data
+
+    @property
+    def pool_bytes(self):
+        return self.m_policy.pool_pages * self.m_file.page_bytes
+
+    @property
+    def stats(self):
+        return dict(self.m_policy.stats, page_count = self.m_file.page_count, page_bytes = self.m_file.page_bytes,
+            pool_bytes = self.pool_bytes, bytes_paged_in = self.m_bytes_paged_in, reads_in_flight = sum(len(r[1]) for r in self.m_reads))
+
+    def update(self, views):
+        import coalpy.gpu
+        self.m_staging.begin_frame()
+        cmd_list = coalpy.gpu.CommandList()
+        self._finish_reads(cmd_list)
+
+        visible = [visible_pages(self.m_file.page_bounds, proj_matrix @ view_matrix) for (view_matrix, proj_matrix) in views]
+        visible = np.unique(np.concatenate(visible)) if len(visible) > 0 else np.zeros(0, dtype = np.int64)
+        priorities = None
+        if len(views) > 0 and visible.shape[0] > 0:
+            priorities = np.min([page_priorities(self.m_file.page_bounds[visible], view_matrix) for (view_matrix, _) in views], axis = 0)
+        loads = self.m_policy.request(visible, priorities, max_loads = self.m_staging.free_count)
+        if len(loads) > 0:
+            staging = [self.m_staging.acquire() for _ in loads]
+            for (page, slot) in loads:
+                self.m_policy.begin_load(page, slot)
+            future = self.m_file.read_pages([page for (page, _) in loads], [s.mappedMemory() for s in staging])
+            self.m_reads.append((future, [(page, slot, s) for ((page, slot), s) in zip(loads, staging)]))
+
+        if self.m_drawn_slots != self.m_policy.written_slots:
+            self.m_drawn_slots = self.m_policy.written_slots
+            self.m_scene_data.vertex_count = self.m_drawn_slots * self.m_file.page_splats
+            cmd_list.upload_resource(source = [int(self.m_scene_data.vertex_count), int(self.m_file.stride), 0, 0], destination = self.m_metadata)
+        coalpy.gpu.schedule(cmd_list)
+        return self.m_scene_data
+
+    def _finish_reads(self, cmd_list):
+        page_bytes = self.m_file.page_bytes
+        while len(self.m_reads) > 0 and self.m_reads[0][0].is_ready():
+            (future, loads) = self.m_reads.pop(0)
+            for (page, slot, staging) in loads:
+                cmd_list.copy_resource(source = staging, destination = self.m_pool, source_offset = 0, destination_offset = slot * page_bytes, size = page_bytes)
+                self.m_policy.complete(page, slot)
+                self.m_staging.retire(staging)
+                self.m_bytes_paged_in += page_bytes
+            self.m_scene_data.touch()
+
+    def release(self):
+        for (future, _) in self.m_reads:
+            future.wait()
+        self.m_reads = []
+
+def _build(args):
+    native.init()
+    begin = time.perf_counter()
+    scene = scene_loader.load_scene_blocking(args.source, upload = False)
+    load_s = time.perf_counter() - begin
+    page_count = build_paged_scene(scene.host_payload, scene.stride, args.output, args.page_splats)
+    print("%s: %d splats, %d pages of %d splats, load %.2fs build %.2fs" % (
+        args.output, scene.vertex_count, page_count, args.page_splats, load_s, time.perf_counter() - begin - load_s))
+    native.shutdown()
+
+def _simulate(args):
+    from . import camera
+    paged_file = PagedSceneFile(args.scene)
+    bounds = np.array(paged_file.bounds)
+    (center, extent) = (0.5 * (bounds[0:3] + bounds[3:6]), float(np.linalg.norm(bounds[3:6] - bounds[0:3])))
+    # orbit around the scene at half its extent, looking at the center
+    keys = camera.CameraBatch(args.keys, 1920, 1080, fov = args.fov)
+    angles = np.linspace(0.0, 2.0 * np.pi, args.keys)
+    keys.positions[:] = center + 0.5 * extent * np.stack([np.sin(angles), np.zeros(args.keys), -np.cos(angles)], axis = 1)
+    keys.rotations[:] = np.stack([np.cos(-0.5 * angles), np.zeros(args.keys), np.sin(-0.5 * angles), np.zeros(args.keys)], axis = 1)
+    path = keys.interpolate(np.arange(args.keys), np.linspace(0, args.keys - 1, args.frames), mode = "spline")
+    (totals, frames) = simulate_paging(paged_file.page_bounds, path.view_matrices(), path.proj_matrices(), args.pool_pages,
+        args.max_loads_per_frame, args.load_latency_frames)
+    totals["fault_rate"] = totals["faults"] / max(1, totals["visible"])
+    totals["bytes_paged_in"] = totals["loads_completed"] * paged_file.page_bytes
+    print(json.dumps(totals, indent = 1))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({ "totals" : totals, "frames" : frames }, f, indent = 1)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m splatastic.paged_scene", description = "Builds and simulates out of core paged scenes")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    build = commands.add_parser("build", help = "Split a scene into spatial pages (.spgs)")
+    build.add_argument("source")
+    build.add_argument("output")
+    build.add_argument("--page-splats", type = int, default = PageSplats)
+    simulate = commands.add_parser("simulate", help = "Runs the paging policy on an orbit around the scene, no gpu needed")
+    simulate.add_argument("scene")
+    simulate.add_argument("--pool-pages", type = int, default = 64)
+    simulate.add_argument("--max-loads-per-frame", type = int, default = 8)
+    simulate.add_argument("--load-latency-frames", type = int, default = 2)
+    simulate.add_argument("--frames", type = int, default = 600)
+    simulate.add_argument("--keys", type = int, default = 9)
+    simulate.add_argument("--fov", type = float, default = 1.0)
+    simulate.add_argument("-o", "--output", default = None, help = "Writes the per frame statistics as json")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        _build(args)
+    else:
+        _simulate(args)
+
+if __name__ == "__main__":
+    main()
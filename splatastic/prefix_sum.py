@@ -1,27 +1,16 @@
 import coalpy.gpu as g
 from . import utilities as utils
+from . import lazy_shader
+from . import resources
 
 g_group_size = 128
-g_prefix_sum_group = None
-g_prefix_sum_group_exclusive = None
-g_prefix_sum_next_input = None
-g_prefix_sum_resolve_parent = None
-g_prefix_sum_resolve_parent_exclusive = None
+g_prefix_sum_group = lazy_shader.LazyShader(file = "prefix_sum.hlsl", main_function = "csPrefixSumOnGroup")
+g_prefix_sum_group_exclusive = lazy_shader.LazyShader(file = "prefix_sum.hlsl", main_function = "csPrefixSumOnGroup", defines = ["EXCLUSIVE_PREFIX"])
+g_prefix_sum_next_input = lazy_shader.LazyShader(file = "prefix_sum.hlsl", main_function = "csPrefixSumNextInput")
+g_prefix_sum_resolve_parent = lazy_shader.LazyShader(file = "prefix_sum.hlsl", main_function = "csPrefixSumResolveParent")
+g_prefix_sum_resolve_parent_exclusive = lazy_shader.LazyShader(file = "prefix_sum.hlsl", main_function = "csPrefixSumResolveParent", defines = ["EXCLUSIVE_PREFIX"])
 
-def init():
-    global g_prefix_sum_group
-    global g_prefix_sum_group_exclusive
-    global g_prefix_sum_next_input
-    global g_prefix_sum_resolve_parent
-    global g_prefix_sum_resolve_parent_exclusive
-
-    g_prefix_sum_group = g.Shader(file = "prefix_sum.hlsl", main_function = "csPrefixSumOnGroup")
-    g_prefix_sum_group_exclusive = g.Shader(file = "prefix_sum.hlsl", main_function = "csPrefixSumOnGroup", defines = ["EXCLUSIVE_PREFIX"])
-    g_prefix_sum_next_input = g.Shader(file = "prefix_sum.hlsl", main_function = "csPrefixSumNextInput")
-    g_prefix_sum_resolve_parent = g.Shader(file = "prefix_sum.hlsl", main_function = "csPrefixSumResolveParent")
-    g_prefix_sum_resolve_parent_exclusive = g.Shader(file = "prefix_sum.hlsl", main_function = "csPrefixSumResolveParent", defines = ["EXCLUSIVE_PREFIX"])
-
-def allocate_args(input_counts):
+def allocate_args(input_counts, lifetime = None):
     aligned_bin_count = utils.alignup(input_counts, g_group_size)
     reduction_count = 0
     c = input_counts
@@ -31,8 +20,8 @@ def allocate_args(input_counts):
         c = utils.divup(c, g_group_size)
         perform_reduction = c > 1
 
-    return (g.Buffer(name = "reductionBufferInput", element_count = aligned_bin_count, format = g.Format.R32_UINT),
-            g.Buffer(name = "reductionBufferOutput", element_count = reduction_count, format = g.Format.R32_UINT),
+    return (resources.buffer("prefix_sum", "reductionBufferInput", lifetime, element_count = aligned_bin_count, format = g.Format.R32_UINT),
+            resources.buffer("prefix_sum", "reductionBufferOutput", lifetime, element_count = reduction_count, format = g.Format.R32_UINT),
             input_counts)
 
 def run(cmd_list, input_buffer, prefix_sum_args, is_exclusive = False, input_counts = -1):
@@ -54,7 +43,7 @@ def run(cmd_list, input_buffer, prefix_sum_args, is_exclusive = False, input_cou
 
         cmd_list.dispatch(
             x = group_count, y = 1, z = 1,
-            shader = g_prefix_sum_group_exclusive if is_exclusive and iteration == 0 and group_count == 1 else g_prefix_sum_group,           
+            shader = (g_prefix_sum_group_exclusive if is_exclusive and iteration == 0 and group_count == 1 else g_prefix_sum_group).get(),           
             inputs = input_buffer if iteration == 0 else reduction_buffer_in,
             outputs = reduction_buffer_out,
             constants = [input_count, 0, output_offset, 0])
@@ -64,7 +53,7 @@ def run(cmd_list, input_buffer, prefix_sum_args, is_exclusive = False, input_cou
             next_group_count = utils.divup(group_count, g_group_size)
             cmd_list.dispatch(
                 x = next_group_count, y = 1, z = 1,
-                shader = g_prefix_sum_next_input,
+                shader = g_prefix_sum_next_input.get(),
                 inputs = reduction_buffer_out,
                 outputs = reduction_buffer_in,
                 constants = [0, output_offset, 0, 0])
@@ -80,14 +69,14 @@ def run(cmd_list, input_buffer, prefix_sum_args, is_exclusive = False, input_cou
         if i == len(pass_list) - 1 and is_exclusive:
             cmd_list.dispatch(
                 x = utils.divup(count, g_group_size), y = 1, z = 1,
-                shader = g_prefix_sum_resolve_parent_exclusive,
+                shader = g_prefix_sum_resolve_parent_exclusive.get(),
                 inputs = input_buffer,
                 outputs = reduction_buffer_out,
                 constants = const)
         else:
             cmd_list.dispatch(
                 x = utils.divup(count, g_group_size), y = 1, z = 1,
-                shader = g_prefix_sum_resolve_parent,
+                shader = g_prefix_sum_resolve_parent.get(),
                 outputs = reduction_buffer_out,
                 constants = const)
     return reduction_buffer_out
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from . import native
+from . import camera
+from . import scene_loader
+from . import scene_container
+from . import cpu_rasterizer
+
+# Offline pruning: scores every splat by how much it can show up in an image and keeps the best scoring ones.
+#  - without sample cameras the score is opacity * the area of the splat's largest ellipse section (world units),
+#    near transparent and tiny splats score lowest.
+#  - with sample cameras the score is the blend weight the splat adds over all the pixels of every camera (cpu
+#    rasterizer, cpu_rasterizer.splat_weights), splats that are never seen or always hidden score 0.
+# Removing a splat changes the image by at most its blend weight in every pixel it touches, so the weight removed,
+# averaged over all the sampled pixels, is the estimated image error of a threshold.
+
+# properties the reduced scene is written with, SplatCloud reads the same layout.
+Stride = 4 * len(scene_loader.GaussianSplatProperties)
+
+PlyHeaderBytes = 64 + 32 * len(scene_loader.GaussianSplatProperties)
+
+def heuristic_scores(cloud):
+    scales = np.sort(cloud.scales, axis=1)
+    return (cloud.alphas * scales[:, 1] * scales[:, 2]).astype(np.float32)
+
+def sample_cameras(bounds, count, width, height, fov = 1.0, distance = 0.75):
+    # orbit of count cameras around the scene bounds at distance * the bounds diagonal, looking at the center.
+    bounds = np.asarray(bounds, dtype = np.float64)
+    (center, extent) = (0.5 * (bounds[0:3] + bounds[3:6]), float(np.linalg.norm(bounds[3:6] - bounds[0:3])))
+    cameras = camera.CameraBatch(count, width, height, fov = fov)
+    angles = np.linspace(0.0, 2.0 * np.pi, count, endpoint = False)
+    cameras.positions[:] = center + distance * extent * np.stack([np.sin(angles), np.zeros(count), -np.cos(angles)], axis = 1)
+    cameras.rotations[:] = np.stack([np.cos(-0.5 * angles), np.zeros(count), np.sin(-0.5 * angles), np.zeros(count)], axis = 1)
+    return cameras
+
+def contribution_scores(cloud, cameras, log = None):
+    # returns (scores, sampled pixels): per splat blend weight summed over every pixel of every camera.
+    scores = np.zeros(cloud.vertex_count, dtype = np.float32)
+    (view_matrices, proj_matrices) = (cameras.view_matrices(), cameras.proj_matrices())
+    pixels = 0
+    for i in range(len(cameras)):
+        begin = time.perf_counter()
+        (width, height) = (int(cameras.ws[i]), int(cameras.hs[i]))
+        (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrices[i], proj_matrices[i], width, height)
+        ordering = cpu_rasterizer.sort_records(keys)
+        (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(width, height)
+        ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], tiles_x * tiles_y)
+        screen_data = cpu_rasterizer.preprocess(cloud, view_matrices[i], proj_matrices[i], width, height)
+        scores += cpu_rasterizer.splat_weights(screen_data, splat_ids, ordering, ranges, width, height, cloud.vertex_count)
+        pixels += width * height
+        if log is not None:
+            log("\tcamera %d / %d: %d records, %.2fs" % (i + 1, len(cameras), keys.shape[0], time.perf_counter() - begin))
+    return (scores, pixels)
+
+def score_splats(cloud, cameras = None, log = None):
+    # returns (scores, sampled pixels), sampled pixels is 0 for the heuristic scores.
+    heuristic = heuristic_scores(cloud)
+    if cameras is None or len(cameras) == 0:
+        return (heuristic, 0)
+    (scores, pixels) = contribution_scores(cloud, cameras, log)
+    # unseen splats still need an order between them, keep the visually larger ones first.
+    return (scores + heuristic / max(float(heuristic.max()), 1e-20) * 1e-6, pixels)
+
+def removed_error(sorted_scores, keep_counts, pixels):
+    # estimated image error (mean blend weight removed per sampled pixel) when keeping the keep_counts best splats.
+    # sorted_scores must be in decreasing order.
+    removed = np.concatenate([[0.0], np.cumsum(sorted_scores[::-1], dtype = np.float64)])
+    errors = removed[sorted_scores.shape[0] - np.asarray(keep_counts)]
+    return errors / pixels if pixels > 0 else errors / max(float(removed[-1]), 1e-20)
+
+def keep_count_for_error(sorted_scores, error_budget, pixels):
+    # smallest number of splats whose estimated error stays under error_budget.
+    counts = np.arange(sorted_scores.shape[0] + 1)
+    errors = removed_error(sorted_scores, counts, pixels)
+    return int(counts[np.argmax(errors <= error_budget)])
+
+def estimated_file_bytes(vertex_count, file_format = "ply"):
+    # containers are estimated uncompressed, their size depends on the data.
+    if file_format == "ply":
+        return PlyHeaderBytes + vertex_count * Stride
+    return scene_container.HeaderSize + vertex_count * Stride
+
+def measure_error(payload, keep, cameras):
+    # renders the full and pruned scenes with the cpu rasterizer, returns the rgb rmse over every camera.
+    (cloud, pruned) = (cpu_rasterizer.SplatCloud(payload), cpu_rasterizer.SplatCloud(np.ascontiguousarray(payload[keep])))
+    (view_matrices, proj_matrices) = (cameras.view_matrices(), cameras.proj_matrices())
+    squared = []
+    for i in range(len(cameras)):
+        (width, height) = (int(cameras.ws[i]), int(cameras.hs[i]))
+        full = cpu_rasterizer.render(cloud, view_matrices[i], proj_matrices[i], width, height)
+        reduced = cpu_rasterizer.render(pruned, view_matrices[i], proj_matrices[i], width, height)
+        squared.append(np.mean((full[:, :, 0:3] - reduced[:, :, 0:3]) ** 2))
+    return float(np.sqrt(np.mean(squared)))
+
+def prune_report(sorted_scores, keep_fractions, pixels, file_format = "ply"):
+    # one row per kept fraction: splat count, score threshold, file size and estimated error.
+    rows = []
+    vertex_count = sorted_scores.shape[0]
+    keep_counts = [int(round(f * vertex_count)) for f in keep_fractions]
+    errors = removed_error(sorted_scores, keep_counts, pixels)
+    for (fraction, count, error) in zip(keep_fractions, keep_counts, errors):
+        rows.append({
+            "keep_fraction" : float(fraction),
+            "splats" : count,
+            "threshold" : float(sorted_scores[count - 1]) if count > 0 else float("inf"),
+            "file_bytes" : estimated_file_bytes(count, file_format),
+            "estimated_error" : float(error) })
+    return rows
+
+def write_scene(file_name, payload):
+    # .splz files are written as compressed containers, anything else as ply.
+    vertex_count = payload.shape[0]
+    if file_name.lower().endswith(scene_container.ContainerFileExtension):
+        return scene_container.write_container(payload, Stride, file_name)["file_bytes"]
+    export = scene_loader.export_scene(file_name, payload, vertex_count)
+    export.resolve()
+    (status, msg) = export.status()
+    if status != scene_loader.ExportSuccessFinish:
+        raise Exception("Failed writing %s: %s" % (file_name, msg))
+    return os.path.getsize(file_name)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m splatastic.prune", description = "Removes the splats that contribute least to the image")
+    parser.add_argument("source", help = "Scene to prune (ply / splz)")
+    parser.add_argument("output", nargs = "?", default = None, help = "Reduced scene (.ply, or .splz for a compressed container), only the report if omitted")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--target-count", type = int, default = None, help = "Number of splats to keep")
+    target.add_argument("--keep-fraction", type = float, default = None, help = "Fraction of the splats to keep")
+    target.add_argument("--error-budget", type = float, default = None, help = "Keep the fewest splats whose estimated error stays under this")
+    parser.add_argument("--sample-cameras", type = int, default = 8, help = "Cameras orbiting the scene used for the contribution scores, 0 for opacity / scale scores only")
+    parser.add_argument("--width", type = int, default = 256, help = "Render width of the sample cameras")
+    parser.add_argument("--height", type = int, default = 256, help = "Render height of the sample cameras")
+    parser.add_argument("--fov", type = float, default = 1.0, help = "Vertical fov (radians) of the sample cameras")
+    parser.add_argument("--camera-distance", type = float, default = 0.75, help = "Orbit radius of the sample cameras, relative to the scene bounds diagonal")
+    parser.add_argument("--report-fractions", default = "1.0,0.9,0.75,0.5,0.25,0.1", help = "Comma separated kept fractions of the report")
+    parser.add_argument("--measure", action = "store_true", help = "Also renders every report row with the cpu rasterizer and reports the measured rmse (slow)")
+    parser.add_argument("-r", "--report", default = None, help = "Writes the report as json")
+    args = parser.parse_args(argv)
+
+    native.init()
+    begin = time.perf_counter()
+    scene = scene_loader.load_scene_blocking(args.source, upload = False)
+    if scene.stride != Stride:
+        raise Exception("Only 3d gaussian splatting scenes (stride %d) can be pruned, %s has a stride of %d." % (Stride, args.source, scene.stride))
+    payload = np.frombuffer(scene.host_payload, dtype = np.float32).reshape((-1, Stride // 4))
+    cloud = cpu_rasterizer.SplatCloud(payload)
+    print("%s: %d splats, loaded in %.2fs" % (args.source, cloud.vertex_count, time.perf_counter() - begin))
+
+    cameras = None
+    if args.sample_cameras > 0:
+        bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+        cameras = sample_cameras(bounds, args.sample_cameras, args.width, args.height, args.fov, args.camera_distance)
+    begin = time.perf_counter()
+    (scores, pixels) = score_splats(cloud, cameras, print)
+    order = np.argsort(-scores, kind = "stable")
+    sorted_scores = scores[order]
+    print("scored with %s in %.2fs" % ("%d sample cameras" % len(cameras) if pixels > 0 else "opacity and scale", time.perf_counter() - begin))
+
+    file_format = "splz" if args.output is not None and args.output.lower().endswith(scene_container.ContainerFileExtension) else "ply"
+    report = prune_report(sorted_scores, [float(f) for f in args.report_fractions.split(",") if f != ""], pixels, file_format)
+    if args.measure and cameras is not None:
+        for row in report:
+            row["measured_rmse"] = measure_error(payload, np.sort(order[:row["splats"]]), cameras)
+
+    keep_count = cloud.vertex_count
+    if args.target_count is not None:
+        keep_count = min(args.target_count, cloud.vertex_count)
+    elif args.keep_fraction is not None:
+        keep_count = int(round(args.keep_fraction * cloud.vertex_count))
+    elif args.error_budget is not None:
+        keep_count = keep_count_for_error(sorted_scores, args.error_budget, pixels)
+
+    error_name = "est. error" if pixels > 0 else "score removed"
+    print("{:>8} {:>10} {:>12} {:>12} {:>14}{}".format("keep", "splats", "threshold", "file MB", error_name, "  measured rmse" if args.measure and cameras is not None else ""))
+    for row in report:
+        print("{:>7.0f}% {:>10} {:>12.4g} {:>12.2f} {:>14.6f}{}".format(row["keep_fraction"] * 100.0, row["splats"], row["threshold"],
+            row["file_bytes"] / 1e6, row["estimated_error"], "  {:>13.6f}".format(row["measured_rmse"]) if "measured_rmse" in row else ""))
+
+    result = { "source" : args.source, "splats" : cloud.vertex_count, "sample_cameras" : 0 if cameras is None else len(cameras),
+        "sampled_pixels" : pixels, "rows" : report }
+    if args.output is not None:
+        keep = np.sort(order[:keep_count])
+        file_bytes = write_scene(args.output, np.ascontiguousarray(payload[keep]))
+        result["output"] = { "file" : args.output, "splats" : int(keep_count), "file_bytes" : int(file_bytes),
+            "estimated_error" : float(removed_error(sorted_scores, [keep_count], pixels)[0]) }
+        print("wrote %s: %d / %d splats (%.1f%%), %.2f MB, %s %.6f" % (args.output, keep_count, cloud.vertex_count,
+            100.0 * keep_count / max(1, cloud.vertex_count), file_bytes / 1e6, error_name, result["output"]["estimated_error"]))
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent = 1)
+    native.shutdown()
+
+if __name__ == "__main__":
+    main()
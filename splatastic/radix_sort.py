@@ -1,5 +1,7 @@
 import coalpy.gpu as g
 from . import utilities as utils
+from . import lazy_shader
+from . import resources
 
 g_group_size = 128
 g_batch_size = 1024
@@ -8,41 +10,29 @@ g_bytes_per_radix = int(g_bits_per_radix/8)
 g_radix_counts = int(1 << g_bits_per_radix)
 g_radix_iterations = int(32/g_bits_per_radix)
 
-g_write_indirect_args_shader = None
-g_count_scatter_shader = None
-g_prefix_count_table_shader = None
-g_prefix_global_table_shader = None
-g_scatter_output_shader = None
-
-def init():
-    global g_write_indirect_args_shader
-    global g_count_scatter_shader
-    global g_prefix_count_table_shader
-    global g_prefix_global_table_shader
-    global g_scatter_output_shader
-
-    g_write_indirect_args_shader = g.Shader(file = "shaders/radix_sort.hlsl", main_function = "csWriteIndirectArguments")
-    g_count_scatter_shader = g.Shader(file = "shaders/radix_sort.hlsl", main_function = "csCountScatterBuckets")
-    g_prefix_count_table_shader = g.Shader(file = "shaders/radix_sort.hlsl", main_function = "csPrefixCountTable", defines = ["GROUP_SIZE=256"])
-    g_prefix_global_table_shader = g.Shader(file = "shaders/radix_sort.hlsl", main_function = "csPrefixGlobalTable", defines = ["GROUP_SIZE=RADIX_COUNTS"])
-    g_scatter_output_shader = g.Shader(file = "shaders/radix_sort.hlsl", main_function = "csScatterOutput", defines=["GROUP_SIZE="+str(g_batch_size)])
+g_write_indirect_args_shader = lazy_shader.LazyShader(file = "shaders/radix_sort.hlsl", main_function = "csWriteIndirectArguments")
+g_count_scatter_shader = lazy_shader.LazyShader(file = "shaders/radix_sort.hlsl", main_function = "csCountScatterBuckets")
+g_prefix_count_table_shader = lazy_shader.LazyShader(file = "shaders/radix_sort.hlsl", main_function = "csPrefixCountTable", defines = ["GROUP_SIZE=256"])
+g_prefix_global_table_shader = lazy_shader.LazyShader(file = "shaders/radix_sort.hlsl", main_function = "csPrefixGlobalTable", defines = ["GROUP_SIZE=RADIX_COUNTS"])
+g_scatter_output_shader = lazy_shader.LazyShader(file = "shaders/radix_sort.hlsl", main_function = "csScatterOutput", defines=["GROUP_SIZE="+str(g_batch_size)])
 
 # Must match flags in radix_sort.hlsl 
 FLAGS_IS_FIRST_PASS = 1 << 0
 FLAGS_OUTPUT_ORDERING = 1 << 1
 
-def allocate_args(input_counts, output_ordering = False, is_indirect = False):
+def allocate_args(input_counts, output_ordering = False, is_indirect = False, lifetime = None):
+    # lifetime: object the buffers are accounted to (resources), usually the sort's owner.
     aligned_batch_count = utils.divup(input_counts, g_batch_size)
     count_table_count = aligned_batch_count * g_radix_counts
     return (
-        g.Buffer(name="localOffsetsBuffer", element_count = input_counts, format = g.Format.R32_UINT),
-        g.Buffer(name="pingBuffer", element_count = input_counts, format = g.Format.R32_UINT),
-        g.Buffer(name="pongBuffer", element_count = input_counts, format = g.Format.R32_UINT),
-        g.Buffer(name="countTableBatchPrefixBuffer", element_count = count_table_count, format = g.Format.R32_UINT),
-        g.Buffer(name="radixTotalCounts", element_count = g_radix_counts, format = g.Format.R32_UINT),
-        g.Buffer(name="countTableBuffer", element_count = count_table_count, format = g.Format.R32_UINT),
-        g.Buffer(name="sortConstants", element_count = 8, format = g.Format.R32_UINT, usage = g.BufferUsage.Constant),
-        g.Buffer(name="IndirectArgs", element_count = 4, format = g.Format.R32_UINT, usage = g.BufferUsage.IndirectArgs) if is_indirect else None,
+        resources.buffer("radix_sort", "localOffsetsBuffer", lifetime, element_count = input_counts, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "pingBuffer", lifetime, element_count = input_counts, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "pongBuffer", lifetime, element_count = input_counts, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "countTableBatchPrefixBuffer", lifetime, element_count = count_table_count, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "radixTotalCounts", lifetime, element_count = g_radix_counts, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "countTableBuffer", lifetime, element_count = count_table_count, format = g.Format.R32_UINT),
+        resources.buffer("radix_sort", "sortConstants", lifetime, element_count = 8, format = g.Format.R32_UINT, usage = g.BufferUsage.Constant),
+        resources.buffer("radix_sort", "IndirectArgs", lifetime, element_count = 4, format = g.Format.R32_UINT, usage = g.BufferUsage.IndirectArgs) if is_indirect else None,
         input_counts,
         output_ordering)
 
@@ -86,7 +76,7 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
     if indirect_args != None:
         cmd_list.dispatch(
             x = 1, y = 1, z = 1,
-            shader = g_write_indirect_args_shader,
+            shader = g_write_indirect_args_shader.get(),
             inputs = indirect_count_buffer,
             outputs = [ constant_buffer, indirect_args ])
 
@@ -122,7 +112,7 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
         if indirect_args == None:
             cmd_list.dispatch(
                 x = batch_counts, y = 1, z = 1,
-                shader = g_count_scatter_shader,
+                shader = g_count_scatter_shader.get(),
                 inputs = [ unsorted_buffer, input_ordering ],
                 outputs = [ local_offsets, count_table ],
                 constants = constant_buffer
@@ -130,7 +120,7 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
         else:
             cmd_list.dispatch(
                 indirect_args = indirect_args,
-                shader = g_count_scatter_shader,
+                shader = g_count_scatter_shader.get(),
                 inputs = [ unsorted_buffer, input_ordering ],
                 outputs = [ local_offsets, count_table ],
                 constants = constant_buffer
@@ -141,7 +131,7 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
         cmd_list.begin_marker("prefix_batch_table")
         cmd_list.dispatch(
             x = int(g_radix_counts), y = 1, z = 1,
-            shader = g_prefix_count_table_shader,
+            shader = g_prefix_count_table_shader.get(),
             inputs = count_table,
             outputs = [count_table_prefix, radix_total_counts],
             constants = constant_buffer
@@ -152,7 +142,7 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
         cmd_list.begin_marker("prefix_global_table")
         cmd_list.dispatch(
             x = 1, y = 1, z = 1,
-            shader = g_prefix_global_table_shader,
+            shader = g_prefix_global_table_shader.get(),
             inputs = radix_total_counts,
             outputs = global_table
         )
@@ -162,14 +152,14 @@ def run (cmd_list, input_buffer, sort_args, indirect_count_buffer = None):
         if indirect_args == None:
             cmd_list.dispatch(
                 x = batch_counts, y = 1, z = 1,
-                shader = g_scatter_output_shader,
+                shader = g_scatter_output_shader.get(),
                 inputs = [unsorted_buffer, input_ordering, local_offsets, count_table_prefix, global_table ],
                 outputs = tmp_output_buffer,
                 constants = constant_buffer)
         else:
             cmd_list.dispatch(
                 indirect_args = indirect_args,
-                shader = g_scatter_output_shader,
+                shader = g_scatter_output_shader.get(),
                 inputs = [unsorted_buffer, input_ordering, local_offsets, count_table_prefix, global_table ],
                 outputs = tmp_output_buffer,
                 constants = constant_buffer)
@@ -0,0 +1,202 @@
+import coalpy.gpu as g
+import numpy as np
+import time
+import concurrent.futures
+from . import resources
+from . import image_io
+
+# Ring of K gpu -> cpu readbacks, so every frame can be read back without waiting on the gpu.
+# Usage per frame:
+#   ring.copy(cmd_list, resource, ...) for every resource to read, g.schedule(cmd_list), ring.submit()
+# (or ring.capture(resource, ...) which records / schedules its own command list).
+# Each copy goes to one of slot_count staging resources, results are delivered in submission order from
+# poll() / submit() / flush(): into a preallocated destination array, to a callback(tag, array) and / or written
+# to an image file by a background thread pool. When all slots are in flight copy() blocks on the oldest one,
+# when the writers fall behind (more than max_pending_writes files queued) delivery blocks on the oldest write.
+
+class _Slot:
+
+    def __init__(self, index):
+        self.index = index
+        self.staging = None
+        self.staging_key = None
+        self.request = None
+        self.tag = None
+        self.shape = None
+        self.dtype = None
+        self.is_texture = False
+        self.destination = None
+        self.callback = None
+        self.file_name = None
+        self.crop = None
+
+class ReadbackRing:
+
+    def __init__(self, slot_count = 3, writer_threads = 2, max_pending_writes = 8, name = "Readback"):
+        if slot_count <= 0:
+            raise Exception("Readback ring needs at least 1 slot.")
+        self.m_name = name
+        self.m_free = [_Slot(i) for i in range(slot_count)]
+        self.m_recorded = []
+        self.m_in_flight = []
+        self.m_writer_threads = writer_threads
+        self.m_writers = None
+        self.m_max_pending_writes = max_pending_writes
+        self.m_pending_writes = []
+        self.m_stats = { "copies" : 0, "delivered" : 0, "bytes_read" : 0, "copy_stalls" : 0, "copy_stall_ms" : 0.0,
+            "written" : 0, "write_stalls" : 0, "write_stall_ms" : 0.0, "write_errors" : 0 }
+
+    @property
+    def slot_count(self):
+        return len(self.m_free) + len(self.m_recorded) + len(self.m_in_flight)
+
+    @property
+    def in_flight(self):
+        return len(self.m_recorded) + len(self.m_in_flight)
+
+    @property
+    def pending_writes(self):
+        return len(self.m_pending_writes)
+
+    @property
+    def stats(self):
+        return dict(self.m_stats, in_flight = self.in_flight, pending_writes = self.pending_writes)
+
+    def _acquire_slot(self):
+        if len(self.m_free) == 0:
+            if len(self.m_in_flight) == 0:
+                raise Exception("All readback slots are recorded but not submitted, call submit() after scheduling.")
+            # backpressure: the gpu (or the consumer) is behind, wait for the oldest readback.
+            begin = time.perf_counter()
+            self.m_in_flight[0].request.resolve()
+            self.m_stats["copy_stalls"] += 1
+            self.m_stats["copy_stall_ms"] += (time.perf_counter() - begin) * 1000.0
+            self._deliver(self.m_in_flight.pop(0))
+        return self.m_free.pop(0)
+
+    def copy(self, cmd_list, source, tag = None, callback = None, destination = None, file_name = None,
+             width = None, height = None, crop = None, element_count = None, dtype = np.uint32, texture_format = g.Format.RGBA_8_UNORM):
+        # Textures: width / height are the full size of source, delivered as (height, width, 4) uint8, or only the
+        # top left (crop height, crop width) corner (views render into oversized buffers).
+        # Buffers: pass element_count (32 bit elements), delivered as a 1d array of dtype.
+        is_texture = element_count is None
+        if is_texture and (width is None or height is None):
+            raise Exception("Texture readbacks need the width and height of the source.")
+        slot = self._acquire_slot()
+        key = (is_texture, width, height, element_count, texture_format)
+        if slot.staging_key != key:
+            if is_texture:
+                slot.staging = resources.texture("readback", self.m_name + "Staging" + str(slot.index), self, format = texture_format, width = width, height = height)
+            else:
+                slot.staging = resources.buffer("readback", self.m_name + "Staging" + str(slot.index), self, format = g.Format.R32_UINT, stride = 4, element_count = element_count)
+            slot.staging_key = key
+        cmd_list.copy_resource(source = source, destination = slot.staging)
+        (slot.tag, slot.callback, slot.destination, slot.file_name) = (tag, callback, destination, file_name)
+        (slot.is_texture, slot.dtype) = (is_texture, np.dtype(np.uint8 if is_texture else dtype))
+        slot.shape = (height, width, 4) if is_texture else (element_count,)
+        slot.crop = crop
+        self.m_recorded.append(slot)
+        self.m_stats["copies"] += 1
+        return slot.index
+
+    def copy_view(self, cmd_list, view, tag = None, callback = None, destination = None, file_name = None):
+        # reads back the rendered part of a splat_rasterizer.SplatRasterView color buffer.
+        (buffer_width, buffer_height) = view.color_buffer_size
+        return self.copy(cmd_list, view.color_buffer, tag, callback, destination, file_name,
+            width = buffer_width, height = buffer_height, crop = (view.height, view.width))
+
+    def submit(self):
+        # starts the downloads of everything copied since the last submit, call once the command lists are scheduled.
+        for slot in self.m_recorded:
+            slot.request = g.ResourceDownloadRequest(resource = slot.staging)
+            self.m_in_flight.append(slot)
+        self.m_recorded = []
+        self.poll()
+
+    def capture(self, source, **copy_args):
+        cmd_list = g.CommandList()
+        index = self.copy(cmd_list, source, **copy_args)
+        g.schedule(cmd_list)
+        self.submit()
+        return index
+
+    def poll(self):
+        # delivers finished readbacks in order, returns how many were delivered.
+        delivered = 0
+        while len(self.m_in_flight) > 0 and self.m_in_flight[0].request.is_ready():
+            self._deliver(self.m_in_flight.pop(0))
+            delivered += 1
+        self._retire_writes(wait = False)
+        return delivered
+
+    def flush(self):
+        # blocks until every readback is delivered and every image written.
+        if len(self.m_recorded) > 0:
+            self.submit()
+        while len(self.m_in_flight) > 0:
+            self.m_in_flight[0].request.resolve()
+            self._deliver(self.m_in_flight.pop(0))
+        while len(self.m_pending_writes) > 0:
+            self._retire_writes(wait = True)
+
+    def close(self):
+        self.flush()
+        if self.m_writers is not None:
+            self.m_writers.shutdown(wait = True)
+            self.m_writers = None
+
+    def _data(self, slot):
+        data = np.frombuffer(slot.request.data_as_bytearray(), dtype = np.uint8)
+        self.m_stats["bytes_read"] += data.shape[0]
+        if not slot.is_texture:
+            return data.view(slot.dtype)[:slot.shape[0]]
+        # texture rows can be padded to the api's row pitch alignment.
+        (height, width, channels) = slot.shape
+        row_pitch = slot.request.data_byte_row_pitch()
+        return data[:row_pitch * height].reshape((height, row_pitch))[:, :width * channels].reshape((height, width, channels))
+
+    def _deliver(self, slot):
+        array = self._data(slot)
+        if slot.crop is not None:
+            array = array[:slot.crop[0], :slot.crop[1]]
+        owned = slot.destination is None
+        if not owned:
+            slot.destination[...] = array
+            array = slot.destination
+        else:
+            array = array.copy()
+        (tag, callback, file_name) = (slot.tag, slot.callback, slot.file_name)
+        (slot.request, slot.destination, slot.callback, slot.tag) = (None, None, None, None)
+        self.m_free.append(slot)
+        self.m_stats["delivered"] += 1
+
+        if file_name is not None:
+            # preallocated destinations get reused by the caller, the writer needs its own copy.
+            self._write(file_name, array if owned and callback is None else array.copy())
+        if callback is not None:
+            callback(tag, array)
+
+    def _write(self, file_name, image):
+        if self.m_writers is None:
+            self.m_writers = concurrent.futures.ThreadPoolExecutor(max_workers = self.m_writer_threads, thread_name_prefix = self.m_name + "Writer")
+        if len(self.m_pending_writes) >= self.m_max_pending_writes:
+            begin = time.perf_counter()
+            self._retire_writes(wait = True)
+            self.m_stats["write_stalls"] += 1
+            self.m_stats["write_stall_ms"] += (time.perf_counter() - begin) * 1000.0
+        self.m_pending_writes.append((file_name, self.m_writers.submit(image_io.write_image, file_name, image)))
+
+    def _retire_writes(self, wait):
+        while len(self.m_pending_writes) > 0:
+            (file_name, future) = self.m_pending_writes[0]
+            if not wait and not future.done():
+                break
+            self.m_pending_writes.pop(0)
+            try:
+                future.result()
+                self.m_stats["written"] += 1
+            except Exception as e:
+                self.m_stats["write_errors"] += 1
+                print("Failed writing readback image %s: %s" % (file_name, str(e)))
+            if wait:
+                break
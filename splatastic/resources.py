@@ -0,0 +1,242 @@
+import csv
+import json
+import weakref
+import threading
+
+# Memory accounting of every gpu resource (and the large host allocations) splatastic creates.
+# Buffers and textures are created with resources.buffer() / resources.texture(): same arguments as
+# coalpy.gpu.Buffer / Texture plus the owner (subsystem) and optionally the object the resource lives as long as.
+# Host allocations are reported with track_host().
+#
+# Entries are keyed by (owner, name, lifetime object): creating a resource under the same key replaces the previous
+# entry, which is how the owners resize their resources. Entries with a lifetime object go away when it is collected,
+# release() drops one explicitly. Sizes are estimated from the element count / dimensions and format (no mips,
+# no driver padding).
+#
+# set_budget() makes the allocation that would go over the budget raise before the resource is created.
+#
+# coalpy.gpu is only imported by buffer() / texture() / StagingRing, host only tools can report host memory without it.
+
+Gpu = "gpu"
+Host = "host"
+Kinds = [Gpu, Host]
+
+FormatBytes = {
+    "R32_UINT" : 4, "R32_SINT" : 4, "R32_FLOAT" : 4,
+    "RG_32_UINT" : 8, "RG_32_SINT" : 8, "RG_32_FLOAT" : 8,
+    "RGBA_32_UINT" : 16, "RGBA_32_SINT" : 16, "RGBA_32_FLOAT" : 16,
+    "RGBA_16_FLOAT" : 8, "RGBA_8_UNORM" : 4, "BGRA_8_UNORM" : 4, "R8_UNORM" : 1 }
+
+# coalpy defaults when the arguments do not name a format.
+DefaultBufferFormatBytes = 16
+DefaultTextureFormatBytes = 4
+
+class _Entry:
+
+    def __init__(self, owner, name, kind, size_bytes):
+        self.owner = owner
+        self.name = name
+        self.kind = kind
+        self.size_bytes = int(size_bytes)
+        self.finalizer = None
+
+g_lock = threading.RLock()
+g_entries = {}
+g_owners = {}
+g_totals = { kind : { "current" : 0, "peak" : 0 } for kind in Kinds }
+g_budgets = { kind : None for kind in Kinds }
+g_format_bytes = None
+
+def _format_bytes(format, default):
+    global g_format_bytes
+    if format is None:
+        return default
+    if g_format_bytes is None:
+        import coalpy.gpu
+        g_format_bytes = { getattr(coalpy.gpu.Format, name) : size for (name, size) in FormatBytes.items() if hasattr(coalpy.gpu.Format, name) }
+    return g_format_bytes.get(format, default)
+
+def buffer_bytes(**buffer_args):
+    import coalpy.gpu
+    element_count = buffer_args.get("element_count", 1)
+    buffer_type = buffer_args.get("type", None)
+    if (buffer_type is not None and buffer_type != coalpy.gpu.BufferType.Standard) or ("format" not in buffer_args and "stride" in buffer_args):
+        return element_count * buffer_args.get("stride", 4)
+    return element_count * _format_bytes(buffer_args.get("format", None), DefaultBufferFormatBytes)
+
+def texture_bytes(**texture_args):
+    texels = texture_args.get("width", 1) * texture_args.get("height", 1) * texture_args.get("depth", 1)
+    return texels * _format_bytes(texture_args.get("format", None), DefaultTextureFormatBytes)
+
+def _owner_stats(owner):
+    if owner not in g_owners:
+        g_owners[owner] = { kind : { "current" : 0, "peak" : 0, "resources" : 0 } for kind in Kinds }
+    return g_owners[owner]
+
+def _key(owner, name, lifetime):
+    return (owner, name, None if lifetime is None else id(lifetime))
+
+def _remove(key, entry = None):
+    with g_lock:
+        current = g_entries.get(key)
+        if current is None or (entry is not None and current is not entry):
+            return
+        del g_entries[key]
+        if current.finalizer is not None:
+            current.finalizer.detach()
+        stats = _owner_stats(current.owner)[current.kind]
+        stats["current"] -= current.size_bytes
+        stats["resources"] -= 1
+        g_totals[current.kind]["current"] -= current.size_bytes
+
+def _largest_owners(kind, count = 3):
+    owners = sorted(g_owners.items(), key = lambda o : -o[1][kind]["current"])[:count]
+    return ", ".join("%s %.1f MB" % (owner, stats[kind]["current"] / (1024.0 * 1024.0)) for (owner, stats) in owners if stats[kind]["current"] > 0)
+
+def check_budget(owner, name, size_bytes, kind = Gpu, lifetime = None):
+    # raises if allocating size_bytes (replacing the current entry of the key, if any) would go over the budget.
+    with g_lock:
+        budget = g_budgets[kind]
+        if budget is None:
+            return
+        replaced = g_entries.get(_key(owner, name, lifetime))
+        total = g_totals[kind]["current"] + int(size_bytes) - (0 if replaced is None else replaced.size_bytes)
+        if total > budget:
+            raise Exception("Allocating %s (%s, %.1f MB) would use %.1f MB of %s memory, over the %.1f MB budget. Largest owners: %s." % (
+                name, owner, size_bytes / (1024.0 * 1024.0), total / (1024.0 * 1024.0), kind, budget / (1024.0 * 1024.0), _largest_owners(kind)))
+
+def track(owner, name, size_bytes, kind = Gpu, lifetime = None):
+    # records an allocation, replacing the previous entry of (owner, name, lifetime).
+    check_budget(owner, name, size_bytes, kind, lifetime)
+    key = _key(owner, name, lifetime)
+    entry = _Entry(owner, name, kind, size_bytes)
+    with g_lock:
+        _remove(key)
+        g_entries[key] = entry
+        stats = _owner_stats(owner)[kind]
+        stats["current"] += entry.size_bytes
+        stats["peak"] = max(stats["peak"], stats["current"])
+        stats["resources"] += 1
+        totals = g_totals[kind]
+        totals["current"] += entry.size_bytes
+        totals["peak"] = max(totals["peak"], totals["current"])
+        if lifetime is not None:
+            try:
+                entry.finalizer = weakref.finalize(lifetime, _remove, key, entry)
+            except TypeError:
+                pass
+    return entry
+
+def track_host(owner, name, array, lifetime = None):
+    return track(owner, name, 0 if array is None else int(array.nbytes), Host, lifetime)
+
+def release(owner, name, lifetime = None):
+    _remove(_key(owner, name, lifetime))
+
+def release_owner(owner, lifetime = None):
+    # drops every entry of owner, or only the ones living as long as lifetime.
+    with g_lock:
+        keys = [k for k in g_entries.keys() if k[0] == owner and (lifetime is None or k[2] == id(lifetime))]
+        for key in keys:
+            _remove(key)
+
+def buffer(owner, name, lifetime = None, **buffer_args):
+    import coalpy.gpu
+    check_budget(owner, name, buffer_bytes(**buffer_args), Gpu, lifetime)
+    resource = coalpy.gpu.Buffer(name = name, **buffer_args)
+    track(owner, name, buffer_bytes(**buffer_args), Gpu, lifetime)
+    return resource
+
+def texture(owner, name, lifetime = None, **texture_args):
+    import coalpy.gpu
+    check_budget(owner, name, texture_bytes(**texture_args), Gpu, lifetime)
+    resource = coalpy.gpu.Texture(name = name, **texture_args)
+    track(owner, name, texture_bytes(**texture_args), Gpu, lifetime)
+    return resource
+
+# frames an upload staging buffer waits after the copies reading it were scheduled before it is written again.
+StagingReuseFrames = 3
+
+class StagingRing:
+    # Upload staging buffers of size_bytes shared by the subsystems streaming data to the gpu. Call begin_frame() once
+    # per frame, acquire() a free buffer, write it and schedule its copies, then retire() it: it is free again
+    # reuse_frames frames later, once the gpu is done reading it.
+
+    def __init__(self, owner, name, lifetime, count, size_bytes, reuse_frames = StagingReuseFrames):
+        import coalpy.gpu
+        self.m_free = [buffer(owner, name + str(i), lifetime,
+            format = coalpy.gpu.Format.R32_UINT,
+            stride = 4,
+            element_count = size_bytes // 4,
+            mem_flags = coalpy.gpu.MemFlags.GpuRead,
+            usage = coalpy.gpu.BufferUsage.Upload) for i in range(count)]
+        # [(frame the staging buffer is free again, staging)]
+        self.m_retiring = []
+        self.m_reuse_frames = reuse_frames
+        self.m_frame = 0
+
+    @property
+    def free_count(self):
+        return len(self.m_free)
+
+    def begin_frame(self):
+        self.m_frame += 1
+        while len(self.m_retiring) > 0 and self.m_retiring[0][0] <= self.m_frame:
+            self.m_free.append(self.m_retiring.pop(0)[1])
+
+    def acquire(self):
+        return self.m_free.pop()
+
+    def retire(self, staging):
+        self.m_retiring.append((self.m_frame + self.m_reuse_frames, staging))
+
+def set_budget(budget_bytes, kind = Gpu):
+    # None removes the budget. Does not free anything, only the next allocations check it.
+    g_budgets[kind] = None if budget_bytes is None else int(budget_bytes)
+
+def budget(kind = Gpu):
+    return g_budgets[kind]
+
+def current_bytes(kind = Gpu):
+    return g_totals[kind]["current"]
+
+def peak_bytes(kind = Gpu):
+    return g_totals[kind]["peak"]
+
+def stats():
+    # {owner : {kind : {current, peak, resources}}}
+    with g_lock:
+        return { owner : { kind : dict(s) for (kind, s) in kinds.items() } for (owner, kinds) in g_owners.items() }
+
+def report():
+    with g_lock:
+        entries = sorted(g_entries.values(), key = lambda e : -e.size_bytes)
+        return {
+            "totals" : { kind : dict(g_totals[kind], budget = g_budgets[kind]) for kind in Kinds },
+            "owners" : stats(),
+            "resources" : [{ "owner" : e.owner, "name" : e.name, "kind" : e.kind, "bytes" : e.size_bytes } for e in entries] }
+
+def save_report(file_name):
+    # .json: totals, per owner current / peak and every live resource. Anything else: csv of the live resources.
+    memory_report = report()
+    if file_name.lower().endswith(".json"):
+        with open(file_name, "w") as f:
+            json.dump(memory_report, f, indent = 1)
+        return
+    with open(file_name, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["owner", "name", "kind", "bytes"])
+        for r in memory_report["resources"]:
+            writer.writerow([r["owner"], r["name"], r["kind"], r["bytes"]])
+
+def format_report():
+    lines = []
+    for kind in Kinds:
+        totals = g_totals[kind]
+        budget_str = "" if g_budgets[kind] is None else " of %.1f MB budget" % (g_budgets[kind] / (1024.0 * 1024.0))
+        lines.append("%s memory: %.1f MB, peak %.1f MB%s" % (kind, totals["current"] / (1024.0 * 1024.0), totals["peak"] / (1024.0 * 1024.0), budget_str))
+        for (owner, kinds) in sorted(stats().items(), key = lambda o : -o[1][kind]["peak"]):
+            if kinds[kind]["peak"] > 0:
+                lines.append("\t%-18s %10.1f MB  peak %10.1f MB  %d resources" % (owner, kinds[kind]["current"] / (1024.0 * 1024.0),
+                    kinds[kind]["peak"] / (1024.0 * 1024.0), kinds[kind]["resources"]))
+    return "\n".join(lines)
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import struct
+import hashlib
+import numpy as np
+from . import native
+
+# Persistent cache of parsed scenes. Each source file (keyed by absolute path) maps to one cache file holding
+# the gpu ready payload plus derived data, validated against the source size, mtime and a content hash.
+# A source whose mtime changed is only served again if its content hash still matches: by default a hash of
+# every byte. hash_mode = "sampled" only hashes a few MB (faster on multi GB scenes) and is opt-in, an in place
+# edit outside the sampled blocks keeps the sampled hash and serves the old payload.
+#
+# Cache file layout (little endian):
+#   header (HeaderSize bytes): magic, version, metadata json size, vertex count, stride, payload offset, payload size, bounds (6 floats)
+#   metadata json: source identity, property names and a "sections" table (name -> [offset, size]) for derived arrays
+#   payload: aligned to PageSize so it can be mmapped directly.
+
+CacheMagic = b"SPLTCCH1"
+CacheVersion = 1
+HeaderFormat = "<8sIIQQQQ6f"
+HeaderSize = 128
+PageSize = 4096
+IndexFileName = "index.json"
+CacheFileExtension = ".splc"
+
+# blocks hashed by the "sampled" hash mode: first / last HashEdgeBytes and HashSampleCount blocks in between.
+HashEdgeBytes = 1024 * 1024
+HashSampleBytes = 64 * 1024
+HashSampleCount = 16
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def content_hash(file_name, mode = "full"):
+    # "full" hashes every byte, "sampled" only reads a few MB so multi GB scenes can be validated quickly.
+    h = hashlib.blake2b(digest_size = 16)
+    file_size = os.path.getsize(file_name)
+    h.update(struct.pack("<Q", file_size))
+    with open(file_name, "rb") as f:
+        if mode == "full" or file_size <= 2 * HashEdgeBytes + HashSampleCount * HashSampleBytes:
+            for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+                h.update(block)
+        else:
+            offsets = [0, file_size - HashEdgeBytes]
+            stride = (file_size - 2 * HashEdgeBytes) // (HashSampleCount + 1)
+            for i in range(HashSampleCount):
+                offsets.insert(-1, HashEdgeBytes + (i + 1) * stride)
+            for offset in offsets:
+                f.seek(offset)
+                h.update(f.read(HashEdgeBytes if offset == 0 or offset == file_size - HashEdgeBytes else HashSampleBytes))
+    return h.hexdigest()
+
+class CacheEntry:
+
+    def __init__(self, file_name, vertex_count, stride, payload_offset, payload_size, bounds, metadata, payload):
+        self.file_name = file_name
+        self.vertex_count = vertex_count
+        self.stride = stride
+        self.payload_offset = payload_offset
+        self.payload_size = payload_size
+        self.bounds = bounds
+        self.metadata = metadata
+        self.payload = payload
+
+    def close(self):
+        # drops the mmap, must be called before the cache evicts / replaces the file (windows keeps it locked).
+        self.payload = None
+
+# A cache file being written. payload is a writable mmap the native loader copies the scene into.
+class PendingEntry:
+
+    def __init__(self, key, source, identity, tmp_file_name, vertex_count, stride, payload_size, properties):
+        self.key = key
+        self.source = source
+        self.identity = identity
+        self.tmp_file_name = tmp_file_name
+        self.vertex_count = vertex_count
+        self.stride = stride
+        self.payload_size = payload_size
+        self.properties = properties
+        self.sections = {}
+        self.metadata_size = len(self._metadata_json())
+        # room for the metadata to grow (sections) without moving the payload.
+        self.payload_offset = _align(HeaderSize + self.metadata_size + 1024, PageSize)
+        with open(tmp_file_name, "wb") as f:
+            f.truncate(self.payload_offset + payload_size)
+        self.payload = np.memmap(tmp_file_name, dtype = np.uint8, mode = "r+", offset = self.payload_offset, shape = (payload_size,))
+
+    def _metadata_json(self):
+        return json.dumps({
+            "source" : self.source,
+            "identity" : self.identity,
+            "properties" : self.properties,
+            "sections" : self.sections,
+            "created" : time.time() }).encode("utf-8")
+
+class SceneCache:
+
+    def __init__(self, directory, budget_bytes = 32 * 1024 * 1024 * 1024, hash_mode = "full"):
+        self.m_directory = os.path.abspath(directory)
+        self.m_budget_bytes = int(budget_bytes)
+        self.m_hash_mode = hash_mode
+        self.m_stats = { "hits" : 0, "misses" : 0, "stale" : 0, "evictions" : 0, "store_skipped" : 0, "bytes_read" : 0, "bytes_written" : 0 }
+        os.makedirs(self.m_directory, exist_ok = True)
+        self.m_index = self._load_index()
+
+    @property
+    def directory(self):
+        return self.m_directory
+
+    @property
+    def budget_bytes(self):
+        return self.m_budget_bytes
+
+    @budget_bytes.setter
+    def budget_bytes(self, value):
+        self.m_budget_bytes = int(value)
+        self.evict()
+
+    @property
+    def stats(self):
+        return dict(self.m_stats, entries = len(self.m_index["entries"]), total_bytes = self.total_bytes)
+
+    @property
+    def total_bytes(self):
+        return sum(e["bytes"] for e in self.m_index["entries"].values())
+
+    def entries(self):
+        return dict(self.m_index["entries"])
+
+    def _load_index(self):
+        index_file = os.path.join(self.m_directory, IndexFileName)
+        try:
+            with open(index_file, "r") as f:
+                index = json.load(f)
+            if index.get("version") == CacheVersion:
+                # drop entries whose cache file was deleted behind our back.
+                index["entries"] = { k : e for (k, e) in index["entries"].items() if os.path.exists(os.path.join(self.m_directory, e["file"])) }
+                return index
+        except Exception:
+            pass
+        return { "version" : CacheVersion, "entries" : {} }
+
+    def _save_index(self):
+        index_file = os.path.join(self.m_directory, IndexFileName)
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.m_index, f, indent = 1)
+        os.replace(tmp_file, index_file)
+
+    def _key(self, source):
+        return hashlib.blake2b(os.path.abspath(source).encode("utf-8"), digest_size = 16).hexdigest()
+
+    def _identity(self, source, with_hash):
+        st = os.stat(source)
+        identity = { "size" : st.st_size, "mtime_ns" : st.st_mtime_ns }
+        if with_hash:
+            identity["hash"] = content_hash(source, self.m_hash_mode)
+            identity["hash_mode"] = self.m_hash_mode
+        return identity
+
+    def _remove(self, key):
+        entry = self.m_index["entries"].pop(key, None)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.m_directory, entry["file"]))
+        except OSError:
+            pass
+
+    def lookup(self, source):
+        # returns a CacheEntry with the payload mmapped (read only), or None on a miss.
+        key = self._key(source)
+        entry = self.m_index["entries"].get(key)
+        if entry is None or not os.path.exists(source):
+            self.m_stats["misses"] += 1
+            return None
+
+        identity = self._identity(source, False)
+        if identity["size"] != entry["identity"]["size"]:
+            return self._stale(key)
+
+        if identity["mtime_ns"] != entry["identity"]["mtime_ns"]:
+            # touched but maybe not modified (copied, checked out again...), fall back to the content hash.
+            identity = self._identity(source, True)
+            if identity["hash"] != entry["identity"].get("hash") or identity["hash_mode"] != entry["identity"].get("hash_mode"):
+                return self._stale(key)
+            entry["identity"] = identity
+
+        cache_entry = self._open(os.path.join(self.m_directory, entry["file"]))
+        if cache_entry is None:
+            return self._stale(key)
+
+        entry["last_access"] = time.time()
+        self._save_index()
+        self.m_stats["hits"] += 1
+        self.m_stats["bytes_read"] += cache_entry.payload_size
+        return cache_entry
+
+    def _stale(self, key):
+        self._remove(key)
+        self._save_index()
+        self.m_stats["stale"] += 1
+        self.m_stats["misses"] += 1
+        return None
+
+    def _open(self, file_name):
+        try:
+            file_size = os.path.getsize(file_name)
+            with open(file_name, "rb") as f:
+                header = f.read(HeaderSize)
+                (magic, version, metadata_size, vertex_count, stride, payload_offset, payload_size, *bounds) = struct.unpack_from(HeaderFormat, header)
+                if magic != CacheMagic or version != CacheVersion or payload_offset + payload_size != file_size:
+                    return None
+                metadata = json.loads(f.read(metadata_size).decode("utf-8"))
+            payload = np.memmap(file_name, dtype = np.uint8, mode = "r", offset = payload_offset, shape = (payload_size,))
+            return CacheEntry(file_name, vertex_count, stride, payload_offset, payload_size, tuple(bounds), metadata, payload)
+        except Exception:
+            return None
+
+    def begin_store(self, source, vertex_count, stride, payload_size, properties = None):
+        # returns a PendingEntry to fill (entry.payload), or None if the scene does not fit in the budget.
+        if payload_size + PageSize > self.m_budget_bytes:
+            self.m_stats["store_skipped"] += 1
+            return None
+        key = self._key(source)
+        tmp_file_name = os.path.join(self.m_directory, key + CacheFileExtension + ".tmp")
+        return PendingEntry(key, os.path.abspath(source), self._identity(source, True), tmp_file_name, vertex_count, stride, payload_size, properties)
+
+    # seals a PendingEntry into the cache, returns it reopened as a read only CacheEntry.
+    def commit_store(self, pending, bounds = None, sections = None):
+        pending.payload.flush()
+        pending.payload = None
+        pending.sections = dict({ "payload" : [pending.payload_offset, pending.payload_size] }, **(sections or {}))
+        metadata = pending._metadata_json()
+        if HeaderSize + len(metadata) > pending.payload_offset:
+            raise Exception("Scene cache metadata does not fit before the payload.")
+
+        bounds = bounds if bounds is not None else (0.0,) * 6
+        header = struct.pack(HeaderFormat, CacheMagic, CacheVersion, len(metadata), pending.vertex_count, pending.stride,
+            pending.payload_offset, pending.payload_size, *[float(b) for b in bounds])
+        with open(pending.tmp_file_name, "r+b") as f:
+            f.write(header.ljust(HeaderSize, b"\0"))
+            f.write(metadata)
+
+        file_name = pending.key + CacheFileExtension
+        self._remove(pending.key)
+        os.replace(pending.tmp_file_name, os.path.join(self.m_directory, file_name))
+        self.m_index["entries"][pending.key] = {
+            "source" : pending.source,
+            "identity" : pending.identity,
+            "file" : file_name,
+            "bytes" : pending.payload_offset + pending.payload_size,
+            "last_access" : time.time() }
+        self.m_stats["bytes_written"] += pending.payload_offset + pending.payload_size
+        self.evict(keep = pending.key)
+        return self._open(os.path.join(self.m_directory, file_name))
+
+    def abort_store(self, pending):
+        pending.payload = None
+        try:
+            os.remove(pending.tmp_file_name)
+        except OSError:
+            pass
+
+    def evict(self, keep = None):
+        # least recently used entries go first until the cache fits in the budget.
+        entries = sorted(self.m_index["entries"].items(), key = lambda kv : kv[1]["last_access"])
+        total = self.total_bytes
+        for (key, entry) in entries:
+            if total <= self.m_budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["bytes"]
+            self._remove(key)
+            self.m_stats["evictions"] += 1
+        self._save_index()
+
+    def clear(self):
+        for key in list(self.m_index["entries"].keys()):
+            self._remove(key)
+        self._save_index()
+
+def compute_bounds(payload, stride):
+    # (min xyz, max xyz) of the splat positions, positions are the first 3 floats of every vertex.
+    bounds = np.zeros(6, dtype = np.float32)
+    if payload.shape[0] >= stride:
+        native.parallel_for("compute_aabb", inputs = [payload], outputs = [bounds], stride = stride)
+    return tuple(float(b) for b in bounds)
@@ -0,0 +1,218 @@
+import os
+import lzma
+import zlib
+import time
+import struct
+import argparse
+import concurrent.futures
+import numpy as np
+from . import native
+from . import scene_loader
+
+# Compressed scene containers (.splz): the payload split in chunks of chunk_splats splats, each chunk compressed on its
+# own so chunks decompress in parallel. Chunks are byte shuffled before compression (stored as stride planes holding
+# byte i of every splat), which groups the bytes of a property together: float payloads compress a lot better.
+#
+# Container file layout (little endian):
+#   header (HeaderSize bytes): magic, version, codec, flags, stride, vertex count, chunk splats, chunk count, index offset, payload size
+#   chunks: compressed bytes of each chunk, back to back
+#   chunk index: chunk count ChunkRecordType records (file offset, compressed size, splat count, codec) at index offset
+#
+# The native loader opens containers like ply files: SceneAsyncRequest(file = "a.splz") reads the file, then
+# request_copy_payload decompresses the chunks across the task system workers straight into the destination.
+# Codecs the native module was built without (native.container_codecs()) only decompress with read_container.
+
+ContainerMagic = b"SPLTCZ01"
+ContainerVersion = 1
+HeaderFormat = "<8sIIIIQIIQQ"
+HeaderSize = 64
+ContainerFileExtension = ".splz"
+ChunkSplats = 16 * 1024
+ChunkRecordType = np.dtype([("offset", np.uint64), ("compressed_size", np.uint64), ("splat_count", np.uint32), ("codec", np.uint32)])
+
+# must match native/scene/SceneContainer.h
+Codecs = { "none" : 0, "zlib" : 1, "lzma" : 2 }
+FlagShuffle = 1 << 0
+
+DefaultLevels = { "none" : 0, "zlib" : 6, "lzma" : 1 }
+
+def shuffle(chunk, stride):
+    return np.ascontiguousarray(np.frombuffer(chunk, dtype = np.uint8).reshape((-1, stride)).T)
+
+def unshuffle(data, stride):
+    return np.ascontiguousarray(np.frombuffer(data, dtype = np.uint8).reshape((stride, -1)).T)
+
+def compress_chunk(chunk, codec, level):
+    # returns (codec, bytes), chunks that do not get smaller are stored.
+    if codec == "zlib":
+        data = zlib.compress(chunk, level)
+    elif codec == "lzma":
+        data = lzma.compress(chunk, preset = level)
+    else:
+        data = bytes(chunk)
+    if len(data) >= memoryview(chunk).nbytes:
+        return (Codecs["none"], bytes(chunk))
+    return (Codecs[codec], data)
+
+def decompress_chunk(data, codec, raw_size):
+    if codec == Codecs["zlib"]:
+        raw = zlib.decompress(data)
+    elif codec == Codecs["lzma"]:
+        raw = lzma.decompress(data)
+    elif codec == Codecs["none"]:
+        raw = data
+    else:
+        raise Exception("Unknown container chunk codec %d." % codec)
+    if len(raw) != raw_size:
+        raise Exception("Corrupted container chunk.")
+    return raw
+
+def write_container(payload, stride, file_name, codec = "zlib", level = None, chunk_splats = ChunkSplats, shuffle_bytes = True, threads = None):
+    # writes a host payload (vertex count * stride bytes) as a compressed container, returns its stats.
+    # zlib and lzma release the gil, chunks compress in parallel on a thread pool.
+    if codec not in Codecs:
+        raise Exception("Unknown container codec %s, expected one of %s." % (codec, ", ".join(Codecs.keys())))
+    level = DefaultLevels[codec] if level is None else level
+    payload = np.frombuffer(payload, dtype = np.uint8)
+    if payload.shape[0] % stride != 0:
+        raise Exception("Payload size %d is not a multiple of the stride %d." % (payload.shape[0], stride))
+    vertex_count = payload.shape[0] // stride
+    chunk_bytes = chunk_splats * stride
+
+    def compress(begin):
+        chunk = payload[begin : begin + chunk_bytes]
+        return compress_chunk(shuffle(chunk, stride) if shuffle_bytes else chunk, codec, level)
+
+    begin_time = time.perf_counter()
+    index = np.zeros((vertex_count + chunk_splats - 1) // chunk_splats, dtype = ChunkRecordType)
+    with open(file_name, "wb") as f, concurrent.futures.ThreadPoolExecutor(max_workers = threads) as pool:
+        f.write(bytes(HeaderSize))
+        offset = HeaderSize
+        for (i, (chunk_codec, data)) in enumerate(pool.map(compress, range(0, payload.shape[0], chunk_bytes))):
+            index[i] = (offset, len(data), min(chunk_splats, vertex_count - i * chunk_splats), chunk_codec)
+            f.write(data)
+            offset += len(data)
+        f.write(index.tobytes())
+        f.seek(0)
+        f.write(struct.pack(HeaderFormat, ContainerMagic, ContainerVersion, Codecs[codec], FlagShuffle if shuffle_bytes else 0,
+            stride, vertex_count, chunk_splats, index.shape[0], offset, payload.shape[0]))
+    file_bytes = offset + index.nbytes
+    return {
+        "codec" : codec,
+        "level" : level,
+        "chunks" : int(index.shape[0]),
+        "raw_bytes" : int(payload.shape[0]),
+        "file_bytes" : int(file_bytes),
+        "ratio" : payload.shape[0] / max(1, file_bytes),
+        "compress_ms" : (time.perf_counter() - begin_time) * 1000.0 }
+
+class ContainerFile:
+
+    def __init__(self, file_name):
+        self.m_file_name = file_name
+        with open(file_name, "rb") as f:
+            (magic, version, codec, self.m_flags, self.m_stride, self.m_vertex_count, self.m_chunk_splats, chunk_count, index_offset, self.m_payload_size) = struct.unpack_from(HeaderFormat, f.read(HeaderSize))
+            if magic != ContainerMagic or version != ContainerVersion:
+                raise Exception("%s is not a compressed scene container (version %d)." % (file_name, ContainerVersion))
+            f.seek(index_offset)
+            self.m_index = np.frombuffer(f.read(chunk_count * ChunkRecordType.itemsize), dtype = ChunkRecordType)
+        self.m_codec = [name for (name, value) in Codecs.items() if value == codec][0]
+
+    @property
+    def file_name(self):
+        return self.m_file_name
+
+    @property
+    def codec(self):
+        return self.m_codec
+
+    @property
+    def stride(self):
+        return self.m_stride
+
+    @property
+    def vertex_count(self):
+        return self.m_vertex_count
+
+    @property
+    def chunk_splats(self):
+        return self.m_chunk_splats
+
+    @property
+    def chunk_count(self):
+        return self.m_index.shape[0]
+
+    @property
+    def payload_size(self):
+        return self.m_payload_size
+
+    @property
+    def shuffled(self):
+        return (self.m_flags & FlagShuffle) != 0
+
+    @property
+    def index(self):
+        return self.m_index
+
+    @property
+    def ratio(self):
+        return self.m_payload_size / max(1, os.path.getsize(self.m_file_name))
+
+def read_container(file_name, destination = None, threads = None):
+    # decompresses a container on a python thread pool (zlib / lzma release the gil), returns the payload as uint8.
+    # Only needed for codecs the native module was built without, scene_loader loads containers natively.
+    container = ContainerFile(file_name)
+    payload = np.zeros(container.payload_size, dtype = np.uint8) if destination is None else np.frombuffer(destination, dtype = np.uint8)
+    with open(file_name, "rb") as f:
+        data = f.read()
+    chunk_bytes = container.chunk_splats * container.stride
+
+    def decompress(i):
+        record = container.index[i]
+        raw_size = int(record["splat_count"]) * container.stride
+        raw = decompress_chunk(data[int(record["offset"]) : int(record["offset"] + record["compressed_size"])], int(record["codec"]), raw_size)
+        payload[i * chunk_bytes : i * chunk_bytes + raw_size] = unshuffle(raw, container.stride).ravel() if container.shuffled else np.frombuffer(raw, dtype = np.uint8)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = threads) as pool:
+        list(pool.map(decompress, range(container.chunk_count)))
+    return payload
+
+def _compress(args):
+    native.init()
+    begin = time.perf_counter()
+    scene = scene_loader.load_scene_blocking(args.source, upload = False)
+    load_s = time.perf_counter() - begin
+    stats = write_container(scene.host_payload, scene.stride, args.output, args.codec, args.level, args.chunk_splats, not args.no_shuffle, args.threads)
+    print("%s: %d splats, %d %s chunks, %.1f MB -> %.1f MB (ratio %.2f), load %.2fs compress %.2fs" % (
+        args.output, scene.vertex_count, stats["chunks"], stats["codec"], stats["raw_bytes"] / 1e6, stats["file_bytes"] / 1e6,
+        stats["ratio"], load_s, stats["compress_ms"] / 1000.0))
+    native.shutdown()
+
+def _info(args):
+    container = ContainerFile(args.container)
+    codecs = native.container_codecs()
+    print("%s: %d splats (stride %d), %d %s chunks of %d splats%s, ratio %.2f, native decompression %s" % (
+        container.file_name, container.vertex_count, container.stride, container.chunk_count, container.codec, container.chunk_splats,
+        ", byte shuffled" if container.shuffled else "", container.ratio, "yes" if codecs[container.codec] else "no"))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m splatastic.scene_container", description = "Writes and inspects compressed scene containers")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    compress = commands.add_parser("compress", help = "Compress a scene into a chunked container (.splz)")
+    compress.add_argument("source")
+    compress.add_argument("output")
+    compress.add_argument("--codec", default = "zlib", choices = list(Codecs.keys()))
+    compress.add_argument("--level", type = int, default = None, help = "Codec level, zlib 0-9 / lzma preset 0-9")
+    compress.add_argument("--chunk-splats", type = int, default = ChunkSplats)
+    compress.add_argument("--no-shuffle", action = "store_true", help = "Compress the splats as is, without byte shuffling")
+    compress.add_argument("-t", "--threads", type = int, default = None, help = "Compression threads, one per cpu by default")
+    info = commands.add_parser("info", help = "Print the layout of a container")
+    info.add_argument("container")
+    args = parser.parse_args(argv)
+    if args.command == "compress":
+        _compress(args)
+    else:
+        _info(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import numpy as np
+from . import scene_loader
+from . import scene_cache
+from . import resources
+
+# Editable scenes: a host mirror of the payload that edits (delete, move, recolor... a selection of splats) are applied
+# to as vectorized numpy operations, then only the changed splats are uploaded to the gpu payload buffer.
+#
+# EditablePayload is the host side (no gpu): the mirror, the edits and the dirty splat ranges. Dirty ranges are kept
+# sorted and merged, and coalesced into at most max_regions copy regions when uploaded (small gaps between ranges are
+# uploaded too, one bigger copy is cheaper than many small ones).
+# EditableScene owns the gpu buffers: update() once per frame copies the dirty ranges into a ring of upload staging
+# buffers and schedules their copies into the payload buffer, with at most the free staging memory uploaded per frame.
+#
+# Deleted splats are hidden in place (transparent and tiny, so they stay in the payload at the cost of one tile record)
+# and only removed by compact(), run lazily once they make up compact_fraction of the scene. Compaction moves every
+# splat after the first deleted one: it re-uploads that range and returns the row remap.
+
+# float offsets in a 3d gaussian splatting vertex.
+PositionOffset = scene_loader.GaussianSplatProperties.index("x")
+ColorOffset = scene_loader.GaussianSplatProperties.index("f_dc_0")
+OpacityOffset = scene_loader.GaussianSplatProperties.index("opacity")
+ScaleOffset = scene_loader.GaussianSplatProperties.index("scale_0")
+
+# opacity logit / log scale of deleted splats: sigmoid(DeletedOpacity) and exp(DeletedScale) are 0.
+DeletedOpacity = -1.0e4
+DeletedScale = -80.0
+
+DefaultMaxRegions = 64
+# gaps of up to MergeGapSplats clean splats between dirty ranges are uploaded with them.
+MergeGapSplats = 256
+DefaultCompactFraction = 0.25
+CompactBlockSplats = 64 * 1024
+
+StagingBytes = 8 * 1024 * 1024
+StagingBuffers = 2 * (resources.StagingReuseFrames + 1)
+
+def sorted_unique(indices):
+    # selections are already sorted and unique, only sort the ones that are not.
+    indices = np.asarray(indices, dtype = np.int64).reshape(-1)
+    if indices.shape[0] > 1 and not np.all(indices[1:] > indices[:-1]):
+        return np.unique(indices)
+    return indices
+
+def index_runs(indices):
+    # (begins, ends) of the runs of consecutive values in sorted unique indices.
+    indices = np.asarray(indices, dtype = np.int64)
+    if indices.shape[0] == 0:
+        return (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))
+    breaks = np.nonzero(np.diff(indices) != 1)[0] + 1
+    return (indices[np.concatenate([[0], breaks])], indices[np.concatenate([breaks - 1, [indices.shape[0] - 1]])] + 1)
+
+def merge_ranges(begins, ends, gap = 0):
+    # sorts [begin, end) ranges and merges the ones overlapping or closer than gap.
+    if begins.shape[0] == 0:
+        return (begins, ends)
+    order = np.argsort(begins, kind = "stable")
+    (begins, ends) = (begins[order], ends[order])
+    reach = np.maximum.accumulate(ends)
+    starts = np.nonzero(np.concatenate([[True], begins[1:] > reach[:-1] + gap]))[0]
+    return (begins[starts], np.maximum.reduceat(ends, starts))
+
+def coalesce_ranges(begins, ends, max_regions, gap = MergeGapSplats):
+    # merges sorted disjoint ranges into at most max_regions, closing the smallest gaps first.
+    (begins, ends) = merge_ranges(begins, ends, gap)
+    if begins.shape[0] <= max_regions:
+        return (begins, ends)
+    gaps = begins[1:] - ends[:-1]
+    # keep the max_regions - 1 largest gaps as region boundaries
+    splits = np.sort(np.argsort(-gaps, kind = "stable")[:max_regions - 1])
+    return (begins[np.concatenate([[0], splits + 1])], ends[np.concatenate([splits, [ends.shape[0] - 1]])])
+
+class DirtyRanges:
+
+    def __init__(self):
+        self.m_begins = np.zeros(0, dtype = np.int64)
+        self.m_ends = np.zeros(0, dtype = np.int64)
+
+    @property
+    def count(self):
+        return self.m_begins.shape[0]
+
+    @property
+    def splats(self):
+        return int(np.sum(self.m_ends - self.m_begins))
+
+    def ranges(self):
+        return (self.m_begins, self.m_ends)
+
+    def add_indices(self, indices):
+        (begins, ends) = index_runs(sorted_unique(indices))
+        self._add(begins, ends)
+
+    def add_range(self, begin, end):
+        if end > begin:
+            self._add(np.array([begin], dtype = np.int64), np.array([end], dtype = np.int64))
+
+    def _add(self, begins, ends):
+        (self.m_begins, self.m_ends) = merge_ranges(np.concatenate([self.m_begins, begins]), np.concatenate([self.m_ends, ends]))
+
+    def clip(self, vertex_count):
+        keep = self.m_begins < vertex_count
+        (self.m_begins, self.m_ends) = (self.m_begins[keep], np.minimum(self.m_ends[keep], vertex_count))
+
+    def take(self, max_regions, max_splats, gap = MergeGapSplats):
+        # removes and returns (begins, ends) of at most max_regions coalesced regions holding at most max_splats splats,
+        # the rest stays dirty.
+        if self.count == 0:
+            return (self.m_begins, self.m_ends)
+        (begins, ends) = coalesce_ranges(self.m_begins, self.m_ends, max_regions, gap)
+        sizes = np.cumsum(ends - begins)
+        count = int(np.searchsorted(sizes, max_splats, side = "right"))
+        (begins, ends) = (begins[:count + 1].copy(), ends[:count + 1].copy())
+        if count < begins.shape[0]:
+            # the first region that does not fit is split, its tail stays dirty
+            ends[count] = begins[count] + max_splats - (int(sizes[count - 1]) if count > 0 else 0)
+            if ends[count] <= begins[count]:
+                (begins, ends) = (begins[:count], ends[:count])
+        if begins.shape[0] > 0:
+            # the regions are a prefix of the dirty splats, everything before the last end is taken
+            keep = self.m_ends > ends[-1]
+            (self.m_begins, self.m_ends) = (np.maximum(self.m_begins[keep], ends[-1]), self.m_ends[keep])
+        return (begins, ends)
+
+    def clear(self):
+        self.m_begins = np.zeros(0, dtype = np.int64)
+        self.m_ends = np.zeros(0, dtype = np.int64)
+
+class EditablePayload:
+
+    def __init__(self, payload, stride, bounds = None, compact_fraction = DefaultCompactFraction):
+        # payload: vertex count * stride bytes, copied into the host mirror.
+        if stride % 4 != 0:
+            raise Exception("Editable scenes need a float payload, stride %d is not a multiple of 4." % stride)
+        self.m_stride = stride
+        self.m_vertices = np.array(np.frombuffer(payload, dtype = np.float32).reshape((-1, stride // 4)))
+        self.m_vertex_count = self.m_vertices.shape[0]
+        self.m_positions = np.ascontiguousarray(self.m_vertices[:, PositionOffset:PositionOffset + 3].T)
+        self.m_deleted = np.zeros(self.m_vertex_count, dtype = bool)
+        self.m_deleted_count = 0
+        self.m_dirty = DirtyRanges()
+        self.m_bounds = scene_cache.compute_bounds(self.payload, stride) if bounds is None else tuple(bounds)
+        self.m_compact_fraction = compact_fraction
+        resources.track_host("scene_edit", "HostMirror", self.m_vertices, self)
+        resources.track_host("scene_edit", "HostPositions", self.m_positions, self)
+        self.m_edits = 0
+        self.m_compactions = 0
+
+    @property
+    def stride(self):
+        return self.m_stride
+
+    @property
+    def vertex_count(self):
+        return self.m_vertex_count
+
+    @property
+    def vertices(self):
+        # (vertex count, stride / 4) float32 rows, direct writes must be followed by mark_dirty.
+        return self.m_vertices[:self.m_vertex_count]
+
+    @property
+    def payload(self):
+        return self.vertices.reshape(-1).view(np.uint8)
+
+    @property
+    def positions(self):
+        # (vertex count, 3), read only
+        return self.m_positions[:, :self.m_vertex_count].T
+
+    @property
+    def deleted(self):
+        return self.m_deleted[:self.m_vertex_count]
+
+    @property
+    def deleted_count(self):
+        return self.m_deleted_count
+
+    @property
+    def bounds(self):
+        return self.m_bounds
+
+    @property
+    def dirty(self):
+        return self.m_dirty
+
+    @property
+    def stats(self):
+        return {
+            "vertex_count" : self.m_vertex_count,
+            "deleted" : self.m_deleted_count,
+            "edits" : self.m_edits,
+            "compactions" : self.m_compactions,
+            "dirty_ranges" : self.m_dirty.count,
+            "dirty_splats" : self.m_dirty.splats }
+
+    def mark_dirty(self, indices, positions_changed = False):
+        if positions_changed:
+            self._refresh_positions(indices)
+        self.m_dirty.add_indices(indices)
+        self.m_edits += 1
+
+    # selections: sorted row indices of the live splats matching the test.
+    def select_box(self, box_min, box_max):
+        (x, y, z) = self._soa_positions()
+        inside = (x >= box_min[0]) & (x <= box_max[0]) & (y >= box_min[1]) & (y <= box_max[1]) & (z >= box_min[2]) & (z <= box_max[2])
+        return np.flatnonzero(inside & ~self.deleted)
+
+    def select_sphere(self, center, radius):
+        (x, y, z) = self._soa_positions()
+        (dx, dy, dz) = (x - np.float32(center[0]), y - np.float32(center[1]), z - np.float32(center[2]))
+        return np.flatnonzero((dx * dx + dy * dy + dz * dz <= np.float32(radius * radius)) & ~self.deleted)
+
+    def select_opacity_below(self, opacity):
+        logit = np.log(opacity / (1.0 - opacity)) if 0.0 < opacity < 1.0 else (np.inf if opacity >= 1.0 else -np.inf)
+        return np.flatnonzero((self.vertices[:, OpacityOffset] < logit) & ~self.deleted)
+
+    def _soa_positions(self):
+        # selections scan the positions as 3 contiguous arrays, reading them from the (vertex count, stride / 4) rows
+        # would touch every cache line of the mirror.
+        return self.m_positions[:, :self.m_vertex_count]
+
+    def _refresh_positions(self, indices):
+        self.m_positions[:, indices] = self.m_vertices[indices, PositionOffset:PositionOffset + 3].T
+
+    def write(self, indices, offset, values):
+        # writes float properties [offset, offset + width) of the selected splats, values broadcast to (len(indices), width).
+        values = np.asarray(values, dtype = np.float32)
+        width = 1 if values.ndim == 0 else values.shape[-1]
+        self.m_vertices[indices, offset:offset + width] = values.reshape((-1, width)) if values.ndim > 0 else values
+        self.mark_dirty(indices, offset < PositionOffset + 3 and offset + width > PositionOffset)
+
+    def translate(self, indices, offset):
+        moved = self.m_vertices[indices, PositionOffset:PositionOffset + 3] + np.asarray(offset, dtype = np.float32)
+        self.m_vertices[indices, PositionOffset:PositionOffset + 3] = moved
+        self.m_positions[:, indices] = moved.T
+        if moved.shape[0] > 0:
+            self.m_bounds = tuple(np.minimum(self.m_bounds[0:3], moved.min(axis = 0)).tolist() + np.maximum(self.m_bounds[3:6], moved.max(axis = 0)).tolist())
+        self.mark_dirty(indices)
+
+    def scale(self, indices, factor):
+        # scales are stored as logs
+        self.m_vertices[indices, ScaleOffset:ScaleOffset + 3] += np.log(np.asarray(factor, dtype = np.float32))
+        self.mark_dirty(indices)
+
+    def set_color(self, indices, rgb):
+        self.write(indices, ColorOffset, rgb)
+
+    def tint(self, indices, rgb):
+        self.m_vertices[indices, ColorOffset:ColorOffset + 3] *= np.asarray(rgb, dtype = np.float32)
+        self.mark_dirty(indices)
+
+    def set_opacity(self, indices, opacity):
+        opacity = np.clip(np.asarray(opacity, dtype = np.float32), 1e-6, 1.0 - 1e-6)
+        self.write(indices, OpacityOffset, np.log(opacity / (1.0 - opacity)))
+
+    def delete(self, indices):
+        # hides the splats, they are removed by the next compaction.
+        indices = sorted_unique(indices)
+        indices = indices[~self.m_deleted[indices]]
+        self.m_deleted[indices] = True
+        self.m_deleted_count += indices.shape[0]
+        self.m_vertices[indices, OpacityOffset] = DeletedOpacity
+        self.m_vertices[indices, ScaleOffset:ScaleOffset + 3] = DeletedScale
+        self.mark_dirty(indices)
+
+    def needs_compaction(self):
+        return self.m_deleted_count > 0 and self.m_deleted_count >= self.m_compact_fraction * self.m_vertex_count
+
+    def compact(self):
+        # removes the deleted splats, returns the remap (old row -> new row, -1 for deleted rows) or None if nothing was deleted.
+        if self.m_deleted_count == 0:
+            return None
+        deleted = self.deleted
+        remap = np.cumsum(~deleted) - 1
+        remap[deleted] = -1
+        first = int(np.argmax(deleted))
+        kept = self.m_vertex_count - self.m_deleted_count
+        # rows move down in place (a row is only written after it was read), in blocks so no copy of the mirror is made.
+        # rows before the first deleted one do not move.
+        write = first
+        for block_begin in range(first, self.m_vertex_count, CompactBlockSplats):
+            block_end = min(block_begin + CompactBlockSplats, self.m_vertex_count)
+            live = np.flatnonzero(~deleted[block_begin:block_end]) + block_begin
+            self.m_vertices[write:write + live.shape[0]] = self.m_vertices[live]
+            self.m_positions[:, write:write + live.shape[0]] = self.m_positions[:, live]
+            write += live.shape[0]
+        self.m_vertex_count = kept
+        self.m_deleted[:] = False
+        self.m_deleted_count = 0
+        self.m_dirty.clip(kept)
+        self.m_dirty.add_range(first, kept)
+        self.m_bounds = scene_cache.compute_bounds(self.payload, self.m_stride)
+        self.m_compactions += 1
+        return remap
+
+class EditableScene:
+
+    def __init__(self, payload, stride, bounds = None, compact_fraction = DefaultCompactFraction, max_regions = DefaultMaxRegions):
+        import coalpy.gpu
+        self.m_edit = EditablePayload(payload, stride, bounds, compact_fraction)
+        self.m_max_regions = max_regions
+        upload = scene_loader.PayloadUpload(self.m_edit.payload, self.m_edit.vertex_count, stride, self.m_edit.bounds)
+        upload.wait()
+        upload.update()
+        self.m_scene_data = upload.scene_data
+        self.m_staging = resources.StagingRing("scene_edit", "SceneEditStaging", self, StagingBuffers, StagingBytes)
+        self.m_uploaded_bytes = 0
+        self.m_copies = 0
+
+    @classmethod
+    def from_scene_data(cls, scene_data, **args):
+        # from a host only load (load_scene(..., upload = False)).
+        if scene_data.host_payload is None:
+            raise Exception("Editable scenes are created from a host payload, load the scene with upload = False.")
+        return cls(scene_data.host_payload, scene_data.stride, scene_data.bounds, **args)
+
+    @property
+    def edit(self):
+        return self.m_edit
+
+    @property
+    def scene_data(self):
+        return self.m_scene_data
+
+    @property
+    def stats(self):
+        return dict(self.m_edit.stats, uploaded_bytes = self.m_uploaded_bytes, copies = self.m_copies,
+            free_staging = self.m_staging.free_count)
+
+    def update(self):
+        # uploads the dirty ranges that fit in the free staging buffers, returns the remap of a compaction or None.
+        import coalpy.gpu
+        self.m_staging.begin_frame()
+
+        edit = self.m_edit
+        remap = edit.compact() if edit.needs_compaction() else None
+        cmd_list = coalpy.gpu.CommandList()
+        if remap is not None or edit.vertex_count != self.m_scene_data.vertex_count:
+            self.m_scene_data.vertex_count = edit.vertex_count
+            self.m_scene_data.bounds = edit.bounds
+            cmd_list.upload_resource(source = [int(edit.vertex_count), int(edit.stride), 0, 0], destination = self.m_scene_data.metadata_buffer)
+
+        stride = edit.stride
+        payload = edit.payload
+        copies = 0
+        while edit.dirty.count > 0 and self.m_staging.free_count > 0:
+            (begins, ends) = edit.dirty.take(self.m_max_regions - copies, StagingBytes // stride)
+            staging = self.m_staging.acquire()
+            memory = np.frombuffer(staging.mappedMemory(), dtype = np.uint8)
+            staging_offset = 0
+            for (begin, end) in zip(begins.tolist(), ends.tolist()):
+                size = (end - begin) * stride
+                memory[staging_offset : staging_offset + size] = payload[begin * stride : end * stride]
+                cmd_list.copy_resource(source = staging, destination = self.m_scene_data.payload_buffer,
+                    source_offset = staging_offset, destination_offset = begin * stride, size = size)
+                staging_offset += size
+            self.m_staging.retire(staging)
+            self.m_uploaded_bytes += staging_offset
+            copies += begins.shape[0]
+            if copies >= self.m_max_regions:
+                break
+
+        if copies > 0 or remap is not None:
+            coalpy.gpu.schedule(cmd_list)
+            self.m_copies += copies
+            self.m_scene_data.touch()
+        return remap
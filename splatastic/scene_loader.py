@@ -1,6 +1,10 @@
-from dataclasses import dataclass
+import asyncio
+import itertools
+import numpy as np
+from dataclasses import dataclass, field
 from . import native as n
-import coalpy.gpu
+from . import scene_cache
+from . import resources
 
 # must match SceneDb.h enums
 Opening = 0
@@ -10,28 +14,174 @@ InvalidHandle = 3
 SuccessFinish = 4
 Failed = 5
 
+# must match SceneDb.h SceneExportStatus
+ExportWriting = 0
+ExportInvalidHandle = 1
+ExportSuccessFinish = 2
+ExportFailed = 3
+
+# float properties of a vertex in a 3d gaussian splatting ply file, in payload order.
+GaussianSplatProperties = (
+    ["x", "y", "z", "nx", "ny", "nz"] +
+    ["f_dc_%d" % i for i in range(3)] +
+    ["f_rest_%d" % i for i in range(45)] +
+    ["opacity"] +
+    ["scale_%d" % i for i in range(3)] +
+    ["rot_%d" % i for i in range(4)])
+
+g_scene_versions = itertools.count(1)
+
+def next_scene_version():
+    return next(g_scene_versions)
+
 @dataclass
 class SceneData:
-    metadata_buffer : coalpy.gpu.Buffer = None
-    payload_buffer : coalpy.gpu.Buffer = None
+    metadata_buffer : "coalpy.gpu.Buffer" = None
+    payload_buffer : "coalpy.gpu.Buffer" = None
     vertex_count : int = 0
     stride : int = 0
+    bounds : tuple = None
+    # host copy of the payload, only set by loads that skip the gpu upload.
+    host_payload : object = None
+    # unique per scene and bumped by touch() when the contents change, renderers compare it to reuse results.
+    version : int = field(default_factory = next_scene_version)
+
+    def touch(self):
+        # call after changing the gpu contents in place: renderers caching results (idle frame skipping) must redraw.
+        self.version = next_scene_version()
+
+# coalpy.gpu is imported by the functions creating gpu objects only, so host only loads work without it.
+def create_scene_buffers(payload_size):
+    # returns (SceneData with the gpu payload buffer allocated, cpu writable upload buffer).
+    import coalpy.gpu
+    scene_data = SceneData()
+    upload_buffer = resources.buffer("scene_loader", "TmpWriteCombined", scene_data,
+        format = coalpy.gpu.Format.R32_UINT,
+        stride = 4,
+        element_count = int((payload_size + 3)/4),
+        mem_flags = coalpy.gpu.MemFlags.GpuRead,
+        usage = coalpy.gpu.BufferUsage.Upload)
+
+    scene_data.payload_buffer = resources.buffer("scene_loader", "ScenePayloadBuffer", scene_data,
+        type = coalpy.gpu.BufferType.Raw,
+        stride = 4,
+        element_count = int((payload_size + 3)/4),
+        mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
+    return (scene_data, upload_buffer)
+
+def schedule_scene_upload(scene_data, upload_buffer, metadata):
+    import coalpy.gpu
+    (scene_data.vertex_count, scene_data.stride) = metadata
+    cmd_list = coalpy.gpu.CommandList()
+    cmd_list.copy_resource(upload_buffer, scene_data.payload_buffer)
+
+    scene_data.metadata_buffer = resources.buffer("scene_loader", "SceneMetadataBuffer", scene_data,
+        type = coalpy.gpu.BufferType.Standard,
+        format = coalpy.gpu.Format.R32_UINT,
+        stride = 4,
+        element_count = 4,
+        mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
+    
+    cmd_list.upload_resource(
+        source = [(metadata[0]), int(metadata[1]), 0, 0],
+        destination = scene_data.metadata_buffer)
+    coalpy.gpu.schedule(cmd_list)
+    # the upload buffer is dropped by the caller once scheduled.
+    resources.release("scene_loader", "TmpWriteCombined", scene_data)
+
+# Uploads a payload already in host memory (numpy array, mmapped cache file...) into a new SceneData.
+# The host -> upload buffer copy runs on the native workers, poll update() until it returns True.
+class PayloadUpload:
+    def __init__(self, payload, vertex_count, stride, bounds = None):
+        (self.m_scene_data, self.m_upload_buffer) = create_scene_buffers(payload.nbytes)
+        self.m_scene_data.bounds = bounds
+        self.m_metadata = (vertex_count, stride)
+        self.m_copy_future = n.map_buffers("copy", inputs = [payload], outputs = [self.m_upload_buffer.mappedMemory()], grain_size = 64)
+
+    @property
+    def scene_data(self):
+        return self.m_scene_data
+
+    def update(self):
+        if self.m_copy_future is None:
+            return True
+        if not self.m_copy_future.is_ready():
+            return False
+        self.m_copy_future = None
+        schedule_scene_upload(self.m_scene_data, self.m_upload_buffer, self.m_metadata)
+        self.m_upload_buffer = None
+        return True
+
+    def wait(self):
+        # blocks (with the GIL released) until the host copy is done, update() then schedules the upload.
+        if self.m_copy_future is not None:
+            self.m_copy_future.wait()
 
 class Loader:
-    def __init__(self, file_name):
-        self.m_request = n.SceneAsyncRequest(file = file_name)
+    # cache is an optional scene_cache.SceneCache. Hits skip the ply parse and upload straight from the mmapped cache file,
+    # misses are parsed as usual and the payload is copied into a new cache entry on the way to the gpu.
+    def __init__(self, file_name, cache = None):
+        self.m_file_name = file_name
+        self.m_cache = cache
+        self.m_cache_entry = None if cache is None else cache.lookup(file_name)
+        self.m_pending_store = None
+        self.m_upload = None
+        self.m_request = None if self.m_cache_entry is not None else n.SceneAsyncRequest(file = file_name)
         self.m_gpu_upload_buffer = None
         self.m_payload_ready = False
         self.m_scene_data = None
+        self.m_from_cache = self.m_cache_entry is not None
 
     @property
     def scene_data(self):
         return self.m_scene_data
 
+    @property
+    def from_cache(self):
+        return self.m_from_cache
+
+    def _finish_upload(self, metadata):
+        schedule_scene_upload(self.m_scene_data, self.m_gpu_upload_buffer, metadata)
+        self.m_gpu_upload_buffer = None
+        self.m_payload_ready = True
+        return (SuccessFinish, 1.0, "Success")
+
+    def _update_cached_upload(self):
+        entry = self.m_cache_entry
+        if self.m_upload is None:
+            self.m_upload = PayloadUpload(entry.payload, entry.vertex_count, entry.stride, entry.bounds)
+            return (Reading, 1.0, "Uploading cached scene")
+
+        if not self.m_upload.update():
+            return (Reading, 1.0, "Uploading cached scene")
+
+        self.m_scene_data = self.m_upload.scene_data
+        self.m_upload = None
+        self.m_cache_entry = None
+        entry.close()
+        self.m_payload_ready = True
+        return (SuccessFinish, 1.0, "Success")
+
+    def _store_in_cache(self):
+        # the payload landed in the cache file, seal it and upload from the (now read only) cache entry.
+        pending = self.m_pending_store
+        self.m_pending_store = None
+        (vertex_count, stride) = self.m_request.metadata()
+        bounds = scene_cache.compute_bounds(pending.payload, stride)
+        self.m_request.close_copy_payload()
+        self.m_request = None
+        self.m_cache_entry = self.m_cache.commit_store(pending, bounds)
+        if self.m_cache_entry is None:
+            return (Failed, 0.0, "Could not reopen the scene cache entry")
+        return (Reading, 1.0, "Scene stored in cache")
+
     def update_load_status(self):
         if self.m_payload_ready:
             return (SuccessFinish, 1.0, "Success")
 
+        if self.m_cache_entry is not None:
+            return self._update_cached_upload()
+
         if self.m_request == None:
             return (Opening, 0.0, "")
 
@@ -40,56 +190,185 @@ class Loader:
             (bytes_read, total_bytes) = self.m_request.ioProgress()
             return (Reading, 0.0 if total_bytes == 0 else bytes_read/total_bytes, msg)
         elif status == Failed:
+            if self.m_pending_store is not None:
+                self.m_cache.abort_store(self.m_pending_store)
+                self.m_pending_store = None
             return (Failed, 0.0, msg)
         elif status == CopyingPayload:
             return (Reading, 1.0, "Copying payload to GPU write combined")
         elif status == SuccessFinish:
-            if self.m_gpu_upload_buffer is None:
-                self.m_scene_data = SceneData()
+            if self.m_pending_store is not None:
+                return self._store_in_cache()
+            elif self.m_gpu_upload_buffer is None:
                 payload_size = self.m_request.payload_size()
                 if payload_size == 0:
                     return (Failed, 0.0, "Payload size recovered from scene is 0")
 
-                self.m_gpu_upload_buffer = coalpy.gpu.Buffer(
-                    name="TmpWriteCombined",
-                    format = coalpy.gpu.Format.R32_UINT,
-                    stride = 4,
-                    element_count = int((payload_size + 3)/4),
-                    mem_flags = coalpy.gpu.MemFlags.GpuRead,
-                    usage = coalpy.gpu.BufferUsage.Upload)
+                if self.m_cache is not None:
+                    (vertex_count, stride) = self.m_request.metadata()
+                    properties = GaussianSplatProperties if stride == 4 * len(GaussianSplatProperties) else None
+                    self.m_pending_store = self.m_cache.begin_store(self.m_file_name, vertex_count, stride, payload_size, properties)
+                    if self.m_pending_store is not None:
+                        self.m_request.request_copy_payload(self.m_pending_store.payload)
+                        return (Reading, 1.0, "Copying payload to the scene cache")
 
+                (self.m_scene_data, self.m_gpu_upload_buffer) = create_scene_buffers(payload_size)
                 self.m_request.request_copy_payload(self.m_gpu_upload_buffer.mappedMemory())
-                self.m_scene_data.payload_buffer = coalpy.gpu.Buffer(
-                    name="ScenePayloadBuffer",
-                    type = coalpy.gpu.BufferType.Raw,
-                    stride = 4,
-                    element_count = int((payload_size + 3)/4),
-                    mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
                 return (Reading, 1.0, "")
             else:
                 self.m_request.close_copy_payload()
                 metadata = self.m_request.metadata()
-                (self.m_scene_data.vertex_count, self.m_scene_data.stride) = metadata
-
                 self.m_request = None
-                cmd_list = coalpy.gpu.CommandList()
-                cmd_list.copy_resource(self.m_gpu_upload_buffer, self.m_scene_data.payload_buffer)
-                self.m_gpu_upload_buffer = None
-
-                self.m_scene_data.metadata_buffer = coalpy.gpu.Buffer(
-                    name="SceneMetadataBuffer",
-                    type = coalpy.gpu.BufferType.Standard,
-                    format = coalpy.gpu.Format.R32_UINT,
-                    stride = 4,
-                    element_count = 4,
-                    mem_flags = coalpy.gpu.MemFlags.GpuRead | coalpy.gpu.MemFlags.GpuWrite)
-                
-                cmd_list.upload_resource(
-                    source = [(metadata[0]), int(metadata[1]), 0, 0],
-                    destination = self.m_scene_data.metadata_buffer)
-
-                self.m_payload_ready = True
-                coalpy.gpu.schedule(cmd_list)
-                return (SuccessFinish, 1.0, "Success")
+                return self._finish_upload(metadata)
 
         return (Failed, 0.0, "Unknown state")
+
+# Awaitable scene load. The native request reports its status changes through a callback, so waiting never polls:
+#   scene_data = await AsyncLoad(file_name)
+#   async for (status, progress, msg) in AsyncLoad(file_name).progress(): ...
+# Loads run concurrently (asyncio.gather), up to the native limit of 8 scenes in flight.
+# upload = False skips the gpu, the payload is returned in SceneData.host_payload instead.
+class AsyncLoad:
+
+    def __init__(self, file_name, cache = None, upload = True):
+        self.m_file_name = file_name
+        self.m_cache = cache
+        self.m_upload = upload
+        self.m_request = None
+        self.m_task = None
+        self.m_status = (Opening, 0.0, "")
+        self.m_from_cache = False
+
+    @property
+    def file_name(self):
+        return self.m_file_name
+
+    @property
+    def from_cache(self):
+        return self.m_from_cache
+
+    @property
+    def status(self):
+        # (status, progress, message), same values as Loader.update_load_status
+        if self.m_request is not None and self.m_status[0] == Reading:
+            (bytes_read, total_bytes) = self.m_request.ioProgress()
+            if total_bytes > 0:
+                self.m_status = (Reading, bytes_read / total_bytes, self.m_status[2])
+        return self.m_status
+
+    def start(self):
+        # the load starts on the first await / start / progress call, must be called within a running event loop.
+        if self.m_task is None:
+            self.m_task = asyncio.ensure_future(self._load())
+        return self.m_task
+
+    def __await__(self):
+        return self.start().__await__()
+
+    async def progress(self, interval = 0.1):
+        # yields the status every interval seconds (and once when the load finishes) until the load is done.
+        task = self.start()
+        while not task.done():
+            yield self.status
+            await asyncio.wait({ task }, timeout = interval)
+        yield self.status
+
+    async def _wait_request(self, changed):
+        # waits until the request leaves Reading / CopyingPayload. changed is set by the native status callback.
+        while True:
+            changed.clear()
+            (status, msg) = self.m_request.status()
+            if status in (SuccessFinish, Failed, InvalidHandle):
+                return (status, msg)
+            await changed.wait()
+
+    async def _load(self):
+        entry = None if self.m_cache is None else self.m_cache.lookup(self.m_file_name)
+        if entry is not None:
+            self.m_from_cache = True
+            return await self._finish(entry.payload, entry.vertex_count, entry.stride, entry.bounds)
+
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        self.m_status = (Reading, 0.0, "")
+        self.m_request = n.SceneAsyncRequest(file = self.m_file_name)
+        self.m_request.set_status_callback(lambda status : loop.call_soon_threadsafe(changed.set))
+        pending = None
+        try:
+            (status, msg) = await self._wait_request(changed)
+            if status != SuccessFinish:
+                raise Exception("Failed opening scene {}: {}".format(self.m_file_name, msg))
+
+            payload_size = self.m_request.payload_size()
+            (vertex_count, stride) = self.m_request.metadata()
+            if payload_size == 0 or vertex_count == 0:
+                raise Exception("Scene {} has no vertices.".format(self.m_file_name))
+
+            if self.m_cache is not None:
+                properties = GaussianSplatProperties if stride == 4 * len(GaussianSplatProperties) else None
+                pending = self.m_cache.begin_store(self.m_file_name, vertex_count, stride, payload_size, properties)
+
+            # without a cache entry to fill, the payload lands straight in the gpu upload buffer.
+            (scene_data, upload_buffer) = (None, None)
+            if pending is not None:
+                destination = pending.payload
+            elif self.m_upload:
+                (scene_data, upload_buffer) = create_scene_buffers(payload_size)
+                destination = upload_buffer.mappedMemory()
+            else:
+                destination = np.empty(payload_size, dtype = np.uint8)
+
+            self.m_status = (CopyingPayload, 1.0, "")
+            self.m_request.request_copy_payload(destination)
+            (status, msg) = await self._wait_request(changed)
+            self.m_request.close_copy_payload()
+            if status != SuccessFinish:
+                raise Exception("Failed copying the payload of {}: {}".format(self.m_file_name, msg))
+        except BaseException as err:
+            self.m_status = (Failed, 0.0, str(err))
+            if pending is not None:
+                self.m_cache.abort_store(pending)
+            raise
+        finally:
+            self.m_request.set_status_callback(None)
+            self.m_request = None
+
+        if upload_buffer is None:
+            bounds = scene_cache.compute_bounds(destination, stride)
+            if pending is not None:
+                entry = self.m_cache.commit_store(pending, bounds)
+                if entry is None:
+                    raise Exception("Could not reopen the scene cache entry of {}.".format(self.m_file_name))
+                return await self._finish(entry.payload, vertex_count, stride, bounds)
+            self.m_status = (SuccessFinish, 1.0, "Success")
+            return SceneData(vertex_count = vertex_count, stride = stride, bounds = bounds, host_payload = destination)
+
+        schedule_scene_upload(scene_data, upload_buffer, (vertex_count, stride))
+        self.m_status = (SuccessFinish, 1.0, "Success")
+        return scene_data
+
+    async def _finish(self, payload, vertex_count, stride, bounds):
+        if not self.m_upload:
+            self.m_status = (SuccessFinish, 1.0, "Success")
+            return SceneData(vertex_count = vertex_count, stride = stride, bounds = bounds, host_payload = payload)
+
+        self.m_status = (CopyingPayload, 1.0, "Uploading cached scene")
+        upload = PayloadUpload(payload, vertex_count, stride, bounds)
+        await asyncio.get_running_loop().run_in_executor(None, upload.wait)
+        upload.update()
+        self.m_status = (SuccessFinish, 1.0, "Success")
+        return upload.scene_data
+
+async def load_scene(file_name, cache = None, upload = True):
+    return await AsyncLoad(file_name, cache, upload)
+
+def load_scene_blocking(file_name, cache = None, upload = True):
+    # blocking variant of load_scene, for scripts without an event loop.
+    return asyncio.run(load_scene(file_name, cache, upload))
+
+def export_scene(file_name, payload, vertex_count, properties = None):
+    # payload is any buffer protocol object holding vertex_count * len(properties) float32 values.
+    # Returns a native.SceneAsyncExport, poll status() / ioProgress() or block on resolve().
+    if properties is None:
+        properties = GaussianSplatProperties
+    return n.SceneAsyncExport(file = file_name, payload = payload, vertex_count = vertex_count, properties = properties)
@@ -0,0 +1,354 @@
+import os
+import time
+import numpy as np
+from . import native as n
+from . import scene_loader
+from . import scene_cache
+from . import resources
+
+# Keeps several scenes resident (host copy and / or gpu buffers) under a vram and a host memory budget.
+# Least recently viewed scenes lose their gpu buffers first (host copy kept, so viewing them again is just an upload),
+# then their host copies. The scene after the active one in the playlist is prefetched in the background.
+
+# scene residency states
+Unloaded = 0
+LoadingHost = 1
+HostResident = 2
+Uploading = 3
+GpuResident = 4
+Failed = 5
+
+StateNames = ["unloaded", "loading", "host", "uploading", "gpu", "failed"]
+
+# bytes of the scene metadata buffer (vertex count, stride, padding).
+MetadataBytes = 16
+
+class ResidentScene:
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.state = Unloaded
+        self.progress = 0.0
+        self.error = ""
+        self.last_viewed = 0.0
+        self.request = None
+        self.copy_destination = None
+        self.pending_store = None
+        self.host_payload = None
+        self.vertex_count = 0
+        self.stride = 0
+        self.bounds = None
+        self.upload = None
+        self.scene_data = None
+
+    @property
+    def host_bytes(self):
+        # mmapped cache entries are counted too, they are page cache backed but still compete for host memory.
+        return 0 if self.host_payload is None else int(self.host_payload.nbytes)
+
+    @property
+    def gpu_bytes(self):
+        if self.scene_data is None and self.upload is None:
+            return 0
+        return (self.vertex_count * self.stride + 3) // 4 * 4 + MetadataBytes
+
+    @property
+    def is_loading(self):
+        return self.request is not None
+
+class SceneResidencyManager:
+
+    def __init__(self, vram_budget_bytes = 4 * 1024 ** 3, host_budget_bytes = 16 * 1024 ** 3, disk_cache = None, max_concurrent_loads = 2, log = print):
+        self.m_vram_budget_bytes = int(vram_budget_bytes)
+        self.m_host_budget_bytes = int(host_budget_bytes)
+        self.m_disk_cache = disk_cache
+        self.m_max_concurrent_loads = max_concurrent_loads
+        self.m_log = log
+        self.m_scenes = {}
+        self.m_active = None
+        self.m_playlist = []
+        self.m_playlist_index = -1
+        self.m_stats = { "gpu_hits" : 0, "host_hits" : 0, "loads" : 0, "gpu_evictions" : 0, "host_evictions" : 0, "prefetches" : 0 }
+
+    @property
+    def vram_budget_bytes(self):
+        return self.m_vram_budget_bytes
+
+    @vram_budget_bytes.setter
+    def vram_budget_bytes(self, value):
+        self.m_vram_budget_bytes = int(value)
+
+    @property
+    def host_budget_bytes(self):
+        return self.m_host_budget_bytes
+
+    @host_budget_bytes.setter
+    def host_budget_bytes(self, value):
+        self.m_host_budget_bytes = int(value)
+
+    @property
+    def disk_cache(self):
+        return self.m_disk_cache
+
+    @disk_cache.setter
+    def disk_cache(self, value):
+        self.m_disk_cache = value
+
+    @property
+    def scenes(self):
+        return list(self.m_scenes.values())
+
+    @property
+    def playlist(self):
+        return list(self.m_playlist)
+
+    @property
+    def playlist_index(self):
+        return self.m_playlist_index
+
+    @property
+    def active_scene(self):
+        return None if self.m_active is None else self.m_scenes[self.m_active]
+
+    @property
+    def active_scene_data(self):
+        scene = self.active_scene
+        return scene.scene_data if scene is not None and scene.state == GpuResident else None
+
+    @property
+    def prefetch_scene(self):
+        if len(self.m_playlist) < 2 or self.m_playlist_index < 0:
+            return None
+        path = self.m_playlist[(self.m_playlist_index + 1) % len(self.m_playlist)]
+        return None if path == self.m_active else self._scene(path)
+
+    @property
+    def vram_bytes(self):
+        return sum(s.gpu_bytes for s in self.m_scenes.values())
+
+    @property
+    def host_bytes(self):
+        return sum(s.host_bytes for s in self.m_scenes.values())
+
+    @property
+    def stats(self):
+        return dict(self.m_stats,
+            vram_bytes = self.vram_bytes, vram_budget_bytes = self.m_vram_budget_bytes,
+            host_bytes = self.host_bytes, host_budget_bytes = self.m_host_budget_bytes,
+            scenes = len(self.m_scenes),
+            gpu_resident = sum(1 for s in self.m_scenes.values() if s.state == GpuResident),
+            host_resident = sum(1 for s in self.m_scenes.values() if s.host_payload is not None))
+
+    def _scene(self, path):
+        path = os.path.abspath(path)
+        if path not in self.m_scenes:
+            self.m_scenes[path] = ResidentScene(path)
+        return self.m_scenes[path]
+
+    def set_playlist(self, paths, index = 0):
+        self.m_playlist = [os.path.abspath(p) for p in paths]
+        self.m_playlist_index = -1
+        if len(self.m_playlist) > 0:
+            self.show_playlist_entry(index)
+
+    def add_to_playlist(self, path):
+        path = os.path.abspath(path)
+        if path not in self.m_playlist:
+            self.m_playlist.append(path)
+        return self.m_playlist.index(path)
+
+    def show_playlist_entry(self, index):
+        if len(self.m_playlist) == 0:
+            return None
+        self.m_playlist_index = index % len(self.m_playlist)
+        return self.activate(self.m_playlist[self.m_playlist_index])
+
+    def next(self):
+        return self.show_playlist_entry(self.m_playlist_index + 1)
+
+    def previous(self):
+        return self.show_playlist_entry(self.m_playlist_index - 1)
+
+    # makes path the viewed scene, it gets loaded / uploaded by update() if it is not gpu resident yet.
+    def activate(self, path):
+        scene = self._scene(path)
+        if scene.path in self.m_playlist:
+            self.m_playlist_index = self.m_playlist.index(scene.path)
+        if scene.state == GpuResident:
+            self.m_stats["gpu_hits"] += 1
+        elif scene.host_payload is not None:
+            self.m_stats["host_hits"] += 1
+        elif scene.state == Failed:
+            scene.state = Unloaded
+        scene.last_viewed = time.perf_counter()
+        self.m_active = scene.path
+        return scene
+
+    def active_status(self):
+        # (state, progress, message) of the active scene, for the ui.
+        scene = self.active_scene
+        if scene is None:
+            return (Unloaded, 0.0, "")
+        return (scene.state, scene.progress, scene.error)
+
+    def release(self, path):
+        scene = self.m_scenes.pop(os.path.abspath(path), None)
+        if scene is None:
+            return
+        self._drop_gpu(scene)
+        self._drop_host(scene)
+        self._cancel_load(scene)
+        if self.m_active == scene.path:
+            self.m_active = None
+
+    def clear(self):
+        for path in list(self.m_scenes.keys()):
+            self.release(path)
+
+    # call once per frame: advances loads / uploads, starts the ones needed and enforces the budgets.
+    def update(self):
+        for scene in self.m_scenes.values():
+            if scene.state == LoadingHost:
+                self._update_host_load(scene)
+            elif scene.state == Uploading:
+                self._update_upload(scene)
+
+        active = self.active_scene
+        if active is not None:
+            self._request_gpu(active, force = True)
+
+        prefetch = self.prefetch_scene
+        if prefetch is not None:
+            self._request_gpu(prefetch, force = False)
+
+        self._enforce_budgets()
+
+    def _request_gpu(self, scene, force):
+        if scene.state in (Unloaded, LoadingHost) and scene.host_payload is None:
+            if scene.state == Unloaded and (force or self._loads_in_flight() < self.m_max_concurrent_loads):
+                if not force:
+                    self.m_stats["prefetches"] += 1
+                self._start_host_load(scene)
+            return
+
+        if scene.state == HostResident:
+            # prefetched scenes are only uploaded if they fit, so they never push viewed scenes out of vram.
+            size = (scene.vertex_count * scene.stride + 3) // 4 * 4 + MetadataBytes
+            if force or self.vram_bytes + size <= self.m_vram_budget_bytes:
+                self._start_upload(scene)
+
+    def _loads_in_flight(self):
+        return sum(1 for s in self.m_scenes.values() if s.is_loading)
+
+    def _start_host_load(self, scene):
+        scene.error = ""
+        scene.progress = 0.0
+        self.m_stats["loads"] += 1
+        entry = None if self.m_disk_cache is None else self.m_disk_cache.lookup(scene.path)
+        if entry is not None:
+            self._set_host_payload(scene, entry.payload, entry.vertex_count, entry.stride, entry.bounds)
+            return
+        scene.request = n.SceneAsyncRequest(file = scene.path)
+        scene.state = LoadingHost
+
+    def _update_host_load(self, scene):
+        (status, msg) = scene.request.status()
+        if status == scene_loader.Reading:
+            (bytes_read, total_bytes) = scene.request.ioProgress()
+            scene.progress = 0.0 if total_bytes == 0 else bytes_read / total_bytes
+        elif status == scene_loader.Failed:
+            self._fail(scene, msg)
+        elif status == scene_loader.SuccessFinish and scene.copy_destination is None:
+            payload_size = scene.request.payload_size()
+            (vertex_count, stride) = scene.request.metadata()
+            if payload_size == 0 or vertex_count == 0:
+                self._fail(scene, "Scene has no vertices")
+                return
+            if self.m_disk_cache is not None:
+                properties = scene_loader.GaussianSplatProperties if stride == 4 * len(scene_loader.GaussianSplatProperties) else None
+                scene.pending_store = self.m_disk_cache.begin_store(scene.path, vertex_count, stride, payload_size, properties)
+            scene.copy_destination = np.empty(payload_size, dtype = np.uint8) if scene.pending_store is None else scene.pending_store.payload
+            scene.request.request_copy_payload(scene.copy_destination)
+        elif status == scene_loader.SuccessFinish:
+            (vertex_count, stride) = scene.request.metadata()
+            scene.request.close_copy_payload()
+            scene.request = None
+            payload = scene.copy_destination
+            scene.copy_destination = None
+            bounds = scene_cache.compute_bounds(payload, stride)
+            if scene.pending_store is not None:
+                entry = self.m_disk_cache.commit_store(scene.pending_store, bounds)
+                scene.pending_store = None
+                payload = payload if entry is None else entry.payload
+            self._set_host_payload(scene, payload, vertex_count, stride, bounds)
+
+    def _set_host_payload(self, scene, payload, vertex_count, stride, bounds):
+        (scene.host_payload, scene.vertex_count, scene.stride, scene.bounds) = (payload, vertex_count, stride, bounds)
+        resources.track_host("scene_residency", scene.path, payload, scene)
+        scene.progress = 1.0
+        scene.state = HostResident if scene.scene_data is None else GpuResident
+
+    def _start_upload(self, scene):
+        scene.upload = scene_loader.PayloadUpload(scene.host_payload, scene.vertex_count, scene.stride, scene.bounds)
+        scene.state = Uploading
+
+    def _update_upload(self, scene):
+        if not scene.upload.update():
+            return
+        scene.scene_data = scene.upload.scene_data
+        scene.upload = None
+        scene.state = GpuResident
+        self.m_log("[SceneResidency]: {} resident ({} splats).".format(scene.name, scene.vertex_count))
+
+    def _fail(self, scene, msg):
+        self._cancel_load(scene)
+        scene.state = Failed
+        scene.error = msg
+        self.m_log("[SceneResidency]: failed loading {}: {}".format(scene.path, msg))
+
+    def _cancel_load(self, scene):
+        if scene.request is not None:
+            scene.request.close_copy_payload()
+            scene.request = None
+        scene.copy_destination = None
+        if scene.pending_store is not None:
+            self.m_disk_cache.abort_store(scene.pending_store)
+            scene.pending_store = None
+
+    def _drop_gpu(self, scene):
+        if scene.scene_data is None:
+            return
+        scene.scene_data = None
+        scene.state = HostResident if scene.host_payload is not None else Unloaded
+
+    def _drop_host(self, scene):
+        if scene.host_payload is None:
+            return
+        scene.host_payload = None
+        resources.release("scene_residency", scene.path, scene)
+        if scene.state == HostResident:
+            scene.state = Unloaded
+
+    def _enforce_budgets(self):
+        protected = set(s.path for s in [self.active_scene, self.prefetch_scene] if s is not None)
+        by_lru = sorted([s for s in self.m_scenes.values() if s.path not in protected], key = lambda s : s.last_viewed)
+
+        vram_bytes = self.vram_bytes
+        for scene in by_lru:
+            if vram_bytes <= self.m_vram_budget_bytes:
+                break
+            if scene.state == GpuResident:
+                vram_bytes -= scene.gpu_bytes
+                self._drop_gpu(scene)
+                self.m_stats["gpu_evictions"] += 1
+
+        # host copies of scenes that are not on the gpu go first, then the ones that are.
+        host_bytes = self.host_bytes
+        for scene in sorted(by_lru, key = lambda s : s.state == GpuResident):
+            if host_bytes <= self.m_host_budget_bytes:
+                break
+            if scene.host_payload is not None and scene.state in (HostResident, GpuResident):
+                host_bytes -= scene.host_bytes
+                self._drop_host(scene)
+                self.m_stats["host_evictions"] += 1
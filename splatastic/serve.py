@@ -0,0 +1,699 @@
+import os
+import json
+import stat
+import time
+import socket
+import struct
+import argparse
+import threading
+import collections
+import socketserver
+import concurrent.futures
+import numpy as np
+from . import native
+from . import camera
+from . import scene_loader
+from . import cpu_rasterizer
+from . import image_io
+
+# Local render server: one warm process keeps scenes loaded and renders the camera requests of other local tools
+# (python -m splatastic.serve run --address 127.0.0.1:8765, or --address unix:/tmp/splatastic.sock).
+#
+# Every message is a little endian uint32 byte length, a json header, then header["body_bytes"] bytes of body
+# (responses only). Requests:
+#   {"op" : "render", "id" : 7, "scene" : "a.ply", "width" : 640, "height" : 480, "encoding" : "png" | "raw",
+#    "position" : [x, y, z], "rotation" : [w, x, y, z], "fov" : radians, "near" : 0.1, "far" : 10000}
+#   (or "view_matrix" / "proj_matrix", 4x4 row major, instead of the camera fields)
+#   {"op" : "load", "scene" : "a.ply"}, {"op" : "stats"}, {"op" : "shutdown"}
+# Responses echo the id and carry "ok" ("error" when false). Render responses hold the image in the body (png file or
+# height * width * 4 rgba8 bytes) and its latency breakdown: queue_ms, render_ms, encode_ms, latency_ms, batch_size.
+#
+# Connection threads parse requests into a bounded RequestQueue, requests over its capacity are answered "busy" right
+# away. The render loop (serve_forever, on the thread owning the gpu) takes the oldest request together with the other
+# queued render requests of the same scene, waiting up to batch_window_ms for more of them when idle, and renders them
+# as one batch: the gpu backend rasters it in one multi view pass (SplatRaster.raster_views), the cpu backend
+# (cpu_rasterizer, for machines without a gpu) one view after the other. Images are encoded and sent by a pool of
+# encoder threads, with at most max_pending_encodes queued before the render loop waits.
+
+DefaultAddress = "127.0.0.1:8765"
+MessageLength = struct.Struct("<I")
+MaxHeaderBytes = 1024 * 1024
+DefaultQueueCapacity = 64
+DefaultBatchWindowMs = 2.0
+DefaultMaxScenes = 4
+DefaultEncodeThreads = 2
+LatencyCapacity = 4096
+Encodings = ["png", "raw"]
+
+def parse_address(address):
+    # "unix:path" -> (AF_UNIX, path), "host:port" / "port" -> (AF_INET, (host, port)), the host defaults to localhost.
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise Exception("Unix sockets are not available on this platform, use a host:port address.")
+        return (socket.AF_UNIX, address[len("unix:"):])
+    (host, _, port) = address.rpartition(":")
+    return (socket.AF_INET, ("127.0.0.1" if host == "" else host, int(port)))
+
+def send_message(sock, header, body = None):
+    data = json.dumps(dict(header, body_bytes = 0 if body is None else len(body))).encode("utf-8")
+    sock.sendall(MessageLength.pack(len(data)) + data)
+    if body is not None and len(body) > 0:
+        sock.sendall(body)
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Connection closed in the middle of a message.")
+    return data
+
+def receive_message(stream):
+    # (header, body) from a buffered binary stream (socket.makefile("rb")), None if it closed between messages.
+    prefix = stream.read(MessageLength.size)
+    if len(prefix) == 0:
+        return None
+    if len(prefix) != MessageLength.size:
+        raise EOFError("Connection closed in the middle of a message.")
+    (length,) = MessageLength.unpack(prefix)
+    if length > MaxHeaderBytes:
+        raise Exception("Message header of %d bytes, over the %d bytes limit." % (length, MaxHeaderBytes))
+    header = json.loads(_read(stream, length).decode("utf-8"))
+    body_bytes = int(header.get("body_bytes", 0))
+    return (header, _read(stream, body_bytes) if body_bytes > 0 else b"")
+
+def validate_render(header):
+    # raises on render requests the backends cannot render.
+    if not isinstance(header.get("scene"), str):
+        raise Exception("Render requests need a scene file.")
+    (width, height) = (header.get("width"), header.get("height"))
+    if not isinstance(width, int) or not isinstance(height, int) or width <= 0 or height <= 0:
+        raise Exception("Render requests need a positive integer width and height.")
+    (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(width, height)
+    if tiles_x * tiles_y > (1 << cpu_rasterizer.BitsPerTileAddress):
+        raise Exception("%dx%d is over the %d coarse tiles a view can hold." % (width, height, 1 << cpu_rasterizer.BitsPerTileAddress))
+    if header.get("encoding", "png") not in Encodings:
+        raise Exception("Unknown encoding %s, expected one of %s." % (header.get("encoding"), ", ".join(Encodings)))
+    if ("view_matrix" in header) != ("proj_matrix" in header):
+        raise Exception("Render requests need both a view_matrix and a proj_matrix, or neither.")
+
+def request_matrices(headers):
+    # (N, 4, 4) view and projection matrices of N render request headers, the camera fields go through one CameraBatch.
+    cameras = camera.CameraBatch(len(headers), 1, 1)
+    for (i, header) in enumerate(headers):
+        cameras.positions[i] = header.get("position", [0.0, 0.0, 0.0])
+        cameras.rotations[i] = header.get("rotation", [1.0, 0.0, 0.0, 0.0])
+        (cameras.ws[i], cameras.hs[i]) = (header["width"], header["height"])
+        cameras.fovs[i] = header.get("fov", cameras.fovs[i])
+        cameras.nears[i] = header.get("near", cameras.nears[i])
+        cameras.fars[i] = header.get("far", cameras.fars[i])
+    (view_matrices, proj_matrices) = (cameras.view_matrices(), cameras.proj_matrices())
+    for (i, header) in enumerate(headers):
+        if "view_matrix" in header:
+            view_matrices[i] = np.array(header["view_matrix"], dtype = np.float64).reshape((4, 4))
+            proj_matrices[i] = np.array(header["proj_matrix"], dtype = np.float64).reshape((4, 4))
+    return (view_matrices, proj_matrices)
+
+def decode_image(header, body):
+    # (height, width, 4) uint8 image of a render response.
+    if header["encoding"] == "png":
+        return image_io.decode_png(body)
+    return np.frombuffer(body, dtype = np.uint8).reshape((header["height"], header["width"], 4))
+
+class Request:
+
+    def __init__(self, header, connection):
+        self.header = header
+        self.connection = connection
+        self.op = header.get("op", "render")
+        self.scene = header.get("scene")
+        self.received = time.perf_counter()
+
+class RequestQueue:
+
+    # Bounded queue of requests, hands them out in batches of render requests of the same scene.
+    def __init__(self, capacity = DefaultQueueCapacity, max_batch = 1 << cpu_rasterizer.BitsPerView, batch_window_ms = DefaultBatchWindowMs):
+        self.m_capacity = capacity
+        self.m_max_batch = max_batch
+        self.m_batch_window = batch_window_ms / 1000.0
+        self.m_requests = collections.deque()
+        self.m_condition = threading.Condition()
+        self.m_closed = False
+        self.m_stats = { "accepted" : 0, "rejected" : 0, "batches" : 0, "batched_requests" : 0, "max_depth" : 0 }
+
+    @property
+    def capacity(self):
+        return self.m_capacity
+
+    @property
+    def max_batch(self):
+        return self.m_max_batch
+
+    @property
+    def depth(self):
+        return len(self.m_requests)
+
+    @property
+    def stats(self):
+        with self.m_condition:
+            return dict(self.m_stats, depth = len(self.m_requests), capacity = self.m_capacity)
+
+    def put(self, request):
+        # False (and the request is not queued) when the queue is full or closed.
+        with self.m_condition:
+            if self.m_closed or len(self.m_requests) >= self.m_capacity:
+                self.m_stats["rejected"] += 1
+                return False
+            self.m_requests.append(request)
+            self.m_stats["accepted"] += 1
+            self.m_stats["max_depth"] = max(self.m_stats["max_depth"], len(self.m_requests))
+            self.m_condition.notify_all()
+            return True
+
+    def _batchable(self, first, request):
+        return request.op == "render" and first.op == "render" and request.scene == first.scene
+
+    def next_batch(self, timeout = None):
+        # waits up to timeout for a request, returns it with up to max_batch - 1 queued render requests of the same scene
+        # in arrival order, [] on timeout or once closed. A render request is held until batch_window_ms after it
+        # arrived, for more requests of its scene to come in.
+        with self.m_condition:
+            if not self.m_condition.wait_for(lambda : len(self.m_requests) > 0 or self.m_closed, timeout) or self.m_closed:
+                return []
+            first = self.m_requests[0]
+            if first.op == "render":
+                deadline = first.received + self.m_batch_window
+                while not self.m_closed and sum(1 for r in self.m_requests if self._batchable(first, r)) < self.m_max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0.0:
+                        break
+                    self.m_condition.wait(remaining)
+            (batch, rest) = ([], collections.deque())
+            for request in self.m_requests:
+                if len(batch) < self.m_max_batch and (len(batch) == 0 or self._batchable(first, request)):
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self.m_requests = rest
+            self.m_stats["batches"] += 1
+            self.m_stats["batched_requests"] += len(batch)
+            return batch
+
+    def close(self):
+        with self.m_condition:
+            self.m_closed = True
+            self.m_condition.notify_all()
+
+    def drain(self):
+        # removes and returns every queued request.
+        with self.m_condition:
+            requests = list(self.m_requests)
+            self.m_requests.clear()
+            return requests
+
+class LatencyStats:
+
+    Fields = ["latency_ms", "queue_ms", "render_ms", "encode_ms", "batch_size"]
+
+    # latency breakdown of the last capacity answered render requests.
+    def __init__(self, capacity = LatencyCapacity):
+        self.m_records = collections.deque(maxlen = capacity)
+        self.m_lock = threading.Lock()
+        self.m_count = 0
+        self.m_errors = 0
+
+    def record(self, timings):
+        with self.m_lock:
+            self.m_records.append([timings[field] for field in LatencyStats.Fields])
+            self.m_count += 1
+
+    def record_error(self):
+        with self.m_lock:
+            self.m_errors += 1
+
+    def summary(self):
+        # mean / median / p95 / p99 / max of every field over the recorded requests.
+        with self.m_lock:
+            (records, count, errors) = (np.array(self.m_records, dtype = np.float64), self.m_count, self.m_errors)
+        summary = { "requests" : count, "errors" : errors }
+        for (i, field) in enumerate(LatencyStats.Fields):
+            if records.shape[0] == 0:
+                summary[field] = None
+                continue
+            values = records[:, i]
+            summary[field] = { "mean" : float(np.mean(values)), "median" : float(np.median(values)), "p95" : float(np.percentile(values, 95)),
+                "p99" : float(np.percentile(values, 99)), "max" : float(np.max(values)) }
+        return summary
+
+def to_rgba8(image):
+    return (np.clip(image, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+class CpuBackend:
+
+    # cpu_rasterizer reference renders, for machines without a gpu.
+    name = "cpu"
+    max_batch = 1 << cpu_rasterizer.BitsPerView
+
+    def load_scene(self, file_name):
+        # returns (scene, vertex count).
+        scene = scene_loader.load_scene_blocking(file_name, upload = False)
+        return (cpu_rasterizer.SplatCloud(scene.host_payload, scene.stride // 4), scene.vertex_count)
+
+    def render(self, scene, views):
+        # views: [(view_matrix, proj_matrix, width, height)], returns their (height, width, 4) uint8 images.
+        return [to_rgba8(cpu_rasterizer.render(scene, view_matrix, proj_matrix, width, height)) for (view_matrix, proj_matrix, width, height) in views]
+
+    def close(self):
+        pass
+
+class GpuBackend:
+
+    name = "gpu"
+
+    # needs init_module, see make_backend.
+    def __init__(self):
+        import coalpy.gpu
+        from . import splat_rasterizer
+        from . import readback
+        self.m_gpu = coalpy.gpu
+        self.max_batch = splat_rasterizer.MaxViewsPerBatch
+        self.m_rasterizer = splat_rasterizer.SplatRaster()
+        self.m_readback = readback.ReadbackRing(slot_count = self.max_batch, writer_threads = 1, name = "ServeReadback")
+
+    def load_scene(self, file_name):
+        scene = scene_loader.load_scene_blocking(file_name)
+        return (scene, scene.vertex_count)
+
+    def render(self, scene, views):
+        # all the views in one raster_views pass, read back with one view per readback slot.
+        cmd_list = self.m_gpu.CommandList()
+        self.m_rasterizer.raster_views(cmd_list, scene, [(i, view_matrix, proj_matrix, width, height) for (i, (view_matrix, proj_matrix, width, height)) in enumerate(views)])
+        images = [None] * len(views)
+        def on_image(tag, image):
+            images[tag] = image
+        for i in range(len(views)):
+            self.m_readback.copy_view(cmd_list, self.m_rasterizer.get_view(i), tag = i, callback = on_image)
+        self.m_gpu.schedule(cmd_list)
+        self.m_readback.flush()
+        return images
+
+    def close(self):
+        self.m_readback.close()
+
+def make_backend(name = "auto", thread_count = 0, log = print):
+    # initializes the native module (and the gpu for the gpu backend), "auto" falls back to the cpu backend without coalpy.
+    if name != "cpu":
+        try:
+            import coalpy.gpu
+        except ImportError as e:
+            if name == "gpu":
+                raise
+            log("coalpy is not available (%s), rendering on the cpu." % str(e))
+        else:
+            from . import init_module
+            init_module(thread_count = thread_count)
+            return GpuBackend()
+    native.init(thread_count = thread_count)
+    return CpuBackend()
+
+class _Connection:
+
+    def __init__(self, sock):
+        self.m_socket = sock
+        self.m_send_lock = threading.Lock()
+        self.m_pending = 0
+        self.m_condition = threading.Condition()
+        self.closed = False
+
+    def send(self, header, body = None):
+        # False if the client went away.
+        with self.m_send_lock:
+            if self.closed:
+                return False
+            try:
+                send_message(self.m_socket, header, body)
+                return True
+            except OSError:
+                self.closed = True
+                return False
+
+    def begin_request(self):
+        with self.m_condition:
+            self.m_pending += 1
+
+    def end_request(self):
+        with self.m_condition:
+            self.m_pending -= 1
+            self.m_condition.notify_all()
+
+    def wait_idle(self, stopped):
+        # waits until every request of the connection is answered (or the server stops).
+        with self.m_condition:
+            while self.m_pending > 0 and not stopped.is_set():
+                self.m_condition.wait(0.1)
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server.render_server
+        connection = _Connection(self.request)
+        while not server.m_stopped.is_set():
+            try:
+                message = receive_message(self.rfile)
+            except Exception as e:
+                connection.send({ "ok" : False, "error" : "Bad message: " + str(e) })
+                break
+            if message is None:
+                break
+            server._on_message(connection, message[0])
+        connection.wait_idle(server.m_stopped)
+        connection.closed = True
+
+class _TcpListener(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixListener(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+class RenderServer:
+
+    def __init__(self, backend, address = DefaultAddress, queue_capacity = DefaultQueueCapacity, batch_window_ms = DefaultBatchWindowMs, max_batch = None,
+                 encode_threads = DefaultEncodeThreads, max_pending_encodes = None, max_scenes = DefaultMaxScenes, log = print):
+        self.m_backend = backend
+        self.m_log = log
+        max_batch = backend.max_batch if max_batch is None else max(1, min(max_batch, backend.max_batch))
+        self.m_queue = RequestQueue(queue_capacity, max_batch, batch_window_ms)
+        self.m_latency = LatencyStats()
+        self.m_lock = threading.Lock()
+        # file name -> (scene, vertex count), least recently rendered first
+        self.m_scenes = collections.OrderedDict()
+        self.m_max_scenes = max_scenes
+        self.m_encoders = concurrent.futures.ThreadPoolExecutor(max_workers = encode_threads, thread_name_prefix = "ServeEncoder")
+        self.m_encode_slots = threading.Semaphore(4 * encode_threads if max_pending_encodes is None else max_pending_encodes)
+        self.m_stats = { "batches" : 0, "rendered" : 0, "render_errors" : 0, "scene_loads" : 0, "scene_evictions" : 0, "dropped_responses" : 0,
+            "encode_stalls" : 0, "encode_stall_ms" : 0.0 }
+        self.m_stopped = threading.Event()
+        self.m_closed = False
+
+        (family, bind_address) = parse_address(address)
+        if family == socket.AF_INET:
+            self.m_listener = _TcpListener(bind_address, _ConnectionHandler)
+        else:
+            # a socket file left over by a server that did not shut down cleanly
+            if os.path.exists(bind_address) and stat.S_ISSOCK(os.stat(bind_address).st_mode):
+                os.remove(bind_address)
+            self.m_listener = _UnixListener(bind_address, _ConnectionHandler)
+        self.m_listener.render_server = self
+        self.m_listener_thread = threading.Thread(target = self.m_listener.serve_forever, name = "ServeListener", daemon = True)
+        self.m_listener_thread.start()
+
+    @property
+    def address(self):
+        # the bound address, with the actual port when created with port 0.
+        if self.m_listener.address_family == socket.AF_INET:
+            (host, port) = self.m_listener.server_address[:2]
+            return "%s:%d" % (host, port)
+        return "unix:" + self.m_listener.server_address
+
+    @property
+    def backend(self):
+        return self.m_backend
+
+    @property
+    def queue(self):
+        return self.m_queue
+
+    @property
+    def stats(self):
+        with self.m_lock:
+            stats = dict(self.m_stats, scenes = list(self.m_scenes.keys()))
+        return dict(stats, backend = self.m_backend.name, queue = self.m_queue.stats, latency = self.m_latency.summary())
+
+    def _count(self, name, value = 1):
+        with self.m_lock:
+            self.m_stats[name] += value
+
+    def load(self, file_name):
+        # returns (scene, vertex count), loading the scene if it is not resident. Render loop thread only.
+        with self.m_lock:
+            if file_name in self.m_scenes:
+                self.m_scenes.move_to_end(file_name)
+                return self.m_scenes[file_name]
+        begin = time.perf_counter()
+        scene = self.m_backend.load_scene(file_name)
+        with self.m_lock:
+            self.m_scenes[file_name] = scene
+            self.m_stats["scene_loads"] += 1
+            while len(self.m_scenes) > self.m_max_scenes:
+                self.m_scenes.popitem(last = False)
+                self.m_stats["scene_evictions"] += 1
+        self.m_log("Loaded %s: %d splats in %.1f ms" % (file_name, scene[1], (time.perf_counter() - begin) * 1000.0))
+        return scene
+
+    def _reply(self, request, header, body = None):
+        header = dict(header, id = request.header.get("id"), op = request.op)
+        if not request.connection.send(header, body):
+            self._count("dropped_responses")
+            return False
+        return True
+
+    def _reply_error(self, request, error):
+        self.m_latency.record_error()
+        self._reply(request, { "ok" : False, "error" : error })
+
+    def _on_message(self, connection, header):
+        # connection thread: answers stats / shutdown / invalid requests right away, queues the rest.
+        request = Request(header, connection)
+        if request.op == "stats":
+            self._reply(request, { "ok" : True, "stats" : self.stats })
+            return
+        if request.op == "shutdown":
+            self._reply(request, { "ok" : True })
+            self.shutdown()
+            return
+        try:
+            if request.op == "render":
+                validate_render(header)
+            elif request.op != "load" or not isinstance(request.scene, str):
+                raise Exception("Unknown request %s." % str(request.op))
+        except Exception as e:
+            self._reply_error(request, str(e))
+            return
+        connection.begin_request()
+        if not self.m_queue.put(request):
+            connection.end_request()
+            self._reply_error(request, "busy: %d requests queued" % self.m_queue.capacity)
+
+    def serve_forever(self, poll_ms = 100.0):
+        # renders the queued requests until shutdown(), on the calling thread (the one owning the gpu).
+        try:
+            while not self.m_stopped.is_set():
+                batch = self.m_queue.next_batch(poll_ms / 1000.0)
+                if len(batch) > 0:
+                    self._process(batch)
+        finally:
+            self.close()
+
+    def shutdown(self):
+        # stops serve_forever, callable from any thread.
+        self.m_stopped.set()
+        self.m_queue.close()
+
+    def close(self):
+        if self.m_closed:
+            return
+        self.m_closed = True
+        self.shutdown()
+        for request in self.m_queue.drain():
+            self._reply_error(request, "server shutting down")
+            request.connection.end_request()
+        self.m_encoders.shutdown(wait = True)
+        self.m_listener.shutdown()
+        self.m_listener.server_close()
+        if self.m_listener.address_family != socket.AF_INET and os.path.exists(self.m_listener.server_address):
+            os.remove(self.m_listener.server_address)
+
+    def _process(self, batch):
+        begin = time.perf_counter()
+        try:
+            (scene, vertex_count) = self.load(batch[0].scene)
+            if batch[0].op == "load":
+                self._reply(batch[0], { "ok" : True, "scene" : batch[0].scene, "vertex_count" : vertex_count, "load_ms" : (time.perf_counter() - begin) * 1000.0 })
+                batch[0].connection.end_request()
+                return
+            headers = [request.header for request in batch]
+            (view_matrices, proj_matrices) = request_matrices(headers)
+            images = self.m_backend.render(scene, [(view_matrices[i], proj_matrices[i], h["width"], h["height"]) for (i, h) in enumerate(headers)])
+        except Exception as e:
+            self._count("render_errors", len(batch))
+            for request in batch:
+                self._reply_error(request, str(e))
+                request.connection.end_request()
+            return
+        render_ms = (time.perf_counter() - begin) * 1000.0
+        self._count("batches")
+        self._count("rendered", len(batch))
+        for (request, image) in zip(batch, images):
+            timings = { "queue_ms" : (begin - request.received) * 1000.0, "render_ms" : render_ms, "batch_size" : len(batch) }
+            if not self.m_encode_slots.acquire(blocking = False):
+                # the encoders are behind, wait for one of them
+                stall_begin = time.perf_counter()
+                self.m_encode_slots.acquire()
+                self._count("encode_stalls")
+                self._count("encode_stall_ms", (time.perf_counter() - stall_begin) * 1000.0)
+            self.m_encoders.submit(self._encode_and_send, request, image, timings)
+
+    def _encode_and_send(self, request, image, timings):
+        try:
+            begin = time.perf_counter()
+            encoding = request.header.get("encoding", "png")
+            body = image_io.encode_png(image) if encoding == "png" else np.ascontiguousarray(image).tobytes()
+            timings["encode_ms"] = (time.perf_counter() - begin) * 1000.0
+            timings["latency_ms"] = (time.perf_counter() - request.received) * 1000.0
+            (height, width) = image.shape[0:2]
+            if self._reply(request, dict(timings, ok = True, width = width, height = height, encoding = encoding), body):
+                self.m_latency.record(timings)
+        except Exception as e:
+            self._reply_error(request, "Encoding failed: " + str(e))
+        finally:
+            self.m_encode_slots.release()
+            request.connection.end_request()
+
+class RenderClient:
+
+    # Blocking client. render() / load() / stats() send one request and wait for its answer, submit() / receive() pipeline
+    # several requests on the connection (answers can come back out of order, match them by id).
+    def __init__(self, address = DefaultAddress, timeout = 60.0):
+        (family, target) = parse_address(address)
+        self.m_socket = socket.socket(family, socket.SOCK_STREAM)
+        self.m_socket.settimeout(timeout)
+        self.m_socket.connect(target)
+        self.m_stream = self.m_socket.makefile("rb")
+        self.m_next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.m_stream.close()
+        self.m_socket.close()
+
+    def submit(self, op = "render", **fields):
+        # sends a request, returns its id.
+        if "id" not in fields:
+            fields["id"] = self.m_next_id
+            self.m_next_id += 1
+        header = { k : (v.tolist() if isinstance(v, np.ndarray) else v) for (k, v) in fields.items() }
+        send_message(self.m_socket, dict(header, op = op))
+        return fields["id"]
+
+    def receive(self):
+        # (header, body) of the next answer.
+        message = receive_message(self.m_stream)
+        if message is None:
+            raise Exception("The render server closed the connection.")
+        return message
+
+    def request(self, op, **fields):
+        self.submit(op, **fields)
+        (header, body) = self.receive()
+        if not header["ok"]:
+            raise Exception(header["error"])
+        return (header, body)
+
+    def render(self, scene, width, height, encoding = "raw", **camera_fields):
+        # returns (answer header, (height, width, 4) uint8 image).
+        (header, body) = self.request("render", scene = scene, width = width, height = height, encoding = encoding, **camera_fields)
+        return (header, decode_image(header, body))
+
+    def load(self, scene):
+        return self.request("load", scene = scene)[0]
+
+    def stats(self):
+        return self.request("stats")[0]["stats"]
+
+    def shutdown(self):
+        return self.request("shutdown")[0]
+
+def _format_latency(latency):
+    if latency["latency_ms"] is None:
+        return "no requests rendered"
+    return "%d requests (%d errors), latency median %.1f ms p95 %.1f ms p99 %.1f ms, queue median %.1f ms, mean batch %.1f" % (
+        latency["requests"], latency["errors"], latency["latency_ms"]["median"], latency["latency_ms"]["p95"], latency["latency_ms"]["p99"],
+        latency["queue_ms"]["median"], latency["batch_size"]["mean"])
+
+def _run(args):
+    backend = make_backend(args.backend, args.threads)
+    server = RenderServer(backend, args.address, queue_capacity = args.queue_size, batch_window_ms = args.batch_window_ms, max_batch = args.max_batch,
+        encode_threads = args.encode_threads, max_scenes = args.max_scenes)
+    try:
+        for scene in args.scene:
+            server.load(scene)
+        print("Serving %s renders on %s (queue %d, batches of up to %d views)" % (backend.name, server.address, args.queue_size, server.queue.max_batch))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        stats = server.stats
+        print("Render server: %d batches, %s, %d rejected" % (stats["batches"], _format_latency(stats["latency"]), stats["queue"]["rejected"]))
+        backend.close()
+        native.shutdown()
+
+def _render(args):
+    fields = { "position" : args.position, "rotation" : args.rotation }
+    if args.fov is not None:
+        fields["fov"] = args.fov
+    with RenderClient(args.address) as client:
+        (header, body) = client.request("render", scene = args.scene, width = args.width, height = args.height,
+            encoding = "png" if args.output.lower().endswith(".png") else "raw", **fields)
+    if header["encoding"] == "png":
+        with open(args.output, "wb") as f:
+            f.write(body)
+    else:
+        image_io.write_image(args.output, decode_image(header, body))
+    print("%s: %dx%d, latency %.1f ms (queue %.1f ms, render %.1f ms, encode %.1f ms, batch of %d)" % (args.output, header["width"], header["height"],
+        header["latency_ms"], header["queue_ms"], header["render_ms"], header["encode_ms"], header["batch_size"]))
+
+def _stats(args):
+    with RenderClient(args.address) as client:
+        stats = client.stats()
+    print(json.dumps(stats, indent = 1))
+
+def _shutdown(args):
+    with RenderClient(args.address) as client:
+        client.shutdown()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m splatastic.serve", description = "Local render server, keeps scenes loaded and renders camera requests")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    run = commands.add_parser("run", help = "Start the render server")
+    run.add_argument("--address", default = DefaultAddress, help = "host:port (localhost by default) or unix:path to listen on")
+    run.add_argument("--backend", default = "auto", choices = ["auto", "gpu", "cpu"], help = "auto renders on the gpu when coalpy is available")
+    run.add_argument("-s", "--scene", nargs = "*", default = [], help = "Scenes to load at startup")
+    run.add_argument("--queue-size", type = int, default = DefaultQueueCapacity, help = "Queued requests before new ones are answered busy")
+    run.add_argument("--batch-window-ms", type = float, default = DefaultBatchWindowMs, help = "How long an idle server waits for more requests of the same scene to batch")
+    run.add_argument("--max-batch", type = int, default = None, help = "Views rendered in one batch, the backend maximum (16) by default")
+    run.add_argument("--encode-threads", type = int, default = DefaultEncodeThreads, help = "Threads encoding / sending images")
+    run.add_argument("--max-scenes", type = int, default = DefaultMaxScenes, help = "Scenes kept loaded, least recently rendered ones are dropped")
+    run.add_argument("-t", "--threads", type = int, default = 0, help = "Native task system worker count, 0 uses one per available cpu")
+    render = commands.add_parser("render", help = "Request one render from a running server")
+    render.add_argument("scene")
+    render.add_argument("output", help = ".png, .npy or raw rgba8 bytes")
+    render.add_argument("--address", default = DefaultAddress)
+    render.add_argument("--width", type = int, default = 1280)
+    render.add_argument("--height", type = int, default = 720)
+    render.add_argument("--position", type = float, nargs = 3, default = [0.0, 0.0, 0.0])
+    render.add_argument("--rotation", type = float, nargs = 4, default = [1.0, 0.0, 0.0, 0.0], help = "Camera rotation quaternion w x y z")
+    render.add_argument("--fov", type = float, default = None, help = "Vertical field of view in radians")
+    for (name, description) in [("stats", "Print the stats of a running server"), ("shutdown", "Stop a running server")]:
+        command = commands.add_parser(name, help = description)
+        command.add_argument("--address", default = DefaultAddress)
+    args = parser.parse_args(argv)
+    { "run" : _run, "render" : _render, "stats" : _stats, "shutdown" : _shutdown }[args.command](args)
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,9 @@ cbuffer Constants : register(b0)
 {
     int2 g_viewSize;
     int2 g_coarseTileViewDims;
+    int g_tileRangeOffset;
+    int g_colorDivider;
+    int2 g_unused0;
 }
 
 float4 drawTile(int2 coord, int tileSize, int tileCount)
@@ -94,12 +97,12 @@ void csMainOverlay(
     int3 gti : SV_GroupThreadID,
     int2 groupID : SV_GroupID)
 {
-    uint tileCoord = groupID.x + groupID.y * g_coarseTileViewDims.x;
+    uint tileCoord = g_tileRangeOffset + groupID.x + groupID.y * g_coarseTileViewDims.x;
     float2 tileUV = (gti.xy + 0.5) / float2(32.0, 32.0);
     int tileBegin = g_coarseTileRanges[2 * tileCoord];
     int tileEnd = g_coarseTileRanges[2 * tileCoord + 1];
     uint coarseCount = max((tileEnd - tileBegin), 0);
     float4 tileColor = 0;//coarseCount == 0 ? float4(0,0,0,0) : drawTile(dti.xy, 32, coarseCount);
-    float4 inputColor = g_colorBuffer.Load(float3(dti.xy, 0));
+    float4 inputColor = g_colorBuffer.Load(int3(min(dti.xy / g_colorDivider, max(g_viewSize / g_colorDivider - 1, 0)), 0));
     g_output[dti.xy] = float4(lerp(inputColor.rgb, tileColor.rgb, tileColor.a), 1.0);
 }
@@ -11,10 +11,57 @@ cbuffer Constants : register(b0)
     float2 g_coarseTileViewDimsInv;
 
     uint g_coarseTileRecordMax;
-    uint3 g_unused0;
+    uint g_viewIndex;
+    uint g_viewTileRangeOffset;
+    uint g_viewCount;
 
     float4x4 g_view;
     float4x4 g_proj;
+
+    // batch wide, same in every view
+    uint g_tileSegmentSplats;
+    uint g_tileSegmentMax;
+    uint g_tileRangeCount;
+    uint g_unused0;
+
+    // occlusion culling (occlusion.py): previous frame of the view, whether the bin culls with its opaque tile depths,
+    // the opacity at which the raster records them (0 does not record) and camera translation * focal length in pixels.
+    float4x4 g_occlusionView;
+    float4x4 g_occlusionProj;
+    uint g_occlusionCulling;
+    float g_occlusionOpacity;
+    float g_occlusionParallax;
+    uint g_unused1;
+};
+
+// must match the layout of Constants. Holds every view of a batch.
+struct ViewConstants
+{
+    uint2 viewSize;
+    float2 viewSizeInv;
+
+    uint2 coarseTileViewDims;
+    float2 coarseTileViewDimsInv;
+
+    uint coarseTileRecordMax;
+    uint viewIndex;
+    uint viewTileRangeOffset;
+    uint viewCount;
+
+    float4x4 view;
+    float4x4 proj;
+
+    uint tileSegmentSplats;
+    uint tileSegmentMax;
+    uint tileRangeCount;
+    uint unused0;
+
+    float4x4 occlusionView;
+    float4x4 occlusionProj;
+    uint occlusionCulling;
+    float occlusionOpacity;
+    float occlusionParallax;
+    uint unused1;
 };
 
 //Utility functions
@@ -52,6 +99,7 @@ struct SplatScene
 {
     int vertexCount;
     int stride;
+    uint instanceCount;
     ByteAddressBuffer payload;
 };
 
@@ -64,10 +112,69 @@ SplatScene loadSplatScene()
     scene.vertexCount = min(g_splatMetadataBuffer[0], 125000);
 #endif
     scene.stride = g_splatMetadataBuffer[1];
+    scene.instanceCount = g_splatMetadataBuffer[2];
     scene.payload = g_splatPayloadBuffer;
     return scene;
 }
 
+// Instanced scenes (instancing.py) share asset payloads between many placements. Their metadata buffer holds
+// [instance splat count, stride, instance count, 0], the first instance splat of every instance (instance count + 1
+// entries) then INSTANCE_RECORD_DWORDS per instance: the 3x4 object to world rows, tint, largest axis scale, first splat
+// of the asset in the payload and the mask of the batch views seeing the instance.
+// Splat ids are instance splat ids, scenes with an instance count of 0 are not instanced.
+// keep in sync with instancing.py
+#define INSTANCE_METADATA_OFFSET 4
+#define INSTANCE_RECORD_DWORDS 20
+
+struct SplatInstance
+{
+    float3x4 transform;
+    float3 tint;
+    float maxScale;
+    uint splatIndex;
+    uint viewMask;
+};
+
+SplatInstance loadSplatInstance(SplatScene scene, uint splatID)
+{
+    SplatInstance instance;
+    if (scene.instanceCount == 0)
+    {
+        instance.transform = float3x4(1,0,0,0, 0,1,0,0, 0,0,1,0);
+        instance.tint = float3(1,1,1);
+        instance.maxScale = 1.0;
+        instance.splatIndex = splatID;
+        instance.viewMask = ~0u;
+        return instance;
+    }
+
+    // last instance starting at or before splatID
+    uint lo = 0;
+    uint hi = scene.instanceCount;
+    while (hi - lo > 1)
+    {
+        uint mid = (lo + hi) / 2;
+        if (g_splatMetadataBuffer[INSTANCE_METADATA_OFFSET + mid] <= splatID)
+            lo = mid;
+        else
+            hi = mid;
+    }
+
+    uint record = INSTANCE_METADATA_OFFSET + scene.instanceCount + 1 + lo * INSTANCE_RECORD_DWORDS;
+    [unroll]
+    for (uint row = 0; row < 3; ++row)
+    {
+        instance.transform[row] = asfloat(uint4(
+            g_splatMetadataBuffer[record + 4 * row], g_splatMetadataBuffer[record + 4 * row + 1],
+            g_splatMetadataBuffer[record + 4 * row + 2], g_splatMetadataBuffer[record + 4 * row + 3]));
+    }
+    instance.tint = asfloat(uint3(g_splatMetadataBuffer[record + 12], g_splatMetadataBuffer[record + 13], g_splatMetadataBuffer[record + 14]));
+    instance.maxScale = asfloat(g_splatMetadataBuffer[record + 15]);
+    instance.splatIndex = g_splatMetadataBuffer[record + 16] + splatID - g_splatMetadataBuffer[INSTANCE_METADATA_OFFSET + lo];
+    instance.viewMask = g_splatMetadataBuffer[record + 17];
+    return instance;
+}
+
 #define SPLAT_POS_OFFSET 0
 #define SPLAT_ALPHA_OFFSET (54 << 2)
 #define SPLAT_SCALE_OFFSET (55 << 2)
@@ -289,26 +396,104 @@ void decomposeCovariance(float3 cov2d, out float2 v1, out float2 v2)
 
 /////
 
+// keep in sync with splat_rasterizer.py (MaxViewsPerBatch)
+#define BITS_PER_VIEW 4
 #define BITS_PER_TILEADDRESS 14
-#define BITS_PER_CLIP_Z (32 - BITS_PER_TILEADDRESS)
-uint packCoarseTile(uint tileAddress, float clipZPos)
+#define BITS_PER_CLIP_Z (32 - BITS_PER_TILEADDRESS - BITS_PER_VIEW)
+#define CLIP_Z_RANGE 600.0
+uint quantizeClipZ(float clipZPos)
+{
+    return (uint)(saturate(clipZPos) * (float)((1 << BITS_PER_CLIP_Z) - 1)) & ((1 << BITS_PER_CLIP_Z) - 1);
+}
+
+uint packCoarseTile(uint viewIndex, uint tileAddress, float clipZPos)
 {
 
+    uint packedView = (viewIndex & ((1 << BITS_PER_VIEW) - 1));
     uint packedTileAddress = (tileAddress & ((1 << BITS_PER_TILEADDRESS) - 1));
-    uint packedZ = (uint)(saturate(clipZPos) * (float)((1 << BITS_PER_TILEADDRESS) - 1)) & ((1 << BITS_PER_TILEADDRESS) - 1);
-    return (packedTileAddress << BITS_PER_TILEADDRESS) | packedZ;
+    uint packedZ = quantizeClipZ(clipZPos);
+    return (packedView << (BITS_PER_TILEADDRESS + BITS_PER_CLIP_Z)) | (packedTileAddress << BITS_PER_CLIP_Z) | packedZ;
 }
 
-void unpackCoarseTile(uint coarseTile, out uint tileAddress, out float clipZPos)
+void unpackCoarseTile(uint coarseTile, out uint viewIndex, out uint tileAddress, out float clipZPos)
 {
-    tileAddress = coarseTile >> BITS_PER_TILEADDRESS;
-    clipZPos = (coarseTile & ((1 << BITS_PER_TILEADDRESS) - 1)) / (float)((1 << BITS_PER_TILEADDRESS) - 1);
+    viewIndex = coarseTile >> (BITS_PER_TILEADDRESS + BITS_PER_CLIP_Z);
+    tileAddress = (coarseTile >> BITS_PER_CLIP_Z) & ((1 << BITS_PER_TILEADDRESS) - 1);
+    clipZPos = (coarseTile & ((1 << BITS_PER_CLIP_Z) - 1)) / (float)((1 << BITS_PER_CLIP_Z) - 1);
 }
 
+StructuredBuffer<ViewConstants> g_viewConstantsArray : register(t2);
+Buffer<uint> g_occlusionTileDepths : register(t3);
 RWBuffer<uint> g_outCoarseTileRecordCounter : register(u0);
 RWBuffer<uint> g_outCoarseTileRecordBuffer : register(u1);
 RWBuffer<uint> g_outCoarseTileRecordSplatIdBuffer : register(u2);
+RWBuffer<uint> g_outViewStats : register(u3);
+
+// per view counters written by csCoarseTileBin, keep in sync with ViewStatsSize in splat_rasterizer.py
+#define VIEW_STATS_VISIBLE_SPLATS 0
+#define VIEW_STATS_TILE_RECORDS 1
+#define VIEW_STATS_OCCLUDED_SPLATS 2
+#define VIEW_STATS_OCCLUDED_TILE_RECORDS 3
+#define VIEW_STATS_SORT_FALLBACK_RECORDS 4
+#define VIEW_STATS_SIZE 5
+
+// uv bounds of a splat's bounding sphere in a view, false when it is outside of the view.
+bool splatScreenBounds(float3 worldPos, float rad, float4x4 viewMatrix, float4x4 projMatrix, out float3 viewPos, out float2 aabbBegin, out float2 aabbEnd)
+{
+    viewPos = mul(viewMatrix, float4(worldPos, 1.0)).xyz;
+    float4 clipPos = mul(projMatrix, float4(viewPos, 1.0));
+    aabbBegin = float2(0,0);
+    aabbEnd = float2(0,0);
+    if (any(abs(clipPos.z) >= clipPos.w) || any(abs(clipPos.xy) >= clipPos.w * 2.0))
+        return false;
 
+    float4 clipEnd = mul(projMatrix, float4(viewPos + rad, 1.0));
+
+    float2 uvCenter = ndcToUv(clipPos.xy / clipPos.w);
+    float2 uvCorner = ndcToUv(clipEnd.xy / clipEnd.w);
+    float2 uvDiff = abs(uvCorner - uvCenter);
+    aabbBegin = uvCenter - uvDiff;
+    aabbEnd = uvCenter + uvDiff;
+
+    return !(any(aabbBegin >= float2(1.0,1.0)) || any(aabbEnd <= float2(0.0,0.0)));
+}
+
+// Occlusion culling, keep OCCLUSION_MAX_TEST_TILES in sync with cpu_rasterizer.py. True when, in the previous frame of the
+// view, the splat was inside the view and sorted before the opaque depth (csRasterSplats) of every tile its bounds
+// covered, dilated by a tile for the camera motion. Tiles whose opaque surface moved by more than that do not occlude.
+#define OCCLUSION_MAX_TEST_TILES 64
+bool isSplatOccluded(float3 worldPos, float rad, ViewConstants viewConstants)
+{
+    float3 viewPos;
+    float2 aabbBegin, aabbEnd;
+    if (!splatScreenBounds(worldPos, rad, viewConstants.occlusionView, viewConstants.occlusionProj, viewPos, aabbBegin, aabbEnd))
+        return false;
+
+    if (any(aabbBegin < float2(0.0,0.0)) || any(aabbEnd > float2(1.0,1.0)))
+        return false;
+
+    int2 tileMax = (int2)viewConstants.coarseTileViewDims - 1;
+    int2 tileBegin = clamp((int2)floor(aabbBegin * (float2)viewConstants.viewSize / float(COARSE_TILE_SIZE)) - 1, int2(0,0), tileMax);
+    int2 tileEnd = clamp((int2)floor(aabbEnd * (float2)viewConstants.viewSize / float(COARSE_TILE_SIZE)) + 1, int2(0,0), tileMax);
+    int2 tileRect = tileEnd - tileBegin + 1;
+    if (tileRect.x * tileRect.y > OCCLUSION_MAX_TEST_TILES)
+        return false;
+
+    uint depthKey = quantizeClipZ(abs(viewPos.z) / CLIP_Z_RANGE);
+    for (int i = tileBegin.x; i <= tileEnd.x; ++i)
+    {
+        for (int j = tileBegin.y; j <= tileEnd.y; ++j)
+        {
+            float tileDepth = asfloat(g_occlusionTileDepths[viewConstants.viewTileRangeOffset + i + j * viewConstants.coarseTileViewDims.x]);
+            if (depthKey >= quantizeClipZ(tileDepth / CLIP_Z_RANGE) || tileDepth * COARSE_TILE_SIZE < viewConstants.occlusionParallax)
+                return false;
+        }
+    }
+    return true;
+}
+
+// Bins every splat against every view of the batch. One dispatch row (y) per view,
+// all views append to the same record list so a single sort covers the whole batch.
 #define COARSE_TILE_BIN_THREADS 128
 [numthreads(COARSE_TILE_BIN_THREADS, 1, 1)]
 void csCoarseTileBin(uint3 dti : SV_DispatchThreadID, uint gti : SV_GroupThreadID)
@@ -319,45 +504,51 @@ void csCoarseTileBin(uint3 dti : SV_DispatchThreadID, uint gti : SV_GroupThreadI
     if (threadID >= splatScene.vertexCount)
         return;
 
+    ViewConstants viewConstants = g_viewConstantsArray[dti.y];
     uint splatID = threadID;
-    float3 worldPos = loadSplatPosition(splatScene, splatID);
-    float3 viewPos = worldToView(worldPos);
-    float4 clipPos = viewToClip(viewPos);
-    if (any(abs(clipPos.z) >= clipPos.w) || any(abs(clipPos.xy) >= clipPos.w * 2.0))
+    SplatInstance instance = loadSplatInstance(splatScene, splatID);
+    if ((instance.viewMask & (1u << viewConstants.viewIndex)) == 0)
         return;
 
-    float3 splatScale = loadSplatScale(splatScene, splatID);
-    float rad = length(splatScale);
-    float4 clipEnd = viewToClip(viewPos + rad);
-
-    float2 uvCenter = ndcToUv(clipPos.xy / clipPos.w);
-    float2 uvCorner = ndcToUv(clipEnd.xy / clipEnd.w);
-    float2 uvDiff = abs(uvCorner - uvCenter);
-    float2 aabbBegin = uvCenter - uvDiff;
-    float2 aabbEnd = uvCenter + uvDiff;
-
-    if (any(aabbBegin >= float2(1.0,1.0)) || any(aabbEnd <= float2(0.0,0.0)))
+    float3 worldPos = mul(instance.transform, float4(loadSplatPosition(splatScene, instance.splatIndex), 1.0));
+    float3 splatScale = loadSplatScale(splatScene, instance.splatIndex);
+    float rad = length(splatScale) * instance.maxScale;
+    float3 viewPos;
+    float2 aabbBegin, aabbEnd;
+    if (!splatScreenBounds(worldPos, rad, viewConstants.view, viewConstants.proj, viewPos, aabbBegin, aabbEnd))
         return;
 
     aabbBegin = saturate(aabbBegin);
     aabbEnd = saturate(aabbEnd);
     
-    int2 tileBegin = (int2)floor(aabbBegin.xy * (float2)g_viewSize / float(COARSE_TILE_SIZE));
-    int2 tileEnd = (int2)floor(aabbEnd.xy * (float2)g_viewSize / float(COARSE_TILE_SIZE));
+    int2 tileBegin = (int2)floor(aabbBegin.xy * (float2)viewConstants.viewSize / float(COARSE_TILE_SIZE));
+    int2 tileEnd = (int2)floor(aabbEnd.xy * (float2)viewConstants.viewSize / float(COARSE_TILE_SIZE));
+
+    uint2 tileRect = (uint2)(tileEnd - tileBegin + 1);
+    uint statsOffset = viewConstants.viewIndex * VIEW_STATS_SIZE;
+    if (viewConstants.occlusionCulling != 0 && isSplatOccluded(worldPos, rad, viewConstants))
+    {
+        InterlockedAdd(g_outViewStats[statsOffset + VIEW_STATS_OCCLUDED_SPLATS], 1);
+        InterlockedAdd(g_outViewStats[statsOffset + VIEW_STATS_OCCLUDED_TILE_RECORDS], tileRect.x * tileRect.y);
+        return;
+    }
+
+    InterlockedAdd(g_outViewStats[statsOffset + VIEW_STATS_VISIBLE_SPLATS], 1);
+    InterlockedAdd(g_outViewStats[statsOffset + VIEW_STATS_TILE_RECORDS], tileRect.x * tileRect.y);
 
     for (int i = tileBegin.x; i <= tileEnd.x; ++i)
     {
         for (int j = tileBegin.y; j <= tileEnd.y; ++j)
         {
             uint2 tileCoord = int2(i, j);
-            uint tileAddress = tileCoord.x + tileCoord.y * g_coarseTileViewDims.x;
+            uint tileAddress = tileCoord.x + tileCoord.y * viewConstants.coarseTileViewDims.x;
             uint coarseTileOffset = 0;
             uint globalOffset = 0;
             InterlockedAdd(g_outCoarseTileRecordCounter[0], 1, globalOffset);
 
-            if (globalOffset < g_coarseTileRecordMax)
+            if (globalOffset < viewConstants.coarseTileRecordMax)
             {
-                uint packedTile = packCoarseTile(tileAddress, abs(viewPos.z) / 600.0);
+                uint packedTile = packCoarseTile(viewConstants.viewIndex, tileAddress, abs(viewPos.z) / CLIP_Z_RANGE);
                 g_outCoarseTileRecordBuffer[globalOffset] = packedTile;
                 g_outCoarseTileRecordSplatIdBuffer[globalOffset] = splatID;
             }
@@ -377,6 +568,7 @@ void csCreateCoarseTileDispatchArgs(int3 dti : SV_DispatchThreadID)
 Buffer<uint> g_createListRecordCountBuffer : register(t0);
 Buffer<uint> g_createListOrdering : register(t1);
 Buffer<uint> g_createListRecords : register(t2);
+StructuredBuffer<ViewConstants> g_createListViewConstantsArray : register(t3);
 RWBuffer<uint> g_outTileListRanges : register(u0);
 
 #define COARSE_TILE_LIST_GROUP_SIZE 64
@@ -401,9 +593,16 @@ void csCreateCoarseTileListRanges(uint3 dti : SV_DispatchThreadID, uint3 gti : S
     uint packedRecord1 = gs_sortedKeys[gti.x + 1];
 
     float unusedZ;
+    uint viewIndex0, viewIndex1;
     uint tileAddress0, tileAddress1;
-    unpackCoarseTile(packedRecord0, tileAddress0, unusedZ);
-    unpackCoarseTile(packedRecord1, tileAddress1, unusedZ);
+    unpackCoarseTile(packedRecord0, viewIndex0, tileAddress0, unusedZ);
+    unpackCoarseTile(packedRecord1, viewIndex1, tileAddress1, unusedZ);
+
+    // tile ranges of all the views live in the same buffer, each view at its own offset.
+    if (packedRecord0 != ~0u)
+        tileAddress0 += g_createListViewConstantsArray[viewIndex0].viewTileRangeOffset;
+    if (packedRecord1 != ~0u)
+        tileAddress1 += g_createListViewConstantsArray[viewIndex1].viewTileRangeOffset;
 
     if (dti.x == 0)
         g_outTileListRanges[2 * tileAddress0] = dti.x;
@@ -421,13 +620,400 @@ void csCreateCoarseTileListRanges(uint3 dti : SV_DispatchThreadID, uint3 gti : S
     }
 }
 
+// Per tile local sort (SplatRaster.sort_mode "local"), instead of the global radix sort of the packed records:
+// csCountTileRecords counts the records of every tile of the batch, their prefix sum (prefix_sum.py) gives the tile
+// list ranges (csCreateLocalSortRanges), csScatterTileRecords writes the record indices into their tile's range and
+// csLocalSortTiles sorts every tile by the full float view depth of its splats in groupshared memory. Tiles with more
+// than LOCAL_SORT_MAX_RECORDS records write (tile, depth) keys instead, sorted by the global radix sort over those
+// records only, and csResolveLocalSortFallback writes them back in order.
+// keep in sync with splat_rasterizer.py / cpu_rasterizer.py
+#define LOCAL_SORT_MAX_RECORDS 2048
+#define LOCAL_SORT_THREADS 256
+#define LOCAL_SORT_GROUPS_X 256
+
+StructuredBuffer<ViewConstants> g_localSortViewConstantsArray : register(t2);
+
+// batch tile (tile range offset of the view + tile address) of a packed record.
+uint localSortRecordTile(uint packedRecord)
+{
+    float unusedZ;
+    uint viewIndex, tileAddress;
+    unpackCoarseTile(packedRecord, viewIndex, tileAddress, unusedZ);
+    return g_localSortViewConstantsArray[viewIndex].viewTileRangeOffset + tileAddress;
+}
+
+// views of the batch own consecutive tile ranges, in batch order.
+uint localSortTileView(uint tileIndex)
+{
+    uint viewIndex = 0;
+    for (uint v = 1; v < g_viewCount; ++v)
+    {
+        if (g_localSortViewConstantsArray[v].viewTileRangeOffset <= tileIndex)
+            viewIndex = v;
+    }
+    return viewIndex;
+}
+
+// (tile, depth) key of the fallback radix sort, the depth gets the bits the batch tile index leaves.
+uint localSortFallbackKey(uint tileIndex, float viewDepth)
+{
+    uint depthBits = 31 - firstbithigh(max(g_tileRangeCount - 1, 1));
+    uint depthMask = (1u << depthBits) - 1;
+    return (tileIndex << depthBits) | min((uint)(saturate(viewDepth / CLIP_Z_RANGE) * (float)depthMask), depthMask);
+}
+
+Buffer<uint> g_localSortRecordCounter : register(t0);
+Buffer<uint> g_localSortRecords : register(t1);
+RWBuffer<uint> g_outTileRecordCounts : register(u0);
+
+[numthreads(64,1,1)]
+void csCountTileRecords(uint3 dti : SV_DispatchThreadID)
+{
+    if (dti.x >= min(g_localSortRecordCounter[0], g_coarseTileRecordMax))
+        return;
+
+    InterlockedAdd(g_outTileRecordCounts[localSortRecordTile(g_localSortRecords[dti.x])], 1);
+}
+
+Buffer<uint> g_localSortTileRecordEnds : register(t0);
+Buffer<uint> g_localSortTileRecordCounts : register(t1);
+RWBuffer<uint> g_outLocalSortRanges : register(u0);
+RWBuffer<uint> g_outLocalSortFallbackCounts : register(u1);
+RWBuffer<uint> g_outLocalSortFallbackCounter : register(u2);
+
+// One thread per tile of the batch, ranges from the inclusive prefix sum of the tile record counts. Fallback counts
+// are the record counts of the tiles over LOCAL_SORT_MAX_RECORDS, 0 for the others.
+[numthreads(64,1,1)]
+void csCreateLocalSortRanges(uint3 dti : SV_DispatchThreadID)
+{
+    uint tileIndex = dti.x;
+    if (tileIndex >= g_tileRangeCount)
+        return;
+
+    uint recordCount = g_localSortTileRecordCounts[tileIndex];
+    uint tileEnd = g_localSortTileRecordEnds[tileIndex];
+    g_outLocalSortRanges[2 * tileIndex] = tileEnd - recordCount;
+    g_outLocalSortRanges[2 * tileIndex + 1] = tileEnd;
+
+    bool fallback = recordCount > LOCAL_SORT_MAX_RECORDS;
+    g_outLocalSortFallbackCounts[tileIndex] = fallback ? recordCount : 0;
+    if (fallback)
+    {
+        InterlockedAdd(g_outLocalSortFallbackCounter[0], recordCount);
+        InterlockedAdd(g_outViewStats[g_localSortViewConstantsArray[localSortTileView(tileIndex)].viewIndex * VIEW_STATS_SIZE + VIEW_STATS_SORT_FALLBACK_RECORDS], recordCount);
+    }
+}
+
+Buffer<uint> g_scatterTileListRanges : register(t3);
+RWBuffer<uint> g_outScatterTileRecordCounts : register(u0);
+RWBuffer<uint> g_outScatterTileListOrdering : register(u1);
+
+// Counts down the tile record counts (left at 0) to place every record in its tile's range, in no particular order.
+[numthreads(64,1,1)]
+void csScatterTileRecords(uint3 dti : SV_DispatchThreadID)
+{
+    uint recordIndex = dti.x;
+    if (recordIndex >= min(g_localSortRecordCounter[0], g_coarseTileRecordMax))
+        return;
+
+    uint tileIndex = localSortRecordTile(g_localSortRecords[recordIndex]);
+    uint remaining = 0;
+    InterlockedAdd(g_outScatterTileRecordCounts[tileIndex], 0xffffffff, remaining);
+    g_outScatterTileListOrdering[g_scatterTileListRanges[2 * tileIndex + 1] - remaining] = recordIndex;
+}
+
+//Buffer<uint> g_splatMetadataBuffer : register(t0);
+//ByteAddressBuffer g_splatPayloadBuffer : register(t1);
+Buffer<uint> g_sortTileListRanges : register(t3);
+Buffer<uint> g_sortTileListSplatIDs : register(t4);
+Buffer<uint> g_sortFallbackEnds : register(t5);
+RWBuffer<uint> g_outSortTileListOrdering : register(u0);
+RWBuffer<uint> g_outSortFallbackKeys : register(u1);
+
+groupshared uint gs_localSortKeys[LOCAL_SORT_MAX_RECORDS];
+groupshared uint gs_localSortValues[LOCAL_SORT_MAX_RECORDS];
+
+// One group per tile of the batch: bitonic sort of the (view depth, record index) of the tile's records, the depth as
+// uint orders like the float since it is positive. Padding entries are ~0 and land after the records.
+[numthreads(LOCAL_SORT_THREADS,1,1)]
+void csLocalSortTiles(uint3 gid : SV_GroupID, uint gti : SV_GroupIndex)
+{
+    SplatScene splatScene = loadSplatScene();
+
+    uint tileIndex = gid.x + gid.y * LOCAL_SORT_GROUPS_X;
+    if (tileIndex >= g_tileRangeCount)
+        return;
+
+    uint tileBegin = g_sortTileListRanges[2 * tileIndex];
+    uint recordCount = g_sortTileListRanges[2 * tileIndex + 1] - tileBegin;
+    if (recordCount <= 1)
+        return;
+
+    float4x4 viewMatrix = g_localSortViewConstantsArray[localSortTileView(tileIndex)].view;
+    uint i;
+    if (recordCount > LOCAL_SORT_MAX_RECORDS)
+    {
+        uint fallbackBegin = g_sortFallbackEnds[tileIndex] - recordCount;
+        for (i = gti; i < recordCount; i += LOCAL_SORT_THREADS)
+        {
+            uint splatID = g_sortTileListSplatIDs[g_outSortTileListOrdering[tileBegin + i]];
+            SplatInstance instance = loadSplatInstance(splatScene, splatID);
+            float3 worldPos = mul(instance.transform, float4(loadSplatPosition(splatScene, instance.splatIndex), 1.0));
+            g_outSortFallbackKeys[fallbackBegin + i] = localSortFallbackKey(tileIndex, abs(mul(viewMatrix, float4(worldPos, 1.0)).z));
+        }
+        return;
+    }
+
+    uint sortCount = 2u << firstbithigh(recordCount - 1);
+    for (i = gti; i < sortCount; i += LOCAL_SORT_THREADS)
+    {
+        uint key = ~0u;
+        uint recordIndex = ~0u;
+        if (i < recordCount)
+        {
+            recordIndex = g_outSortTileListOrdering[tileBegin + i];
+            SplatInstance instance = loadSplatInstance(splatScene, g_sortTileListSplatIDs[recordIndex]);
+            float3 worldPos = mul(instance.transform, float4(loadSplatPosition(splatScene, instance.splatIndex), 1.0));
+            key = asuint(abs(mul(viewMatrix, float4(worldPos, 1.0)).z));
+        }
+        gs_localSortKeys[i] = key;
+        gs_localSortValues[i] = recordIndex;
+    }
+
+    GroupMemoryBarrierWithGroupSync();
+
+    for (uint k = 2; k <= sortCount; k <<= 1)
+    {
+        for (uint j = k >> 1; j > 0; j >>= 1)
+        {
+            for (i = gti; i < sortCount; i += LOCAL_SORT_THREADS)
+            {
+                uint partner = i ^ j;
+                if (partner > i)
+                {
+                    uint2 a = uint2(gs_localSortKeys[i], gs_localSortValues[i]);
+                    uint2 b = uint2(gs_localSortKeys[partner], gs_localSortValues[partner]);
+                    bool greater = a.x > b.x || (a.x == b.x && a.y > b.y);
+                    if (greater == ((i & k) == 0))
+                    {
+                        gs_localSortKeys[i] = b.x;
+                        gs_localSortValues[i] = b.y;
+                        gs_localSortKeys[partner] = a.x;
+                        gs_localSortValues[partner] = a.y;
+                    }
+                }
+            }
+            GroupMemoryBarrierWithGroupSync();
+        }
+    }
+
+    for (i = gti; i < recordCount; i += LOCAL_SORT_THREADS)
+        g_outSortTileListOrdering[tileBegin + i] = gs_localSortValues[i];
+}
+
+Buffer<uint> g_resolveTileListRanges : register(t0);
+Buffer<uint> g_resolveFallbackEnds : register(t1);
+Buffer<uint> g_resolveFallbackOrdering : register(t2);
+RWBuffer<uint> g_outResolveTileListOrdering : register(u0);
+RWBuffer<uint> g_outResolveFallbackRecords : register(u1);
+
+// One group per tile of the batch, tiles over LOCAL_SORT_MAX_RECORDS only. Their keys sort by tile first, so a tile's
+// sorted keys sit at the same fallback range it wrote them to: gather the record indices in that order, then write
+// them back over the tile's range.
+[numthreads(LOCAL_SORT_THREADS,1,1)]
+void csResolveLocalSortFallback(uint3 gid : SV_GroupID, uint gti : SV_GroupIndex)
+{
+    uint tileIndex = gid.x + gid.y * LOCAL_SORT_GROUPS_X;
+    if (tileIndex >= g_tileRangeCount)
+        return;
+
+    uint tileBegin = g_resolveTileListRanges[2 * tileIndex];
+    uint recordCount = g_resolveTileListRanges[2 * tileIndex + 1] - tileBegin;
+    if (recordCount <= LOCAL_SORT_MAX_RECORDS)
+        return;
+
+    uint fallbackBegin = g_resolveFallbackEnds[tileIndex] - recordCount;
+    uint i;
+    for (i = gti; i < recordCount; i += LOCAL_SORT_THREADS)
+        g_outResolveFallbackRecords[fallbackBegin + i] = g_outResolveTileListOrdering[tileBegin + g_resolveFallbackOrdering[fallbackBegin + i] - fallbackBegin];
+
+    DeviceMemoryBarrierWithGroupSync();
+
+    for (i = gti; i < recordCount; i += LOCAL_SORT_THREADS)
+        g_outResolveTileListOrdering[tileBegin + i] = g_outResolveFallbackRecords[fallbackBegin + i];
+}
+
+// radiance (color * opacity, opacity) of a splat at screenUv of a view.
+float4 splatRadiance(SplatScene splatScene, uint splatID, float2 screenUv, float4x4 viewMatrix, float4x4 projMatrix, uint2 viewSize)
+{
+    SplatInstance instance = loadSplatInstance(splatScene, splatID);
+    float3 splatPos = mul(instance.transform, float4(loadSplatPosition(splatScene, instance.splatIndex), 1.0));
+    float3 splatScale = loadSplatScale(splatScene, instance.splatIndex);
+    float4 splatRotation = loadSplatRotation(splatScene, instance.splatIndex);
+    float3 splatCol = max(loadSplatColor(splatScene, instance.splatIndex), float3(0,0,0)) * instance.tint;
+    float splatAlpha = loadSplatAlpha(splatScene, instance.splatIndex);
+
+    // instance covariance: A * R * S * (A * R * S)^T, A the linear part of the instance transform
+    float3x3 splatTransform = mul((float3x3)instance.transform, calcMatrixFromRotationScale(splatRotation, splatScale));
+
+    float3 cov3d0, cov3d1;
+    calcCovariance3D(splatTransform, cov3d0, cov3d1);
+
+    float4 splatClipPos = mul(projMatrix, mul(viewMatrix, float4(splatPos, 1.0)));
+    float2 splatScreenUv = clipToUv(splatClipPos);
+    float3 cov2d = calcCovariance2D(splatPos, cov3d0, cov3d1, viewMatrix, projMatrix, (float)viewSize.x);
+
+    float2 axis0, axis1;
+    decomposeCovariance(cov2d, axis0, axis1);
+
+    float lenAxis0 = dot(axis0, axis0);
+    float lenAxis1 = dot(axis1, axis1);
+
+    axis0 *= 2;
+    axis1 *= 2;
+
+    float2 splatRelUv = (splatScreenUv - screenUv) * (float2)viewSize;
+    float2 localCoord = float2(dot(axis0, splatRelUv), dot(axis1, splatRelUv))/float2(lenAxis0, lenAxis1);
+
+    float splatOpacity = exp(-dot(localCoord, localCoord)) * saturate(splatAlpha);
+    return float4(splatCol * splatOpacity, splatOpacity);
+}
+
+// col = radiance + col * (1 - opacity): a run of splats blends to (color, transmittance = prod(1 - opacity)),
+// which is how the partials of split tiles merge back in order.
+float4 blendRadiance(float4 col, float4 radiance)
+{
+    col.rgb = radiance.rgb + col.rgb * (1.0 - radiance.a);
+    col.a = saturate(radiance.a + (1.0 - radiance.a) * col.a);
+    return col;
+}
+
+// Load balancing of heavy tiles. Tiles holding more than g_tileSegmentSplats records are split in segments of
+// g_tileSegmentSplats records, csRasterTileSegments rasters each segment in its own groups into a partial
+// (color, transmittance) per pixel and csRasterSplats merges the partials of the tile in list order.
+// g_tileSegmentSplats == 0 disables the split. Keep in sync with splat_rasterizer.py (TileSegmentPixels).
+#define TILE_SEGMENT_GROUP_SIZE 8
+#define TILE_SEGMENT_GROUPS ((COARSE_TILE_SIZE / TILE_SEGMENT_GROUP_SIZE) * (COARSE_TILE_SIZE / TILE_SEGMENT_GROUP_SIZE))
+#define TILE_SEGMENT_PIXELS (COARSE_TILE_SIZE * COARSE_TILE_SIZE)
+
+Buffer<uint> g_segmentTileListRanges : register(t0);
+StructuredBuffer<ViewConstants> g_segmentViewConstantsArray : register(t1);
+RWBuffer<uint> g_outTileSegmentCounter : register(u0);
+RWBuffer<uint4> g_outTileSegmentRecords : register(u1);
+RWBuffer<uint2> g_outTileSegments : register(u2);
+
+// One thread per tile of the batch. Segment records are (tile address in the view, record begin, record end, view index),
+// tile segments are (first segment, segment count), (0, 0) for tiles rastered as a whole.
+[numthreads(64,1,1)]
+void csCreateTileSegments(uint3 dti : SV_DispatchThreadID)
+{
+    uint tileAddress = dti.x;
+    if (tileAddress >= g_tileRangeCount)
+        return;
+
+    uint tileBegin = g_segmentTileListRanges[2 * tileAddress];
+    uint tileEnd = g_segmentTileListRanges[2 * tileAddress + 1];
+    uint recordCount = tileEnd > tileBegin ? tileEnd - tileBegin : 0;
+    if (g_tileSegmentSplats == 0 || recordCount <= g_tileSegmentSplats)
+    {
+        g_outTileSegments[tileAddress] = uint2(0, 0);
+        return;
+    }
+
+    // views of the batch own consecutive tile ranges, in batch order.
+    uint viewIndex = 0;
+    for (uint v = 1; v < g_viewCount; ++v)
+    {
+        if (g_segmentViewConstantsArray[v].viewTileRangeOffset <= tileAddress)
+            viewIndex = v;
+    }
+
+    uint segmentCount = (recordCount + g_tileSegmentSplats - 1) / g_tileSegmentSplats;
+    uint firstSegment = 0;
+    InterlockedAdd(g_outTileSegmentCounter[0], segmentCount, firstSegment);
+
+    // tiles that do not fit in the segment list are rastered as a whole, their slots are left empty.
+    bool fits = (firstSegment + segmentCount) <= g_tileSegmentMax;
+    uint viewTileAddress = tileAddress - g_segmentViewConstantsArray[viewIndex].viewTileRangeOffset;
+    for (uint s = 0; s < segmentCount && (firstSegment + s) < g_tileSegmentMax; ++s)
+    {
+        uint segmentBegin = tileBegin + s * g_tileSegmentSplats;
+        uint segmentEnd = min(segmentBegin + g_tileSegmentSplats, tileEnd);
+        g_outTileSegmentRecords[firstSegment + s] = fits ? uint4(viewTileAddress, segmentBegin, segmentEnd, viewIndex) : uint4(0, 0, 0, viewIndex);
+    }
+
+    g_outTileSegments[tileAddress] = fits ? uint2(firstSegment, segmentCount) : uint2(0, 0);
+}
+
+Buffer<uint> g_segmentArgsCounter : register(t0);
+RWBuffer<uint4> g_outSegmentArgs : register(u0);
+
+[numthreads(1,1,1)]
+void csCreateTileSegmentArgs(int3 dti : SV_DispatchThreadID)
+{
+    g_outSegmentArgs[0] = uint4(min(g_segmentArgsCounter[0], g_tileSegmentMax) * TILE_SEGMENT_GROUPS, 1, 1, 0);
+}
+
+//Buffer<uint> g_splatMetadataBuffer : register(t0);
+//ByteAddressBuffer g_splatPayloadBuffer : register(t1);
+Buffer<uint4> g_tileSegmentRecords : register(t2);
+Buffer<uint> g_segmentTileListOrdering : register(t3);
+Buffer<uint> g_segmentTileListSplatIDs : register(t4);
+StructuredBuffer<ViewConstants> g_segmentRasterViewConstantsArray : register(t5);
+RWBuffer<float4> g_outTileSegmentPartials : register(u0);
+
+// TILE_SEGMENT_GROUPS groups per segment, each covering 8x8 pixels of the segment's tile.
+[numthreads(TILE_SEGMENT_GROUP_SIZE, TILE_SEGMENT_GROUP_SIZE, 1)]
+void csRasterTileSegments(uint3 gid : SV_GroupID, uint3 gti : SV_GroupThreadID)
+{
+    SplatScene splatScene = loadSplatScene();
+
+    uint segmentIndex = gid.x / TILE_SEGMENT_GROUPS;
+    uint groupInTile = gid.x % TILE_SEGMENT_GROUPS;
+    uint2 pixelInTile = uint2(groupInTile % (COARSE_TILE_SIZE / TILE_SEGMENT_GROUP_SIZE), groupInTile / (COARSE_TILE_SIZE / TILE_SEGMENT_GROUP_SIZE)) * TILE_SEGMENT_GROUP_SIZE + gti.xy;
+
+    uint4 segment = g_tileSegmentRecords[segmentIndex];
+    ViewConstants viewConstants = g_segmentRasterViewConstantsArray[segment.w];
+    uint2 tileID = uint2(segment.x % viewConstants.coarseTileViewDims.x, segment.x / viewConstants.coarseTileViewDims.x);
+    float2 screenUv = (tileID * COARSE_TILE_SIZE + pixelInTile + 0.5) * viewConstants.viewSizeInv;
+
+    float4 col = float4(0,0,0,1.0);
+    float transmittance = 1.0;
+    for (uint i = segment.y; i < segment.z; ++i)
+    {
+        uint splatID = g_segmentTileListSplatIDs[g_segmentTileListOrdering[i]];
+        float4 radiance = splatRadiance(splatScene, splatID, screenUv, viewConstants.view, viewConstants.proj, viewConstants.viewSize);
+        col = blendRadiance(col, radiance);
+        transmittance *= 1.0 - radiance.a;
+    }
+
+    g_outTileSegmentPartials[segmentIndex * TILE_SEGMENT_PIXELS + pixelInTile.x + pixelInTile.y * COARSE_TILE_SIZE] = float4(col.rgb, transmittance);
+}
+
 //Buffer<uint> g_splatMetadataBuffer : register(t0);
 //ByteAddressBuffer g_splatPayloadBuffer : register(t1);
 Buffer<uint> g_tileListRanges : register(t2);
 Buffer<uint> g_tileListOrdering : register(t3);
 Buffer<uint> g_tileListSplatIDs : register(t4);
+Buffer<uint2> g_tileSegments : register(t5);
+Buffer<float4> g_tileSegmentPartials : register(t6);
 RWTexture2D<float4> g_colorBuffer : register(u0);
+RWBuffer<uint> g_outOpaqueTileDepths : register(u1);
+
+// view depth of the splat of a tile list record.
+float recordViewDepth(SplatScene splatScene, uint recordIndex)
+{
+    uint splatID = g_tileListSplatIDs[g_tileListOrdering[recordIndex]];
+    SplatInstance instance = loadSplatInstance(splatScene, splatID);
+    float3 worldPos = mul(instance.transform, float4(loadSplatPosition(splatScene, instance.splatIndex), 1.0));
+    return abs(mul(g_view, float4(worldPos, 1.0)).z);
+}
 
+// Records are blended over the ones before them (col = radiance + col * (1 - opacity)). The list is walked from its
+// last record, accumulating the same color front to back, so the transmittance tells where the pixel becomes opaque:
+// with g_occlusionOpacity > 0 the view depth of that record, min over the pixels of the tile, is the tile's opaque depth
+// (0 when a pixel never gets there) the next frame's occlusion culling compares against. Every pixel of the view writes
+// its tile, the view's buffer is cleared to infinity before.
 [numthreads(8,8,1)]
 void csRasterSplats(int3 dti : SV_DispatchThreadID)
 {
@@ -437,71 +1023,56 @@ void csRasterSplats(int3 dti : SV_DispatchThreadID)
         return;
 
     uint2 tileID = dti.xy / COARSE_TILE_SIZE;
-    uint tileAddress = tileID.x + tileID.y * g_coarseTileViewDims.x;
+    uint tileAddress = g_viewTileRangeOffset + tileID.x + tileID.y * g_coarseTileViewDims.x;
     int tileBegin = (int)g_tileListRanges[2 * tileAddress];
     int tileEnd = (int)g_tileListRanges[2 * tileAddress + 1];
 
     float2 screenUv = (dti.xy + 0.5) * float2(g_viewSizeInv.xy);
 
-    float4 col = float4(0,0,0,1.0);
+    float3 color = float3(0,0,0);
+    float transmittance = 1.0;
+    float opaqueTransmittance = 1.0 - g_occlusionOpacity;
+    float opaqueDepth = 0.0;
+    bool opaque = false;
     int tileCount = max(tileEnd - tileBegin, 0);
     //tileCount = min(tileCount, 500);
-    float weights = 0.0;
-    for (int i = 0; i < tileCount; ++i)
+
+    // split tile: merge the partials of its segments (rastered by csRasterTileSegments), from the last one.
+    uint2 tileSegments = g_tileSegments[tileAddress];
+    if (tileSegments.y > 0)
     {
-        uint tileOrdering = g_tileListOrdering[tileBegin + i];
+        uint pixelIndex = (dti.x % COARSE_TILE_SIZE) + (dti.y % COARSE_TILE_SIZE) * COARSE_TILE_SIZE;
+        for (uint s = tileSegments.y; s > 0; --s)
+        {
+            float4 partial = g_tileSegmentPartials[(tileSegments.x + s - 1) * TILE_SEGMENT_PIXELS + pixelIndex];
+            color += transmittance * partial.rgb;
+            transmittance *= partial.a;
+            if (!opaque && transmittance < opaqueTransmittance)
+            {
+                // somewhere in the segment, its first record is the nearest
+                opaque = true;
+                opaqueDepth = recordViewDepth(splatScene, tileBegin + (s - 1) * g_tileSegmentSplats);
+            }
+        }
+        tileCount = 0;
+    }
 
+    for (int i = tileCount - 1; i >= 0; --i)
+    {
+        uint tileOrdering = g_tileListOrdering[tileBegin + i];
         uint splatID = g_tileListSplatIDs[tileOrdering];
-        float3 splatPos = loadSplatPosition(splatScene, splatID);
-        float3 splatScale = loadSplatScale(splatScene, splatID);
-        float4 splatRotation = loadSplatRotation(splatScene, splatID);
-        float3 splatCol = max(loadSplatColor(splatScene, splatID), float3(0,0,0));
-        float splatAlpha = loadSplatAlpha(splatScene, splatID);
-    
-        float3x3 splatTransform = calcMatrixFromRotationScale(splatRotation, splatScale);
-
-        float3 cov3d0, cov3d1;
-        calcCovariance3D(splatTransform, cov3d0, cov3d1);
-
-        float4 splatClipPos = worldToClip(splatPos);
-        float2 splatScreenUv = clipToUv(splatClipPos);
-        float3 cov2d = calcCovariance2D(splatPos, cov3d0, cov3d1, g_view, g_proj, (float)g_viewSize.x);
-
-        float2 axis0, axis1;
-        decomposeCovariance(cov2d, axis0, axis1);
-
-        float lenAxis0 = dot(axis0, axis0);
-        float lenAxis1 = dot(axis1, axis1);
-
-		axis0 *= 2;
-		axis1 *= 2;
-		//axis0.y *= -1;	
-		//axis1.y *= -1;	
-
-        float2 splatRelUv = (splatScreenUv - screenUv) * (float2)g_viewSize;
-        splatRelUv = float2(dot(axis0, splatRelUv), dot(axis1, splatRelUv))/float2(lenAxis0, lenAxis1);
-
-        float2 localCoord = splatRelUv;
-        
-        float splatOpacity = exp(-dot(localCoord, localCoord)) * saturate(splatAlpha);
-        float4 radiance = float4(splatCol * splatOpacity, splatOpacity);
-#if 1
-        col.rgb = radiance.rgb + col.rgb * (1.0 - radiance.a);
-        col.a = saturate(radiance.a + (1.0 - radiance.a) * col.a);
-        //col += abs(exp(-dot(localCoord, localCoord))) * saturate(1.0 - col.a);
-#elif 0
-        float op = saturate(col.a);
-        col.rgb += radiance.rgb * (1.0 - op);
-        col.a = saturate(op + radiance.a);
-#else
-        float op = saturate(col.a);
-        float3 sampleCol = splatOpacity * splatCol;
-        if (length(localCoord) > 1.8)
-            sampleCol = 0;
-        col.rgb += sampleCol * (1.0 - op);
-        col.a = saturate(op + splatOpacity);
-#endif
+        float4 radiance = splatRadiance(splatScene, splatID, screenUv, g_view, g_proj, g_viewSize);
+        color += transmittance * radiance.rgb;
+        transmittance *= 1.0 - radiance.a;
+        if (!opaque && transmittance < opaqueTransmittance)
+        {
+            opaque = true;
+            opaqueDepth = recordViewDepth(splatScene, tileBegin + i);
+        }
     }
 
-    g_colorBuffer[dti.xy] = float4(col.rgb, col.a);
+    if (g_occlusionOpacity > 0.0 && all(dti.xy < g_viewSize.xy))
+        InterlockedMin(g_outOpaqueTileDepths[tileID.x + tileID.y * g_coarseTileViewDims.x], asuint(opaqueDepth));
+
+    g_colorBuffer[dti.xy] = float4(color, 1.0);
 }
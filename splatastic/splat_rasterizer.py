@@ -2,20 +2,183 @@ import coalpy.gpu as g
 import numpy
 from dataclasses import dataclass
 import math
+import time
 from . import utilities
 from . import camera
 from . import radix_sort
+from . import prefix_sum
+from . import lazy_shader
+from . import readback
+from . import resources
+from . import occlusion
 
 g_coarse_tile_record_bytes = 512 * 1024 * 1024
 
 CoarseTileSize = 32
 
+g_coarse_tile_bin_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CoarseTileBin", main_function = "csCoarseTileBin")
+g_create_coarse_tile_args_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateCoarseTileDispatchArgs", main_function = "csCreateCoarseTileDispatchArgs")
+g_create_coarse_tile_list_ranges_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateCoarseTileList", main_function = "csCreateCoarseTileListRanges")
+g_raster_splat_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="RasterSplats", main_function = "csRasterSplats")
+g_create_tile_segments_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateTileSegments", main_function = "csCreateTileSegments")
+g_create_tile_segment_args_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateTileSegmentArgs", main_function = "csCreateTileSegmentArgs")
+g_raster_tile_segments_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="RasterTileSegments", main_function = "csRasterTileSegments")
+g_count_tile_records_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CountTileRecords", main_function = "csCountTileRecords")
+g_create_local_sort_ranges_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateLocalSortRanges", main_function = "csCreateLocalSortRanges")
+g_scatter_tile_records_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="ScatterTileRecords", main_function = "csScatterTileRecords")
+g_local_sort_tiles_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="LocalSortTiles", main_function = "csLocalSortTiles")
+g_resolve_local_sort_fallback_shader = lazy_shader.LazyShader(file = "shaders/splat_rasterizer_cs.hlsl", name="ResolveLocalSortFallback", main_function = "csResolveLocalSortFallback")
+
 @dataclass
 class SplatRasterViewGpuInfo:
     coarse_tile_record_max : int = 0
     current_view_tile_records : int = 0
-    coarse_tile_records_counter_copy = None
-    resource_request = None
+    counter_readback = None
+
+#keep in sync with BITS_PER_VIEW in splat_rasterizer_cs.hlsl
+MaxViewsPerBatch = 16
+
+#number of dwords per view in the constant buffer / view constants array
+ViewConstantsSize = 84
+
+# Heavy tile load balancing: tiles with more than tile_segment_splats records are split in segments rastered by their
+# own groups, then merged in order (see csCreateTileSegments). Tiles that do not fit in the MaxTileSegments segments of
+# a batch are rastered as a whole. keep TileSegmentPixels in sync with TILE_SEGMENT_PIXELS in splat_rasterizer_cs.hlsl
+DefaultTileSegmentSplats = 2048
+MaxTileSegments = 2048
+TileSegmentPixels = CoarseTileSize * CoarseTileSize
+
+#per view counters written by the coarse tile bin, keep in sync with VIEW_STATS_* in splat_rasterizer_cs.hlsl
+ViewStatsVisibleSplats = 0
+ViewStatsTileRecords = 1
+ViewStatsOccludedSplats = 2
+ViewStatsOccludedTileRecords = 3
+ViewStatsSortFallbackRecords = 4
+ViewStatsSize = 5
+
+# Occlusion culling (see occlusion.py): views record the depth at which their tiles are opaque (transmittance below
+# 1 - occlusion_opacity) and the next frame's coarse tile bin skips the splats hidden behind it.
+# keep in sync with cpu_rasterizer.py
+DefaultOcclusionOpacity = 0.99
+# float infinity, opaque tile depths are cleared to it before the raster takes the min over the pixels of each tile.
+OpaqueTileDepthClear = 0x7f800000
+
+# Record sorting: "global" radix sorts the packed (view, tile, quantized depth) records of the batch, "local" counts /
+# scatters the records into their tile's range and sorts every tile by the full float view depth in groupshared
+# memory (see csLocalSortTiles). Tiles over LocalSortMaxRecords records fall back to a radix sort of their records.
+# keep LocalSortMaxRecords / LocalSortGroupsX in sync with LOCAL_SORT_* in splat_rasterizer_cs.hlsl
+SortModes = ["global", "local"]
+DefaultSortMode = "global"
+LocalSortMaxRecords = 2048
+LocalSortGroupsX = 256
+
+class SplatRasterView:
+
+    def __init__(self, view_id):
+        self.m_view_id = view_id
+        self.m_constants = None
+        self.m_constants_data = None
+        self.m_color_buffer = None
+        self.m_max_width = 0
+        self.m_max_height = 0
+        self.m_width = 0
+        self.m_height = 0
+        self.m_coarse_tile_count_x = 0
+        self.m_coarse_tile_count_y = 0
+        self.m_batch_index = 0
+        self.m_tile_range_offset = 0
+        self.m_opaque_tile_depths = None
+        self.m_occlusion = occlusion.OcclusionHistory()
+
+    @property
+    def view_id(self):
+        return self.m_view_id
+
+    @property
+    def color_buffer(self):
+        return self.m_color_buffer
+
+    # allocated size of color_buffer, grows to the largest width / height the view was rendered at.
+    @property
+    def color_buffer_size(self):
+        return (self.m_max_width, self.m_max_height)
+
+    @property
+    def constants(self):
+        return self.m_constants
+
+    @property
+    def width(self):
+        return self.m_width
+
+    @property
+    def height(self):
+        return self.m_height
+
+    @property
+    def coarse_tiles_dims(self):
+        return (self.m_coarse_tile_count_x, self.m_coarse_tile_count_y)
+
+    @property
+    def coarse_tile_count(self):
+        return self.m_coarse_tile_count_x * self.m_coarse_tile_count_y
+
+    @property
+    def tile_range_offset(self):
+        return self.m_tile_range_offset
+
+    # opaque depth of every coarse tile of the last raster of the view, when the rasterizer's occlusion culling is on.
+    @property
+    def opaque_tile_depths(self):
+        return self.m_opaque_tile_depths
+
+    # occlusion.OcclusionHistory of the view, occlusion.culling tells if the last raster culled.
+    @property
+    def occlusion(self):
+        return self.m_occlusion
+
+    def update_resources(self, width, height):
+        (self.m_width, self.m_height) = (width, height)
+        (self.m_coarse_tile_count_x, self.m_coarse_tile_count_y) = (int(math.ceil(width/CoarseTileSize)), int(math.ceil(height/CoarseTileSize)))
+
+        if self.m_constants is None:
+            self.m_constants = resources.buffer("splat_rasterizer", "SplatRasterConstants" + str(self.m_view_id), self,
+                stride = 4,
+                element_count = ViewConstantsSize,
+                usage = g.BufferUsage.Constant)
+
+        if width <= self.m_max_width and height <= self.m_max_height:
+            return
+
+        (self.m_max_width, self.m_max_height) = (max(width, self.m_max_width), max(height, self.m_max_height))
+        self.m_color_buffer = resources.texture("splat_rasterizer", "ColorBuffer" + str(self.m_view_id), self,
+            format = g.Format.RGBA_8_UNORM,
+            width = self.m_max_width, height = self.m_max_height)
+        self.m_opaque_tile_depths = resources.buffer("splat_rasterizer", "OpaqueTileDepths" + str(self.m_view_id), self,
+            format = g.Format.R32_UINT,
+            stride = 4,
+            element_count = int(math.ceil(self.m_max_width/CoarseTileSize)) * int(math.ceil(self.m_max_height/CoarseTileSize)))
+        # the previous depths were recorded in the old buffer
+        self.m_occlusion.reset()
+
+    def update_constants(self, view_matrix, proj_matrix, coarse_tile_record_max, batch_index, batch_count, tile_range_offset, tile_segment_splats = 0, tile_range_count = 0, occlusion_opacity = 0.0):
+        (self.m_batch_index, self.m_tile_range_offset) = (batch_index, tile_range_offset)
+        (width, height) = (self.m_width, self.m_height)
+        (coarse_tile_count_x, coarse_tile_count_y) = self.coarse_tiles_dims
+        self.m_constants_data = [
+            int(width), int(height), float(1.0/width), float(1.0/height),
+            int(coarse_tile_count_x), int(coarse_tile_count_y), float(1.0/coarse_tile_count_x), float(1.0/coarse_tile_count_y),
+            int(coarse_tile_record_max), int(batch_index), int(tile_range_offset), int(batch_count),
+        ]
+
+        self.m_constants_data.extend(view_matrix.transpose().flatten().tolist())
+        self.m_constants_data.extend(proj_matrix.transpose().flatten().tolist())
+        self.m_constants_data.extend([int(tile_segment_splats), int(MaxTileSegments), int(tile_range_count), 0])
+        (occlusion_view, occlusion_proj) = self.m_occlusion.prev_matrices
+        self.m_constants_data.extend(occlusion_view.transpose().flatten().tolist())
+        self.m_constants_data.extend(occlusion_proj.transpose().flatten().tolist())
+        self.m_constants_data.extend([int(self.m_occlusion.culling), float(occlusion_opacity), float(self.m_occlusion.parallax), 0])
+        return self.m_constants_data
 
 class SplatRaster:
 
@@ -24,50 +187,140 @@ class SplatRaster:
         self.m_coarse_tile_records = None
         self.m_coarse_tile_record_splat_ids = None
         self.m_coarse_tile_records_counter = None
+        self.m_view_stats = None
         self.m_coarse_tile_record_max = 0
         self.m_coarse_tile_list_ordering = None
         self.m_coarse_tile_list_ranges = None
-        self.m_color_buffer = None
-        self.m_constants = None
-        self.m_max_width = 0
-        self.m_max_height = 0
+        self.m_coarse_tile_list_ranges_count = 0
+        self.m_view_constants_array = None
+        self.m_tile_segment_splats = DefaultTileSegmentSplats
+        self.m_tile_segment_counter = None
+        self.m_tile_segment_args_buffer = None
+        self.m_tile_segment_records = None
+        self.m_tile_segment_partials = None
+        self.m_tile_segments = None
+        self.m_occlusion_culling = False
+        self.m_occlusion_opacity = DefaultOcclusionOpacity
+        self.m_occlusion_max_rotation = occlusion.DefaultMaxRotation
+        self.m_occlusion_tile_depths = None
+        self.m_sort_mode = DefaultSortMode
+        self.m_tile_record_counts = None
+        self.m_local_sort_fallback_counts = None
+        self.m_local_sort_fallback_counter = None
+        self.m_local_sort_ordering = None
+        self.m_local_sort_prefix_args = None
+        self.m_views = {}
+        self.m_last_view = None
         self.m_radix_sort_args = None
+        self.m_metrics = None
         self.init_shaders()
         return
 
     @property
     def color_buffer(self):
-        return self.m_color_buffer
+        return None if self.m_last_view is None else self.m_last_view.color_buffer
 
-    def init_shaders(self):
-        self.m_coarse_dispatch_bin_shader = g.Shader(file = "shaders/splat_rasterizer_cs.hlsl", name="CoarseTileBin", main_function = "csCoarseTileBin")
-        self.m_create_coarse_tile_args_shader = g.Shader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateCoarseTileDispatchArgs", main_function = "csCreateCoarseTileDispatchArgs")
-        self.m_create_coarse_tile_list_ranges_shader = g.Shader(file = "shaders/splat_rasterizer_cs.hlsl", name="CreateCoarseTileList", main_function = "csCreateCoarseTileListRanges")
-        self.m_raster_splat_shader = g.Shader(file = "shaders/splat_rasterizer_cs.hlsl", name="RasterSplats", main_function = "csRasterSplats")
+    @property
+    def coarse_tile_list_ranges(self):
+        return self.m_coarse_tile_list_ranges
 
-    def update_constants(self, cmd_list, view_matrix, proj_matrix, width, height, coarse_tile_count_x, coarse_tile_count_y):
-        constants_data = [
-            int(width), int(height), float(1.0/width), float(1.0/height),
-            int(coarse_tile_count_x), int(coarse_tile_count_y), float(1.0/coarse_tile_count_x), float(1.0/coarse_tile_count_y),
-            int(self.m_coarse_tile_record_max), 0, 0, 0,
-        ]
+    # optional metrics.FrameMetricsCollector, receives the per view counters of every rastered batch.
+    @property
+    def metrics(self):
+        return self.m_metrics
 
-        constants_data.extend(view_matrix.transpose().flatten().tolist())
-        constants_data.extend(proj_matrix.transpose().flatten().tolist())
+    @metrics.setter
+    def metrics(self, value):
+        self.m_metrics = value
 
-        if self.m_constants == None:
-            self.m_constants = g.Buffer(
-                name = "SplatRasterConstants",
-                stride = 4,
-                element_count = len(constants_data),
-                usage = g.BufferUsage.Constant)
+    # records per tile above which tiles are split across groups, 0 rasters every tile in a single pass.
+    @property
+    def tile_segment_splats(self):
+        return self.m_tile_segment_splats
+
+    @tile_segment_splats.setter
+    def tile_segment_splats(self, value):
+        self.m_tile_segment_splats = max(0, int(value))
+
+    # skip the splats hidden behind the opaque tiles of the view's previous frame, see occlusion.py.
+    @property
+    def occlusion_culling(self):
+        return self.m_occlusion_culling
+
+    @occlusion_culling.setter
+    def occlusion_culling(self, value):
+        self.m_occlusion_culling = bool(value)
+
+    # opacity at which a tile counts as opaque, the culled splats add less than 1 - occlusion_opacity to a pixel.
+    @property
+    def occlusion_opacity(self):
+        return self.m_occlusion_opacity
+
+    @occlusion_opacity.setter
+    def occlusion_opacity(self, value):
+        self.m_occlusion_opacity = min(max(float(value), 0.0), 1.0)
+
+    # camera rotation (radians) since the previous frame above which a view does not cull.
+    @property
+    def occlusion_max_rotation(self):
+        return self.m_occlusion_max_rotation
+
+    @occlusion_max_rotation.setter
+    def occlusion_max_rotation(self, value):
+        self.m_occlusion_max_rotation = float(value)
+
+    # one of SortModes, how the tile records of a batch get sorted.
+    @property
+    def sort_mode(self):
+        return self.m_sort_mode
+
+    @sort_mode.setter
+    def sort_mode(self, value):
+        if value not in SortModes:
+            raise Exception("Unknown sort mode %s, expected one of %s." % (value, ", ".join(SortModes)))
+        self.m_sort_mode = value
+
+    def get_view(self, view_id):
+        if view_id not in self.m_views:
+            self.m_views[view_id] = SplatRasterView(view_id)
+        return self.m_views[view_id]
 
-        cmd_list.upload_resource(source = constants_data, destination =  self.m_constants)
+    def release_view(self, view_id):
+        if view_id in self.m_views:
+            del self.m_views[view_id]
 
-    def update_view_resources(self, width, height, coarse_tile_count_x, coarse_tile_count_y):
+    def init_shaders(self):
+        # shared by all rasterizers, created (compiled) on their first dispatch unless lazy_shader.warm_up ran.
+        self.m_coarse_dispatch_bin_shader = g_coarse_tile_bin_shader
+        self.m_create_coarse_tile_args_shader = g_create_coarse_tile_args_shader
+        self.m_create_coarse_tile_list_ranges_shader = g_create_coarse_tile_list_ranges_shader
+        self.m_raster_splat_shader = g_raster_splat_shader
+        self.m_create_tile_segments_shader = g_create_tile_segments_shader
+        self.m_create_tile_segment_args_shader = g_create_tile_segment_args_shader
+        self.m_raster_tile_segments_shader = g_raster_tile_segments_shader
+        self.m_count_tile_records_shader = g_count_tile_records_shader
+        self.m_create_local_sort_ranges_shader = g_create_local_sort_ranges_shader
+        self.m_scatter_tile_records_shader = g_scatter_tile_records_shader
+        self.m_local_sort_tiles_shader = g_local_sort_tiles_shader
+        self.m_resolve_local_sort_fallback_shader = g_resolve_local_sort_fallback_shader
+
+    def update_constants(self, cmd_list, batch_views):
+        batch_data = []
+        for view in batch_views:
+            cmd_list.upload_resource(source = view.m_constants_data, destination = view.constants)
+            batch_data.extend(view.m_constants_data)
+
+        if self.m_view_constants_array is None:
+            self.m_view_constants_array = resources.buffer("splat_rasterizer", "SplatRasterViewConstantsArray", self,
+                type = g.BufferType.Structured,
+                stride = 4 * ViewConstantsSize,
+                element_count = MaxViewsPerBatch)
+
+        cmd_list.upload_resource(source = batch_data, destination = self.m_view_constants_array)
+
+    def update_view_resources(self, tile_range_count):
         if self.m_coarse_tile_args_buffer is None:
-            self.m_coarse_tile_args_buffer = g.Buffer(
-                "CoarseTileArgsBuffer",
+            self.m_coarse_tile_args_buffer = resources.buffer("splat_rasterizer", "CoarseTileArgsBuffer", self,
                 format = g.Format.RGBA_32_UINT,
                 usage = g.BufferUsage.IndirectArgs,
                 element_count = 1)
@@ -75,48 +328,98 @@ class SplatRaster:
         if self.m_coarse_tile_records is None:
             coarse_tile_record_stride = 4
             self.m_coarse_tile_record_max = utilities.divup(g_coarse_tile_record_bytes, coarse_tile_record_stride)
-            self.m_coarse_tile_records = g.Buffer(
-                "CoarseTileRecord",
+            self.m_coarse_tile_records = resources.buffer("splat_rasterizer", "CoarseTileRecord", self,
                 format = g.Format.R32_UINT,
                 stride = coarse_tile_record_stride,
                 element_count = self.m_coarse_tile_record_max)
-            self.m_coarse_tile_record_splat_ids = g.Buffer(
-                "CoarseTileSplatId",
+            self.m_coarse_tile_record_splat_ids = resources.buffer("splat_rasterizer", "CoarseTileSplatId", self,
                 format = g.Format.R32_UINT,
                 stride = coarse_tile_record_stride,
                 element_count = self.m_coarse_tile_record_max)
+            self.m_radix_sort_args = radix_sort.allocate_args(self.m_coarse_tile_record_max, output_ordering = True, is_indirect = True, lifetime = self)
 
         if self.m_coarse_tile_records_counter is None:
-            self.m_coarse_tile_records_counter = g.Buffer(
-                "CoarseTileRecordCounter",
+            self.m_coarse_tile_records_counter = resources.buffer("splat_rasterizer", "CoarseTileRecordCounter", self,
                 format = g.Format.R32_UINT,
                 stride = 4,
                 element_count = 1)
 
-        if width <= self.m_max_width and height <= self.m_max_height:
-            return
+        if self.m_view_stats is None:
+            self.m_view_stats = resources.buffer("splat_rasterizer", "SplatRasterViewStats", self,
+                format = g.Format.R32_UINT,
+                stride = 4,
+                element_count = ViewStatsSize * MaxViewsPerBatch)
 
-        self.m_radix_sort_args = radix_sort.allocate_args(self.m_coarse_tile_record_max, output_ordering = True, is_indirect = True)
+        if self.m_tile_segment_counter is None:
+            self.m_tile_segment_counter = resources.buffer("splat_rasterizer", "TileSegmentCounter", self,
+                format = g.Format.R32_UINT,
+                stride = 4,
+                element_count = 1)
+            self.m_tile_segment_args_buffer = resources.buffer("splat_rasterizer", "TileSegmentArgsBuffer", self,
+                format = g.Format.RGBA_32_UINT,
+                usage = g.BufferUsage.IndirectArgs,
+                element_count = 1)
+            self.m_tile_segment_records = resources.buffer("splat_rasterizer", "TileSegmentRecords", self,
+                format = g.Format.RGBA_32_UINT,
+                element_count = MaxTileSegments)
+            self.m_tile_segment_partials = resources.buffer("splat_rasterizer", "TileSegmentPartials", self,
+                format = g.Format.RGBA_32_FLOAT,
+                element_count = MaxTileSegments * TileSegmentPixels)
 
-        (self.m_max_width, self.m_max_height) = (width, height)
+        if self.m_sort_mode == "local" and self.m_local_sort_ordering is None:
+            self.m_local_sort_ordering = resources.buffer("splat_rasterizer", "LocalSortOrdering", self,
+                format = g.Format.R32_UINT,
+                stride = 4,
+                element_count = self.m_coarse_tile_record_max)
+            self.m_local_sort_fallback_counter = resources.buffer("splat_rasterizer", "LocalSortFallbackCounter", self,
+                format = g.Format.R32_UINT,
+                stride = 4,
+                element_count = 1)
 
-        self.m_color_buffer = g.Texture(
-            "ColorBuffer",
-            format = g.Format.RGBA_8_UNORM,
-            width = self.m_max_width, height = self.m_max_height)
+        if tile_range_count <= self.m_coarse_tile_list_ranges_count:
+            return
 
-        self.m_coarse_tile_list_ranges = g.Buffer(
-            "CoarseTileListRanges",
+        self.m_coarse_tile_list_ranges_count = tile_range_count
+        self.m_coarse_tile_list_ranges = resources.buffer("splat_rasterizer", "CoarseTileListRanges", self,
+            format = g.Format.R32_UINT, stride = 4,
+            element_count = 2 * tile_range_count)
+        self.m_tile_segments = resources.buffer("splat_rasterizer", "TileSegments", self,
+            format = g.Format.RG_32_UINT,
+            element_count = tile_range_count)
+        self.m_occlusion_tile_depths = resources.buffer("splat_rasterizer", "OcclusionTileDepths", self,
+            format = g.Format.R32_UINT, stride = 4,
+            element_count = tile_range_count)
+        self.m_tile_record_counts = resources.buffer("splat_rasterizer", "TileRecordCounts", self,
             format = g.Format.R32_UINT, stride = 4,
-            element_count = 2 * coarse_tile_count_x * coarse_tile_count_y)
+            element_count = tile_range_count)
+        self.m_local_sort_fallback_counts = resources.buffer("splat_rasterizer", "LocalSortFallbackCounts", self,
+            format = g.Format.R32_UINT, stride = 4,
+            element_count = tile_range_count)
+        self.m_local_sort_prefix_args = prefix_sum.allocate_args(tile_range_count, lifetime = self)
 
         return
 
-    def clear_view_buffers(self, cmd_list, width, height, coarse_tile_count_x, coarse_tile_count_y):
+    def clear_view_buffers(self, cmd_list, tile_range_count):
         utilities.clear_uint_buffer(cmd_list, 0, self.m_coarse_tile_records_counter, 0, 1)
-        utilities.clear_uint_buffer(cmd_list, 0, self.m_coarse_tile_list_ranges, 0, coarse_tile_count_x * coarse_tile_count_y * 2)
-
-    def dispatch_coarse_tile_bin(self, cmd_list, scene_data, coarse_tile_count_x, coarse_tile_count_y):
+        utilities.clear_uint_buffer(cmd_list, 0, self.m_tile_segment_counter, 0, 1)
+        utilities.clear_uint_buffer(cmd_list, 0, self.m_view_stats, 0, ViewStatsSize * MaxViewsPerBatch)
+        utilities.clear_uint_buffer(cmd_list, 0, self.m_coarse_tile_list_ranges, 0, tile_range_count * 2)
+        if self.m_sort_mode == "local":
+            utilities.clear_uint_buffer(cmd_list, 0, self.m_tile_record_counts, 0, tile_range_count)
+            utilities.clear_uint_buffer(cmd_list, 0, self.m_local_sort_fallback_counter, 0, 1)
+
+    def prepare_occlusion(self, cmd_list, batch_views):
+        # the previous opaque depths of the culling views go to the batch buffer the bin reads (at their tile range
+        # offset), then the views' buffers are cleared for this frame's raster to record the new ones.
+        for view in batch_views:
+            if view.occlusion.culling:
+                cmd_list.copy_resource(source = view.opaque_tile_depths, destination = self.m_occlusion_tile_depths, source_offset = 0,
+                    destination_offset = view.tile_range_offset * 4, size = view.coarse_tile_count * 4)
+        if self.m_occlusion_culling:
+            for view in batch_views:
+                utilities.clear_uint_buffer(cmd_list, OpaqueTileDepthClear, view.opaque_tile_depths, 0, view.coarse_tile_count)
+
+    def dispatch_coarse_tile_bin(self, cmd_list, scene_data, view_count):
     
         #keep in sync with csCoarseTileBin
         coarse_tile_bin_threads = 128
@@ -124,20 +427,20 @@ class SplatRaster:
         cmd_list.begin_marker("coarse_tile_bin")
 
         cmd_list.dispatch(
-            shader = self.m_coarse_dispatch_bin_shader,
-            constants = self.m_constants,
-            inputs = [ scene_data.metadata_buffer, scene_data.payload_buffer ],
-            outputs = [ self.m_coarse_tile_records_counter, self.m_coarse_tile_records, self.m_coarse_tile_record_splat_ids ],
-            x = utilities.divup(scene_data.vertex_count, coarse_tile_bin_threads), y = 1, z = 1)
+            shader = self.m_coarse_dispatch_bin_shader.get(),
+            inputs = [ scene_data.metadata_buffer, scene_data.payload_buffer, self.m_view_constants_array, self.m_occlusion_tile_depths ],
+            outputs = [ self.m_coarse_tile_records_counter, self.m_coarse_tile_records, self.m_coarse_tile_record_splat_ids, self.m_view_stats ],
+            x = utilities.divup(scene_data.vertex_count, coarse_tile_bin_threads), y = view_count, z = 1)
         cmd_list.end_marker()
 
+    def dispatch_global_sort(self, cmd_list):
         cmd_list.begin_marker("radix_sort")
         (self.m_coarse_tile_list_ordering, _) = radix_sort.run(cmd_list, self.m_coarse_tile_records, self.m_radix_sort_args, indirect_count_buffer = self.m_coarse_tile_records_counter)
         cmd_list.end_marker()
 
         cmd_list.begin_marker("create_tile_args")
         cmd_list.dispatch(
-            shader = self.m_create_coarse_tile_args_shader,
+            shader = self.m_create_coarse_tile_args_shader.get(),
             inputs = self.m_coarse_tile_records_counter,
             outputs = self.m_coarse_tile_args_buffer,
             x = 1, y = 1, z = 1)
@@ -145,51 +448,182 @@ class SplatRaster:
 
         cmd_list.begin_marker("create_tile_list_ranges")
         cmd_list.dispatch(
-            shader = self.m_create_coarse_tile_list_ranges_shader,
-            constants = self.m_constants,
+            shader = self.m_create_coarse_tile_list_ranges_shader.get(),
             inputs = [
                 self.m_coarse_tile_records_counter,
                 self.m_coarse_tile_list_ordering,
-                self.m_coarse_tile_records ],
+                self.m_coarse_tile_records,
+                self.m_view_constants_array ],
             outputs = [ self.m_coarse_tile_list_ranges ],
             indirect_args = self.m_coarse_tile_args_buffer)
         cmd_list.end_marker()
 
+    def dispatch_local_sort(self, cmd_list, scene_data, view, tile_range_count):
+        # view: any view of the batch, its constants hold the batch wide record max / tile range count.
+        cmd_list.begin_marker("create_tile_args")
+        cmd_list.dispatch(
+            shader = self.m_create_coarse_tile_args_shader.get(),
+            inputs = self.m_coarse_tile_records_counter,
+            outputs = self.m_coarse_tile_args_buffer,
+            x = 1, y = 1, z = 1)
+        cmd_list.end_marker()
+
+        cmd_list.begin_marker("create_tile_list_ranges")
+        cmd_list.dispatch(
+            shader = self.m_count_tile_records_shader.get(),
+            inputs = [ self.m_coarse_tile_records_counter, self.m_coarse_tile_records, self.m_view_constants_array ],
+            outputs = self.m_tile_record_counts,
+            constants = view.constants,
+            indirect_args = self.m_coarse_tile_args_buffer)
 
-    def dispatch_raster_splat(self, cmd_list, scene_data, width, height):
-        cmd_list.begin_marker("raster_splat")
+        tile_record_ends = prefix_sum.run(cmd_list, self.m_tile_record_counts, self.m_local_sort_prefix_args, input_counts = tile_range_count)
         cmd_list.dispatch(
-            shader = self.m_raster_splat_shader,
+            shader = self.m_create_local_sort_ranges_shader.get(),
+            inputs = [ tile_record_ends, self.m_tile_record_counts, self.m_view_constants_array ],
+            outputs = [ self.m_coarse_tile_list_ranges, self.m_local_sort_fallback_counts, self.m_local_sort_fallback_counter, self.m_view_stats ],
+            constants = view.constants,
+            x = utilities.divup(tile_range_count, 64), y = 1, z = 1)
+
+        # same prefix buffers, the record ends are in the ranges now.
+        fallback_ends = prefix_sum.run(cmd_list, self.m_local_sort_fallback_counts, self.m_local_sort_prefix_args, input_counts = tile_range_count)
+
+        cmd_list.dispatch(
+            shader = self.m_scatter_tile_records_shader.get(),
+            inputs = [ self.m_coarse_tile_records_counter, self.m_coarse_tile_records, self.m_view_constants_array, self.m_coarse_tile_list_ranges ],
+            outputs = [ self.m_tile_record_counts, self.m_local_sort_ordering ],
+            constants = view.constants,
+            indirect_args = self.m_coarse_tile_args_buffer)
+        cmd_list.end_marker()
+
+        # the packed records are not read past the scatter, their buffer holds the fallback keys.
+        cmd_list.begin_marker("local_sort")
+        cmd_list.dispatch(
+            shader = self.m_local_sort_tiles_shader.get(),
             inputs = [
                 scene_data.metadata_buffer,
                 scene_data.payload_buffer,
+                self.m_view_constants_array,
                 self.m_coarse_tile_list_ranges,
-                self.m_coarse_tile_list_ordering,
-                self.m_coarse_tile_record_splat_ids ],
-            outputs = self.m_color_buffer,
-            constants = self.m_constants,
-            x = utilities.divup(width, 8), y = utilities.divup(height, 8), z = 1)
+                self.m_coarse_tile_record_splat_ids,
+                fallback_ends ],
+            outputs = [ self.m_local_sort_ordering, self.m_coarse_tile_records ],
+            constants = view.constants,
+            x = LocalSortGroupsX, y = utilities.divup(tile_range_count, LocalSortGroupsX), z = 1)
+
+        (fallback_ordering, _) = radix_sort.run(cmd_list, self.m_coarse_tile_records, self.m_radix_sort_args, indirect_count_buffer = self.m_local_sort_fallback_counter)
+        cmd_list.dispatch(
+            shader = self.m_resolve_local_sort_fallback_shader.get(),
+            inputs = [ self.m_coarse_tile_list_ranges, fallback_ends, fallback_ordering ],
+            outputs = [ self.m_local_sort_ordering, self.m_coarse_tile_records ],
+            constants = view.constants,
+            x = LocalSortGroupsX, y = utilities.divup(tile_range_count, LocalSortGroupsX), z = 1)
         cmd_list.end_marker()
+        self.m_coarse_tile_list_ordering = self.m_local_sort_ordering
 
-    def get_coarse_tiles_dims(self, width, height):
-        return (int(math.ceil(width/CoarseTileSize)), int(math.ceil(height/CoarseTileSize)))
 
-    def raster(self, cmd_list, scene_data, view_matrix, proj_matrix, width, height):
-        (coarse_tile_count_x, coarse_tile_count_y) = self.get_coarse_tiles_dims(width, height)
+    def dispatch_tile_segments(self, cmd_list, scene_data, view, tile_range_count):
+        # view: any view of the batch, its constants hold the batch wide segment settings.
+        cmd_list.begin_marker("tile_segments")
+        cmd_list.dispatch(
+            shader = self.m_create_tile_segments_shader.get(),
+            inputs = [ self.m_coarse_tile_list_ranges, self.m_view_constants_array ],
+            outputs = [ self.m_tile_segment_counter, self.m_tile_segment_records, self.m_tile_segments ],
+            constants = view.constants,
+            x = utilities.divup(tile_range_count, 64), y = 1, z = 1)
 
-        self.update_view_resources(width, height, coarse_tile_count_x, coarse_tile_count_y)
+        cmd_list.dispatch(
+            shader = self.m_create_tile_segment_args_shader.get(),
+            inputs = self.m_tile_segment_counter,
+            outputs = self.m_tile_segment_args_buffer,
+            constants = view.constants,
+            x = 1, y = 1, z = 1)
 
-        self.clear_view_buffers(cmd_list, width, height, coarse_tile_count_x, coarse_tile_count_y)
+        cmd_list.dispatch(
+            shader = self.m_raster_tile_segments_shader.get(),
+            inputs = [
+                scene_data.metadata_buffer,
+                scene_data.payload_buffer,
+                self.m_tile_segment_records,
+                self.m_coarse_tile_list_ordering,
+                self.m_coarse_tile_record_splat_ids,
+                self.m_view_constants_array ],
+            outputs = self.m_tile_segment_partials,
+            indirect_args = self.m_tile_segment_args_buffer)
+        cmd_list.end_marker()
 
-        self.update_constants(
-            cmd_list,
-            view_matrix, proj_matrix, 
-            width, height,
-            coarse_tile_count_x, coarse_tile_count_y)
+    def dispatch_raster_splat(self, cmd_list, scene_data, view):
+        cmd_list.begin_marker("raster_splat")
+        cmd_list.dispatch(
+            shader = self.m_raster_splat_shader.get(),
+            inputs = [
+                scene_data.metadata_buffer,
+                scene_data.payload_buffer,
+                self.m_coarse_tile_list_ranges,
+                self.m_coarse_tile_list_ordering,
+                self.m_coarse_tile_record_splat_ids,
+                self.m_tile_segments,
+                self.m_tile_segment_partials ],
+            outputs = [ view.color_buffer, view.opaque_tile_depths ],
+            constants = view.constants,
+            x = utilities.divup(view.width, 8), y = utilities.divup(view.height, 8), z = 1)
+        cmd_list.end_marker()
 
-        self.dispatch_coarse_tile_bin(cmd_list, scene_data, coarse_tile_count_x, coarse_tile_count_y)
+    def get_coarse_tiles_dims(self, width, height):
+        return (int(math.ceil(width/CoarseTileSize)), int(math.ceil(height/CoarseTileSize)))
 
-        self.dispatch_raster_splat(cmd_list, scene_data, width, height)
+    def raster(self, cmd_list, scene_data, view_matrix, proj_matrix, width, height, view_id = 0):
+        return self.raster_views(cmd_list, scene_data, [(view_id, view_matrix, proj_matrix, width, height)])
+
+    # Renders several views of the same scene in one dispatch chain.
+    # views is a list of tuples (view_id, view_matrix, proj_matrix, width, height).
+    # All views are binned in a single pass, sorted once and then rastered into the color buffer of each view.
+    def raster_views(self, cmd_list, scene_data, views):
+        if len(views) == 0:
+            return []
+
+        if len(views) > MaxViewsPerBatch:
+            raise Exception("Cannot raster more than %d views in a single batch." % MaxViewsPerBatch)
+
+        record_begin = time.perf_counter()
+        batch_views = []
+        tile_range_count = 0
+        for (view_id, view_matrix, proj_matrix, width, height) in views:
+            view = self.get_view(view_id)
+            view.update_resources(width, height)
+            batch_views.append((view, view_matrix, proj_matrix, tile_range_count))
+            tile_range_count += view.coarse_tile_count
+
+        self.update_view_resources(tile_range_count)
+
+        self.clear_view_buffers(cmd_list, tile_range_count)
+
+        for batch_index, (view, view_matrix, proj_matrix, tile_range_offset) in enumerate(batch_views):
+            if self.m_occlusion_culling:
+                view.occlusion.advance(view_matrix, proj_matrix, view.width, view.height, scene_data.version, self.m_occlusion_max_rotation)
+            else:
+                view.occlusion.reset()
+            view.update_constants(view_matrix, proj_matrix, self.m_coarse_tile_record_max, batch_index, len(batch_views), tile_range_offset,
+                self.m_tile_segment_splats, tile_range_count, self.m_occlusion_opacity if self.m_occlusion_culling else 0.0)
+
+        batch_views = [view for (view, _, _, _) in batch_views]
+        self.update_constants(cmd_list, batch_views)
+        self.prepare_occlusion(cmd_list, batch_views)
+
+        self.dispatch_coarse_tile_bin(cmd_list, scene_data, len(batch_views))
+        if self.m_sort_mode == "local":
+            self.dispatch_local_sort(cmd_list, scene_data, batch_views[0], tile_range_count)
+        else:
+            self.dispatch_global_sort(cmd_list)
+        self.dispatch_tile_segments(cmd_list, scene_data, batch_views[0], tile_range_count)
+
+        for view in batch_views:
+            self.dispatch_raster_splat(cmd_list, scene_data, view)
+
+        self.m_last_view = batch_views[-1]
+        if self.m_metrics is not None:
+            record_ms = (time.perf_counter() - record_begin) * 1000.0
+            self.m_metrics.record_batch(cmd_list, self.m_view_stats, batch_views, self.m_coarse_tile_record_max, record_ms, self.m_sort_mode)
+        return batch_views
 
     def update_gpu_debug_view_info(self, debug_gpu_view_info):
         if self.m_coarse_tile_records_counter is None:
@@ -199,25 +633,17 @@ class SplatRaster:
             debug_gpu_view_info = SplatRasterViewGpuInfo()
 
         debug_gpu_view_info.coarse_tile_record_max = self.m_coarse_tile_record_max
-        if debug_gpu_view_info.coarse_tile_records_counter_copy is None:
-            debug_gpu_view_info.coarse_tile_records_counter_copy = g.Buffer(
-                name = "DebugCounterTileRecordsCounterCopy", 
-                format = g.Format.R32_UINT,
-                stride = 4,
-                element_count = 1)
-
-        if debug_gpu_view_info.resource_request is None:
-            cmd_list = g.CommandList()
-            cmd_list.copy_resource(
-                source = self.m_coarse_tile_records_counter,
-                destination = debug_gpu_view_info.coarse_tile_records_counter_copy)
-            g.schedule(cmd_list)
-            debug_gpu_view_info.resource_request =  g.ResourceDownloadRequest(resource = debug_gpu_view_info.coarse_tile_records_counter_copy)
-
-        if debug_gpu_view_info.resource_request != None and debug_gpu_view_info.resource_request.is_ready():
-            cpu_result_array = numpy.frombuffer(debug_gpu_view_info.resource_request.data_as_bytearray(), dtype='i')
-            debug_gpu_view_info.current_view_tile_records = cpu_result_array[0]
-            debug_gpu_view_info.resource_request = None
+        if debug_gpu_view_info.counter_readback is None:
+            debug_gpu_view_info.counter_readback = readback.ReadbackRing(slot_count = 3, name = "DebugCounterTileRecords")
+
+        # one counter copy per frame, results land a few frames later without waiting on the gpu.
+        def on_counter(tag, counter):
+            debug_gpu_view_info.current_view_tile_records = int(counter[0])
+        ring = debug_gpu_view_info.counter_readback
+        if ring.in_flight < ring.slot_count:
+            ring.capture(self.m_coarse_tile_records_counter, callback = on_counter, element_count = 1, dtype = numpy.int32)
+        else:
+            ring.poll()
 
         return debug_gpu_view_info
 
@@ -1,6 +1,32 @@
+import sys
+import os
+import shutil
+import json
+import time
+import asyncio
+import threading
 from .  import native as n
 from . import scene_loader
+from . import metrics
+from . import scene_cache
+from . import scene_residency
+from . import camera
+from . import vec
+from . import readback
+from . import paged_scene
+from . import scene_container
+from . import cpu_rasterizer
+from . import prune
+from . import resources
+from . import scene_edit
+from . import image_io
+from . import serve
+from . import instancing
+from . import occlusion
+from .benchmarks import scene_gen
+import zlib
 import coalpy.gpu as g
+import numpy as np
 
 g.init()
 
@@ -11,36 +37,532 @@ def testIOResolve(fileStr):
     request = n.SceneAsyncRequest(file = fileStr)
     request.resolve()
     (status, msg) = request.status()
-    print("\t"+("Success" if scene_loader.SuccessFinish  else "Failed")+ msg)
+    print("\t"+("Success" if status == scene_loader.SuccessFinish else "Failed")+ msg)
     print ("[testIOResolve end]")
 
 def testIOStreaming(fileStr):
     print ("[testIOStreaming begin]")
     print ("\tloading file " + fileStr)
+    async def stream():
+        load = scene_loader.AsyncLoad(fileStr, upload = False)
+        async for (status, progress, msg) in load.progress(interval = 0.05):
+            print ("\t"+str(progress * 100))
+        return (status, "" if status == scene_loader.SuccessFinish else msg)
+    (status, msg) = asyncio.run(stream())
+    print("\t"+("Success" if status == scene_loader.SuccessFinish else "Failed")+ msg)
+    print ("[testIOStreaming end]")
+
+def testAsyncLoad(fileStr):
+    print ("[testAsyncLoad begin]")
+    async def load_all():
+        return await asyncio.gather(*[scene_loader.load_scene(fileStr, upload = False) for i in range(4)])
+    scenes = asyncio.run(load_all())
+    success = all(np.array_equal(s.host_payload, scenes[0].host_payload) and s.vertex_count > 0 for s in scenes)
+    print("\t"+("Success" if success else "Failed")+ " %d concurrent loads" % len(scenes))
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    print("\t"+("Success" if np.array_equal(scene.host_payload, scenes[0].host_payload) else "Failed")+ " blocking load")
+    print ("[testAsyncLoad end]")
+
+def testExportRoundTrip(fileStr):
+    print ("[testExportRoundTrip begin]")
+    vertex_count = 10000
+    payload = np.random.rand(vertex_count, len(scene_loader.GaussianSplatProperties)).astype(np.float32)
+    export = scene_loader.export_scene(fileStr, payload, vertex_count)
+    export.resolve()
+    (status, msg) = export.status()
+    (bytes_written, total_bytes) = export.ioProgress()
+    print("\t"+("Success" if status == scene_loader.ExportSuccessFinish else "Failed")+ " export " + str(bytes_written) + "/" + str(total_bytes) + msg)
+    del export
+
     request = n.SceneAsyncRequest(file = fileStr)
+    request.resolve()
+    loaded = np.zeros_like(payload)
+    copied = threading.Event()
+    request.set_status_callback(lambda status : copied.set() if status != scene_loader.CopyingPayload else None)
+    request.request_copy_payload(loaded)
+    copied.wait()
     (status, msg) = request.status()
-    ii = 0
-    while status == scene_loader.Reading:
-        (bytes_read, total_bytes) = request.ioProgress()
-        if total_bytes == 0:
-            (status, msg) = request.status()
-            continue
-        elif (ii % 40000) == 0:
-            print ("\t"+str((bytes_read/total_bytes) * 100))
+    request.close_copy_payload()
+    print("\t"+("Success" if status == scene_loader.SuccessFinish and np.array_equal(loaded, payload) else "Failed")+ " round trip " + msg)
+    print ("[testExportRoundTrip end]")
+
+def testBufferKernels():
+    print ("[testBufferKernels begin]")
+    quats = np.random.rand(100000, 4).astype(np.float32)
+    expected = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    future = n.map_buffers("normalize_quaternions", outputs=[quats])
+    future.wait()
+    print("\t"+("Success" if np.allclose(quats, expected, atol=1e-6) else "Failed")+ " normalize_quaternions")
+
+    positions = np.random.rand(100000, 3).astype(np.float32)
+    bounds = np.zeros(6, dtype=np.float32)
+    n.parallel_for("compute_aabb", inputs=[positions], outputs=[bounds])
+    expected = np.concatenate([positions.min(axis=0), positions.max(axis=0)])
+    print("\t"+("Success" if np.array_equal(bounds, expected) else "Failed")+ " compute_aabb")
+    print ("[testBufferKernels end]")
+
+def testTrace(fileStr, traceStr):
+    print ("[testTrace begin]")
+    n.enable_trace()
+    request = n.SceneAsyncRequest(file = fileStr)
+    request.resolve()
+    n.enable_trace(False)
+    count = n.dump_trace(traceStr)
+    names = set(e["name"] for e in json.load(open(traceStr, "r"))["traceEvents"])
+    success = count > 0 and "parsePlyChunk" in names and "FileSystem::read" in names
+    print("\t"+("Success" if success else "Failed")+ " %d events written to %s" % (count, traceStr))
+    print ("[testTrace end]")
+
+def storeSceneCache(cache, fileStr):
+    request = n.SceneAsyncRequest(file = fileStr)
+    request.resolve()
+    (vertex_count, stride) = request.metadata()
+    pending = cache.begin_store(fileStr, vertex_count, stride, request.payload_size())
+    request.request_copy_payload(pending.payload)
+    (status, msg) = request.status()
+    while status == scene_loader.CopyingPayload:
         (status, msg) = request.status()
-        ii += 1
+    request.close_copy_payload()
+    cache.commit_store(pending, scene_cache.compute_bounds(pending.payload, stride)).close()
+    return (vertex_count, stride)
 
-    print("\t"+("Success" if scene_loader.SuccessFinish  else "Failed")+ msg)
-    print ("[testIOStreaming end]")
+def testSceneCache(fileStr, cacheDir):
+    print ("[testSceneCache begin]")
+    cache = scene_cache.SceneCache(cacheDir)
+    cache.clear()
+    (vertex_count, stride) = storeSceneCache(cache, fileStr)
+    entry = cache.lookup(fileStr)
+    success = entry is not None and entry.vertex_count == vertex_count and entry.stride == stride and cache.stats["hits"] == 1
+    print("\t"+("Success" if success else "Failed")+ " cache hit %s" % str(cache.stats))
+
+    # same size, new mtime, one byte changed outside the blocks a sampled hash reads.
+    editedStr = os.path.join(cacheDir, "edited_source.ply")
+    shutil.copyfile(fileStr, editedStr)
+    storeSceneCache(cache, editedStr)
+    with open(editedStr, "r+b") as f:
+        f.seek(min(scene_cache.HashEdgeBytes + 100, os.path.getsize(editedStr) - 1))
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xff]))
+    st = os.stat(editedStr)
+    os.utime(editedStr, ns = (st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    success = cache.lookup(editedStr) is None and cache.stats["stale"] == 1
+    print("\t"+("Success" if success else "Failed")+ " in place edit is stale")
+    os.remove(editedStr)
+    print ("[testSceneCache end]")
+
+def testSceneResidency(sceneDir):
+    print ("[testSceneResidency begin]")
+    os.makedirs(sceneDir, exist_ok = True)
+    paths = [os.path.join(sceneDir, "residency_%d.ply" % i) for i in range(4)]
+    for (i, path) in enumerate(paths):
+        scene_gen.write_scene(path, scene_gen.generate_scene(256, seed = i))
+    host_bytes = 256 * len(scene_loader.GaussianSplatProperties) * 4
+    gpu_bytes = host_bytes + scene_residency.MetadataBytes
+    # room for two scenes on the gpu and three host copies.
+    manager = scene_residency.SceneResidencyManager(vram_budget_bytes = 2 * gpu_bytes, host_budget_bytes = 3 * host_bytes, log = lambda msg : None)
+    scenes = [manager._scene(path) for path in paths]
+    def pump(done):
+        for i in range(10000):
+            manager.update()
+            if done():
+                return True
+            time.sleep(0.001)
+        return False
+
+    # a viewed, b prefetched: both fit on the gpu.
+    manager.set_playlist(paths, 0)
+    success = pump(lambda : scenes[0].state == scene_residency.GpuResident and scenes[1].state == scene_residency.GpuResident)
+    print("\t"+("Success" if success else "Failed")+ " viewed and prefetched scenes uploaded")
+
+    # b viewed, c prefetched: c would go over the vram budget, it stays a host copy and evicts nothing.
+    manager.next()
+    success = pump(lambda : scenes[2].state == scene_residency.HostResident)
+    for i in range(4):
+        manager.update()
+    success = success and scenes[2].state == scene_residency.HostResident and scenes[0].state == scene_residency.GpuResident and \
+        manager.stats["gpu_evictions"] == 0 and manager.stats["host_evictions"] == 0
+    print("\t"+("Success" if success else "Failed")+ " prefetch never evicts %s" % str(manager.stats))
+
+    # c viewed, d prefetched: a (least recently viewed) first drops its gpu buffers, then its host copy once d is loaded.
+    manager.next()
+    success = pump(lambda : scenes[2].state == scene_residency.GpuResident)
+    success = success and scenes[0].scene_data is None and scenes[1].state == scene_residency.GpuResident and manager.stats["gpu_evictions"] == 1
+    success = success and pump(lambda : scenes[3].state == scene_residency.HostResident)
+    success = success and scenes[0].state == scene_residency.Unloaded and scenes[1].host_payload is not None and \
+        manager.stats["gpu_evictions"] == 1 and manager.stats["host_evictions"] == 1 and \
+        manager.vram_bytes <= manager.vram_budget_bytes and manager.host_bytes <= manager.host_budget_bytes
+    print("\t"+("Success" if success else "Failed")+ " lru eviction, gpu buffers before host copies %s" % str(manager.stats))
+    manager.clear()
+    print ("[testSceneResidency end]")
+
+def testFrameMetrics(fileStr):
+    print ("[testFrameMetrics begin]")
+    frame_metrics = metrics.FrameMetrics(capacity = 8)
+    for i in range(12):
+        frame_metrics.push(frame = i, view_id = i % 2, raster_splat_ms = float(i), visible_splats = i * 10)
+    frames = frame_metrics.column("frame")
+    print("\t"+("Success" if list(frames) == list(range(4, 12)) and frame_metrics.dropped == 4 else "Failed")+ " ring buffer order")
+    frame_metrics.save(fileStr)
+    lines = open(fileStr, "r").read().splitlines()
+    print("\t"+("Success" if len(lines) == 9 and lines[0].split(",") == metrics.Columns else "Failed")+ " csv dump")
+    print ("[testFrameMetrics end]")
+
+def testCameraBatch():
+    print ("[testCameraBatch begin]")
+    rng = np.random.default_rng(7)
+    cameras = []
+    for i in range(64):
+        cam = camera.Camera(int(rng.integers(64, 2048)), int(rng.integers(64, 2048)))
+        cam.pos = (rng.standard_normal(3) * 10.0).astype('f')
+        cam.transform.rotation = vec.q_from_angle_axis(rng.uniform(-np.pi, np.pi), rng.standard_normal(3))
+        (cam.fov, cam.near, cam.far) = (rng.uniform(0.2, 1.5), rng.uniform(0.01, 1.0), rng.uniform(100.0, 10000.0))
+        cameras.append(cam)
+    batch = camera.CameraBatch.from_cameras(cameras)
+    (views, projs, proj_invs) = (batch.view_matrices(), batch.proj_matrices(), batch.proj_inv_matrices())
+    success = all(np.allclose(views[i], c.view_matrix, atol=1e-4) and np.allclose(projs[i], c.proj_matrix, rtol=1e-5, atol=1e-6)
+        and np.allclose(proj_invs[i], c.proj_inv_matrix, rtol=1e-4, atol=1e-6) for (i, c) in enumerate(cameras))
+    print("\t"+("Success" if success else "Failed")+ " parity with Camera")
+
+    path = batch.interpolate(np.arange(len(batch)), np.arange(len(batch)), mode = "spline")
+    success = np.allclose(path.positions, batch.positions) and np.allclose(np.abs(np.sum(path.rotations * batch.rotations, axis=1)), 1.0)
+    print("\t"+("Success" if success else "Failed")+ " path interpolation through the keys")
+    print ("[testCameraBatch end]")
+
+def testReadbackRing(fileStr):
+    print ("[testReadbackRing begin]")
+    ring = readback.ReadbackRing(slot_count = 2)
+    buffer = g.Buffer(name = "ReadbackTestBuffer", format = g.Format.R32_UINT, stride = 4, element_count = 256)
+    results = []
+    for i in range(8):
+        cmd_list = g.CommandList()
+        cmd_list.upload_resource(source = np.arange(256, dtype = np.uint32) + i, destination = buffer)
+        ring.copy(cmd_list, buffer, tag = i, callback = lambda tag, data : results.append((tag, int(data[0]))), element_count = 256)
+        g.schedule(cmd_list)
+        ring.submit()
+    ring.flush()
+    print("\t"+("Success" if results == [(i, i) for i in range(8)] else "Failed")+ " in order delivery %s" % str(ring.stats))
+
+    image = np.random.randint(0, 255, (17, 33, 4), dtype = np.uint8)
+    image_io.write_png(fileStr, image)
+    data = open(fileStr, "rb").read()
+    idat = data.index(b"IDAT")
+    rows = np.frombuffer(zlib.decompress(data[idat + 4 : idat + 4 + int.from_bytes(data[idat - 4 : idat], "big")]), dtype = np.uint8)
+    success = data[:8] == b"\x89PNG\r\n\x1a\n" and np.array_equal(rows.reshape((17, -1))[:, 1:].reshape(image.shape), image)
+    print("\t"+("Success" if success else "Failed")+ " png writer")
+    ring.close()
+    print ("[testReadbackRing end]")
+
+def testPagedScene(fileStr, pagedStr):
+    print ("[testPagedScene begin]")
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    paged_scene.build_paged_scene(scene.host_payload, scene.stride, pagedStr, page_splats = 1024)
+    paged_file = paged_scene.PagedSceneFile(pagedStr)
+    pages = [np.zeros(paged_file.page_bytes, dtype = np.uint8) for i in range(paged_file.page_count)]
+    paged_file.read_pages(range(paged_file.page_count), pages).wait()
+    splats = np.concatenate([p.reshape((-1, scene.stride))[:paged_file.page_splats if i < paged_file.page_count - 1 else paged_file.vertex_count - i * paged_file.page_splats] for (i, p) in enumerate(pages)])
+    as_rows = lambda a : np.sort(np.ascontiguousarray(a).view(np.dtype((np.void, scene.stride))).ravel())
+    success = np.array_equal(as_rows(splats), as_rows(np.frombuffer(scene.host_payload, dtype = np.uint8).reshape((-1, scene.stride))))
+    print("\t"+("Success" if success else "Failed")+ " %d pages hold every splat" % paged_file.page_count)
+
+    cameras = camera.CameraBatch(64, 1280, 720, fov = 0.5)
+    cameras.positions[:, 2] = -40.0
+    cameras.positions[:, 0] = np.linspace(-20.0, 20.0, 64)
+    pool_pages = max(1, paged_file.page_count // 2)
+    (totals, frames) = paged_scene.simulate_paging(paged_file.page_bounds, cameras.view_matrices(), cameras.proj_matrices(), pool_pages)
+    success = totals["loads_completed"] > 0 and totals["resident_pages"] <= pool_pages and len(frames) == 64
+    print("\t"+("Success" if success else "Failed")+ " paging simulation %s" % str(totals))
+    print ("[testPagedScene end]")
+
+def testSceneContainer(fileStr, containerStr):
+    print ("[testSceneContainer begin]")
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    payload = np.frombuffer(scene.host_payload, dtype = np.uint8)
+    codecs = n.container_codecs()
+    for codec in ["zlib", "lzma"]:
+        stats = scene_container.write_container(payload, scene.stride, containerStr, codec, chunk_splats = 4096)
+        if codecs[codec]:
+            loaded = scene_loader.load_scene_blocking(containerStr, upload = False)
+            success = loaded.vertex_count == scene.vertex_count and np.array_equal(np.frombuffer(loaded.host_payload, dtype = np.uint8), payload)
+        else:
+            success = np.array_equal(scene_container.read_container(containerStr), payload)
+        print("\t"+("Success" if success else "Failed")+ " %s round trip, ratio %.2f, %d chunks" % (codec, stats["ratio"], stats["chunks"]))
+    print ("[testSceneContainer end]")
+
+def testPrune(fileStr):
+    print ("[testPrune begin]")
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(np.frombuffer(scene.host_payload, dtype = np.float32)[:2000 * 62])
+    cameras = prune.sample_cameras(np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)]), 1, 64, 64)
+    (view_matrix, proj_matrix) = (cameras.view_matrices()[0], cameras.proj_matrices()[0])
+    (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, 64, 64)
+    ordering = cpu_rasterizer.sort_records(keys)
+    ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], 4)
+    screen_data = cpu_rasterizer.preprocess(cloud, view_matrix, proj_matrix, 64, 64)
+    image = cpu_rasterizer.raster(screen_data, splat_ids, ordering, ranges, 64, 64, chunk_size = 256)
+    weights = cpu_rasterizer.splat_weights(screen_data, splat_ids, ordering, ranges, 64, 64, cloud.vertex_count, chunk_size = 256)
+    success = np.allclose(np.sum(weights[:, np.newaxis] * cloud.colors, axis = 0), image[:, :, 0:3].reshape((-1, 3)).sum(axis = 0), rtol = 1e-3)
+    print("\t"+("Success" if success else "Failed")+ " splat weights match the raster image")
+
+    (scores, pixels) = prune.score_splats(cloud, cameras)
+    sorted_scores = np.sort(scores)[::-1]
+    errors = prune.removed_error(sorted_scores, np.arange(cloud.vertex_count + 1), pixels)
+    keep = prune.keep_count_for_error(sorted_scores, 0.01, pixels)
+    success = errors[-1] == 0.0 and np.all(np.diff(errors) <= 0.0) and errors[keep] <= 0.01 and (keep == 0 or errors[keep - 1] > 0.01)
+    print("\t"+("Success" if success else "Failed")+ " keeps %d / %d splats under the error budget" % (keep, cloud.vertex_count))
+    print ("[testPrune end]")
+
+def testLoadBalancedRaster(fileStr):
+    print ("[testLoadBalancedRaster begin]")
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(np.frombuffer(scene.host_payload, dtype = np.float32)[:4000 * 62])
+    cameras = prune.sample_cameras(np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)]), 1, 96, 64)
+    (view_matrix, proj_matrix) = (cameras.view_matrices()[0], cameras.proj_matrices()[0])
+    (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, 96, 64)
+    ordering = cpu_rasterizer.sort_records(keys)
+    ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], 6)
+    screen_data = cpu_rasterizer.preprocess(cloud, view_matrix, proj_matrix, 96, 64)
+    image = cpu_rasterizer.raster(screen_data, splat_ids, ordering, ranges, 96, 64)
+    segment_splats = max(1, int((ranges[:, 1] - ranges[:, 0]).max()) // 3)
+    balanced = cpu_rasterizer.raster_load_balanced(screen_data, splat_ids, ordering, ranges, 96, 64, segment_splats = segment_splats)
+    (segments, tile_segments) = cpu_rasterizer.tile_segments(ranges, segment_splats)
+    success = segments.shape[0] > 0 and np.allclose(image, balanced, atol = 1e-4)
+    print("\t"+("Success" if success else "Failed")+ " split tiles (%d segments) match the raster image" % segments.shape[0])
+
+    (_, overflow) = cpu_rasterizer.tile_segments(ranges, segment_splats, max_segments = 2)
+    model = cpu_rasterizer.load_balance_model(ranges, segment_splats = segment_splats, concurrent_groups = 16)
+    success = np.all(overflow[:, 1] <= 2) and sum(model["histogram"]["counts"]) == model["non_empty_tiles"] and model["speedup"] > 0.0
+    print("\t"+("Success" if success else "Failed")+ " load model, expected speed up %.2f" % model["speedup"])
+    print ("[testLoadBalancedRaster end]")
+
+def testSceneEdit(fileStr):
+    print ("[testSceneEdit begin]")
+    (begins, ends) = scene_edit.coalesce_ranges(np.array([0, 10, 1000, 5000]), np.array([5, 20, 1001, 5002]), 2, gap = 8)
+    success = list(begins) == [0, 5000] and list(ends) == [1001, 5002]
+    dirty = scene_edit.DirtyRanges()
+    dirty.add_indices([7, 3, 4, 5, 100, 101])
+    (begins, ends) = dirty.take(8, 2, gap = 0)
+    success = success and list(begins) == [3] and list(ends) == [5] and list(dirty.ranges()[0]) == [5, 7, 100]
+    print("\t"+("Success" if success else "Failed")+ " dirty range coalescing")
+
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    editable = scene_edit.EditableScene.from_scene_data(scene, compact_fraction = 0.1)
+    edit = editable.edit
+    gpu_payload = lambda : np.frombuffer(editable.scene_data.payload_buffer.mappedMemory(), dtype = np.uint8)[:edit.vertex_count * edit.stride]
+    center = np.mean(edit.positions, axis = 0)
+    selection = edit.select_sphere(center, float(np.linalg.norm(np.std(edit.positions, axis = 0))) * 0.5)
+    edit.translate(selection, [0.0, 1.0, 0.0])
+    edit.set_color(selection[::2], [1.0, 0.0, 0.0])
+    edit.delete(selection[:len(selection) // 8])
+    editable.update()
+    success = editable.stats["copies"] > 0 and edit.dirty.count == 0 and np.array_equal(gpu_payload(), edit.payload)
+    print("\t"+("Success" if success else "Failed")+ " dirty ranges uploaded, %d splats in %d copies" % (editable.stats["uploaded_bytes"] // edit.stride, editable.stats["copies"]))
+
+    before = edit.vertex_count
+    live = np.array(edit.vertices[~edit.deleted])
+    edit.delete(np.union1d(edit.select_box(edit.bounds[0:3], center), np.arange(0, edit.vertex_count, 4)))
+    live_after = np.array(edit.vertices[~edit.deleted])
+    remap = editable.update()
+    for _ in range(scene_edit.StagingBuffers):
+        editable.update()
+    success = remap is not None and edit.vertex_count == live_after.shape[0] and np.array_equal(edit.vertices, live_after) and \
+        editable.scene_data.vertex_count == edit.vertex_count and np.array_equal(gpu_payload(), edit.payload) and np.array_equal(edit.positions, live_after[:, 0:3])
+    print("\t"+("Success" if success else "Failed")+ " lazy compaction %d -> %d splats" % (before, edit.vertex_count))
+    print ("[testSceneEdit end]")
+
+def testRenderServer(fileStr):
+    print ("[testRenderServer begin]")
+    queue = serve.RequestQueue(capacity = 3, max_batch = 2, batch_window_ms = 0.0)
+    requests = [serve.Request({ "op" : "render", "scene" : scene }, None) for scene in ["a", "b", "a", "a"]]
+    accepted = [queue.put(r) for r in requests]
+    batches = [queue.next_batch(0.0) for _ in range(3)]
+    success = accepted == [True, True, True, False] and batches[0] == [requests[0], requests[2]] and batches[1] == [requests[1]] and batches[2] == []
+    print("\t"+("Success" if success else "Failed")+ " bounded request queue, same scene batches")
+
+    server = serve.RenderServer(serve.CpuBackend(), "127.0.0.1:0", batch_window_ms = 200.0, log = lambda *args : None)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.start()
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(scene.host_payload)
+    cameras = prune.sample_cameras(np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)]), 3, 48, 32)
+    with serve.RenderClient(server.address) as client:
+        for (i, encoding) in enumerate(["raw", "png", "raw"]):
+            client.submit(scene = fileStr, width = 48, height = 32, encoding = encoding, position = cameras.positions[i], rotation = cameras.rotations[i], fov = float(cameras.fovs[i]))
+        answers = sorted([client.receive() for _ in range(3)], key = lambda answer : answer[0]["id"])
+        client.submit(scene = fileStr + ".missing", width = 48, height = 32)
+        (missing, _) = client.receive()
+        stats = client.stats()
+    (view_matrices, proj_matrices) = (cameras.view_matrices(), cameras.proj_matrices())
+    references = [serve.to_rgba8(cpu_rasterizer.render(cloud, view_matrices[i], proj_matrices[i], 48, 32)) for i in range(3)]
+    images = [serve.decode_image(header, body) for (header, body) in answers]
+    success = all(header["ok"] and header["batch_size"] == 3 for (header, _) in answers) and all(np.array_equal(a, b) for (a, b) in zip(images, references))
+    print("\t"+("Success" if success else "Failed")+ " batched cpu renders, latency median %.1f ms" % stats["latency"]["latency_ms"]["median"])
+    success = not missing["ok"] and stats["latency"]["errors"] == 1 and stats["batches"] == 1 and stats["rendered"] == 3
+    print("\t"+("Success" if success else "Failed")+ " failed request answered with an error")
+    server.shutdown()
+    thread.join()
+    print ("[testRenderServer end]")
+
+def testInstancing(fileStr):
+    print ("[testInstancing begin]")
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    payload = np.frombuffer(scene.host_payload, dtype = np.float32).reshape((-1, 62))[:2000]
+    cloud = cpu_rasterizer.SplatCloud(payload.tobytes())
+    local_bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+    (angle, scale) = (0.7, 1.5)
+    transform = np.eye(4)
+    transform[0:3, 0:3] = scale * np.array([[np.cos(angle), -np.sin(angle), 0.0], [np.sin(angle), np.cos(angle), 0.0], [0.0, 0.0, 1.0]])
+    transform[0:3, 3] = [0.5, -0.25, 2.0]
+    corners = np.array([[local_bounds[3 * x], local_bounds[3 * y + 1], local_bounds[3 * z + 2]] for x in range(2) for y in range(2) for z in range(2)])
+    world_corners = cpu_rasterizer.transform_points(transform, corners)
+    world_bounds = instancing.transform_bounds(local_bounds, transform[np.newaxis])[0]
+    success = np.allclose(world_bounds, np.concatenate([world_corners.min(axis = 0), world_corners.max(axis = 0)]))
+    print("\t"+("Success" if success else "Failed")+ " transformed instance bounds")
+
+    # rotation about z and uniform scale baked into a copy of the payload: position, log scale, rotation quaternion (w, x, y, z).
+    baked = np.array(payload)
+    baked[:, 0:3] = cpu_rasterizer.transform_points(transform, payload[:, 0:3])
+    baked[:, 55:58] += np.log(scale)
+    (w, x, y, z) = (payload[:, 58], payload[:, 59], payload[:, 60], payload[:, 61])
+    (c, s) = (np.cos(0.5 * angle), np.sin(0.5 * angle))
+    baked[:, 58:62] = np.stack([c * w - s * z, c * x - s * y, c * y + s * x, c * z + s * w], axis = 1)
+    table = instancing.InstanceTable()
+    table.add(0, transform)
+    far = np.eye(4)
+    far[2, 3] = -100.0 * float(np.linalg.norm(local_bounds[3:6] - local_bounds[0:3]))
+    table.add(0, far, [1.0, 0.0, 0.0])
+    cameras = prune.sample_cameras(world_bounds, 1, 48, 32)
+    (view_matrix, proj_matrix) = (cameras.view_matrices()[0], cameras.proj_matrices()[0])
+    masks = instancing.instance_view_masks(table.world_bounds([local_bounds]), [proj_matrix @ view_matrix])
+    image = instancing.render([cloud], [local_bounds], table, view_matrix, proj_matrix, 48, 32)
+    reference = cpu_rasterizer.render(cpu_rasterizer.SplatCloud(baked.tobytes()), view_matrix, proj_matrix, 48, 32)
+    success = list(masks) == [1, 0] and np.max(reference) > 0.0 and np.allclose(image, reference, atol = 1e-3)
+    print("\t"+("Success" if success else "Failed")+ " instance render matches the baked payload, instance behind the camera culled")
+
+    (metadata, visible, total) = instancing.instance_metadata(table, [0], [cloud.vertex_count], 62 * 4, np.array([1, 1], dtype = np.uint32))
+    splat_ids = np.arange(total)
+    (instances, splats) = instancing.resolve_instance_splats(metadata, splat_ids)
+    records = metadata[instancing.InstanceMetadataOffset + 3:].reshape((2, instancing.InstanceRecordDwords)).view(np.float32)
+    rows = records[instances, instancing.RecordTransform:instancing.RecordTransform + 12].reshape((-1, 3, 4))
+    positions = np.einsum("nij,nj->ni", rows[:, :, 0:3], cloud.positions[splats]) + rows[:, :, 3]
+    success = total == 2 * cloud.vertex_count and np.allclose(positions, instancing.InstancedCloud([cloud], table).positions, atol = 1e-4)
+    print("\t"+("Success" if success else "Failed")+ " instance table lookup of %d instance splats" % total)
+    print ("[testInstancing end]")
+
+def testOcclusion():
+    print ("[testOcclusion begin]")
+    # an opaque grid of splats covering the view, with a layer of splats its tile lists blend under.
+    rng = np.random.default_rng(1)
+    (gx, gy) = np.meshgrid(np.linspace(-8.0, 8.0, 161), np.linspace(-8.0, 8.0, 161))
+    payload = np.zeros((gx.size + 2000, 62), dtype = np.float32)
+    payload[:gx.size, 0:3] = np.stack([gx.ravel(), gy.ravel(), np.full(gx.size, 4.0)], axis = 1)
+    payload[gx.size:, 0:3] = rng.uniform([-1.5, -1.5, 0.0], [1.5, 1.5, 3.0], (2000, 3))
+    payload[:, 6:9] = rng.uniform(0.0, 1.0, (payload.shape[0], 3))
+    payload[:, 54] = 8.0
+    payload[:, 55:58] = np.log(rng.uniform(0.15, 0.2, (payload.shape[0], 3)))
+    payload[:, 58:62] = rng.normal(size = (payload.shape[0], 4))
+    cloud = cpu_rasterizer.SplatCloud(payload.tobytes())
+    cameras = camera.CameraBatch(3, 96, 64, fov = 1.0)
+    cameras.positions[:] = [[0.0, 0.0, -4.0], [0.02, 0.0, -4.0], [0.04, 0.01, -4.0]]
+    opacity = cpu_rasterizer.DefaultOcclusionOpacity
+    (totals, frames) = occlusion.simulate_occlusion(cloud, cameras.view_matrices(), cameras.proj_matrices(), 96, 64, opacity, reference = True)
+    success = not frames[0]["culling"] and all(f["culling"] and f["culled_splats"] > 0 for f in frames[1:]) and totals["max_error"] < 1.0 - opacity
+    print("\t"+("Success" if success else "Failed")+ " %d / %d records culled, max error %f" % (totals["culled_records"], totals["records"], totals["max_error"]))
+
+    history = occlusion.OcclusionHistory()
+    turned = camera.CameraBatch(1, 96, 64, fov = 1.0)
+    turned.positions[:] = cameras.positions[0]
+    turned.rotations[:] = [np.cos(0.25), 0.0, np.sin(0.25), 0.0]
+    steps = [(cameras, 0, 1), (cameras, 1, 1), (turned, 0, 1), (turned, 0, 2)]
+    culling = [history.advance(c.view_matrices()[i], c.proj_matrices()[i], 96, 64, version) for (c, i, version) in steps]
+    (translation, rotation) = occlusion.camera_motion(cameras.view_matrices()[0], turned.view_matrices()[0])
+    success = culling == [False, True, False, False] and history.stats["fallbacks"] == 2 and abs(rotation - 0.5) < 1e-4 and translation < 1e-4
+    print("\t"+("Success" if success else "Failed")+ " history falls back on camera cuts and scene changes")
+    print ("[testOcclusion end]")
+
+def testLocalSort(fileStr):
+    print ("[testLocalSort begin]")
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 50, (7, 64)).astype(np.uint32)
+    values = rng.permutation(7 * 64).reshape((7, 64)).astype(np.uint32)
+    (_, sorted_values) = cpu_rasterizer.bitonic_sort(keys, values)
+    success = all(np.array_equal(sorted_values[i], values[i][np.lexsort((values[i], keys[i]))]) for i in range(keys.shape[0]))
+    print("\t"+("Success" if success else "Failed")+ " bitonic network sorts by key then value")
+
+    scene = scene_loader.load_scene_blocking(fileStr, upload = False)
+    cloud = cpu_rasterizer.SplatCloud(scene.host_payload, scene.stride // 4)
+    bounds = np.concatenate([cloud.positions.min(axis = 0), cloud.positions.max(axis = 0)])
+    cameras = prune.sample_cameras(bounds, 1, 128, 128)
+    (view_matrix, proj_matrix) = (cameras.view_matrices()[0], cameras.proj_matrices()[0])
+    (keys, splat_ids) = cpu_rasterizer.bin_splats(cloud, view_matrix, proj_matrix, 128, 128)
+    (tiles_x, tiles_y) = cpu_rasterizer.coarse_tiles_dims(128, 128)
+    ordering = cpu_rasterizer.sort_records(keys)
+    ranges = cpu_rasterizer.tile_list_ranges(keys[ordering], tiles_x * tiles_y)
+    # reference: records sorted by tile then full precision depth
+    depths = np.abs(cpu_rasterizer.transform_points(view_matrix, cloud.positions[splat_ids])[:, 2]).astype(np.float32)
+    exact_ordering = np.lexsort((depths, cpu_rasterizer.unpack_coarse_tiles(keys)[1])).astype(np.uint32)
+    screen_data = cpu_rasterizer.preprocess(cloud, view_matrix, proj_matrix, 128, 128)
+    exact_image = cpu_rasterizer.raster(screen_data, splat_ids, exact_ordering, ranges, 128, 128)
+    for max_records in [cpu_rasterizer.LocalSortMaxRecords, 64]:
+        (local_ordering, local_ranges, fallback_tiles) = cpu_rasterizer.local_sort_records(cloud, keys, splat_ids, view_matrix, tiles_x * tiles_y, max_records)
+        image = cpu_rasterizer.raster(screen_data, splat_ids, local_ordering, local_ranges, 128, 128)
+        same_records = all(np.array_equal(np.sort(ordering[b:e]), np.sort(local_ordering[b:e])) for (b, e) in ranges)
+        success = np.array_equal(local_ranges, ranges) and same_records and np.allclose(image, exact_image, atol = 1e-3)
+        print("\t"+("Success" if success else "Failed")+ " local sort of %d records matches the full depth order (%d fallback tiles)" % (keys.shape[0], fallback_tiles.shape[0]))
+    print ("[testLocalSort end]")
+
+def testResources():
+    print ("[testResources begin]")
+    class Owner:
+        pass
+    owner = Owner()
+    base = resources.current_bytes(resources.Gpu)
+    resources.track("test", "A", 1024, resources.Gpu, owner)
+    resources.track("test", "A", 4096, resources.Gpu, owner)
+    resources.track("test", "B", 512, resources.Gpu)
+    success = resources.current_bytes(resources.Gpu) == base + 4096 + 512 and resources.stats()["test"][resources.Gpu]["resources"] == 2
+    resources.release("test", "B")
+    del owner
+    success = success and resources.current_bytes(resources.Gpu) == base and resources.peak_bytes(resources.Gpu) >= base + 4096 + 512
+    print("\t"+("Success" if success else "Failed")+ " replaced / released / collected resources")
 
+    resources.set_budget(resources.current_bytes(resources.Host) + 1000, resources.Host)
+    try:
+        resources.track_host("test", "Payload", np.zeros(2000, dtype = np.uint8))
+        success = False
+    except Exception as err:
+        success = "budget" in str(err)
+    resources.set_budget(None, resources.Host)
+    success = success and "test" not in [r["owner"] for r in resources.report()["resources"]]
+    print("\t"+("Success" if success else "Failed")+ " allocation over the budget raises")
+    print ("[testResources end]")
 
 if __name__=="__main__":
     print ("Native init")
     n.init()
 
-    fileStr = "test_data/train.ply"
+    fileStr = sys.argv[1] if len(sys.argv) > 1 else "test_data/train.ply"
     testIOResolve(fileStr)
     testIOStreaming(fileStr)
+    testAsyncLoad(fileStr)
+    testBufferKernels()
+    testExportRoundTrip("test_data/export_test.ply")
+    testFrameMetrics("test_data/metrics_test.csv")
+    testTrace(fileStr, "test_data/trace_test.json")
+    testSceneCache(fileStr, "test_data/scene_cache")
+    testSceneResidency("test_data/residency")
+    testCameraBatch()
+    testReadbackRing("test_data/readback_test.png")
+    testPagedScene(fileStr, "test_data/paged_test.spgs")
+    testSceneContainer(fileStr, "test_data/container_test.splz")
+    testPrune(fileStr)
+    testLoadBalancedRaster(fileStr)
+    testSceneEdit(fileStr)
+    testRenderServer(fileStr)
+    testInstancing(fileStr)
+    testOcclusion()
+    testLocalSort(fileStr)
+    testResources()
     
     print ("Native shutdown")
     n.shutdown()
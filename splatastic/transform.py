@@ -121,10 +121,37 @@ class Transform:
         if (self.m_dirty_flags != 0):
             np.matmul(self.m_rotation_matrix, self.m_scale_matrix, Transform.__tmp_matrix)
             np.matmul(self.m_translation_matrix, Transform.__tmp_matrix, self.m_transform_matrix)
-            self.m_transform_inv_matrix = np.linalg.inv(self.m_transform_matrix)
+            self.m_transform_inv_matrix = rigid_inverse(self.m_rotation_matrix[0:3, 0:3], self.m_scale, self.m_translation)
 
         self.m_dirty_flags = 0
 
+def rotation_matrices(q):
+    # (..., 4) float quaternions (w, x, y, z, not required to be normalized) to (..., 3, 3) rotation matrices.
+    q = np.asarray(q, dtype = np.float64)
+    q = q / np.linalg.norm(q, axis = -1, keepdims = True)
+    (w, x, y, z) = (q[..., 0], q[..., 1], q[..., 2], q[..., 3])
+    m = np.empty(q.shape[:-1] + (3, 3), dtype = np.float64)
+    m[..., 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    m[..., 0, 1] = 2.0 * (x * y - z * w)
+    m[..., 0, 2] = 2.0 * (x * z + y * w)
+    m[..., 1, 0] = 2.0 * (x * y + z * w)
+    m[..., 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    m[..., 1, 2] = 2.0 * (y * z - x * w)
+    m[..., 2, 0] = 2.0 * (x * z - y * w)
+    m[..., 2, 1] = 2.0 * (y * z + x * w)
+    m[..., 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return m
+
+def rigid_inverse(rotation, scale, translation):
+    # closed form inverse of translation * rotation * scale: scale^-1 * rotation^T * translation^-1.
+    # rotation (..., 3, 3), scale and translation (..., 3), returns (..., 4, 4) in the dtype of rotation.
+    inv_rs = np.swapaxes(rotation, -1, -2) / np.asarray(scale)[..., :, None]
+    inv = np.zeros(inv_rs.shape[:-2] + (4, 4), dtype = rotation.dtype)
+    inv[..., 0:3, 0:3] = inv_rs
+    inv[..., 0:3, 3] = -np.einsum("...ij,...j->...i", inv_rs, translation)
+    inv[..., 3, 3] = 1.0
+    return inv
+
 def projection_matrix(l, r, t, b, n, f, is_ortho=False):
     mat = Transform.Identity()
     proj_num = 2.0 if is_ortho else (2.0*n)
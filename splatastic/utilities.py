@@ -1,17 +1,13 @@
 import coalpy.gpu as g
 import math
+from . import lazy_shader
 
-g_clear_target_shader = None
-g_clear_uint_buffer_shader = None
-
-def init():
-    global g_clear_target_shader, g_clear_uint_buffer_shader
-    g_clear_target_shader = g.Shader(file = "clear_target_cs.hlsl", name = "clear", main_function = "csMainClear" )
-    g_clear_uint_buffer_shader = g.Shader(file = "clear_target_cs.hlsl", name = "clear", main_function = "csMainClearUintBuffer" )
+g_clear_target_shader = lazy_shader.LazyShader(file = "clear_target_cs.hlsl", name = "clear", main_function = "csMainClear" )
+g_clear_uint_buffer_shader = lazy_shader.LazyShader(file = "clear_target_cs.hlsl", name = "clear", main_function = "csMainClearUintBuffer" )
 
 def clear_texture(cmd_list, color, texture, w, h):
     cmd_list.dispatch(
-        shader = g_clear_target_shader,
+        shader = g_clear_target_shader.get(),
         constants = color,
         x = math.ceil(w / 8), 
         y = math.ceil(h / 8), 
@@ -20,7 +16,7 @@ def clear_texture(cmd_list, color, texture, w, h):
 
 def clear_uint_buffer(cmd_list, clear_val, buff, el_offset, el_count):
     cmd_list.dispatch(
-        shader = g_clear_uint_buffer_shader,
+        shader = g_clear_uint_buffer_shader.get(),
         constants = [int(clear_val), int(el_offset), int(el_count)],
         outputs = buff,
         x = math.ceil(el_count / 64),
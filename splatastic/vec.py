@@ -18,3 +18,21 @@ def q_from_angle_axis(angle, axis):
     a = np.sin(angle) * normalize(axis)
     w = np.cos(angle)
     return np.quaternion(w, a[0], a[1], a[2])
+
+def q_slerp(q0, q1, t):
+    # vectorized slerp of (..., 4) float quaternions (w, x, y, z), t broadcasts against the leading dims.
+    q0 = np.asarray(q0, dtype = np.float64)
+    q1 = np.asarray(q1, dtype = np.float64)
+    t = np.asarray(t, dtype = np.float64)[..., None]
+    d = np.sum(q0 * q1, axis = -1, keepdims = True)
+    # take the short way around
+    q1 = np.where(d < 0.0, -q1, q1)
+    d = np.abs(d)
+    theta = np.arccos(np.clip(d, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    nearly_parallel = sin_theta < 1e-6
+    safe_sin = np.where(nearly_parallel, 1.0, sin_theta)
+    w0 = np.where(nearly_parallel, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+    w1 = np.where(nearly_parallel, t, np.sin(t * theta) / safe_sin)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis = -1, keepdims = True)